@@ -1,29 +1,35 @@
 import logging
 import sys
-import time
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
-    QLineEdit, QLabel, QComboBox, QPushButton, QMessageBox, QScrollArea, QApplication, QCheckBox, QHeaderView
+    QWidget, QVBoxLayout, QHBoxLayout, QTableView,
+    QLineEdit, QLabel, QComboBox, QPushButton, QMessageBox, QScrollArea, QApplication, QHeaderView
 )
 from PyQt5.QtCore import Qt,pyqtSignal
-from PyQt5.QtGui import QColor
-from sqlalchemy import and_
 from models import Company, Account, Files  # Import the necessary models
-from backend import get_session  # Ensure correct import for SQLAlchemy session handling
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
+from deadline_status import STATUS_PRIORITY
+from status_engine import refresh_statuses
+from roll_forward import roll_forward
+from files_count import recount_files
 from sqlalchemy.orm import joinedload
+from table_model import ColumnTableModel, RowFilterProxy, DEADLINE_COLORS
+from change_tracking import ChangeTracker
+from lazy_loading import LazyLoader
+from list_queries import account_rows
+from db_worker import db_worker
+from instrumentation import operation
 
 logging.basicConfig(level=logging.INFO)
 
-COMPANY_ACCOUNT_ROLE = Qt.UserRole + 1
+CHECK_FIELDS = {5: 'email_check', 6: 'invoice_check', 7: 'done_check'}
 
 class AccountTab(QWidget):
+    refresh_category = 'Account'  # Slice of the dashboard refresh shown in this tab
     status_changed = pyqtSignal()  # Signal to emit when status changes
 
     def __init__(self ,parent=None):
         super().__init__(parent)
         self.updating_item = False  # Flag to prevent recursion
+        self.tracker = ChangeTracker(Account)  # Remembers what the last load has seen
         self.initUI()
 
     def initUI(self):
@@ -52,16 +58,30 @@ class AccountTab(QWidget):
         self.refresh_button.clicked.connect(self.refresh)
         search_sort_layout.addWidget(self.refresh_button)
 
+        self.roll_forward_button = QPushButton("Roll Forward Selected")
+        self.roll_forward_button.setMinimumHeight(40)
+        self.roll_forward_button.clicked.connect(self.roll_forward_selected)
+        search_sort_layout.addWidget(self.roll_forward_button)
+
         main_layout.addLayout(search_sort_layout)
 
         # Table for Accounts
-        self.table = QTableWidget()
-        self.table.setColumnCount(10)
-        self.table.setHorizontalHeaderLabels([
-            'Id', 'Company Name', 'Account Office Number', 'Account Date',
-            'Status', 'Email Check', 'Invoice Check', 'Done Check', 'Files Count', 'UTR'
-        ])
-        self.table.itemChanged.connect(self.check_item_changed)
+        self.model = ColumnTableModel(
+            [
+                'Id', 'Company Name', 'Account Office Number', 'Account Date',
+                'Status', 'Email Check', 'Invoice Check', 'Done Check', 'Files Count', 'UTR'
+            ],
+            status_column=4,
+            status_colors=DEADLINE_COLORS,
+            checkable_columns=CHECK_FIELDS,
+            default_order=lambda values: STATUS_PRIORITY.get(values[4], len(STATUS_PRIORITY))  # As build_rows sorts
+        )
+        self.model.check_changed.connect(self.check_item_changed)
+        self.table = QTableView()
+        self.proxy = RowFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self.table.setModel(self.proxy)
+        self.table.setSelectionBehavior(QTableView.SelectRows)  # Several rows for the bulk roll forward
 
         header = self.table.horizontalHeader()
         header.setSectionResizeMode(QHeaderView.Stretch)
@@ -74,7 +94,7 @@ class AccountTab(QWidget):
         main_layout.addWidget(scroll_area)
         self.setLayout(main_layout)
 
-        self.load_data()
+        self.lazy_loader = LazyLoader(self, self.load_data, main_layout)  # Loads when first shown
 
     def sort_data(self):
         """Sort data in the table based on user selection."""
@@ -99,7 +119,7 @@ class AccountTab(QWidget):
                 column_index, ascending = 3, False
 
             if sort_option != 'Default':
-                self.table.sortItems(column_index, order=Qt.AscendingOrder if ascending else Qt.DescendingOrder)
+                self.model.sort(column_index, Qt.AscendingOrder if ascending else Qt.DescendingOrder)
             else:
                 # If "Default" is selected, load data with status-based sorting
                 self.load_data()
@@ -108,232 +128,149 @@ class AccountTab(QWidget):
             QMessageBox.critical(self, 'Error', f'Error occurred while sorting data: {str(e)}')
 
     def refresh(self):
-        """Refresh the table data."""
-        self.load_data()
-
-    def load_data(self):
-        """Load data from the database and populate the table."""
-        start_time = time.time()  # Record the start time
-        print("Account time 1:", datetime.now().strftime("%H:%M:%S"))
-        
-        """Load data from the database and populate the table, sorted by status by default."""
-
-        self.table.setRowCount(0)  # Clear the table before loading new data
-        try:
-            with get_session() as session:
-                accounts = (
-                    session.query(Account)
-                    .options(joinedload(Account.company))  # Eagerly load the company relationship
-                    .all()
-                )
-
-                self.table.setRowCount(len(accounts))
+        """Fetch only the accounts changed since the last load."""
+        with operation('Accounts refresh'):
+            db_worker().submit((id(self), 'rows'), self.fetch_changes, self.show_changes, self.load_failed)
 
-                # Sort the confirmations based on the status priority
-                status_priority = {
-                    'Overdue': 0,
-                    'Urgent': 1,
-                    'Soon': 2,
-                    'Early': 3
-                }
-                accounts.sort(key=lambda x: status_priority.get(x.status, 5))
+    def select_rows(self):
+        """Return the select() the table rows are loaded with, only the columns shown."""
+        return account_rows()
 
-                # Block signals while populating the table to avoid unnecessary updates
-                self.table.blockSignals(True)
-                for row, account in enumerate(accounts):
-                    self.add_account_to_table(row, account)
-                self.table.blockSignals(False)
+    def load_data(self):
+        """Load the accounts on the database worker; the table fills in when they arrive."""
+        with operation('Accounts load'):
+            db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.load_failed)
+
+    def fetch_rows(self, session):
+        """Worker thread: return the change tracking mark and the table rows."""
+        mark = self.tracker.current_mark(session)
+        return mark, self.build_rows(session.execute(self.select_rows()).all())
+
+    def fetch_changes(self, session):
+        """Worker thread: return the changes since the last load, or all rows when a reload is needed."""
+        changes = self.tracker.fetch_changes(session, self.select_rows(), self.account_row)
+        return changes if changes is not None else self.fetch_rows(session)
+
+    def build_rows(self, accounts):
+        """Sort accounts by status and return their (rows, ids) for the table."""
+        # Sort the confirmations based on the status priority
+        accounts.sort(key=lambda x: STATUS_PRIORITY.get(x.status, len(STATUS_PRIORITY)))
+        return [self.account_row(account) for account in accounts], [account.id for account in accounts]
+
+    def show_rows(self, result):
+        """Show the rows of a full load, sorted by status by default."""
+        mark, (rows, ids) = result
+        self.tracker.set_mark(mark)
+        self.model.set_rows(rows, ids=ids)
+        self.lazy_loader.finish()
+        if self.search_bar.text():
+            self.search_data()
+
+    def show_changes(self, result):
+        """Patch the changed rows into the table, or show a full load."""
+        if not self.tracker.apply_changes(result, self.model):
+            self.show_rows(result)
+        elif self.search_bar.text():
+            self.search_data()
+
+    def load_failed(self, error):
+        logging.error(f"Failed to load data: {error}")
+        self.lazy_loader.finish()
+        QMessageBox.critical(self, 'Error', f'Failed to load data: {str(error)}')
+
+    def account_row(self, account):
+        """Return the table values of a projected account row (see list_queries.account_rows)."""
+        return (
+            account.id, account.name, account.account_office_number, account.date,
+            account.status, account.email_check, account.invoice_check, account.done_check,
+            account.files_count, account.company_id
+        )
 
-        except Exception as e:
-            logging.exception("Failed to load data")
-            QMessageBox.critical(self, 'Error', f'Failed to load data: {str(e)}')
-
-        
-        print("Account time 2:", datetime.now().strftime("%H:%M:%S"))
-        end_time = time.time()  # Record the end time
-        print("Account Total : {:.2f} seconds".format(end_time - start_time))
-
-    def add_account_to_table(self, row, account):
-        company =account.company
-        id_item = QTableWidgetItem(str(account.id))
-        id_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 0, id_item)
-
-        name_item = QTableWidgetItem(account.name)
-        name_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 1, name_item)
-
-        a_office_nr_item = QTableWidgetItem(company.account_office_number)
-        a_office_nr_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 2, a_office_nr_item)
-
-        date_item = QTableWidgetItem(account.date.strftime('%Y-%m-%d'))
-        date_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 3, date_item)
-
-        status_item = QTableWidgetItem(account.status)
-        status_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 4, status_item)
-
-        email_check_item = self.create_checkbox_item(account.email_check, account.id)
-        self.table.setItem(row, 5, email_check_item)
-
-        invoice_check_item = self.create_checkbox_item(account.invoice_check, account.id)
-        self.table.setItem(row, 6, invoice_check_item)
-
-        done_check_item = self.create_checkbox_item(account.done_check, account.id)
-        self.table.setItem(row, 7, done_check_item)
-
-        file_item = QTableWidgetItem(str(account.files_count))
-        file_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 8, file_item)
-
-        utr_item = QTableWidgetItem(str(account.company_id))
-        utr_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 9, utr_item)
-
-        self.set_row_color(row, account.status)
-       
-    def create_checkbox_item(self, checked, account_id):
-        """Create a checkbox item."""
-        item = QTableWidgetItem()
-        item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-        item.setCheckState(Qt.Checked if checked else Qt.Unchecked)
-        item.setData(COMPANY_ACCOUNT_ROLE, account_id)
-        return item
-    
-    def check_item_changed(self, item):
+    def check_item_changed(self, row, column, checked):
         """Handle checkbox item changes."""
         if self.updating_item:
             return
-        if item.column() in [5,6,7]:  # Invoice Check or Done Check columns
-            try:
-                account_id = item.data(COMPANY_ACCOUNT_ROLE)
-                with get_session() as session:
-                    account = session.query(Account).filter_by(id=account_id).first()
-                    if account:
-                        self.updating_item = True  # Prevent recursion
-                        if item.column() == 5:
-                            account.email_check = item.checkState() == Qt.Checked
-                        elif item.column() == 6:
-                            account.invoice_check = item.checkState() == Qt.Checked
-                        elif item.column() == 7:
-                            account.done_check = item.checkState() == Qt.Checked
-                        session.commit()
-                        self.updating_item = False  # Re-enable updates
-
-                        if account.email_check and account.invoice_check and account.done_check:
-                            response = QMessageBox.question(
-                                self, 'Confirm',
-                                'Both checks are marked. Do you want to update the confirmation date and reset the checks?',
-                                QMessageBox.Yes | QMessageBox.No
-                            )
-                            if response == QMessageBox.Yes:
-                                try:
-                                    self.table.blockSignals(True)  # Temporarily disconnect the signal to prevent recursion
-
-                                    account.date += relativedelta(years=1)
-                                    # Reset the checkboxes
-                                    account.email_check = False
-                                    account.invoice_check = False
-                                    account.done_check = False
-
-                                    session.commit()
-
-                                    self.load_data()
-                                    self.check_status()
-                                except Exception as e:
-                                    logging.exception("Error updating account date")
-                                    QMessageBox.critical(self, "Error", f"Error updating account date: {str(e)}")
-                                finally:
-                                    self.table.blockSignals(False)  # Reconnect the signal
-            except Exception as e:
-                logging.exception("Error handling item change")
-                QMessageBox.critical(self, "Error", f"Error handling item change: {str(e)}")
+        if column in CHECK_FIELDS:  # Email, Invoice or Done Check columns
+            account_id = self.model.row_id(row)
+            field = CHECK_FIELDS[column]
+            with operation('Account save'):
+                db_worker().submit_write(
+                    lambda session: self.store_check(session, account_id, field, checked),
+                    lambda checks: self.check_saved(account_id, checks),
+                    lambda error: self.check_failed(account_id, column, not checked, error),
+                    idempotent=True  # Setting a flag twice leaves it the same
+                )
+
+    def store_check(self, session, account_id, field, checked):
+        """Worker thread: store one check and return the three checks of the account, or None when it is gone."""
+        account = session.get(Account, account_id)
+        if account is None:
+            return None
+        setattr(account, field, checked)
+        return account.email_check, account.invoice_check, account.done_check
+
+    def check_saved(self, account_id, checks):
+        """Offer to roll the account forward once all its checks are marked."""
+        if checks is None or not all(checks):
+            return
+        response = QMessageBox.question(
+            self, 'Confirm',
+            'Both checks are marked. Do you want to update the confirmation date and reset the checks?',
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if response == QMessageBox.Yes:
+            db_worker().submit_write(
+                lambda session: self.roll_rows_forward(session, [account_id]),  # Only this row changed
+                self.show_rolled_rows,
+                lambda error: self.roll_forward_failed("Error updating account date", error)
+            )
+
+    def check_failed(self, account_id, column, previous, error):
+        """Put the checkbox back when the check could not be stored."""
+        logging.error(f"Error handling item change: {error}")
+        row = self.model.find_row(account_id)
+        if row is not None:
+            self.model.set_value(row, column, previous)
+        QMessageBox.critical(self, "Error", f"Error handling item change: {str(error)}")
 
     def search_data(self):
         """Search and highlight data in the table."""
         try:
             search_text = self.search_bar.text().lower()
-            for row in range(self.table.rowCount()):
-                match = False
-                for col in range(self.table.columnCount()):
-                    item = self.table.item(row, col)
-                    if item:
-                        original_color = item.data(Qt.UserRole)
-                        if not original_color:
-                            original_color = item.background()
-                            item.setData(Qt.UserRole, original_color)
-
-                        if search_text and search_text in item.text().lower():
-                            item.setBackground(QColor(255, 255, 0, 127))  # light yellow with transparency
-                            match = True
-                        else:
-                            item.setBackground(original_color)
-                self.table.setRowHidden(row, not match if search_text else False)
+            self.model.set_highlight(search_text)
+            self.proxy.set_visible_ids(self.model.matching_ids(search_text) if search_text else None)
         except Exception as e:
             logging.exception("Error occurred while searching data")
             QMessageBox.critical(self, 'Error', f'Error occurred while searching data: {str(e)}')
 
     def check_status(self):
-        """Check and update the status of accounts."""
-        try:
-            with get_session() as session:
-                accounts = session.query(Account).all()
-                for account in accounts:
-                    self.update_status(account)
-                session.commit()
-            self.load_data()
-        except Exception as e:
-            logging.exception("Error occurred while checking status")
-            QMessageBox.critical(self, "Error", f"Error occurred while checking status: {str(e)}")
+        """Check and update the status of accounts, then reload the table."""
+        with operation('Accounts status check'):
+            db_worker().submit_write(self.update_statuses, self.statuses_updated, self.status_failed,
+                                     idempotent=True)  # Setting the statuses twice stores the same ones
 
-    def set_row_color(self, row, status):
-        """Set the background color of a row based on its status."""
-        try:
-            color_map = {
-                'Overdue': QColor(251, 55, 107, 127),  # light red with transparency
-                'Urgent': QColor(247, 131, 34, 127),   # light orange with transparency
-                'Soon': QColor(241, 240, 133, 127),    # light yellow with transparency
-                'Early': QColor(87, 242, 141, 127)     # light green with transparency
-            }
-            color = color_map.get(status, QColor(255, 255, 255, 127))  # default to white with transparency
-
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    item.setBackground(color)
-                    item.setData(Qt.UserRole, color)  # Store the color
-        except Exception as e:
-            logging.exception("Error occurred while setting row color")
-            QMessageBox.critical(self, "Error", f"Error occurred while setting row color: {str(e)}")
-
-    def update_status(self, account):
-        """Update the status of an account based on the date."""
-        today = datetime.now().date()
-        days_diff = (account.date - today).days
-        if days_diff > 7:
-            account.status = 'Early'
-        elif 3 <= days_diff <= 7:
-            account.status = 'Soon'
-        elif 3 <= days_diff <= 0:
-            account.status = 'Urgent'
-        else:
-            account.status = 'Overdue'
+    def update_statuses(self, session):
+        """Worker thread: store the statuses; submit_write commits them."""
+        refresh_statuses(session, ['Account'])  # One UPDATE ... CASE for the whole table
+
+    def statuses_updated(self, result):
+        """Reload the table once the statuses are stored."""
+        db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.status_failed)
+
+    def status_failed(self, error):
+        QMessageBox.critical(self, "Error", f"Error occurred while checking status: {str(error)}")
 
     def update_files_count(self):
-        """Update the files count for each account."""
-        try:
-            with get_session() as session:
-                accounts = session.query(Account).all()
-                for account in accounts:
-                    file_count = session.query(Files).filter(
-                        and_(Files.company_id == account.company_id, Files.second_id == 'Account')
-                    ).count()
-                    account.files_count = file_count
-                session.commit()
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(e)}')
+        """Update the files count for each account on the database worker."""
+        with operation('Accounts files count'):
+            db_worker().submit_write(self.recount, on_error=self.recount_failed,
+                                     idempotent=True)  # Counting twice stores the same counts
+
+    def recount(self, session):
+        recount_files(session, 'Account')  # One GROUP BY query for all rows
+
+    def recount_failed(self, error):
+        QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(error)}')
 
 
 
@@ -349,122 +286,46 @@ class AccountTab(QWidget):
      #               tab.refresh()
 
 
-#old
-
-    def confirm_and_update_account(self, account):
-        """Confirm and update account date if all checks are checked."""
-        confirmation = QMessageBox.question(
-            self,
-            "Confirm Update",
-            "All checks are true. Do you want to update the account date by adding one year and reset the checks?",
+    def roll_forward_selected(self):
+        """Roll all selected accounts forward at once, with one confirmation and one commit."""
+        account_ids = self.proxy.selected_ids(self.table)
+        if not account_ids:
+            QMessageBox.information(self, 'Roll Forward', 'Select the accounts to roll forward first.')
+            return
+        response = QMessageBox.question(
+            self, 'Confirm',
+            f'Roll {len(account_ids)} selected accounts forward? This will move their account date on by one year and reset their checks.',
             QMessageBox.Yes | QMessageBox.No
         )
-
-        if confirmation == QMessageBox.Yes:
-            try:
-                with get_session() as session:
-                    # Update the date by adding one year
-                    account.date += relativedelta(years=1)
-                    # Reset the checkboxes
-                    account.email_check = False
-                    account.invoice_check = False
-                    account.done_check = False
-
-                    # Update the status based on the new date
-                    self.update_status(account)
-
-                    # Commit the changes to the database
-                    session.commit()
-
-                    # Update the specific row in the table
-                    self.update_row_in_table(account)
-
-            except Exception as e:
-                QMessageBox.critical(self, 'Error', f'Failed to update account: {str(e)}')
-
-    def update_row_in_table(self, account):
-        """Update the specific row in the table with the updated account data."""
-        row = self.get_row_by_account_id(account.id)
-        if row is None:
-            logging.error(f"Account with ID {account.id} not found in the table.")
+        if response != QMessageBox.Yes:
             return
-
-        # Update the date and status in the table
-        self.table.setItem(row, 3, self.create_noneditable_item(account.date.strftime('%Y-%m-%d')))
-        self.table.setItem(row, 4, self.create_noneditable_item(account.status))
-
-
-        email_check_item = self.table.cellWidget(row, 5)
-        if isinstance(email_check_item, QCheckBox):
-            email_check_item.setChecked(account.email_check)
-
-        invoice_check_item = self.table.cellWidget(row, 6)
-        if isinstance(invoice_check_item, QCheckBox):
-            invoice_check_item.setChecked(account.invoice_check)
-        
-        done_check_item = self.table.cellWidget(row, 7)
-        if isinstance(done_check_item, QCheckBox):
-            done_check_item.setChecked(account.done_check)
-
-        # Update the row color based on the status
-        self.set_row_color(row, account.status)
-        self.update_checkbox_background(row, account.status)
-
-    def update_checkbox_state(self, row, column, state):
-        """Helper function to update checkbox state."""
-        checkbox = self.table.cellWidget(row, column)
-        if isinstance(checkbox, QCheckBox):
-            checkbox.setChecked(state)
-
-    def update_status_and_color_by_account(self, account_id):
-        """Update status and color for a specific account entry."""
-        with get_session() as session:
-            account = session.query(Account).get(account_id)
-            if not account:
-                logging.error(f"Account with ID {account_id} not found.")
-                return
-
-            status = account.status
-            row = self.get_row_by_account_id(account_id)
+        with operation('Accounts roll forward'):
+            db_worker().submit_write(
+                lambda session: self.roll_rows_forward(session, account_ids),
+                self.show_rolled_rows,
+                lambda error: self.roll_forward_failed("Error rolling accounts forward", error)
+            )
+
+    def roll_rows_forward(self, session, account_ids):
+        """Worker thread: roll accounts forward with one UPDATE and return their reloaded rows."""
+        roll_forward(session, 'Account', account_ids)
+        return session.execute(self.select_rows().where(Account.id.in_(account_ids))).all()
+
+    def show_rolled_rows(self, records):
+        """Show rolled forward accounts in their rows and move each row to its sorted place."""
+        for account in records:
+            row = self.model.find_row(account.id)
             if row is not None:
-                self.set_row_color(row, status)
-                self.update_checkbox_background(row, status)
+                self.model.update_row(row, self.account_row(account))
+                self.model.reposition_row(row)
+        if self.search_bar.text():
+            self.search_data()
+
+    def roll_forward_failed(self, message, error):
+        logging.error(f"{message}: {error}")
+        QMessageBox.critical(self, "Error", f"{message}: {str(error)}")
 
-    def update_checkbox_background(self, row, status):
-        """Update checkbox background color based on status."""
-        if row is None:  # Handle invalid row
-            logging.warning(f"Row not found for the given payrun. Cannot update checkbox background.")
-            return
 
-        color_map = {
-            'Overdue': QColor(251, 55, 107, 127),
-            'Urgent': QColor(247, 131, 34, 127),
-            'Soon': QColor(241, 240, 133, 127),
-            'Early': QColor(87, 242, 141, 127)
-        }
-        color = color_map.get(status, QColor(255, 255, 255, 127))
-
-        for col in [5, 6, 7]:  # Columns for checkboxes
-            item = self.table.cellWidget(row, col)
-            if item:
-                item.setStyleSheet(f"background-color: rgba({color.red()}, {color.green()}, {color.blue()}, {color.alpha() / 255.0});")
-
-
-    def get_row_by_account_id(self, account_id):
-
-        """Find the table row corresponding to the given account ID."""
-        for row in range(self.table.rowCount()):
-            if self.table.item(row, 0) and int(self.table.item(row, 0).text()) == account_id:  # Now uses payrun.id
-                return row
-        logging.warning(f"Account with ID {account_id} not found in the table.")
-        return None
-
-    def create_noneditable_item(self, text):
-        """Create a non-editable QTableWidgetItem."""
-        item = QTableWidgetItem(text)
-        item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-        return item
- 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = QWidget()
@@ -1,23 +1,38 @@
 import sys
-import time
-from datetime import datetime
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, 
+    QWidget, QVBoxLayout, QHBoxLayout, QTableView, QHeaderView,
     QPushButton, QMessageBox, QLineEdit, QComboBox, QApplication, QTabWidget
 )
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QColor
-from sqlalchemy import and_
 from models import Company, Files
+from files_count import recount_files
 from create1 import CompanyForm
-from backend import get_session
+from db_session import get_session
+from table_model import ColumnTableModel, RowFilterProxy
+from company_search import search_company_ids
+from change_tracking import ChangeTracker
+from refresh_coordinator import RefreshCoordinator
+from lazy_loading import LazyLoader
+from db_worker import db_worker
+from instrumentation import operation
+from list_queries import company_rows
+
+COMPANY_COLUMNS = [
+    'id', 'house_number', 'name', 'nature', 'pay_reference_number',
+    'account_office_number', 'cis', 'vat', 'email', 'contact_number',
+    'government_gateway_id', 'files_count', 'address_id'
+]
 
 class AllCompaniesTab(QWidget):
+    refresh_category = 'Company'  # Slice of the dashboard refresh shown in this tab
 
     def __init__(self, tab_widget):
         super().__init__()
         self.tab_widget = tab_widget
-        self.company_data = []  # Preload data into memory
+        self.company_data = []  # Preload data into memory, one Row tuple per company
+        self.tracker = ChangeTracker(Company)  # Remembers what the last load has seen
+        self.coordinator = RefreshCoordinator(tab_widget)
         self.initUI()
 
     def initUI(self):
@@ -47,18 +62,24 @@ class AllCompaniesTab(QWidget):
         main_layout.addLayout(search_sort_layout)
 
         # Table for Companies
-        self.table = QTableWidget()
-        self.table.setColumnCount(12)
-        self.table.setHorizontalHeaderLabels([
-            'UTR', 'House Number', 'Name', 'Nature', 'Pay Reference Number',
-            'Account Office Number', 'CIS', 'VAT', 'Email', 'Contact Number',
-            'Government Gateway ID', 'Files', 'Address ID'
-        ])
-        self.load_companies()
+        yes_no = lambda value: 'Yes' if value else 'No'
+        self.model = ColumnTableModel(
+            [
+                'UTR', 'House Number', 'Name', 'Nature', 'Pay Reference Number',
+                'Account Office Number', 'CIS', 'VAT', 'Email', 'Contact Number',
+                'Government Gateway ID', 'Files', 'Address ID'
+            ],
+            alternate_colors=(QColor(155, 135, 212, 127), QColor(196, 193, 233, 127)),  # Light purple and light light purple
+            formatters={6: yes_no, 7: yes_no, 11: lambda count: f"Files: {count}"}
+        )
+        self.table = QTableView()
+        self.proxy = RowFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self.table.setModel(self.proxy)
+        self.table.setSelectionBehavior(QTableView.SelectRows)
 
         # Adjust header width
-        for column in range(self.table.columnCount()):
-            self.table.horizontalHeader().setSectionResizeMode(column, self.table.horizontalHeader().ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
 
         self.table.horizontalHeader().setStretchLastSection(True)
 
@@ -84,187 +105,97 @@ class AllCompaniesTab(QWidget):
         main_layout.addLayout(buttons_layout)
         self.setLayout(main_layout)
 
+        self.lazy_loader = LazyLoader(self, self.load_companies, main_layout)  # Loads when first shown
+
     def on_search_text_changed(self):
         """Delay search trigger to improve performance."""
         self.search_timer.start(1000)  # 300ms delay
 
 
     def load_companies(self):
-        """Load companies into memory and display them in the table."""
-        start_time = time.time()  # Record the start time
-        try:
-            print("Loading data started at:", datetime.now().strftime("%H:%M:%S"))
-            self.company_data.clear()
-            with get_session() as session:
-                companies = session.query(Company).all()
-                for company in companies:
-                    self.company_data.append({
-                        'id': company.id,
-                        'house_number': company.house_number,
-                        'name': company.name,
-                        'nature': company.nature,
-                        'pay_reference_number': company.pay_reference_number,
-                        'account_office_number': company.account_office_number,
-                        'cis': 'Yes' if company.cis else 'No',
-                        'vat': 'Yes' if company.vat else 'No',
-                        'email': company.email,
-                        'contact_number': company.contact_number,
-                        'government_gateway_id': company.government_gateway_id,
-                        'files_count': company.files_count,
-                        'address_id': company.address_id
-                    })
-            print("Data loaded at:", datetime.now().strftime("%H:%M:%S"))
-
-            self.populate_table(self.company_data)  # Populate the table with the loaded data
-            print("Table populated at:", datetime.now().strftime("%H:%M:%S"))
-            
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'An error occurred while loading data: {str(e)}')
-
-        end_time = time.time()  # Record the end time
-        print("Total time to load and populate table: {:.2f} seconds".format(end_time - start_time))
+        """Load companies on the database worker and display them when they arrive."""
+        with operation('Companies load'):
+            db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.load_failed)
+
+    def fetch_rows(self, session):
+        """Worker thread: return the change tracking mark and the company records."""
+        mark = self.tracker.current_mark(session)
+        return mark, session.execute(company_rows()).all()
+
+    def fetch_changes(self, session):
+        """Worker thread: return the changed records, or all records when a reload is needed."""
+        changes = self.tracker.fetch_changes(session, company_rows(), lambda record: record)
+        return changes if changes is not None else self.fetch_rows(session)
+
+    def build_rows(self, companies):
+        """Return the records of projected company rows, kept as the Row tuples they are."""
+        return companies
+
+    def show_rows(self, result):
+        """Keep the records of a full load and show them in the table."""
+        mark, self.company_data = result
+        self.tracker.set_mark(mark)
+        self.populate_table(self.company_data)  # Populate the table with the loaded data
+        self.lazy_loader.finish()
+        if self.search_bar.text().strip():
+            self.search_data()
+
+    def load_failed(self, error):
+        self.lazy_loader.finish()
+        QMessageBox.critical(self, 'Error', f'An error occurred while loading data: {str(error)}')
 
     def populate_table(self, companies):
         """Populate the table with preloaded data."""
-        self.table.setRowCount(len(companies))
-        for row, company in enumerate(companies):
-            self.table.setItem(row, 0, self.create_noneditable_item(str(company['id'])))
-            self.table.setItem(row, 1, self.create_noneditable_item(company['house_number']))
-            self.table.setItem(row, 2, self.create_noneditable_item(company['name']))
-            self.table.setItem(row, 3, self.create_noneditable_item(company['nature']))
-            self.table.setItem(row, 4, self.create_noneditable_item(company['pay_reference_number']))
-            self.table.setItem(row, 5, self.create_noneditable_item(company['account_office_number']))
-            self.table.setItem(row, 6, self.create_noneditable_item(company['cis']))
-            self.table.setItem(row, 7, self.create_noneditable_item(company['vat']))
-            self.table.setItem(row, 8, self.create_noneditable_item(company['email']))
-            self.table.setItem(row, 9, self.create_noneditable_item(company['contact_number']))
-            self.table.setItem(row, 10, self.create_noneditable_item(company['government_gateway_id']))
-            self.table.setItem(row, 11, self.create_noneditable_item(f"Files: {company['files_count']}"))
-            self.table.setItem(row, 12, self.create_noneditable_item(str(company['address_id'])))
-
-        self.apply_row_colors()
-
-    def create_noneditable_item(self, text):
-        """Create a non-editable QTableWidgetItem."""
-        item = QTableWidgetItem(text)
-        item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-        return item
+        self.model.set_rows(
+            [tuple(getattr(company, key) for key in COMPANY_COLUMNS) for company in companies],
+            ids=[company.id for company in companies]
+        )
+
+    def patch_rows(self, records, ids, removed_ids, statuses=None):
+        """Patch changed, new and removed companies into the records and the table (see ChangeTracker.apply_changes)."""
+        changed = {record.id: record for record in records}
+        kept = []
+        for company in self.company_data:
+            if company.id in removed_ids:
+                continue
+            kept.append(changed.pop(company.id, company))
+        self.company_data = kept + list(changed.values())
+
+        self.model.patch_rows(
+            [tuple(getattr(record, key) for key in COMPANY_COLUMNS) for record in records],
+            ids,
+            removed_ids
+        )
 
     def search_data(self):
-        """Search and highlight data in the preloaded dataset with minimal UI interaction."""
-        search_text = self.search_bar.text().lower()
+        """Search companies in the database and highlight the matching rows."""
+        search_text = self.search_bar.text().strip().lower()
 
-        # If no search text, reset the table with all data
+        # If no search text, show all rows again
         if not search_text:
-            self.populate_table(self.company_data)
+            db_worker().cancel((id(self), 'search'))
+            self.model.set_highlight('')
+            self.show_matching(None)
             return
 
-        # Determine if the search text is numeric
-        is_numeric_search = search_text.isdigit()
-
-        # Determine if the search text is 'yes' or 'no'
-        is_yes_no_search = search_text in ['yes', 'no', 'ye']
-
-        # Use a single pass to filter and highlight companies
-        filtered_companies = []
-        for company in self.company_data:
-            row_data = {
-                'id': str(company['id']),
-                'house_number': str(company['house_number']),
-                'name': company['name'].lower(),  # Ensure lowercase for case-insensitive search
-                'nature': company['nature'].lower(),
-                'pay_reference_number': company['pay_reference_number'].lower(),
-                'account_office_number': company['account_office_number'].lower(),
-                'cis': 'yes' if company['cis'].lower() == 'yes' else 'no',
-                'vat': 'yes' if company['vat'].lower() == 'yes' else 'no',
-                'email': company['email'].lower(),
-                'contact_number': company['contact_number'].lower(),
-                'government_gateway_id': str(company['government_gateway_id']),
-                'files_count': f"Files: {company['files_count']}",
-                'address_id': str(company['address_id'])
-            }
-
-            # Skip numeric fields if the search text is not a number
-            if not is_numeric_search:
-                del row_data['id']
-                del row_data['house_number']
-                del row_data['government_gateway_id']
-                del row_data['address_id']
-
-            # Skip cis and vat columns if the search text is not 'yes' or 'no'
-            if not is_yes_no_search:
-                del row_data['cis']
-                del row_data['vat']
-
-            # If any column in this row contains the search text, add it to filtered companies
-            if any(search_text in str(field).lower() for field in row_data.values()):
-                filtered_companies.append(company)
-
-        # Populate table with filtered data and highlight the matches
-        self.populate_table_with_highlighting(filtered_companies, search_text)
-
-
-
-    def populate_table_with_highlighting(self, companies, search_text):
-        """Populate the table and highlight matching cells with minimal UI updates."""
-        self.table.setRowCount(len(companies))
-
-        for row, company in enumerate(companies):
-            row_data = [
-                str(company['id']),
-                company['house_number'],
-                company['name'],
-                company['nature'],
-                company['pay_reference_number'],
-                company['account_office_number'],
-                company['cis'],
-                company['vat'],
-                company['email'],
-                company['contact_number'],
-                company['government_gateway_id'],
-                f"Files: {company['files_count']}",
-                str(company['address_id'])
-            ]
-
-            for col, field in enumerate(row_data):
-                item = self.create_noneditable_item(field)
-                
-                # Only highlight matching text in the relevant cells
-                if search_text in field.lower():
-                    item.setBackground(QColor(255, 255, 0, 127))  # Highlight yellow
-                self.table.setItem(row, col, item)
-
-        # Apply alternating row colors after the entire table is populated
-        self.set_row_colors()
-
-    def apply_row_colors(self):
-        """Apply alternating colors to table rows."""
-        for row in range(self.table.rowCount()):
-            color = QColor(155, 135, 212, 127) if row % 2 == 0 else QColor(196, 193, 233, 127)  # Light purple and light light purple
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    item.setBackground(color)
-
-    def set_row_colors(self):
-        """Apply a single color to all table rows, but preserve existing highlights."""
-        color = QColor(196, 193, 233, 127)  # Single color (light purple)
-
-        for row in range(self.table.rowCount()):
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    # If the cell is not already highlighted, apply the single color
-                    if item.background().color() != QColor(255, 255, 0, 127):  # Check if it's not yellow
-                        item.setBackground(color)
-
-
-    def create_noneditable_item(self, text):
-        """Create a non-editable QTableWidgetItem."""
-        item = QTableWidgetItem(text)
-        item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-        return item
-
+        # The search runs as an indexed query on the database worker and only
+        # returns the matching ids. A newer search replaces one still running.
+        def show_results(matching_ids):
+            # Hide the other rows and highlight the matches
+            self.model.set_highlight(search_text)
+            self.show_matching(matching_ids)
+
+        with operation('Companies search'):
+            db_worker().submit(
+                (id(self), 'search'),
+                lambda session: search_company_ids(session, search_text),
+                show_results,
+                lambda error: QMessageBox.critical(self, 'Error', f'An error occurred while searching: {str(error)}')
+            )
+
+    def show_matching(self, company_ids):
+        """Show only the rows of the given companies, or every row when company_ids is None."""
+        self.proxy.set_visible_ids(company_ids)
 
     def sort_dropdown_changed(self):
         """Handle sorting dropdown changes."""
@@ -280,8 +211,9 @@ class AllCompaniesTab(QWidget):
 
     def sort_data(self, column, ascending):
         """Sort data in the preloaded dataset."""
-        sorted_companies = sorted(self.company_data, key=lambda x: x[column], reverse=not ascending)
+        sorted_companies = sorted(self.company_data, key=lambda x: getattr(x, column), reverse=not ascending)
         self.populate_table(sorted_companies)
+        self.search_data()  # Keep the current search applied to the new order
 
     # Other methods remain unchanged (e.g., open_create_company_tab, open_view_company_tab)
     def open_create_company_tab(self):
@@ -295,26 +227,18 @@ class AllCompaniesTab(QWidget):
 
     def open_view_company_tab(self):
         """Open the view company tab."""
-        selected_row = self.table.currentRow()
+        selected_row = self.proxy.source_row(self.table.currentIndex())
         if selected_row >= 0:
-            company_id = int(self.table.item(selected_row, 0).text())
+            company_id = self.model.row_id(selected_row)
             
             with get_session() as session:
                 # Query the company and ensure all necessary data is loaded
                 company = session.query(Company).filter(Company.id == company_id).first()
                 
                 if company:
-                    # Load all necessary fields while the session is still open
                     company_name = company.name
-                    address = company.address
-                    if address:
-                        address_number = address.number
-                        address_street = address.street
-                        address_city = address.city
-                        address_postcode = address.postcode
-                        address_country = address.country
-
-                    # Create and populate the CompanyForm
+
+                    # Create and populate the CompanyForm; it reads the rest of the company itself
                     create_view = CompanyForm(self.tab_widget, company)
                     create_view.toggle_edit_mode(False)  # Set fields to read-only for view mode
 
@@ -327,33 +251,38 @@ class AllCompaniesTab(QWidget):
             QMessageBox.warning(self, 'Warning', 'Please select a company to view.')
 
     def refresh(self):
-        """Refresh the company data in the table."""
-        self.load_companies()
+        """Fetch only the companies changed since the last load."""
+        with operation('Companies refresh'):
+            db_worker().submit(
+                (id(self), 'rows'), self.fetch_changes, self.show_changes,
+                lambda error: QMessageBox.critical(self, 'Error', f'An error occurred while refreshing data: {str(error)}')
+            )
+
+    def show_changes(self, result):
+        """Patch the changed companies into the table, or show a full load."""
+        if not self.tracker.apply_changes(result, self):
+            self.show_rows(result)
+        elif self.search_bar.text().strip():
+            self.search_data()
 
     def refresh_tabs(self):
-        """Refresh all tabs."""
-        self.update_files_count()  # Call the new method to update file counts
-        self.refresh()  # Refresh current tab
-        if hasattr(self, 'tab_widget'):
-            for i in range(self.tab_widget.count()):
-                tab = self.tab_widget.widget(i)
-                if hasattr(tab, 'refresh') and tab != self:
-                    tab.refresh()
-
-    def update_files_count(self):
-        """Update the file count for each company."""
+        """Refresh all tabs with one pass of set-based queries."""
         try:
-            with get_session() as session:
-                companies = session.query(Company).all()
-                for company in companies:
-                    file_count = session.query(Files).filter(
-                        and_(Files.company_id == company.id, Files.second_id == 'Company')
-                    ).count()
-                    company.files_count = file_count
-                    session.add(company)  # Mark the company object as modified
-                session.commit()  # Commit all changes
+            self.coordinator.refresh()
         except Exception as e:
-            QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(e)}')
+            QMessageBox.critical(self, 'Error', f'An error occurred while refreshing the tabs: {str(e)}')
+
+    def update_files_count(self, on_done=None):
+        """Update the file count for each company on the database worker."""
+        with operation('Companies files count'):
+            db_worker().submit_write(self.recount, on_done, self.recount_failed,
+                                     idempotent=True)  # Counting twice stores the same counts
+
+    def recount(self, session):
+        recount_files(session, 'Company')  # One GROUP BY query for all rows
+
+    def recount_failed(self, error):
+        QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(error)}')
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,456 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+from sqlalchemy import event, insert, select, func
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import joinedload
+from models import Base, Address, Company, Director, Employer, Account, CIS, VAT, PayRun, ConfirmationStatement, Task, Invoice, Files
+from deadline_status import compute_status
+from db_session import create_app_engine, pool_stats, use_engine
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('benchmark')
+
+# Rows of each kind in the synthetic database unless given on the command line
+DEFAULT_SIZES = {
+    'companies': 2000,
+    'directors': 2000,  # At most one per company
+    'files': 20000,
+    'tasks': 10000,
+    'invoices': 10000,
+}
+
+# Rows per INSERT while generating
+INSERT_CHUNK = 5000
+
+# Timed runs of each scenario; the median is reported
+REPEATS = 3
+
+# A scenario regresses when it is this much slower or bigger than its baseline,
+# and by more than the noise floor, or when it runs more statements
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.25
+NOISE_SECONDS = 0.02
+NOISE_KB = 512
+
+# Longest wait for the database worker to finish a scenario
+SCENARIO_TIMEOUT = 300
+
+# (name, module, class, constructor arguments, load method, search text)
+# Constructor arguments: 'tabs' for the tab widget, 'plain' for none.
+TABS = [
+    ('Companies', 'all_companies_tab', 'AllCompaniesTab', 'tabs', 'load_companies', 'company 12'),
+    ('Accounts', 'account_tab', 'AccountTab', 'plain', 'load_data', 'company 12'),
+    ('CIS', 'cis_tab', 'CISTab', 'plain', 'load_data', 'company 12'),
+    ('VAT', 'vat_tab', 'VatTab', 'plain', 'load_first', 'company 12'),
+    ('PayRun', 'payrun', 'PayRunTab', 'tabs', 'load_data', 'company 12'),
+    ('Confirmation statements', 'confirmation_statement', 'ConfirmationStatementTab', 'plain', 'load_data', 'company 12'),
+    ('Tasks', 'task', 'TaskTab', 'tabs', 'load_data', 'task 12'),
+    ('Paid tasks', 'paid_tasks', 'PaidTasksTab', 'tabs', 'load_paid_tasks', 'task 12'),
+    ('Invoices', 'invoice', 'InvoiceTab', 'plain', 'load_existing_invoices', 'invoice 12'),
+    ('Files', 'tab_file', 'FilesTab', 'plain', 'load_files', 'file 12'),
+]
+
+TASK_NAMES = ['Bookkeeping', 'Payroll', 'Self assessment', 'VAT return', 'Company formation']
+DONE_BY = ['aleks', 'krista', 'ledia', 'denalda', 'kujtim', 'other']
+TASK_STATUSES = ['not_started', 'in_process', 'details_missing', 'done', 'paid']
+FILE_CATEGORIES = ['Vat', 'Account', 'Company', 'Payrun']
+
+
+# Synthetic data
+
+def insert_rows(connection, model, rows):
+    """Insert plain dicts into the table of a model, a chunk at a time.
+
+    Rows carry their ids: SQLite only numbers INTEGER primary keys, not BIGINT ones.
+    """
+    for start in range(0, len(rows), INSERT_CHUNK):
+        connection.execute(insert(model.__table__), rows[start:start + INSERT_CHUNK])
+    logger.info(f"Generated {len(rows)} {model.__table__.name} rows.")
+
+
+def generate(engine, sizes, seed=1):
+    """Drop and recreate every table and fill them with deterministic synthetic data."""
+    rng = random.Random(seed)
+    today = date.today()
+
+    def day(back=730, ahead=180):
+        return today + timedelta(days=rng.randint(-back, ahead))
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    companies = sizes['companies']
+    company_ids = range(1, companies + 1)
+    with engine.begin() as connection:
+        insert_rows(connection, Address, [
+            {'id': i, 'number': rng.randint(1, 300), 'street': f'{i} High Street', 'city': rng.choice(['London', 'Leeds']),
+             'postcode': f'N{i % 20} {i % 9}AB', 'country': 'United Kingdom'}
+            for i in company_ids
+        ])
+
+        flags = {i: (rng.random() < 0.4, rng.random() < 0.5) for i in company_ids}  # (cis, vat)
+        insert_rows(connection, Company, [
+            {'id': i, 'house_number': str(10000000 + i)[:10], 'name': f'Company {i} Ltd', 'nature': 'Services',
+             'pay_reference_number': f'P{i:06d}', 'account_office_number': f'A{i:06d}',
+             'cis': flags[i][0], 'vat': flags[i][1], 'email': f'company{i}@example.com',
+             'address_id': i, 'contact_number': f'07{i:09d}', 'government_gateway_id': f'G{i:08d}',
+             'date_added': day(ahead=0), 'files_count': 0}
+            for i in company_ids
+        ])
+
+        insert_rows(connection, Director, [
+            {'id': i, 'company_id': i, 'name': f'Director {i}', 'insurance_number': f'QQ{i:06d}C', 'address_id': i,
+             'phone': f'07{i:09d}', 'email': f'director{i}@example.com'}
+            for i in company_ids[:sizes['directors']]
+        ])
+        insert_rows(connection, Employer, [
+            {'id': i, 'name': f'Employer {i}', 'email': f'employer{i}@example.com', 'company_id': i,
+             'utr': str(i), 'nino': f'QQ{i:06d}D', 'start_date': day(ahead=0)}
+            for i in company_ids if i % 2 == 0
+        ])
+
+        def deadline_rows(extra):
+            rows = []
+            for i in company_ids:
+                deadline = day(back=60, ahead=120)
+                row = {'id': i, 'company_id': i, 'status': compute_status(deadline, today)}
+                row.update(extra(i, deadline))
+                rows.append(row)
+            return rows
+
+        insert_rows(connection, Account, deadline_rows(lambda i, deadline: {
+            'name': f'Company {i} Ltd', 'date': deadline, 'email_check': False, 'invoice_check': False,
+            'done_check': False, 'files_count': 0}))
+        insert_rows(connection, ConfirmationStatement, deadline_rows(lambda i, deadline: {
+            'name': f'Company {i} Ltd', 'date': deadline, 'invoice_check': False, 'done_check': False}))
+        insert_rows(connection, PayRun, deadline_rows(lambda i, deadline: {
+            'company_name': f'Company {i} Ltd', 'date': deadline, 'month_check': False, 'pay_run': False,
+            'p60': False, 'files_count': 0}))
+        insert_rows(connection, CIS, [
+            dict(row, name=f"Company {row['company_id']} Ltd", employees_reference=f"E{row['company_id']:06d}",
+                 last_month=row['next_month'] - timedelta(days=30), email_check=False, month_check=False)
+            for row in [
+                {'id': i, 'company_id': i, 'next_month': deadline, 'status': compute_status(deadline, today)}
+                for i, deadline in ((i, day(back=30, ahead=30)) for i in company_ids if flags[i][0])
+            ]
+        ])
+        vat_rows = []
+        for i in company_ids:
+            if flags[i][1]:
+                end_date = day(back=90, ahead=90)
+                vat_rows.append({
+                    'id': i, 'number': f'{i:09d}', 'registration_date': day(ahead=0), 'address_id': i,
+                    'company_number': f'{i:08d}', 'company_name': f'Company {i} Ltd',
+                    'start_date': end_date - timedelta(days=90), 'end_date': end_date,
+                    'due_date': end_date + timedelta(days=37), 'files_count': 0, 'done': False,
+                    'company_id': i, 'status': compute_status(end_date, today)
+                })
+        insert_rows(connection, VAT, vat_rows)
+
+        task_names = [f'{rng.choice(TASK_NAMES)} {i}' for i in range(1, sizes['tasks'] + 1)]
+        insert_rows(connection, Task, [
+            {'id': i, 'task_name': name, 'done_by': rng.choice(DONE_BY), 'status': rng.choice(TASK_STATUSES),
+             'task_type': rng.choice(TASK_NAMES), 'date_added': day(ahead=0), 'date_finished': None,
+             'price': rng.randint(50, 2000), 'invoice_sent': rng.random() < 0.5, 'invoice_paid': rng.random() < 0.3,
+             'office': rng.choice(['london', 'leeds']), 'files_count': 0}
+            for i, name in enumerate(task_names, 1)
+        ])
+        insert_rows(connection, Invoice, [
+            {'id': i, 'name': f'Invoice {i}', 'type': 'company', 'service_description': 'Services', 'date': day(ahead=0),
+             'amount': rng.randint(50, 5000), 'sent': rng.random() < 0.6, 'paid': rng.random() < 0.4,
+             'company_id': rng.randint(1, companies)}
+            for i in range(1, sizes['invoices'] + 1)
+        ])
+
+        files = []
+        for i in range(1, sizes['files'] + 1):
+            if task_names and rng.random() < 0.2:
+                # Task files keep the task name in company_name and have no company
+                files.append({'company_id': None, 'second_id': 'Task', 'company_name': rng.choice(task_names)})
+            else:
+                company_id = rng.randint(1, companies)
+                files.append({'company_id': company_id, 'second_id': rng.choice(FILE_CATEGORIES),
+                              'company_name': f'Company {company_id} Ltd'})
+            files[-1].update({'id': i, 'name': f'file {i}.pdf', 'path': f'files/file {i}.pdf'})
+        insert_rows(connection, Files, files)
+
+
+# Headless harness
+
+class Prompts:
+    """Answers the message boxes of the application without showing them.
+
+    Questions are answered Yes. Errors are kept, so a scenario that shows one
+    is reported as failed.
+    """
+
+    def __init__(self):
+        self.errors = []
+
+    def install(self):
+        from PyQt5.QtWidgets import QMessageBox
+
+        def critical(parent, title, text, *args, **kwargs):
+            self.errors.append(f'{title}: {text}')
+            return QMessageBox.Ok
+
+        QMessageBox.critical = staticmethod(critical)
+        QMessageBox.warning = staticmethod(critical)
+        QMessageBox.information = staticmethod(lambda *args, **kwargs: QMessageBox.Ok)
+        QMessageBox.question = staticmethod(lambda *args, **kwargs: QMessageBox.Yes)
+
+
+class StatementCounter:
+    """Counts the statements run on an engine, on any thread."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'after_cursor_execute', self.executed)
+
+    def executed(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.count += 1
+
+
+def wait_idle(app, timeout=SCENARIO_TIMEOUT):
+    """Run the event loop until the database worker has delivered every result."""
+    from db_worker import db_worker
+    worker = db_worker()
+    deadline = time.perf_counter() + timeout
+    while True:
+        app.processEvents()
+        if not worker.has_pending():
+            app.processEvents()  # Painting the results may read more pages
+            if not worker.has_pending():
+                return
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"The database worker is still busy after {timeout} s")
+        worker.wait(5)
+
+
+class Scenario:
+    """One measured data path: setup() builds what it needs, untimed, and run(state) is timed."""
+
+    def __init__(self, name, setup, run):
+        self.name = name
+        self.setup = setup
+        self.run = run
+
+
+def tab_scenarios(tabs, get_session, only=None):
+    """Return the load, search, files count, status check and company open and save scenarios."""
+    scenarios = []
+
+    for title, module_name, class_name, arguments, load, search_text in TABS:
+        if only and not any(word.lower() in title.lower() for word in only):
+            continue
+        tab_class = getattr(importlib.import_module(module_name), class_name)
+
+        def new_tab(tab_class=tab_class, arguments=arguments, title=title):
+            while tabs.count():
+                tabs.widget(0).deleteLater()
+                tabs.removeTab(0)
+            tab = tab_class(tabs) if arguments == 'tabs' else tab_class()
+            tabs.addTab(tab, title)
+            tabs.setCurrentWidget(tab)
+            return tab
+
+        def loaded_tab(new_tab=new_tab, load=load):
+            tab = new_tab()
+            getattr(tab, load)()
+            return tab
+
+        def search(tab, search_text=search_text):
+            tab.search_bar.blockSignals(True)  # The search runs once, not per typed character
+            tab.search_bar.setText(search_text)
+            tab.search_bar.blockSignals(False)
+            tab.search_data()
+
+        scenarios.append(Scenario(f'{title} load', new_tab, lambda tab, load=load: getattr(tab, load)()))
+        scenarios.append(Scenario(f'{title} search', loaded_tab, search))
+        if hasattr(tab_class, 'update_files_count'):
+            scenarios.append(Scenario(f'{title} files count', loaded_tab, lambda tab: tab.update_files_count()))
+        if hasattr(tab_class, 'check_status'):
+            scenarios.append(Scenario(f'{title} status check', loaded_tab, lambda tab: tab.check_status()))
+
+    if not only or any(word.lower() in 'company open save' for word in only):
+        from create1 import CompanyForm
+
+        def company_form():
+            while tabs.count():
+                tabs.widget(0).deleteLater()
+                tabs.removeTab(0)
+            with get_session() as session:
+                company_id = session.execute(select(func.min(Company.id))).scalar()
+                company = session.get(Company, company_id, options=[joinedload(Company.address)])
+                form = CompanyForm(tabs, company)
+            tabs.addTab(form, 'Company')
+            return form
+
+        scenarios.append(Scenario('Company open', lambda: None, lambda state: company_form()))
+        def edit_and_save(form):
+            form.account_email_check.toggle()  # A save only writes what changed
+            form.save_data()
+
+        scenarios.append(Scenario('Company save', company_form, edit_and_save))
+    return scenarios
+
+
+def measure(app, scenario, counter, prompts, repeats=REPEATS):
+    """Run a scenario and return its result: median seconds, statements and peak memory in KB."""
+    timings, statements = [], 0
+    for _ in range(repeats):
+        state = scenario.setup()
+        wait_idle(app)
+        before = counter.count
+        started = time.perf_counter()
+        scenario.run(state)
+        wait_idle(app)
+        timings.append(time.perf_counter() - started)
+        statements = max(statements, counter.count - before)
+
+    # Memory is traced in a run of its own: tracing slows everything down
+    state = scenario.setup()
+    wait_idle(app)
+    errors = len(prompts.errors)
+    tracemalloc.start()
+    try:
+        scenario.run(state)
+        wait_idle(app)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        'seconds': round(statistics.median(timings), 4),
+        'statements': statements,
+        'peak_kb': round(peak / 1024),
+    }
+    if len(prompts.errors) > errors:
+        result['errors'] = prompts.errors[errors:]
+    return result
+
+
+# Baselines
+
+def compare(results, baseline):
+    """Return the regressions of results against a baseline, as text lines."""
+    regressions = []
+    for name, base in baseline['scenarios'].items():
+        result = results['scenarios'].get(name)
+        if result is None:
+            continue
+        seconds, base_seconds = result['seconds'], base['seconds']
+        if seconds > base_seconds * (1 + TIME_TOLERANCE) and seconds - base_seconds > NOISE_SECONDS:
+            regressions.append(f"{name}: {seconds:.3f} s, baseline {base_seconds:.3f} s")
+        if result['statements'] > base['statements']:
+            regressions.append(f"{name}: {result['statements']} statements, baseline {base['statements']}")
+        peak, base_peak = result['peak_kb'], base['peak_kb']
+        if peak > base_peak * (1 + MEMORY_TOLERANCE) and peak - base_peak > NOISE_KB:
+            regressions.append(f"{name}: peak {peak} KB, baseline {base_peak} KB")
+    return regressions
+
+
+def report(results):
+    """Return the results as a text table."""
+    lines = [f"{'scenario':<36} {'seconds':>9} {'statements':>11} {'peak KB':>9}"]
+    for name, result in results['scenarios'].items():
+        flag = '  ERROR' if result.get('errors') else ''
+        lines.append(f"{name:<36} {result['seconds']:>9.3f} {result['statements']:>11} {result['peak_kb']:>9}{flag}")
+    return '\n'.join(lines)
+
+
+def configured_url():
+    """Return the URL of the application database, or None when backend cannot be imported."""
+    try:
+        import backend
+        return str(backend.engine.url)
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the load, search and save paths of every tab on synthetic data.')
+    parser.add_argument('--url', help='SQLAlchemy URL of a scratch database, e.g. postgresql://localhost/benchmark. '
+                                      'Its tables are dropped. Defaults to a temporary SQLite file.')
+    for name, size in DEFAULT_SIZES.items():
+        parser.add_argument(f'--{name}', type=int, default=size, help=f'Rows of {name} (default {size})')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--only', nargs='*', help='Only run the scenarios of these tabs, e.g. Tasks Files')
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='Baseline file to compare with or save to')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    sizes = {name: getattr(args, name) for name in DEFAULT_SIZES}
+    sizes['directors'] = min(sizes['directors'], sizes['companies'])  # One director per company at most
+    url = args.url or f"sqlite:///{os.path.join(tempfile.gettempdir(), 'benchmark.db')}"
+    if configured_url() is not None and make_url(url) == make_url(configured_url()):
+        parser.error('--url is the application database; the benchmark drops its tables')
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication, QTabWidget
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    engine = create_app_engine(url)
+    generate(engine, sizes, args.seed)
+    get_session = use_engine(engine)  # Before the tabs are imported: a few bind engine from backend
+    prompts = Prompts()
+    prompts.install()
+    counter = StatementCounter(engine)
+
+    tabs = QTabWidget()
+    tabs.resize(1400, 900)
+    tabs.show()
+
+    results = {'sizes': sizes, 'dialect': engine.dialect.name, 'scenarios': {}}
+    for scenario in tab_scenarios(tabs, get_session, args.only):
+        logger.info(f"Running {scenario.name}...")
+        results['scenarios'][scenario.name] = measure(app, scenario, counter, prompts, args.repeats)
+
+    results['pool'] = pool_stats(engine)
+    print(report(results))
+    print(f"Connections: peak {results['pool']['peak_checked_out']} in use, {results['pool']['connects']} opened.")
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    failed = [name for name, result in results['scenarios'].items() if result.get('errors')]
+    for name in failed:
+        logger.error(f"{name} failed: {'; '.join(results['scenarios'][name]['errors'])}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        logger.info(f"Baseline saved to {args.baseline}.")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['sizes'] != sizes or baseline.get('dialect') != results['dialect']:
+            logger.error(f"{args.baseline} was recorded with other sizes or another database; not compared.")
+            return 2
+        regressions = compare(results, baseline)
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        if regressions:
+            return 1
+        logger.info("No regressions against the baseline.")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
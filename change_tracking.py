@@ -0,0 +1,131 @@
+import logging
+from datetime import date, timedelta
+from sqlalchemy import func, select, true
+from models import DeletedRow
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Changes are fetched from a little before the last mark, so a row written by a
+# transaction that committed late is not missed. Fetching a row twice is harmless.
+OVERLAP = timedelta(seconds=5)
+
+
+class ChangeTracker:
+    """Remember how far a tab has read a table and fetch only what changed since.
+
+    The high-water mark is the latest updated_at of the table together with the
+    latest tombstone written for it in deleted_row. When neither moved, a
+    refresh costs a single query returning two values.
+
+    The row_version of the rows a refresh read is kept as well, so the next
+    refresh only reads again the rows of its overlap that were written since.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.table_name = model.__table__.name
+        self.mark = None
+        self.loaded_on = None
+        self.versions = {}  # id -> row_version of the rows the last refresh saw changed
+
+    def current_mark(self, session):
+        """Return (latest updated_at, latest deletion) of the table in one query."""
+        last_update = select(func.max(self.model.updated_at)).scalar_subquery()
+        last_delete = (
+            select(func.max(DeletedRow.deleted_at))
+            .where(DeletedRow.table_name == self.table_name)
+            .scalar_subquery()
+        )
+        return tuple(session.query(last_update, last_delete).one())
+
+    def set_mark(self, mark):
+        """Remember the mark taken at the start of a full load."""
+        self.mark = mark
+        self.loaded_on = date.today()
+        self.versions = {}
+
+    def changes(self, session, statement):
+        """Return (new mark, changed rows, removed ids, row versions) since the last mark.
+
+        statement is the select() the tab loads its rows with (see list_queries);
+        changed rows it no longer returns are reported as removed. Returns None when the tab needs a full
+        reload instead: nothing was loaded yet, or the day changed and the
+        derived deadline statuses moved without any row being written.
+        The tracker itself is left as it is, so this can run on a worker thread.
+        """
+        if self.mark is None or self.loaded_on != date.today():
+            return None
+
+        mark = self.current_mark(session)
+        if mark == self.mark:
+            return mark, [], set(), self.versions
+        last_update, last_delete = self.mark
+
+        rows = []
+        removed_ids = set()
+        versions = self.versions
+        if mark[0] != last_update:
+            changed_since = self.model.updated_at >= last_update - OVERLAP if last_update else true()
+            versions = dict(session.query(self.model.id, self.model.row_version).filter(changed_since).all())
+            # Rows of the overlap still at the version the last refresh read are already in the table
+            changed_ids = {row_id for row_id, version in versions.items() if self.versions.get(row_id) != version}
+            if changed_ids:
+                rows = session.execute(statement.where(changed_since, self.model.id.in_(changed_ids))).all()
+            removed_ids |= changed_ids - {row.id for row in rows}
+
+        if mark[1] != last_delete:
+            tombstones = session.query(DeletedRow.row_id).filter(DeletedRow.table_name == self.table_name)
+            if last_delete:
+                tombstones = tombstones.filter(DeletedRow.deleted_at >= last_delete - OVERLAP)
+            removed_ids |= {row_id for row_id, in tombstones}
+
+        logging.info(f"{self.table_name}: {len(rows)} changed rows, {len(removed_ids)} removed rows.")
+        return mark, rows, removed_ids, versions
+
+    def fetch_changes(self, session, statement, make_row, make_status=None):
+        """Read the changes since the last mark as plain table values.
+
+        Runs on a worker thread; the result goes to apply_changes() on the GUI
+        thread. Returns None when a full reload is needed instead.
+        """
+        changes = self.changes(session, statement)
+        if changes is None:
+            return None
+        mark, rows, removed_ids, versions = changes
+        return ChangeSet(
+            mark,
+            [make_row(row) for row in rows],
+            [row.id for row in rows],
+            removed_ids,
+            [make_status(row) for row in rows] if make_status else None,
+            versions
+        )
+
+    def apply_changes(self, changes, table_model):
+        """Patch a ChangeSet into a ColumnTableModel and move the mark forward.
+
+        table_model may be anything with the patch_rows() of ColumnTableModel.
+        Returns False when changes is not a ChangeSet, i.e. the job fell back to
+        a full load.
+        """
+        if not isinstance(changes, ChangeSet):
+            return False
+        self.mark = changes.mark
+        self.versions = changes.versions
+        if changes.rows or changes.removed_ids:
+            table_model.patch_rows(changes.rows, changes.ids, changes.removed_ids, statuses=changes.statuses)
+        return True
+
+
+class ChangeSet:
+    """Changes of a table since the last mark, as plain values."""
+    __slots__ = ('mark', 'rows', 'ids', 'removed_ids', 'statuses', 'versions')
+
+    def __init__(self, mark, rows, ids, removed_ids, statuses=None, versions=None):
+        self.mark = mark
+        self.rows = rows
+        self.ids = ids
+        self.removed_ids = removed_ids
+        self.statuses = statuses
+        self.versions = versions or {}
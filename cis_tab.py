@@ -1,28 +1,36 @@
 import calendar
 import logging
-import time  # Import time module for measuring execution time
 import sys
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
-    QLineEdit, QLabel, QComboBox, QMessageBox, QScrollArea, QPushButton, QApplication, QCheckBox, QHeaderView
+    QWidget, QVBoxLayout, QHBoxLayout, QTableView,
+    QLineEdit, QLabel, QComboBox, QMessageBox, QScrollArea, QPushButton, QApplication, QHeaderView
 )
 from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtGui import QColor
 from models import Company, CIS, Files
-from backend import get_session  # Use the context manager for session handling
-from datetime import date, datetime, timedelta
+from deadline_status import STATUS_PRIORITY
+from status_engine import refresh_statuses
+from roll_forward import roll_forward
+from datetime import date, timedelta
 from sqlalchemy.orm import joinedload
+from table_model import ColumnTableModel, RowFilterProxy, DEADLINE_COLORS
+from change_tracking import ChangeTracker
+from lazy_loading import LazyLoader
+from list_queries import cis_rows
+from db_worker import db_worker
+from instrumentation import operation
 
 
 logging.basicConfig(level=logging.INFO)
 
-COMPANY_CIS_ROLE = Qt.UserRole + 1
+CHECK_FIELDS = {6: 'email_check', 7: 'month_check'}
 
 class CISTab(QWidget):
+    refresh_category = 'CIS'  # Slice of the dashboard refresh shown in this tab
     status_changed = pyqtSignal()
     def __init__(self, parent=None):
         super().__init__(parent)
         self.updating_item = False  # Prevent recursion flag
+        self.tracker = ChangeTracker(CIS)  # Remembers what the last load has seen
         self.initUI()
 
     def initUI(self):
@@ -51,16 +59,30 @@ class CISTab(QWidget):
         self.refresh_button.clicked.connect(self.refresh)
         search_sort_layout.addWidget(self.refresh_button)
 
+        self.roll_forward_button = QPushButton("Roll Forward Selected")
+        self.roll_forward_button.setMinimumHeight(40)
+        self.roll_forward_button.clicked.connect(self.roll_forward_selected)
+        search_sort_layout.addWidget(self.roll_forward_button)
+
         main_layout.addLayout(search_sort_layout)
 
         # Table for CIS Records
-        self.table = QTableWidget()
-        self.table.setColumnCount(9)
-        self.table.setHorizontalHeaderLabels([
-            'ID', 'Company ID', 'Company Name', 'Employees Reference',
-            'CIS Last Month', 'CIS Next Month', 'Email Check', 'Month Check', 'Status'
-        ])
-        self.table.itemChanged.connect(self.check_item_changed)
+        self.model = ColumnTableModel(
+            [
+                'ID', 'Company ID', 'Company Name', 'Employees Reference',
+                'CIS Last Month', 'CIS Next Month', 'Email Check', 'Month Check', 'Status'
+            ],
+            status_column=8,
+            status_colors=DEADLINE_COLORS,
+            checkable_columns=CHECK_FIELDS,
+            default_order=lambda values: STATUS_PRIORITY.get(values[8], len(STATUS_PRIORITY))  # As build_rows sorts
+        )
+        self.model.check_changed.connect(self.check_item_changed)
+        self.table = QTableView()
+        self.proxy = RowFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self.table.setModel(self.proxy)
+        self.table.setSelectionBehavior(QTableView.SelectRows)  # Several rows for the bulk roll forward
 
         header = self.table.horizontalHeader()
         header.setSectionResizeMode(QHeaderView.Stretch)
@@ -73,7 +95,7 @@ class CISTab(QWidget):
         main_layout.addWidget(scroll_area)
         self.setLayout(main_layout)
 
-        self.load_data()
+        self.lazy_loader = LazyLoader(self, self.load_data, main_layout)  # Loads when first shown
 
     def sort_data(self):
         try:
@@ -97,7 +119,7 @@ class CISTab(QWidget):
                 column_index, ascending = 5, False
 
             if sort_option != 'Default':
-                self.table.sortItems(column_index, order=Qt.AscendingOrder if ascending else Qt.DescendingOrder)
+                self.model.sort(column_index, Qt.AscendingOrder if ascending else Qt.DescendingOrder)
             else:
                 self.load_data()
         except Exception as e:
@@ -105,163 +127,114 @@ class CISTab(QWidget):
             QMessageBox.critical(self, 'Error', f'Error occurred while sorting data: {str(e)}')
 
     def refresh(self):
-        """Refresh the table data."""
-        self.load_data()
-
-    def load_data(self):
-        """Load data from the database and populate the table."""
-        start_time = time.time()  # Record the start time
-        print("CIS 1:", datetime.now().strftime("%H:%M:%S"))
-        
-        self.table.setRowCount(0)
-        try:
-            with get_session() as session:
-                #companies_with_cis = session.query(CIS).all()
-                companies_with_cis = (
-                    session.query(CIS)
-                    .options(joinedload(CIS.company))  # Eagerly load the company relationship
-                    .all()
-                )
-
-                self.table.setRowCount(len(companies_with_cis))
-
-                status_priority = {
-                    'Overdue': 0,
-                    'Urgent': 1,
-                    'Soon': 2,
-                    'Early': 3
-                }
-                companies_with_cis.sort(key=lambda x: status_priority.get(x.status, 9))
-
-                self.table.blockSignals(True)
-                for row, cis in enumerate(companies_with_cis):
-                    self.add_cis_to_table(row, cis)
-                self.table.blockSignals(False)
-
-        except Exception as e:
-            logging.exception("Failed to load data")
-            QMessageBox.critical(self, 'Error', f'Failed to load data: {str(e)}')
-
-        print("CIS 2:", datetime.now().strftime("%H:%M:%S"))
-        end_time = time.time()  # Record the end time
-        print("Total CIS: {:.2f} seconds".format(end_time - start_time))
-
-    def add_cis_to_table(self, row, cis):
-        id_item = QTableWidgetItem(str(cis.id))
-        id_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 0, id_item)
-
-        c_id_item = QTableWidgetItem(str(cis.company_id))
-        c_id_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 1, c_id_item)
-
-        c_name = QTableWidgetItem(str(cis.name))
-        c_name.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 2, c_name)
-
-        emp_ref = QTableWidgetItem(str(cis.employees_reference))
-        emp_ref.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 3, emp_ref)
-
-        last_date_item = QTableWidgetItem(cis.last_month.strftime('%Y-%m-%d'))
-        last_date_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 4, last_date_item)
+        """Fetch only the CIS records changed since the last load."""
+        with operation('CIS refresh'):
+            db_worker().submit((id(self), 'rows'), self.fetch_changes, self.show_changes, self.load_failed)
 
-        next_date_itme = QTableWidgetItem(cis.next_month.strftime('%Y-%m-%d'))
-        next_date_itme.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 5, next_date_itme)
+    def select_rows(self):
+        """Return the select() the table rows are loaded with, only the columns shown."""
+        return cis_rows()
 
-        email_check_item = self.create_checkbox_item(cis.email_check, cis.id)
-        self.table.setItem(row, 6, email_check_item)
-
-        month_check_item = self.create_checkbox_item(cis.month_check, cis.id)
-        self.table.setItem(row, 7, month_check_item)
-
-        status_item = QTableWidgetItem(cis.status)
-        status_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 8, status_item)
-
-        self.set_row_color(row, cis.status)
-
-    def create_checkbox_item(self, checked, cis_id):
-        """Create a checkbox item."""
-        item = QTableWidgetItem()
-        item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-        item.setCheckState(Qt.Checked if checked else Qt.Unchecked)
-        item.setData(COMPANY_CIS_ROLE, cis_id)
-        return item
-
-    def check_item_changed(self, item):
+    def load_data(self):
+        """Load the CIS records on the database worker; the table fills in when they arrive."""
+        with operation('CIS load'):
+            db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.load_failed)
+
+    def fetch_rows(self, session):
+        """Worker thread: return the change tracking mark and the table rows."""
+        mark = self.tracker.current_mark(session)
+        return mark, self.build_rows(session.execute(self.select_rows()).all())
+
+    def fetch_changes(self, session):
+        """Worker thread: return the changes since the last load, or all rows when a reload is needed."""
+        changes = self.tracker.fetch_changes(session, self.select_rows(), self.cis_row)
+        return changes if changes is not None else self.fetch_rows(session)
+
+    def build_rows(self, companies_with_cis):
+        """Sort CIS records by status and return their (rows, ids) for the table."""
+        companies_with_cis.sort(key=lambda x: STATUS_PRIORITY.get(x.status, len(STATUS_PRIORITY)))
+        return [self.cis_row(row) for row in companies_with_cis], [row.id for row in companies_with_cis]
+
+    def show_rows(self, result):
+        """Show the rows of a full load, sorted by status by default."""
+        mark, (rows, ids) = result
+        self.tracker.set_mark(mark)
+        self.model.set_rows(rows, ids=ids)
+        self.lazy_loader.finish()
+        if self.search_bar.text():
+            self.search_data()
+
+    def show_changes(self, result):
+        """Patch the changed rows into the table, or show a full load."""
+        if not self.tracker.apply_changes(result, self.model):
+            self.show_rows(result)
+        elif self.search_bar.text():
+            self.search_data()
+
+    def load_failed(self, error):
+        logging.error(f"Failed to load data: {error}")
+        self.lazy_loader.finish()
+        QMessageBox.critical(self, 'Error', f'Failed to load data: {str(error)}')
+
+    def cis_row(self, cis):
+        """Return the table values of a projected CIS row (see list_queries.cis_rows)."""
+        return (
+            cis.id, cis.company_id, cis.name, cis.employees_reference,
+            cis.last_month, cis.next_month, cis.email_check, cis.month_check, cis.status
+        )
+
+    def check_item_changed(self, row, column, checked):
         """Handle checkbox state changes."""
         if self.updating_item:
             return
-        if item.column() in [6,7]:
-            try:
-                cis_id = item.data(COMPANY_CIS_ROLE)
-                with get_session() as session:
-                    # Re-fetch the CIS object within an active session
-                    cis = session.query(CIS).filter_by(id=cis_id).first()
-                    if  cis:
-                        self.updating_item = True  # Prevent recursion
-                        if item.column() == 6:
-                            cis.email_check = item.checkState() == Qt.Checked
-                        elif item.column() == 7:
-                            cis.month_check = item.checkState() == Qt.Checked
-                        session.commit()
-                        self.updating_item = False  # Re-enable updates
-
-                        if cis.email_check and cis.month_check:
-                            response = QMessageBox.question(
-                                self, 'Confirm',
-                                'Both checks are marked. Do you want to update the CIS date and reset the checks?',
-                                QMessageBox.Yes | QMessageBox.No
-                            )
-                            if response == QMessageBox.Yes:
-                                try:
-                                    self.table.blockSignals(True)  # Temporarily disconnect the signal to prevent recursion
-
-                                    
-                                    next_month = cis.next_month
-                                    new_last_month = next_month
-                                    new_next_month = self.add_months(next_month, 1)
-                                    
-                                    cis.last_month = new_last_month
-                                    cis.next_month = new_next_month
-                                    cis.email_check = False
-                                    cis.month_check = False
-
-                                    session.commit()
-
-                                    self.load_data()
-                                    self.check_status()
-                                except Exception as e:
-                                    logging.exception("Error updating confirmation date")
-                                    QMessageBox.critical(self, "Error", f"Error updating confirmation date: {str(e)}")
-                                finally:
-                                    self.table.blockSignals(False)  # Reconnect the signal
-            except Exception as e:
-                logging.exception("Error handling item change")
-                QMessageBox.critical(self, "Error", f"Error handling item change: {str(e)}")
+        if column in CHECK_FIELDS:
+            cis_id = self.model.row_id(row)
+            field = CHECK_FIELDS[column]
+            with operation('CIS save'):
+                db_worker().submit_write(
+                    lambda session: self.store_check(session, cis_id, field, checked),
+                    lambda checks: self.check_saved(cis_id, checks),
+                    lambda error: self.check_failed(cis_id, column, not checked, error),
+                    idempotent=True  # Setting a flag twice leaves it the same
+                )
+
+    def store_check(self, session, cis_id, field, checked):
+        """Worker thread: store one check and return both checks of the CIS record, or None when it is gone."""
+        cis = session.get(CIS, cis_id)
+        if cis is None:
+            return None
+        setattr(cis, field, checked)
+        return cis.email_check, cis.month_check
+
+    def check_saved(self, cis_id, checks):
+        """Offer to move the CIS record on to the next month once both its checks are marked."""
+        if checks is None or not all(checks):
+            return
+        response = QMessageBox.question(
+            self, 'Confirm',
+            'Both checks are marked. Do you want to update the CIS date and reset the checks?',
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if response == QMessageBox.Yes:
+            db_worker().submit_write(
+                lambda session: self.roll_rows_forward(session, [cis_id]),  # Only this row changed
+                self.show_rolled_rows,
+                lambda error: self.roll_forward_failed("Error updating confirmation date", error)
+            )
+
+    def check_failed(self, cis_id, column, previous, error):
+        """Put the checkbox back when the check could not be stored."""
+        logging.error(f"Error handling item change: {error}")
+        row = self.model.find_row(cis_id)
+        if row is not None:
+            self.model.set_value(row, column, previous)
+        QMessageBox.critical(self, "Error", f"Error handling item change: {str(error)}")
 
     def search_data(self):
         """Search data in the table based on user input."""
         search_text = self.search_bar.text().lower()
-        for row in range(self.table.rowCount()):
-            match = False
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    original_color = item.data(Qt.UserRole)
-                    if not original_color:
-                        original_color = item.background()
-                        item.setData(Qt.UserRole, original_color)
-
-                    if search_text and search_text in item.text().lower():
-                        item.setBackground(QColor(255, 255, 0, 127))
-                        match = True
-                    else:
-                        item.setBackground(original_color)
-            self.table.setRowHidden(row, not match if search_text else False)
+        self.model.set_highlight(search_text)
+        self.proxy.set_visible_ids(self.model.matching_ids(search_text) if search_text else None)
 
     def add_months(self, source_date, months):
         """Add a specified number of months to a date."""
@@ -272,111 +245,62 @@ class CISTab(QWidget):
         return date(year, month, day)
 
     def check_status(self):
-        """Check and update the status of confirmation statements."""
-        try:
-            with get_session() as session:
-                cises = session.query(CIS).options(joinedload(CIS.company)).all()
-                for cis in cises:
-                    self.update_status(cis)
-                session.commit()
-            self.load_data()
-        except Exception as e:
-            logging.exception("Error occurred while checking status")
-            QMessageBox.critical(self, "Error", f"Error occurred while checking status: {str(e)}")
-
-    def update_status(self, cis):
-        """Update the status of a confirmation based on the date."""
-        today = datetime.now().date()
-        days_diff = (cis.next_month - today).days
-        if days_diff > 7:
-            cis.status = 'Early'
-        elif 3 <= days_diff <= 7:
-            cis.status = 'Soon'
-        elif 3 <= days_diff <= 0:
-            cis.status = 'Urgent'
-        else:
-            cis.status = 'Overdue'
-
-    def set_row_color(self, row, status):
-        """Set the background color of a row based on its status."""
-        try:  
-            color_map = {
-                'Overdue': QColor(251, 55, 107, 127),  # light red with transparency
-                'Urgent': QColor(247, 131, 34, 127),   # light orange with transparency
-                'Soon': QColor(241, 240, 133, 127),    # light yellow with transparency
-                'Early': QColor(87, 242, 141, 127)     # light green with transparency
-            }
-            color = color_map.get(status, QColor(255, 255, 255, 127))  # default to white with transparency
-
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    item.setBackground(color)
-                    item.setData(Qt.UserRole, color)  # Store the original color
-        except Exception as e:
-            logging.exception("Error occurred while setting row color")
-            QMessageBox.critical(self, "Error", f"Error occurred while setting row color: {str(e)}")
-
-#old
-    def update_status_and_color(self, row, cis):
-        """Update the status and color of a CIS entry in the table."""
-        today = date.today()
-        status = "Early"
-        if cis.next_month <= today:
-            status = "Overdue"
-        elif cis.next_month <= today + timedelta(days=3):
-            status = "Urgent"
-        elif cis.next_month <= today + timedelta(days=7):
-            status = "Soon"
-
-        self.table.setItem(row, 8, self.create_noneditable_item(status))
-        self.set_row_color(row, status)
-        self.update_checkbox_background(row, status)
-
-    def update_status_and_color_by_cis(self, cis_id):
-        """Update status and color for a specific CIS entry."""
-        with get_session() as session:
-            cis = session.query(CIS).get(cis_id)
-            if not cis:
-                return
-
-            today = date.today()
-            status = "Early"
-            if cis.next_month <= today:
-                status = "Overdue"
-            elif cis.next_month <= today + timedelta(days=3):
-                status = "Urgent"
-            elif cis.next_month <= today + timedelta(days=7):
-                status = "Soon"
-            cis.status = status
-            session.commit()
-
-            # Update the table view
-            companies_with_cis = session.query(Company).filter(Company.cis == True).all()
-            for row, company in enumerate(companies_with_cis):
-                if company.id == cis.company_id:
-                    self.update_status_and_color(row, cis)
-
-    def update_checkbox_background(self, row, status):
-        """Update checkbox background color based on status."""
-        color_map = {
-            'Overdue': QColor(251, 55, 107, 127),
-            'Urgent': QColor(247, 131, 34, 127),
-            'Soon': QColor(241, 240, 133, 127),
-            'Early': QColor(87, 242, 141, 127)
-        }
-        color = color_map.get(status, QColor(255, 255, 255, 127))
-
-        for col in [6, 7]:  # Columns for checkboxes
-            item = self.table.cellWidget(row, col)
-            if item:
-                item.setStyleSheet(f"background-color: rgba({color.red()}, {color.green()}, {color.blue()}, {color.alpha() / 255.0});")
-    def create_noneditable_item(self, text):
-        """Create a non-editable QTableWidgetItem."""
-        item = QTableWidgetItem(text)
-        item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-        return item
-    
+        """Check and update the status of confirmation statements, then reload the table."""
+        with operation('CIS status check'):
+            db_worker().submit_write(self.update_statuses, self.statuses_updated, self.status_failed,
+                                     idempotent=True)  # Setting the statuses twice stores the same ones
+
+    def update_statuses(self, session):
+        """Worker thread: store the statuses; submit_write commits them."""
+        refresh_statuses(session, ['CIS'])  # One UPDATE ... CASE for the whole table
+
+    def statuses_updated(self, result):
+        """Reload the table once the statuses are stored."""
+        db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.status_failed)
+
+    def status_failed(self, error):
+        QMessageBox.critical(self, "Error", f"Error occurred while checking status: {str(error)}")
+
+    def roll_forward_selected(self):
+        """Roll all selected CIS records forward at once, with one confirmation and one commit."""
+        cis_ids = self.proxy.selected_ids(self.table)
+        if not cis_ids:
+            QMessageBox.information(self, 'Roll Forward', 'Select the CIS records to roll forward first.')
+            return
+        response = QMessageBox.question(
+            self, 'Confirm',
+            f'Roll {len(cis_ids)} selected CIS records forward? This will move them on to the next month and reset their checks.',
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if response != QMessageBox.Yes:
+            return
+        with operation('CIS roll forward'):
+            db_worker().submit_write(
+                lambda session: self.roll_rows_forward(session, cis_ids),
+                self.show_rolled_rows,
+                lambda error: self.roll_forward_failed("Error rolling CIS records forward", error)
+            )
+
+    def roll_rows_forward(self, session, cis_ids):
+        """Worker thread: roll CIS records forward with one UPDATE and return their reloaded rows."""
+        roll_forward(session, 'CIS', cis_ids)
+        return session.execute(self.select_rows().where(CIS.id.in_(cis_ids))).all()
+
+    def show_rolled_rows(self, records):
+        """Show rolled forward CIS records in their rows and move each row to its sorted place."""
+        for cis in records:
+            row = self.model.find_row(cis.id)
+            if row is not None:
+                self.model.update_row(row, self.cis_row(cis))
+                self.model.reposition_row(row)
+        if self.search_bar.text():
+            self.search_data()
+
+    def roll_forward_failed(self, message, error):
+        logging.error(f"{message}: {error}")
+        QMessageBox.critical(self, "Error", f"{message}: {str(error)}")
+
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = QWidget()
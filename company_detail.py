@@ -0,0 +1,255 @@
+import logging
+import sys
+from collections import namedtuple
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import joinedload, make_transient_to_detached, selectinload
+from models import Company, Address, Account, ConfirmationStatement, PayRun, CIS, VAT, Employer, Director, Files
+from deadline_status import compute_status
+from db_session import get_session
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Everything the company form shows. One-to-one parts are a record or None;
+# employers and files are tuples of records, directors a tuple of
+# (director record, address record or None) pairs.
+CompanySnapshot = namedtuple('CompanySnapshot', [
+    'company', 'address', 'account', 'confirmation_statement', 'payrun', 'cis', 'vat',
+    'employers', 'directors', 'files'
+])
+
+_record_types = {}  # model -> named tuple type of its columns
+
+
+def record(instance):
+    """Return the column values of a model instance as an immutable named tuple, or None."""
+    if instance is None:
+        return None
+    model = type(instance)
+    record_type = _record_types.get(model)
+    if record_type is None:
+        keys = [attribute.key for attribute in inspect(model).column_attrs]
+        record_type = _record_types[model] = namedtuple(f'{model.__name__}Record', keys)
+    return record_type(*[getattr(instance, key) for key in record_type._fields])
+
+
+def company_detail_query(company_id):
+    """Return the select() of a company with everything the form shows.
+
+    The one-to-one parts are joined in. Employers and directors are joined as
+    well: company_id is unique in both tables, so the joins cannot multiply
+    the row. Files are the only real collection and come from one IN query.
+    """
+    return select(Company).where(Company.id == company_id).options(
+        joinedload(Company.address),
+        joinedload(Company.accounts),
+        joinedload(Company.confirmation_statements),
+        joinedload(Company.payrun),
+        joinedload(Company.cis_details),
+        joinedload(Company.vats),
+        joinedload(Company.employers),
+        joinedload(Company.directors).joinedload(Director.address),
+        selectinload(Company.files)
+    )
+
+
+def load_company(session, company_id):
+    """Return the CompanySnapshot of a company in two queries, or None when it does not exist."""
+    company = session.execute(company_detail_query(company_id)).unique().scalar_one_or_none()
+    if company is None:
+        return None
+    return CompanySnapshot(
+        company=record(company),
+        address=record(company.address),
+        account=record(company.accounts),
+        confirmation_statement=record(company.confirmation_statements),
+        payrun=record(company.payrun),
+        cis=record(company.cis_details),
+        vat=record(company.vats),
+        employers=tuple(record(employer) for employer in company.employers),
+        directors=tuple((record(director), record(director.address)) for director in company.directors),
+        files=tuple(record(file) for file in company.files)
+    )
+
+
+def fetch_company(company_id):
+    """Return the CompanySnapshot of a company read in a session of its own."""
+    with get_session() as session:
+        return load_company(session, company_id)
+
+
+# One-row parts of a company: snapshot field, model, column the deadline status follows
+ONE_ROW_PARTS = (
+    ('account', Account, 'date'),
+    ('confirmation_statement', ConfirmationStatement, 'date'),
+    ('payrun', PayRun, 'date'),
+    ('cis', CIS, 'next_month'),
+    ('vat', VAT, 'end_date'),
+)
+
+
+class RowChange:
+    """One row a save writes: inserted when record is None, deleted when values is None, else updated.
+
+    values holds only the columns that differ from the snapshot record. links
+    maps a relationship of the row to the RowChange of a row inserted in the
+    same save, e.g. a new director and its new address.
+    """
+    __slots__ = ('model', 'record', 'values', 'links', 'instance')
+
+    def __init__(self, model, record, values, links=None):
+        self.model = model
+        self.record = record
+        self.values = values
+        self.links = links or {}
+        self.instance = None
+
+
+def same(old, new):
+    """Return True when a form value matches a stored one; an empty text field matches NULL."""
+    if old in (None, '') and new in (None, ''):
+        return True
+    return old == new
+
+
+def changed_fields(record, values):
+    """Return the values that differ from a snapshot record, all of them when there is no record."""
+    if record is None:
+        return dict(values)
+    return {key: value for key, value in values.items() if not same(getattr(record, key), value)}
+
+
+def company_changes(snapshot, values):
+    """Return the RowChanges that turn a snapshot into what the form holds.
+
+    snapshot is the CompanySnapshot the form was loaded from, or None for a
+    new company. values is CompanyForm.form_values(): a dict of column values
+    per part, None for a part to delete (CIS switched off) and no key for a
+    part the form leaves alone (VAT switched off); employers, directors and
+    files are lists of rows led by their id, None for new rows. Rows of the
+    snapshot missing from the lists are deleted, except files, which the form
+    cannot remove. A row whose deadline changes gets its status recomputed.
+    An empty list means there is nothing to save.
+    """
+    changes = []
+
+    def change(model, record, new_values, links=None):
+        if new_values is None:
+            if record is None:
+                return None
+            row_change = RowChange(model, record, None)
+        else:
+            delta = changed_fields(record, new_values)
+            if not delta and not links:
+                return None
+            row_change = RowChange(model, record, delta, links)
+        changes.append(row_change)
+        return row_change
+
+    def deadline_status(row_change, deadline):
+        if row_change is not None and row_change.values and deadline in row_change.values:
+            row_change.values['status'] = compute_status(row_change.values[deadline])
+
+    company_record = snapshot.company if snapshot else None
+    address_record = snapshot.address if snapshot else None
+    company_id = values['company']['id']
+
+    address_change = change(Address, address_record, values['address'])
+    new_address = address_change if address_record is None else None
+    change(Company, company_record, values['company'], {'address': new_address} if new_address else None)
+
+    for part, model, deadline in ONE_ROW_PARTS:
+        if part not in values:
+            continue
+        record = getattr(snapshot, part) if snapshot else None
+        part_values = values[part]
+        links = None
+        if part_values is not None:
+            part_values = dict(part_values)
+            if record is None:
+                part_values['company_id'] = company_id
+            if model is VAT:  # The VAT return is filed at the company address
+                if new_address:
+                    links = {'address': new_address}
+                else:
+                    part_values['address_id'] = address_record.id
+        deadline_status(change(model, record, part_values, links), deadline)
+
+    employers = {record.id: record for record in snapshot.employers} if snapshot else {}
+    kept = set()
+    for employer_id, employer_values in values['employers']:
+        record = employers.get(employer_id)
+        kept.add(employer_id)
+        change(Employer, record, employer_values if record else {**employer_values, 'company_id': company_id})
+    for employer_id, record in employers.items():
+        if employer_id not in kept:
+            change(Employer, record, None)
+
+    directors = {director.id: (director, address) for director, address in snapshot.directors} if snapshot else {}
+    kept = set()
+    for director_id, director_values, director_address in values['directors']:
+        record, address = directors.get(director_id, (None, None))
+        kept.add(director_id)
+        if address is None:
+            links = {'address': change(Address, None, director_address)}
+        else:
+            change(Address, address, director_address)
+            links = None
+        change(Director, record, director_values if record else {**director_values, 'company_id': company_id}, links)
+    for director_id, (record, _) in directors.items():
+        if director_id not in kept:
+            change(Director, record, None)
+
+    files = {record.id: record for record in snapshot.files} if snapshot else {}
+    for file_id, file_values in values['files']:
+        if file_id in files:
+            change(Files, files[file_id], file_values)
+    return changes
+
+
+def new_files(values):
+    """Return the (name, category) of the file rows added to the form since it was loaded."""
+    return [(file_values['name'], file_values['second_id']) for file_id, file_values in values['files'] if file_id is None]
+
+
+def known_instance(session, model, record):
+    """Return a persistent instance holding a snapshot record, without reading the row again."""
+    instance = model(**record._asdict())
+    make_transient_to_detached(instance)
+    return session.merge(instance, load=False)
+
+
+def apply_changes(session, changes):
+    """Write RowChanges in one flush: only the changed columns are updated.
+
+    Rows of the snapshot are not read again; the ORM still runs its events, so
+    deletions leave their tombstones and file counts follow their files.
+    """
+    for row_change in changes:
+        if row_change.record is None:
+            row_change.instance = row_change.model(**row_change.values)
+            session.add(row_change.instance)
+        else:
+            row_change.instance = known_instance(session, row_change.model, row_change.record)
+            if row_change.values is None:
+                session.delete(row_change.instance)
+                continue
+            for key, value in row_change.values.items():
+                setattr(row_change.instance, key, value)
+        for name, target in row_change.links.items():
+            setattr(row_change.instance, name, target.instance)
+    session.flush()
+    logging.info(f"Company saved: {len(changes)} rows written.")
+
+
+if __name__ == "__main__":
+    # python company_detail.py <company id>: print the snapshot the company form shows
+    if len(sys.argv) != 2:
+        print("Usage: python company_detail.py <company id>")
+        sys.exit(2)
+    snapshot = fetch_company(sys.argv[1])
+    if snapshot is None:
+        print(f"No company with ID {sys.argv[1]}.")
+        sys.exit(1)
+    for name, value in snapshot._asdict().items():
+        print(f"{name}: {value}")
@@ -0,0 +1,83 @@
+import logging
+import sys
+from sqlalchemy import or_, text
+from models import Company
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Columns searched with a substring match, served by the trigram indexes on PostgreSQL.
+# Every arm of the OR needs an index there, or the whole search scans the table.
+TEXT_COLUMNS = [
+    Company.name, Company.nature, Company.email, Company.pay_reference_number,
+    Company.account_office_number, Company.contact_number
+]
+
+# Columns only compared when the search text is a number
+NUMERIC_COLUMNS = [Company.id, Company.address_id]
+
+
+def like_pattern(search_text):
+    """Return a '%text%' pattern with the LIKE wildcards of the text escaped."""
+    escaped = search_text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def search_predicate(search_text):
+    """Build the WHERE clause matching companies against the search text."""
+    search_text = search_text.strip().lower()
+    pattern = like_pattern(search_text)
+    conditions = [column.ilike(pattern, escape='\\') for column in TEXT_COLUMNS]
+
+    # Numeric fields use the exact match indexes
+    if search_text.isdigit():
+        if len(search_text) <= 18:  # Larger numbers do not fit a BIGINT
+            conditions.extend(column == int(search_text) for column in NUMERIC_COLUMNS)
+        conditions.append(Company.house_number == search_text)
+        conditions.append(Company.government_gateway_id.ilike(pattern, escape='\\'))
+
+    # CIS and VAT are only matched for 'yes' or 'no'
+    if search_text in ['yes', 'ye']:
+        conditions.extend([Company.cis.is_(True), Company.vat.is_(True)])
+    elif search_text == 'no':
+        conditions.extend([Company.cis.is_(False), Company.vat.is_(False)])
+
+    return or_(*conditions)
+
+
+def search_company_ids(session, search_text):
+    """Return the ids of the companies matching the search text.
+
+    The filtering happens in the database, so only the matching ids come back.
+    """
+    rows = session.query(Company.id).filter(search_predicate(search_text)).all()
+    return {row.id for row in rows}
+
+
+def search_indexes():
+    """Return the indexes backing the company search."""
+    return [index for index in Company.__table__.indexes if 'updated_at' not in index.columns]
+
+
+def install_search_indexes(connection):
+    """Create the company search indexes that are missing, inside an open transaction."""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    for index in search_indexes():
+        index.create(connection, checkfirst=True)
+        logging.info(f"Index {index.name} is in place.")
+
+
+def create_search_indexes(engine):
+    """Create the company search indexes on an existing database."""
+    with engine.begin() as connection:
+        install_search_indexes(connection)
+
+
+if __name__ == "__main__":
+    from backend import engine
+    try:
+        create_search_indexes(engine)
+    except Exception:
+        logging.exception("Failed to create the company search indexes")
+        sys.exit(1)
@@ -1,29 +1,37 @@
 import sys
-from datetime import datetime
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
+    QWidget, QVBoxLayout, QHBoxLayout, QTableView,
     QLineEdit, QLabel, QComboBox, QMessageBox, QScrollArea, QApplication, QPushButton, QHeaderView
 )
 from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtGui import QColor
 from sqlalchemy.orm import joinedload
 from models import Company, ConfirmationStatement, Files
-from backend import get_session  # Ensure using the context manager from backend.py
+from deadline_status import compute_status, row_status, STATUS_PRIORITY
+from status_engine import refresh_statuses
+from roll_forward import roll_forward
+from files_count import recount_files
+from table_model import ColumnTableModel, RowFilterProxy, DEADLINE_COLORS
+from change_tracking import ChangeTracker
+from lazy_loading import LazyLoader
+from list_queries import confirmation_rows
+from db_worker import db_worker
+from instrumentation import operation
+from refresh_coordinator import RefreshCoordinator
 import logging
-from dateutil.relativedelta import relativedelta
-import time  # Import the time module
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-COMPANY_CONFIRMATION_ROLE = Qt.UserRole + 1
+CHECK_FIELDS = {4: 'invoice_check', 5: 'done_check'}
 
 class ConfirmationStatementTab(QWidget):
+    refresh_category = 'ConfirmationStatement'  # Slice of the dashboard refresh shown in this tab
     status_changed = pyqtSignal()  # Signal to emit when status changes
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.updating_item = False  # Flag to prevent recursion
+        self.tracker = ChangeTracker(ConfirmationStatement)  # Remembers what the last load has seen
         self.initUI()
 
     def initUI(self):
@@ -52,17 +60,31 @@ class ConfirmationStatementTab(QWidget):
         self.refresh_button.clicked.connect(self.refresh_tabs)
         search_sort_layout.addWidget(self.refresh_button)
 
+        self.roll_forward_button = QPushButton("Roll Forward Selected")
+        self.roll_forward_button.setMinimumHeight(40)
+        self.roll_forward_button.clicked.connect(self.roll_forward_selected)
+        search_sort_layout.addWidget(self.roll_forward_button)
+
         main_layout.addLayout(search_sort_layout)
 
         # Table for Confirmation Statements
-        self.table = QTableWidget()
-        self.table.setColumnCount(6)
-        self.table.setHorizontalHeaderLabels([
-            'ID', 'Company Name',
-            'Confirmation Date', 'Confirmation Status',
-            'Invoice Check', 'Done Check'
-        ])
-        self.table.itemChanged.connect(self.check_item_changed)
+        self.model = ColumnTableModel(
+            [
+                'ID', 'Company Name',
+                'Confirmation Date', 'Confirmation Status',
+                'Invoice Check', 'Done Check'
+            ],
+            status_column=3,
+            status_colors=DEADLINE_COLORS,
+            checkable_columns=CHECK_FIELDS,
+            default_order=lambda values: STATUS_PRIORITY.get(values[3], len(STATUS_PRIORITY))  # As build_rows sorts
+        )
+        self.model.check_changed.connect(self.check_item_changed)
+        self.table = QTableView()
+        self.proxy = RowFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self.table.setModel(self.proxy)
+        self.table.setSelectionBehavior(QTableView.SelectRows)  # Several rows for the bulk roll forward
         
         header = self.table.horizontalHeader()
         header.setSectionResizeMode(QHeaderView.Stretch)
@@ -75,83 +97,56 @@ class ConfirmationStatementTab(QWidget):
         main_layout.addWidget(scroll_area)
         self.setLayout(main_layout)
 
-        # Load data initially
-        self.load_data()
+        self.lazy_loader = LazyLoader(self, self.load_data, main_layout)  # Loads when first shown
 
     def load_data(self):
-        """Load data from the database directly within the method and measure load time."""
-        start_time = time.time()  # Start the timer
-        print("Loading Confirmation 2:", datetime.now().strftime("%H:%M:%S"))
-
-        self.table.setRowCount(0)  # Clear the table before loading new data
-        try:
-            with get_session() as session:
-                confirmations = (
-                    session.query(ConfirmationStatement)
-                    .options(joinedload(ConfirmationStatement.company))  # Eagerly load the company relationship
-                    .all()
-                )
-
-                self.table.setRowCount(len(confirmations))
-
-                # Sort the confirmations based on the status priority
-                status_priority = {
-                    'Overdue': 0,
-                    'Urgent': 1,
-                    'Soon': 2,
-                    'Early': 3
-                }
-                confirmations.sort(key=lambda x: status_priority.get(x.status, 4))
-
-                # Block signals while populating the table to avoid unnecessary updates
-                self.table.blockSignals(True)
-                for row, confirmation in enumerate(confirmations):
-                    self.add_confirmation_to_table(row, confirmation)
-                self.table.blockSignals(False)
-
-        except Exception as e:
-            logging.exception("Failed to load data")
-            QMessageBox.critical(self, 'Error', f'Failed to load data: {str(e)}')
-
-        # Measure the time taken to load and populate the table
-        end_time = time.time()  # Stop the timer
-        print("Confirmation Statement 2:", datetime.now().strftime("%H:%M:%S"))
-        print("Confirmation Statement Total: {:.2f} seconds".format(end_time - start_time))
-
-    def add_confirmation_to_table(self, row, confirmation):
-        """Add a confirmation entry to the table."""
-
-        id_item = QTableWidgetItem(str(confirmation.company_id))
-        id_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 0, id_item)
-
-        name_item = QTableWidgetItem(confirmation.name)
-        name_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 1, name_item)
-
-        date_item = QTableWidgetItem(confirmation.date.strftime('%Y-%m-%d'))
-        date_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 2, date_item)
-
-        status_item = QTableWidgetItem(confirmation.status)
-        status_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 3, status_item)
-
-        invoice_check_item = self.create_checkbox_item(confirmation.invoice_check, confirmation.id)
-        self.table.setItem(row, 4, invoice_check_item)
-
-        done_check_item = self.create_checkbox_item(confirmation.done_check, confirmation.id)
-        self.table.setItem(row, 5, done_check_item)
-
-        self.set_row_color(row, confirmation.status)
-
-    def create_checkbox_item(self, checked, confirmation_id):
-        """Create a checkbox item."""
-        item = QTableWidgetItem()
-        item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-        item.setCheckState(Qt.Checked if checked else Qt.Unchecked)
-        item.setData(COMPANY_CONFIRMATION_ROLE, confirmation_id)
-        return item
+        """Load the confirmation statements on the database worker; the table fills in when they arrive."""
+        with operation('Confirmation statements load'):
+            db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.load_failed)
+
+    def fetch_rows(self, session):
+        """Worker thread: return the change tracking mark and the table rows."""
+        mark = self.tracker.current_mark(session)
+        return mark, self.build_rows(session.execute(self.select_rows()).all())
+
+    def fetch_changes(self, session):
+        """Worker thread: return the changes since the last load, or all rows when a reload is needed."""
+        changes = self.tracker.fetch_changes(session, self.select_rows(), self.confirmation_row)
+        return changes if changes is not None else self.fetch_rows(session)
+
+    def build_rows(self, confirmations):
+        """Sort confirmation statements by status and return their (rows, ids) for the table."""
+        # Sort the confirmations based on the status priority
+        confirmations.sort(key=lambda x: STATUS_PRIORITY.get(x.status, len(STATUS_PRIORITY)))
+        return [self.confirmation_row(row) for row in confirmations], [row.id for row in confirmations]
+
+    def show_rows(self, result):
+        """Show the rows of a full load, sorted by status by default."""
+        mark, (rows, ids) = result
+        self.tracker.set_mark(mark)
+        self.model.set_rows(rows, ids=ids)
+        self.lazy_loader.finish()
+        if self.search_bar.text():
+            self.search_data()
+
+    def show_changes(self, result):
+        """Patch the changed rows into the table, or show a full load."""
+        if not self.tracker.apply_changes(result, self.model):
+            self.show_rows(result)
+        elif self.search_bar.text():
+            self.search_data()
+
+    def load_failed(self, error):
+        logging.error(f"Failed to load data: {error}")
+        self.lazy_loader.finish()
+        QMessageBox.critical(self, 'Error', f'Failed to load data: {str(error)}')
+
+    def confirmation_row(self, confirmation):
+        """Return the table values of a projected confirmation statement row (see list_queries.confirmation_rows)."""
+        return (
+            confirmation.company_id, confirmation.name, confirmation.date, confirmation.status,
+            confirmation.invoice_check, confirmation.done_check
+        )
 
     def sort_data(self):
         """Sort the data based on the selected option."""
@@ -172,7 +167,7 @@ class ConfirmationStatementTab(QWidget):
                 column_index, ascending = 2, False
 
             if sort_option != 'Default':
-                self.table.sortItems(column_index, order=Qt.AscendingOrder if ascending else Qt.DescendingOrder)
+                self.model.sort(column_index, Qt.AscendingOrder if ascending else Qt.DescendingOrder)
             else:
                 self.load_data()
         except Exception as e:
@@ -180,147 +175,149 @@ class ConfirmationStatementTab(QWidget):
             QMessageBox.critical(self, 'Error', f'Error occurred while sorting data: {str(e)}')
 
     def refresh(self):
-        """Refresh the data in the table."""
-        self.load_data()
+        """Fetch only the confirmation statements changed since the last load."""
+        with operation('Confirmation statements refresh'):
+            db_worker().submit((id(self), 'rows'), self.fetch_changes, self.show_changes, self.load_failed)
+
+    def select_rows(self):
+        """Return the select() the table rows are loaded with, only the columns shown."""
+        return confirmation_rows()
 
     def refresh_tabs(self):
-        """Refresh all tabs."""
+        """Refresh all tabs with one pass of set-based queries."""
         try:
-            self.update_files_count()
-            self.check_status()
-            self.refresh()
+            RefreshCoordinator.of(self).refresh()
         except Exception as e:
-            logging.exception("Error occurred while refreshing tabs")
-            QMessageBox.critical(self, 'Error', f'Error occurred while refreshing tabs: {str(e)}')
+            QMessageBox.critical(self, 'Error', f'An error occurred while refreshing the tabs: {str(e)}')
 
-    def update_files_count(self):
-        """Update the file count for each company."""
-        try:
-            with get_session() as session:
-                companies = session.query(Company).all()
-                for company in companies:
-                    file_count = session.query(Files).filter_by(company_id=company.id).count()
-                    company.files_count = file_count
-                    session.add(company)  # Mark the company object as modified
-                session.commit()  # Commit all changes
-        except Exception as e:
-            logging.exception("Error occurred while updating file counts")
-            QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(e)}')
+    def update_files_count(self, on_done=None):
+        """Update the file count for each company on the database worker."""
+        with operation('Confirmation statements files count'):
+            db_worker().submit_write(self.recount, on_done, self.recount_failed,
+                                     idempotent=True)  # Counting twice stores the same counts
+
+    def recount(self, session):
+        recount_files(session, 'Company')  # One GROUP BY query for all rows
+
+    def recount_failed(self, error):
+        QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(error)}')
 
     def search_data(self):
         """Search and highlight data in the table."""
         try:
             search_text = self.search_bar.text().lower()
-            for row in range(self.table.rowCount()):
-                match = False
-                for col in range(self.table.columnCount()):
-                    item = self.table.item(row, col)
-                    if item:
-                        original_color = item.data(Qt.UserRole)
-                        if not original_color:
-                            original_color = item.background()
-                            item.setData(Qt.UserRole, original_color)
-
-                        if search_text and search_text in item.text().lower():
-                            item.setBackground(QColor(255, 255, 0, 127))  # light yellow with transparency
-                            match = True
-                        else:
-                            item.setBackground(original_color)
-                self.table.setRowHidden(row, not match if search_text else False)
+            self.model.set_highlight(search_text)
+            self.proxy.set_visible_ids(self.model.matching_ids(search_text) if search_text else None)
         except Exception as e:
             logging.exception("Error occurred while searching data")
             QMessageBox.critical(self, 'Error', f'Error occurred while searching data: {str(e)}')
 
-    def check_item_changed(self, item):
+    def check_item_changed(self, row, column, checked):
         """Handle checkbox item changes."""
         if self.updating_item:
             return
-        if item.column() in [4, 5]:  # Invoice Check or Done Check columns
-            try:
-                confirmation_id = item.data(COMPANY_CONFIRMATION_ROLE)
-                with get_session() as session:
-                    confirmation = session.query(ConfirmationStatement).filter_by(id=confirmation_id).first()
-                    if confirmation:
-                        self.updating_item = True  # Prevent recursion
-                        if item.column() == 4:
-                            confirmation.invoice_check = item.checkState() == Qt.Checked
-                        elif item.column() == 5:
-                            confirmation.done_check = item.checkState() == Qt.Checked
-                        session.commit()
-                        self.updating_item = False  # Re-enable updates
-
-                        if confirmation.invoice_check and confirmation.done_check:
-                            response = QMessageBox.question(
-                                self, 'Confirm',
-                                'Both checks are marked. Do you want to update the confirmation date and reset the checks?',
-                                QMessageBox.Yes | QMessageBox.No
-                            )
-                            if response == QMessageBox.Yes:
-                                try:
-                                    self.table.blockSignals(True)  # Temporarily disconnect the signal to prevent recursion
-
-                                    new_date = confirmation.date + relativedelta(years=1)
-                                    confirmation.date = new_date
-                                    confirmation.invoice_check = False
-                                    confirmation.done_check = False
-                                    session.commit()
-
-                                    self.load_data()
-                                    self.check_status()
-                                except Exception as e:
-                                    logging.exception("Error updating confirmation date")
-                                    QMessageBox.critical(self, "Error", f"Error updating confirmation date: {str(e)}")
-                                finally:
-                                    self.table.blockSignals(False)  # Reconnect the signal
-            except Exception as e:
-                logging.exception("Error handling item change")
-                QMessageBox.critical(self, "Error", f"Error handling item change: {str(e)}")
+        if column in CHECK_FIELDS:  # Invoice Check or Done Check columns
+            confirmation_id = self.model.row_id(row)
+            field = CHECK_FIELDS[column]
+            with operation('Confirmation statement save'):
+                db_worker().submit_write(
+                    lambda session: self.store_check(session, confirmation_id, field, checked),
+                    lambda checks: self.check_saved(confirmation_id, checks),
+                    lambda error: self.check_failed(confirmation_id, column, not checked, error),
+                    idempotent=True  # Setting a flag twice leaves it the same
+                )
+
+    def store_check(self, session, confirmation_id, field, checked):
+        """Worker thread: store one check and return both checks of the statement, or None when it is gone."""
+        confirmation = session.get(ConfirmationStatement, confirmation_id)
+        if confirmation is None:
+            return None
+        setattr(confirmation, field, checked)
+        return confirmation.invoice_check, confirmation.done_check
+
+    def check_saved(self, confirmation_id, checks):
+        """Offer to roll the statement forward once both its checks are marked."""
+        if checks is None or not all(checks):
+            return
+        response = QMessageBox.question(
+            self, 'Confirm',
+            'Both checks are marked. Do you want to update the confirmation date and reset the checks?',
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if response == QMessageBox.Yes:
+            db_worker().submit_write(
+                lambda session: self.roll_rows_forward(session, [confirmation_id]),  # Only this row changed
+                self.show_rolled_rows,
+                lambda error: self.roll_forward_failed("Error updating confirmation date", error)
+            )
+
+    def check_failed(self, confirmation_id, column, previous, error):
+        """Put the checkbox back when the check could not be stored."""
+        logging.error(f"Error handling item change: {error}")
+        row = self.model.find_row(confirmation_id)
+        if row is not None:
+            self.model.set_value(row, column, previous)
+        QMessageBox.critical(self, "Error", f"Error handling item change: {str(error)}")
 
     def check_status(self):
-        """Check and update the status of confirmation statements."""
-        try:
-            with get_session() as session:
-                confirmations = session.query(ConfirmationStatement).options(joinedload(ConfirmationStatement.company)).all()
-                for confirmation in confirmations:
-                    self.update_status(confirmation)
-                session.commit()
-            self.load_data()
-        except Exception as e:
-            logging.exception("Error occurred while checking status")
-            QMessageBox.critical(self, "Error", f"Error occurred while checking status: {str(e)}")
+        """Check and update the status of confirmation statements, then reload the table."""
+        with operation('Confirmation statements status check'):
+            db_worker().submit_write(self.update_statuses, self.statuses_updated, self.status_failed,
+                                     idempotent=True)  # Setting the statuses twice stores the same ones
 
-    def set_row_color(self, row, status):
-        """Set the background color of a row based on its status."""
-        try:
-            color_map = {
-                'Overdue': QColor(251, 55, 107, 127),  # light red with transparency
-                'Urgent': QColor(247, 131, 34, 127),   # light orange with transparency
-                'Soon': QColor(241, 240, 133, 127),    # light yellow with transparency
-                'Early': QColor(87, 242, 141, 127)     # light green with transparency
-            }
-            color = color_map.get(status, QColor(255, 255, 255, 127))  # default to white with transparency
-
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    item.setBackground(color)
-                    item.setData(Qt.UserRole, color)  # Store the color
-        except Exception as e:
-            logging.exception("Error occurred while setting row color")
-            QMessageBox.critical(self, "Error", f"Error occurred while setting row color: {str(e)}")
+    def update_statuses(self, session):
+        """Worker thread: store the statuses; submit_write commits them."""
+        refresh_statuses(session, ['ConfirmationStatement'])  # One UPDATE ... CASE for the whole table
+
+    def statuses_updated(self, result):
+        """Reload the table once the statuses are stored."""
+        db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.status_failed)
+
+    def status_failed(self, error):
+        QMessageBox.critical(self, "Error", f"Error occurred while checking status: {str(error)}")
 
     def update_status(self, confirmation):
         """Update the status of a confirmation based on the date."""
-        today = datetime.now().date()
-        days_diff = (confirmation.date - today).days
-        if days_diff > 7:
-            confirmation.status = 'Early'
-        elif 3 <= days_diff <= 7:
-            confirmation.status = 'Soon'
-        elif 3 <= days_diff <= 0:
-            confirmation.status = 'Urgent'
-        else:
-            confirmation.status = 'Overdue'
+        confirmation.status = compute_status(confirmation.date)
+
+    def roll_forward_selected(self):
+        """Roll all selected confirmation statements forward at once, with one confirmation and one commit."""
+        confirmation_ids = self.proxy.selected_ids(self.table)
+        if not confirmation_ids:
+            QMessageBox.information(self, 'Roll Forward', 'Select the confirmation statements to roll forward first.')
+            return
+        response = QMessageBox.question(
+            self, 'Confirm',
+            f'Roll {len(confirmation_ids)} selected confirmation statements forward? This will move their date on by one year and reset their checks.',
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if response != QMessageBox.Yes:
+            return
+        with operation('Confirmation statements roll forward'):
+            db_worker().submit_write(
+                lambda session: self.roll_rows_forward(session, confirmation_ids),
+                self.show_rolled_rows,
+                lambda error: self.roll_forward_failed("Error rolling confirmation statements forward", error)
+            )
+
+    def roll_rows_forward(self, session, confirmation_ids):
+        """Worker thread: roll confirmation statements forward with one UPDATE and return their reloaded rows."""
+        roll_forward(session, 'ConfirmationStatement', confirmation_ids)
+        return session.execute(self.select_rows().where(ConfirmationStatement.id.in_(confirmation_ids))).all()
+
+    def show_rolled_rows(self, records):
+        """Show rolled forward confirmation statements in their rows and move each row to its sorted place."""
+        for confirmation in records:
+            row = self.model.find_row(confirmation.id)
+            if row is not None:
+                self.model.update_row(row, self.confirmation_row(confirmation))
+                self.model.reposition_row(row)
+        if self.search_bar.text():
+            self.search_data()
+
+    def roll_forward_failed(self, message, error):
+        logging.error(f"{message}: {error}")
+        QMessageBox.critical(self, "Error", f"{message}: {str(error)}")
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
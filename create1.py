@@ -7,17 +7,17 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt, QDate
 from PyQt5.QtGui import QFont
 from sqlalchemy.sql import text
-from sqlalchemy.exc import OperationalError, IntegrityError, SQLAlchemyError
-from sqlalchemy.orm import sessionmaker, joinedload
-from time import sleep
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
 import logging
 import os
 import shutil
 from models import Company, Address, Account, ConfirmationStatement, CIS, VAT, Employer, Director, Files, PayRun
-from backend import engine, get_session  # Ensure consistent session management
-from google.oauth2.service_account import Credentials 
-from googleapiclient.discovery import build 
-from googleapiclient.http import MediaFileUpload
+from backend import engine
+from company_detail import fetch_company, company_changes, new_files, apply_changes
+from db_worker import db_worker
+from instrumentation import operation
+from drive_uploads import upload_service, UploadStatusLabel
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -26,41 +26,13 @@ logging.basicConfig(level=logging.INFO)
 Session = sessionmaker(bind=engine)
 
 
-# Define the scope for Google Drive API access
-SCOPES = ['https://www.googleapis.com/auth/drive.file']
-
-
-def get_service_account_file_path():
-    # Get the current directory where the script is located
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    
-    # The name of the service account file (change the name if needed)
-    service_account_file = os.path.join(script_dir, "adroit-producer-421409-e1fdc9fd2b6f.json")
-
-    # Check if the file exists
-    if not os.path.exists(service_account_file):
-        raise FileNotFoundError(f"Service account file not found: {service_account_file}")
-    
-    return service_account_file
-
-# Use the dynamic path
-SERVICE_ACCOUNT_FILE = get_service_account_file_path()
-
-# Use SERVICE_ACCOUNT_FILE in the Google API authentication
-def authenticate_google_drive():
-    """Authenticate and return the Google Drive service using a service account."""
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    service = build('drive', 'v3', credentials=creds)
-    return service
-
-
-
 class CompanyForm(QWidget):
     """Form for viewing and editing company details."""
     def __init__(self, tab_widget, company=None):
         super().__init__()
         self.tab_widget = tab_widget
         self.company = company
+        self.snapshot = None  # CompanySnapshot of the company as last loaded
         self.is_edit_mode = not bool(company)  # If company is None, start in edit mode for creating a new company
         self.initUI()
 
@@ -246,6 +218,9 @@ class CompanyForm(QWidget):
         self.upload_file_button.clicked.connect(self.upload_file)
         layout.addWidget(self.upload_file_button)
 
+        self.upload_status_label = UploadStatusLabel()  # Progress of the background uploads
+        layout.addWidget(self.upload_status_label)
+
         employer_buttons_layout = QVBoxLayout()
 
         self.add_employer_button = QPushButton("Add Employer")
@@ -292,21 +267,28 @@ class CompanyForm(QWidget):
             return
 
         try:
+            with operation('Company load'):
+                self.snapshot = fetch_company(self.company.id)  # The whole company in two queries
+            if self.snapshot is None:
+                QMessageBox.critical(self, "Error", "The specified company does not exist.")
+                return
+            company = self.snapshot.company
+
             # Populate fields with company data
-            self.id_field.setText(str(self.company.id))
-            self.company_name_field.setText(self.company.name)
-            self.house_number_field.setText(str(self.company.house_number))
-            self.pay_reference_field.setText(str(self.company.pay_reference_number))
-            self.account_office_field.setText(self.company.account_office_number)
-            self.gateway_id_field.setText(self.company.government_gateway_id)
-            self.cis_check.setChecked(self.company.cis)
-            self.vat_check.setChecked(self.company.vat)
-            self.date_added_field.setDate(self.company.date_added)
-            self.email_field.setText(self.company.email)
-            self.contact_field.setText(self.company.contact_number)
-            self.nature_field.setText(self.company.nature)
-
-            address = self.company.address
+            self.id_field.setText(str(company.id))
+            self.company_name_field.setText(company.name)
+            self.house_number_field.setText(str(company.house_number))
+            self.pay_reference_field.setText(str(company.pay_reference_number))
+            self.account_office_field.setText(company.account_office_number)
+            self.gateway_id_field.setText(company.government_gateway_id)
+            self.cis_check.setChecked(company.cis)
+            self.vat_check.setChecked(company.vat)
+            self.date_added_field.setDate(company.date_added)
+            self.email_field.setText(company.email)
+            self.contact_field.setText(company.contact_number)
+            self.nature_field.setText(company.nature)
+
+            address = self.snapshot.address
             if address:
                 self.address_fields["number"].setText(str(address.number))
                 self.address_fields["street"].setText(address.street)
@@ -315,43 +297,17 @@ class CompanyForm(QWidget):
                 self.address_fields["country"].setText(address.country)
 
             # Load related data (accounts, confirmation statements, payrun, cis, vat, employers, directors, files)
-            self.load_related_data()
+            self.load_related_data(self.snapshot)
 
         except Exception as e:
             logging.exception("Failed to load company data")
             QMessageBox.critical(self, "Error", f"An error occurred while loading data: {e}")
 
-    def load_related_data(self):
-        """Load related data (accounts, confirmation statements, payrun, employers, directors, files) into the form."""
-        try:
-            with get_session() as session:
-                # Fetch the company by ID with eager loading for related data
-                company = session.query(Company).options(
-                    joinedload(Company.accounts),
-                    joinedload(Company.confirmation_statements),
-                    joinedload(Company.payrun),
-                    joinedload(Company.employers),
-                    joinedload(Company.directors),
-                    joinedload(Company.files)
-                ).filter_by(id=self.company.id).first()
-                
-                # Ensure company exists and load data
-                if not company:
-                    QMessageBox.critical(self, "Error", "The specified company does not exist.")
-                    return
-
-                # Set all UI fields with loaded data
-                self.load_all_data(session)
-   
-
-        except Exception as e:
-            logging.exception("Failed to load related data")
-            QMessageBox.critical(self, "Error", f"An error occurred while loading related data: {e}")
-   
-    def load_all_data(self,session):
+    def load_related_data(self, snapshot):
+        """Load related data (accounts, confirmation statements, payrun, cis, vat, employers, directors, files) into the form."""
         #for accounts
         try:
-            account = session.query(Account).filter_by(company_id=self.company.id).first()
+            account = snapshot.account
             if account:
                 self.account_date_field.setDate(QDate(account.date.year, account.date.month, account.date.day))
                 self.account_email_check.setChecked(account.email_check)
@@ -362,7 +318,7 @@ class CompanyForm(QWidget):
             QMessageBox.critical(self, "Error", f"An error occurred while loading account data: {e}")
         #for cis
         try:
-            cis = session.query(CIS).filter_by(company_id=self.company.id).first()
+            cis = snapshot.cis
             if cis:
                 # Populate CIS fields
                 self.cis_employee_ref_field.setText(cis.employees_reference or "")
@@ -382,7 +338,7 @@ class CompanyForm(QWidget):
             QMessageBox.critical(self, "Error", f"An error occurred while loading CIS data: {e}")
         # for payrun
         try:
-            payrun = session.query(PayRun).filter_by(company_id=self.company.id).first()  # Fetch the single payrun
+            payrun = snapshot.payrun
             if payrun:
                 self.payrun_date_field.setDate(QDate(payrun.date.year, payrun.date.month, payrun.date.day))
                 self.payrun_month_check.setChecked(payrun.month_check)
@@ -393,7 +349,7 @@ class CompanyForm(QWidget):
             QMessageBox.critical(self, "Error", f"An error occurred while loading payrun data: {e}")
         #for confirmation statements
         try:
-            confirmation_statement = session.query(ConfirmationStatement).filter_by(company_id=self.company.id).first()  # Fetch the single confirmation statement
+            confirmation_statement = snapshot.confirmation_statement
             if confirmation_statement:
                 self.confirmation_date_field.setDate(QDate(confirmation_statement.date.year, confirmation_statement.date.month, confirmation_statement.date.day))
                 self.confirmation_invoice_check.setChecked(confirmation_statement.invoice_check)
@@ -403,8 +359,7 @@ class CompanyForm(QWidget):
             QMessageBox.critical(self, "Error", f"An error occurred while loading confirmation statement data: {e}")
         #for employers
         try:
-            # Fetch all employers associated with the company
-            employers = session.query(Employer).filter_by(company_id=self.company.id).all()
+            employers = snapshot.employers
             self.employer_table.setRowCount(len(employers))
 
             for row, employer in enumerate(employers):
@@ -432,21 +387,21 @@ class CompanyForm(QWidget):
             QMessageBox.critical(self, "Error", f"An error occurred while loading employer data: {e}")
         #for directors
         try:
-            directors = session.query(Director).filter_by(company_id=self.company.id).all()
+            directors = snapshot.directors
             self.director_table.setRowCount(len(directors))
             
-            for row, director in enumerate(directors):
+            for row, (director, address) in enumerate(directors):
                 self.director_table.setItem(row, 0, QTableWidgetItem(director.name))
                 self.director_table.setItem(row, 1, QTableWidgetItem(director.insurance_number))
                 self.director_table.setItem(row, 2, QTableWidgetItem(director.phone))
                 self.director_table.setItem(row, 3, QTableWidgetItem(director.email))
                 
-                if director.address:
-                    self.director_table.setItem(row, 4, QTableWidgetItem(str(director.address.number)))
-                    self.director_table.setItem(row, 5, QTableWidgetItem(director.address.street))
-                    self.director_table.setItem(row, 6, QTableWidgetItem(director.address.city))
-                    self.director_table.setItem(row, 7, QTableWidgetItem(director.address.postcode))
-                    self.director_table.setItem(row, 8, QTableWidgetItem(director.address.country))
+                if address:
+                    self.director_table.setItem(row, 4, QTableWidgetItem(str(address.number)))
+                    self.director_table.setItem(row, 5, QTableWidgetItem(address.street))
+                    self.director_table.setItem(row, 6, QTableWidgetItem(address.city))
+                    self.director_table.setItem(row, 7, QTableWidgetItem(address.postcode))
+                    self.director_table.setItem(row, 8, QTableWidgetItem(address.country))
                 else:
                     # If no address, leave these fields blank
                     self.director_table.setItem(row, 4, QTableWidgetItem(""))
@@ -454,16 +409,20 @@ class CompanyForm(QWidget):
                     self.director_table.setItem(row, 6, QTableWidgetItem(""))
                     self.director_table.setItem(row, 7, QTableWidgetItem(""))
                     self.director_table.setItem(row, 8, QTableWidgetItem(""))
+
+                # Store the director ID in the first column's Qt.UserRole, so a save updates it
+                self.director_table.item(row, 0).setData(Qt.UserRole, director.id)
         except Exception as e:
             logging.exception("Failed to load director data")
             QMessageBox.critical(self, "Error", f"An error occurred while loading director data: {e}")
         #for files
         try:
-            files = session.query(Files).filter_by(company_id=self.company.id).all()
+            files = snapshot.files
             self.file_table.setRowCount(len(files))
             
             for row, file in enumerate(files):
                 self.file_table.setItem(row, 0, QTableWidgetItem(file.name))
+                self.file_table.item(row, 0).setData(Qt.UserRole, file.id)  # Rows without an id are new uploads
                 
                 # Create a QComboBox for file types
                 type_combo = QComboBox()
@@ -476,7 +435,7 @@ class CompanyForm(QWidget):
             QMessageBox.critical(self, "Error", f"An error occurred while loading file data: {e}")
         #for vat
         try:
-            vat = session.query(VAT).filter_by(company_id=self.company.id).first()  # Fetch the single VAT
+            vat = snapshot.vat
             if vat:
                 self.vat_number_field.setText(vat.number)
                 self.vat_registration_date_field.setDate(QDate(vat.registration_date.year, vat.registration_date.month, vat.registration_date.day))
@@ -490,421 +449,172 @@ class CompanyForm(QWidget):
             QMessageBox.critical(self, "Error", f"An error occurred while loading VAT data: {e}")
 
     def save_data(self):
-        """Save or update company data."""
+        """Save what changed since the company was loaded, or the new company."""
         try:
-            with get_session() as session:
-                if not self.company:
-                    self.save_new_company(session)
-                else:
-                    self.update_existing_company(session)
-                session.commit()
-                QMessageBox.information(self, "Success", "Company data saved successfully!")
-                self.close_tab_save()
-        except IntegrityError as e:
-            logging.exception("Integrity error during save")
-            QMessageBox.critical(self, "Error", "Integrity error, please check your data.")
-        except Exception as e:
-            logging.exception("Failed to save company data")
-            QMessageBox.critical(self, "Error", f"An error occurred while saving: {e}")
+            values = self.form_values()
+        except ValueError as ve:
+            QMessageBox.critical(self, "Error", f"Invalid data: {ve}")
+            return
+        changes = company_changes(self.snapshot, values)
+        files = new_files(values)
+        if not changes and not files:
+            QMessageBox.information(self, "Saved", "No changes to save.")
+            self.close_tab()
+            return
 
-    def save_new_company(self, session):
-        """Save a new company and related records."""
-        try:
-            # Create and save new Address
-            address = Address(
-                number=int(self.address_fields["number"].text()),
-                street=self.address_fields["street"].text(),
-                city=self.address_fields["city"].text(),
-                postcode=self.address_fields["postcode"].text(),
-                country=self.address_fields["country"].text()
-            )
-            session.add(address)
-            session.flush()  # Ensure address ID is generated
-
-            # Create and save new Company
-            self.company = Company(
-                id=self.id_field.text(),
-                name=self.company_name_field.text(),
-                house_number=self.house_number_field.text(),
-                pay_reference_number=self.pay_reference_field.text(),
-                account_office_number=self.account_office_field.text(),
-                government_gateway_id=self.gateway_id_field.text(),
-                cis=self.cis_check.isChecked(),
-                vat=self.vat_check.isChecked(),
-                date_added=self.date_added_field.date().toPyDate(),
-                email=self.email_field.text(),
-                contact_number=self.contact_field.text(),
-                nature=self.nature_field.text(),
-                address_id=address.id
+        for row, (file_name, file_type) in enumerate(files):
+            if not file_name or not file_type:
+                QMessageBox.critical(self, "Error", f"Invalid data for new file {row + 1}: File name or type is missing.")
+        files = [(file_name, file_type) for file_name, file_type in files if file_name and file_type]
+
+        with operation('Company save'):
+            db_worker().submit_write(
+                lambda session: self.store_company(session, values['company']['id'], values['company']['name'], changes, files),
+                self.company_saved,
+                self.save_failed
             )
-            session.add(self.company)
-            session.flush()  # Ensure company ID is generated
 
-            # Save related entities
-            self.save_other_data(session)
-        except ValueError as ve:
-            QMessageBox.critical(self, "Error", f"Invalid data: {ve}")
-            raise
+    def store_company(self, session, company_id, company_name, changes, files):
+        """Worker thread: write the changed rows and queue the new files, as one transaction."""
+        # A changed UTR is a single UPDATE of company.id; the rows pointing at it follow (ON UPDATE CASCADE)
+        apply_changes(session, changes)  # One flush of the changed rows only
+        self.save_files(session, company_id, company_name, files)
 
-    def update_existing_company(self, session):
-        """Update an existing company's data and related records."""
-        try:
-            # Re-fetch or merge the company instance with the current session
-            self.company = session.merge(self.company)
-            
-            old_company_id = self.company.id
-            new_company_id = self.id_field.text()
-
-            # Check if the company ID has changed and update if necessary
-            if old_company_id != new_company_id:
-                self.update_foreign_keys(session, old_company_id, new_company_id)
-
-            self.company.id = new_company_id
-            self.company.name = self.company_name_field.text()
-            self.company.house_number = self.house_number_field.text()
-            self.company.pay_reference_number = self.pay_reference_field.text()
-            self.company.account_office_number = self.account_office_field.text()
-            self.company.government_gateway_id = self.gateway_id_field.text()
-            self.company.cis = self.cis_check.isChecked()
-            self.company.vat = self.vat_check.isChecked()
-            self.company.date_added = self.date_added_field.date().toPyDate()
-            self.company.email = self.email_field.text()
-            self.company.contact_number = self.contact_field.text()
-            self.company.nature = self.nature_field.text()
-
-            # Ensure the address is initialized before accessing it
-            if self.company.address is None:
-                self.company.address = Address()  # or fetch it from somewhere if it's supposed to exist
-
-            # Update Address
-            address = self.company.address
-            address.number = self.address_fields["number"].text()
-            address.street = self.address_fields["street"].text()
-            address.city = self.address_fields["city"].text()
-            address.postcode = self.address_fields["postcode"].text()
-            address.country = self.address_fields["country"].text()
-
-            # Save related entities
-            self.save_other_data(session)
+    def company_saved(self, result):
+        QMessageBox.information(self, "Success", "Company data saved successfully!")
+        self.close_tab_save()
 
-        except Exception as e:
-            session.rollback()
-            logging.exception("Failed to update company data")
-            raise
-    
-    def save_other_data(self, session):
-        #for account
-        try:
-            # Check if an account already exists for this company
-            account = session.query(Account).filter_by(company_id=self.company.id).first()
-
-            if account:  # If an account exists, update it
-                account.name = self.company.name
-                account.date = self.account_date_field.date().toPyDate()
-                account.email_check = self.account_email_check.isChecked()
-                account.invoice_check = self.account_invoice_check.isChecked()
-                account.done_check = self.account_done_check.isChecked()
-                account.status = "Early"  # Update or recalculate status as needed
-                account.files_count = 0  # Implement this method to count associated files
-
-            else:  # If no account exists, create a new one
-                account = Account(
-                    company_id=self.company.id,
-                    name=self.company.name,
-                    date=self.account_date_field.date().toPyDate(),
-                    email_check=self.account_email_check.isChecked(),
-                    invoice_check=self.account_invoice_check.isChecked(),
-                    done_check=self.account_done_check.isChecked(),
-                    status="Early",  # Default status; update as needed
-                    files_count=0  # Implement this method to count associated files
+    def save_failed(self, error):
+        if isinstance(error, IntegrityError):
+            logging.error(f"Integrity error during save: {error}")
+            QMessageBox.critical(self, "Error", "Integrity error, please check your data.")
+        else:
+            logging.error(f"Failed to save company data: {error}")
+            QMessageBox.critical(self, "Error", f"An error occurred while saving: {error}")
+
+    def form_values(self):
+        """Return what the form holds, as company_detail.company_changes() compares it with the snapshot.
+
+        Raises ValueError for a number field that does not hold a number or an empty company name.
+        """
+        company_name = self.company_name_field.text()
+        if not company_name.strip():
+            raise ValueError("Company name cannot be empty or None")
+        values = {
+            'company': {
+                'id': int(self.id_field.text()),
+                'name': company_name,
+                'house_number': self.house_number_field.text(),
+                'pay_reference_number': self.pay_reference_field.text(),
+                'account_office_number': self.account_office_field.text(),
+                'government_gateway_id': self.gateway_id_field.text(),
+                'cis': self.cis_check.isChecked(),
+                'vat': self.vat_check.isChecked(),
+                'date_added': self.date_added_field.date().toPyDate(),
+                'email': self.email_field.text(),
+                'contact_number': self.contact_field.text(),
+                'nature': self.nature_field.text(),
+            },
+            'address': {
+                'number': int(self.address_fields["number"].text()),
+                'street': self.address_fields["street"].text(),
+                'city': self.address_fields["city"].text(),
+                'postcode': self.address_fields["postcode"].text(),
+                'country': self.address_fields["country"].text(),
+            },
+            'account': {
+                'name': company_name,
+                'date': self.account_date_field.date().toPyDate(),
+                'email_check': self.account_email_check.isChecked(),
+                'invoice_check': self.account_invoice_check.isChecked(),
+                'done_check': self.account_done_check.isChecked(),
+            },
+            'confirmation_statement': {
+                'name': company_name,
+                'date': self.confirmation_date_field.date().toPyDate(),
+                'invoice_check': self.confirmation_invoice_check.isChecked(),
+                'done_check': self.confirmation_done_check.isChecked(),
+            },
+            'payrun': {
+                'company_name': company_name,
+                'date': self.payrun_date_field.date().toPyDate(),
+                'month_check': self.payrun_month_check.isChecked(),
+                'pay_run': self.payrun_pay_run_check.isChecked(),
+                'p60': self.payrun_p60_check.isChecked(),
+            },
+            # Switching CIS off deletes the CIS record
+            'cis': {
+                'name': company_name,
+                'employees_reference': self.cis_employee_ref_field.text(),
+                'last_month': self.cis_last_month_field.date().toPyDate(),
+                'next_month': self.cis_next_month_field.date().toPyDate(),
+                'email_check': self.cis_email_check.isChecked(),
+                'month_check': self.cis_month_check.isChecked(),
+            } if self.cis_check.isChecked() else None,
+            'employers': [
+                (
+                    self.row_id(self.employer_table, row),
+                    {
+                        'name': self.cell_text(self.employer_table, row, 0),
+                        'email': self.cell_text(self.employer_table, row, 1),
+                        'utr': self.cell_text(self.employer_table, row, 2) or None,
+                        'nino': self.cell_text(self.employer_table, row, 3),
+                        'start_date': self.employer_table.cellWidget(row, 4).date().toPyDate(),
+                    }
                 )
-                session.add(account)
-        except Exception as e:
-            logging.exception("Failed to save or update account")
-            QMessageBox.critical(self, "Error", f"An error occurred while saving or updating account: {e}")
-        #for confirmation statement
-        try:
-            # Ensure the name field is not None
-            company_name = self.company_name_field.text().strip()
-            if not company_name:
-                raise ValueError("Company name cannot be empty or None")
-
-            # Fetch the existing confirmation statement for the company, if any
-            confirmation_statement = session.query(ConfirmationStatement).filter_by(company_id=self.company.id).first()
-            
-            if confirmation_statement:  # Update the existing confirmation statement
-                confirmation_statement.name = self.company_name_field.text()                
-                confirmation_statement.date = self.confirmation_date_field.date().toPyDate()
-                confirmation_statement.invoice_check = self.confirmation_invoice_check.isChecked()
-                confirmation_statement.done_check = self.confirmation_done_check.isChecked()
-                confirmation_statement.company_id = self.id_field.text()
-                confirmation_statement.status = "Early"
-            else:  # Create a new confirmation statement
-                confirmation_statement = ConfirmationStatement(
-                    company_id=self.company.id,
-                    name=company_name,
-                    date=self.confirmation_date_field.date().toPyDate(),
-                    invoice_check=self.confirmation_invoice_check.isChecked(),
-                    done_check=self.confirmation_done_check.isChecked(),
-                    status = "Early"
+                for row in range(self.employer_table.rowCount())
+            ],
+            'directors': [
+                (
+                    self.row_id(self.director_table, row),
+                    {
+                        'name': self.cell_text(self.director_table, row, 0),
+                        'insurance_number': self.cell_text(self.director_table, row, 1),
+                        'phone': self.cell_text(self.director_table, row, 2),
+                        'email': self.cell_text(self.director_table, row, 3),
+                    },
+                    {
+                        'number': int(self.cell_text(self.director_table, row, 4)),
+                        'street': self.cell_text(self.director_table, row, 5),
+                        'city': self.cell_text(self.director_table, row, 6),
+                        'postcode': self.cell_text(self.director_table, row, 7),
+                        'country': self.cell_text(self.director_table, row, 8),
+                    }
                 )
-                session.add(confirmation_statement)
-        except ValueError as ve:
-            logging.exception("Validation error: %s", ve)
-            QMessageBox.critical(self, "Error", str(ve))
-        except Exception as e:
-            logging.exception("Failed to save confirmation statement")
-            QMessageBox.critical(self, "Error", f"An error occurred while saving the confirmation statement: {e}")
-        #for payrun
-        try:
-            payrun = session.query(PayRun).filter_by(company_id=self.company.id).first()
-            if payrun:  # Update existing payrun
-                payrun.date = self.payrun_date_field.date().toPyDate()
-                payrun.month_check = self.payrun_month_check.isChecked()
-                payrun.pay_run = self.payrun_pay_run_check.isChecked()
-                payrun.p60 = self.payrun_p60_check.isChecked()
-                payrun.files_count = 0
-                payrun.status = "Early"
-                payrun.company_name = self.company_name_field.text()
-                payrun.company_id = self.id_field.text()
-            else:  # Create new payrun
-                payrun = PayRun(
-                    company_id=self.company.id,
-                    date=self.payrun_date_field.date().toPyDate(),
-                    month_check=self.payrun_month_check.isChecked(),
-                    pay_run=self.payrun_pay_run_check.isChecked(),
-                    p60=self.payrun_p60_check.isChecked(),
-                    files_count = 0,
-                    status = "Early",
-                    company_name = self.company_name_field.text(),
+                for row in range(self.director_table.rowCount())
+            ],
+            'files': [
+                (
+                    self.row_id(self.file_table, row),
+                    {'name': self.cell_text(self.file_table, row, 0), 'second_id': self.file_table.cellWidget(row, 1).currentText()}
                 )
-                session.add(payrun)
-        except Exception as e:
-            logging.exception("Failed to save payrun")
-            QMessageBox.critical(self, "Error", f"An error occurred while saving payrun: {e}")
-        #for cis
-        try:
-            # Check if the company has CIS enabled
-            if self.cis_check.isChecked():
-                # Check if a CIS record already exists for the company
-                cis = session.query(CIS).filter_by(company_id=self.company.id).first()
-
-                if cis:
-                    # Update existing CIS data
-                    cis.name = self.company_name_field.text()
-                    cis.employees_reference = self.cis_employee_ref_field.text()
-                    cis.last_month = self.cis_last_month_field.date().toPyDate()
-                    cis.next_month = self.cis_next_month_field.date().toPyDate()
-                    cis.email_check = self.cis_email_check.isChecked()
-                    cis.month_check = self.cis_month_check.isChecked()
-                    cis.status ='Early'
-                else:
-                    # Create new CIS record
-                    cis = CIS(
-                        company_id=self.company.id,
-                        name = self.company_name_field.text(),
-                        employees_reference=self.cis_employee_ref_field.text(),
-                        last_month=self.cis_last_month_field.date().toPyDate(),
-                        next_month=self.cis_next_month_field.date().toPyDate(),
-                        email_check=self.cis_email_check.isChecked(),
-                        month_check=self.cis_month_check.isChecked(),
-                        status="Early"
-                    )
-                    session.add(cis)
-
-            else:
-                # If CIS is not enabled, delete existing CIS records
-                cis = session.query(CIS).filter_by(company_id=self.company.id).first()
-                if cis:
-                    session.delete(cis)
-        except Exception as e:
-            logging.exception("Failed to save CIS data")
-            QMessageBox.critical(self, "Error", f"An error occurred while saving CIS data: {e}")
-        #for vat
+                for row in range(self.file_table.rowCount())
+            ],
+        }
+        # Switching VAT off leaves the VAT record as it is
         if self.vat_check.isChecked():
-            try:
-                # Fetch the existing VAT record for the company, if any
-                vat = session.query(VAT).filter_by(company_id=self.company.id).first()
-
-                # Ensure that the company name and address are available
-                company_name = self.company_name_field.text().strip()
-                if not company_name:
-                    raise ValueError("Company name cannot be empty or None")
-                
-                if not self.company.address:
-                    raise ValueError("Company address cannot be empty or None")
-                
-                # Update existing VAT record
-                if vat:
-                    vat.number = self.vat_number_field.text()
-                    vat.registration_date = self.vat_registration_date_field.date().toPyDate()
-                    vat.address_id = self.company.address.id  # Ensure this is set correctly
-                    vat.company_number = self.company.house_number  # Assuming this field corresponds
-                    vat.company_name = company_name
-                    vat.start_date = self.vat_start_date_field.date().toPyDate()
-                    vat.end_date = self.vat_end_date_field.date().toPyDate()
-                    vat.due_date = self.vat_due_date_field.date().toPyDate()
-                    vat.calculations = self.vat_calculations_field.text()
-                    vat.files_count = 0  # Assuming files count should be reset or recalculated
-                    vat.done = self.vat_done_check.isChecked()
-                    vat.status = "Early"  # Update the status as needed
-                else:
-                    # Create a new VAT record
-                    vat = VAT(
-                        company_id=self.company.id,
-                        number=self.vat_number_field.text(),
-                        registration_date=self.vat_registration_date_field.date().toPyDate(),
-                        address_id=self.company.address.id,  # This must not be None
-                        company_number=self.company.house_number,
-                        company_name=company_name,
-                        start_date=self.vat_start_date_field.date().toPyDate(),
-                        end_date=self.vat_end_date_field.date().toPyDate(),
-                        due_date=self.vat_due_date_field.date().toPyDate(),
-                        calculations=self.vat_calculations_field.text(),
-                        files_count=0,
-                        done=self.vat_done_check.isChecked(),
-                        status="Early"
-                    )
-                    session.add(vat)
-            except ValueError as ve:
-                logging.exception("Validation error: %s", ve)
-                QMessageBox.critical(self, "Error", str(ve))
-            except IntegrityError as ie:
-                session.rollback()
-                logging.exception("Integrity error during save")
-                QMessageBox.critical(self, "Error", f"An integrity error occurred while saving VAT: {ie}")
-            except Exception as e:
-                session.rollback()
-                logging.exception("Failed to save VAT")
-                QMessageBox.critical(self, "Error", f"An error occurred while saving VAT: {e}")
-        #for employer
-        try:
-            # Fetch the existing employers from the database
-            existing_employers = {emp.id: emp for emp in session.query(Employer).filter_by(company_id=self.company.id).all()}
-
-            for row in range(self.employer_table.rowCount()):
-                employer_id = self.employer_table.item(row, 0).data(Qt.UserRole)
-                if employer_id:  # Update existing employer
-                    employer = existing_employers.get(employer_id)
-                    if employer:
-                        employer.name = self.employer_table.item(row, 0).text()
-                        employer.email = self.employer_table.item(row, 1).text()
-                        employer.utr = self.employer_table.item(row, 2).text() if self.employer_table.item(row, 2).text() else None
-                        employer.nino = self.employer_table.item(row, 3).text()
-                        # Fetch date from QDateEdit
-                        date_widget = self.employer_table.cellWidget(row, 4)
-                        if isinstance(date_widget, QDateEdit):
-                            employer.start_date = date_widget.date().toPyDate()
-
-                else:  # Add new employer
-                    new_employer = Employer(
-                        name=self.employer_table.item(row, 0).text(),
-                        email=self.employer_table.item(row, 1).text(),
-                        utr=self.employer_table.item(row, 2).text() if self.employer_table.item(row, 2).text() else None,
-                        nino=self.employer_table.item(row, 3).text(),
-                        start_date=self.employer_table.cellWidget(row, 4).date().toPyDate(),
-                        company_id=self.company.id,
-                    )
-                    session.add(new_employer)
-
-            # Remove any employers from the database that are no longer in the table
-            employer_ids_in_table = [self.employer_table.item(row, 0).data(Qt.UserRole) for row in range(self.employer_table.rowCount())]
-            for employer_id in existing_employers:
-                if employer_id not in employer_ids_in_table:
-                    session.delete(existing_employers[employer_id])
-        except Exception as e:
-            logging.exception("Failed to save employer data")
-            QMessageBox.critical(self, "Error", f"An error occurred while saving employer data: {e}")
-        #for director
-        try:
-            # Fetch existing directors from the database
-            existing_directors = {director.id: director for director in session.query(Director).filter_by(company_id=self.company.id).all()}
-
-            for row in range(self.director_table.rowCount()):
-                director_id = self.director_table.item(row, 0).data(Qt.UserRole)
-
-                if director_id and director_id in existing_directors:
-                    # Update the existing director
-                    director = existing_directors[director_id]
-                    director.name = self.director_table.item(row, 0).text()
-                    director.insurance_number = self.director_table.item(row, 1).text()
-                    director.phone = self.director_table.item(row, 2).text()
-                    director.email = self.director_table.item(row, 3).text()
-
-                    # Update the director's address
-                    if director.address:
-                        director.address.number = int(self.director_table.item(row, 4).text())
-                        director.address.street = self.director_table.item(row, 5).text()
-                        director.address.city = self.director_table.item(row, 6).text()
-                        director.address.postcode = self.director_table.item(row, 7).text()
-                        director.address.country = self.director_table.item(row, 8).text()
-                    else:
-                        # If no address exists, create a new one
-                        director.address = Address(
-                            number=int(self.director_table.item(row, 4).text()),
-                            street=self.director_table.item(row, 5).text(),
-                            city=self.director_table.item(row, 6).text(),
-                            postcode=self.director_table.item(row, 7).text(),
-                            country=self.director_table.item(row, 8).text()
-                        )
-                    # Remove from the existing directors dictionary once processed
-                    del existing_directors[director_id]
-
-                else:
-                    # Add new director
-                    director_address = Address(
-                        number=int(self.director_table.item(row, 4).text()),
-                        street=self.director_table.item(row, 5).text(),
-                        city=self.director_table.item(row, 6).text(),
-                        postcode=self.director_table.item(row, 7).text(),
-                        country=self.director_table.item(row, 8).text()
-                    )
-                    session.add(director_address)
-                    session.flush()  # Ensure address ID is generated
-
-                    new_director = Director(
-                        name=self.director_table.item(row, 0).text(),
-                        insurance_number=self.director_table.item(row, 1).text(),
-                        phone=self.director_table.item(row, 2).text(),
-                        email=self.director_table.item(row, 3).text(),
-                        address_id=director_address.id,
-                        company_id=self.company.id
-                    )
-                    session.add(new_director)
-                    session.flush()  # Ensure the director ID is generated and added to the table
-
-                    # Store the director ID back in the table's user role for future saves
-                    self.director_table.item(row, 0).setData(Qt.UserRole, new_director.id)
+            values['vat'] = {
+                'number': self.vat_number_field.text(),
+                'registration_date': self.vat_registration_date_field.date().toPyDate(),
+                'company_number': self.house_number_field.text(),
+                'company_name': company_name,
+                'start_date': self.vat_start_date_field.date().toPyDate(),
+                'end_date': self.vat_end_date_field.date().toPyDate(),
+                'due_date': self.vat_due_date_field.date().toPyDate(),
+                'calculations': self.vat_calculations_field.text(),
+                'done': self.vat_done_check.isChecked(),
+            }
+        return values
 
-            # Any remaining directors in the existing_directors dict are not present in the UI, so they should be deleted
-            for director_id, director in existing_directors.items():
-                session.delete(director)
-        except ValueError as ve:
-            logging.exception("Failed to save director")
-            QMessageBox.critical(self, "Error", f"Invalid data: {ve}")
-        except Exception as e:
-            logging.exception("Failed to save director")
-            QMessageBox.critical(self, "Error", f"An error occurred while saving directors: {e}")
-        self.save_files(session)
+    def cell_text(self, table, row, column):
+        """Return the text of a table cell, empty when the cell has no item."""
+        item = table.item(row, column)
+        return item.text() if item else ''
 
-    def update_foreign_keys(self, session, old_company_id, new_company_id):
-        """Update foreign keys for all related tables if the company ID has changed."""
-        try:
-            queries = [
-                "UPDATE account SET company_id = :new_id WHERE company_id = :old_id",
-                "UPDATE confirmation_statement SET company_id = :new_id WHERE company_id = :old_id",
-                "UPDATE cis SET company_id = :new_id WHERE company_id = :old_id",
-                "UPDATE employer SET company_id = :new_id WHERE company_id = :old_id",
-                "UPDATE files SET company_id = :new_id WHERE company_id = :old_id",
-                "UPDATE payrun SET company_id = :new_id WHERE company_id = :old_id",
-                "UPDATE vat SET company_id = :new_id WHERE company_id = :old_id",
-                "UPDATE director SET company_id = :new_id WHERE company_id = :old_id"
-            ]
-            for query in queries:
-                session.execute(text(query), {"new_id": new_company_id, "old_id": old_company_id})
-        except Exception as e:
-            logging.exception("Failed to update foreign keys")
-            raise
+    def row_id(self, table, row):
+        """Return the database id kept in the first cell of a table row, None for a new row."""
+        item = table.item(row, 0)
+        return item.data(Qt.UserRole) if item else None
 
     def toggle_edit_mode(self, edit_mode):
         """Enable or disable edit mode for all form fields."""
@@ -976,26 +686,6 @@ class CompanyForm(QWidget):
                 logging.exception("Failed to upload file")
                 QMessageBox.critical(self, "Error", f"An error occurred while uploading the file: {e}")
 
-    def execute_with_retry(self, session, statement, params, retries=5, delay=1):
-        attempt = 0
-        while attempt < retries:
-            try:
-                session.execute(statement, params)
-                session.commit()
-                break
-            except OperationalError as e:
-                if "database is locked" in str(e):
-                    attempt += 1
-                    sleep(delay)
-                    logging.warning(f"Database is locked, retrying {attempt}/{retries}...")
-                    continue
-                else:
-                    session.rollback()
-                    raise
-            except Exception as e:
-                session.rollback()
-                raise
-
     def add_field(self, layout, label, row, col, readonly=False):
         """Helper method to add a QLineEdit field to the layout."""
         field_label = QLabel(label)
@@ -1093,114 +783,64 @@ class CompanyForm(QWidget):
             self.director_table.removeRow(selected_row)
     
 
-    def save_files(self, session):
-        """Save or update file details for the company and upload to Google Drive."""
-        # Authenticate with Google Drive using the service account
-        service = authenticate_google_drive()
+    def save_files(self, session, company_id, company_name, files):
+        """Queue the new files of the company for upload to Google Drive.
 
-        for row in range(self.file_table.rowCount()):
-            try:
-                file_name = self.file_table.item(row, 0).text()
-                file_type = self.file_table.cellWidget(row, 1).currentText()
-
-                # Validate file data before proceeding
-                if not file_name or not file_type:
-                    raise ValueError("File name or type is missing.")
-
-                # Ensure the company_id is valid and exists
-                if not self.company or not self.company.id:
-                    raise ValueError("The company ID is missing or invalid.")
-
-                # Ensure the company_name is not None
-                company_name = self.company_name_field.text()
-                if not company_name:
-                    raise ValueError("The company name cannot be None or empty.")
-
-                # Check if the file already exists for the company
-                existing_file = session.query(Files).filter_by(
-                    name=file_name,
-                    second_id=file_type,
-                    company_id=self.company.id
-                ).first()
-
-                if existing_file:
-                    # If the file exists, log it or handle it accordingly
-                    logging.info(f"File '{file_name}' already exists for company '{self.company.id}'. Skipping re-upload.")
-                    continue  # Skip to the next file
-
-                # If the file does not exist, upload it to Google Drive and save the path
-                local_file_path = os.path.join("files", file_name)  # Local file path
-                google_drive_file_id = self.upload_file_to_google_drive(service, file_name, local_file_path)  # Upload to Google Drive
-
-                # Save the file details in the database
-                file = Files(
-                    name=file_name,
-                    second_id=file_type,
-                    company_id=self.company.id,
-                    path=f"https://drive.google.com/file/d/{google_drive_file_id}/view",  # Google Drive link
-                    company_name=company_name
-                )
-                session.add(file)  # Add the new file to the session
+        files are the (name, category) of the file rows added since the form
+        was loaded. The uploads run in the background once the company is
+        saved; each file gets its Files row when it is on Drive.
+        """
+        uploads = upload_service()
 
-            except ValueError as ve:
-                QMessageBox.critical(self, "Error", f"Invalid file data at row {row + 1}: {ve}")
-            except SQLAlchemyError as se:
-                logging.exception("Database error when saving file")
-                QMessageBox.critical(self, "Error", f"Database error while saving file: {se}")
-            except Exception as e:
-                logging.exception("Failed to save file")
-                QMessageBox.critical(self, "Error", f"An unexpected error occurred while saving file: {e}")
+        for file_name, file_type in files:
+            # Check if the file already exists for the company
+            existing_file = session.query(Files.id).filter_by(
+                name=file_name,
+                second_id=file_type,
+                company_id=company_id
+            ).first()
 
-    def upload_file_to_google_drive(self, service, file_name, file_path):
-        """Upload a file to Google Drive."""
-        try:
-            # Set the folder ID where the file will be uploaded (your shared folder ID)
-            folder_id = '15OclGTq9SFDYl9pBA69Gs5-jy2dUwxrZ'
-            
-            # Metadata with the folder ID to upload the file to the specific folder
-            file_metadata = {
-                'name': file_name,
-                'parents': [folder_id]  # Specify the folder ID here
-            }
-            
-            media = MediaFileUpload(file_path, mimetype='application/octet-stream')
-            file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-            file_id = file.get('id')
-            logging.info(f"File uploaded successfully. File ID: {file_id}")
-            
-            # Now set the file permissions so anyone with the link can view the file
-            permission = {
-                'type': 'anyone',
-                'role': 'reader'
-            }
-            service.permissions().create(fileId=file_id, body=permission).execute()
-            logging.info(f"Permissions updated for file ID: {file_id}")
-            
-            return file_id  # Return the file ID from Google Drive
+            if existing_file or uploads.is_queued(session, file_name, file_type, company_id):
+                # If the file exists, log it or handle it accordingly
+                logging.info(f"File '{file_name}' already exists for company '{company_id}'. Skipping re-upload.")
+                continue  # Skip to the next file
 
-        except Exception as e:
-            logging.error(f"An error occurred while uploading the file: {e}")
-            return None
+            # If the file does not exist, queue it for upload to Google Drive
+            local_file_path = os.path.abspath(os.path.join("files", file_name))  # Local file path
+            uploads.enqueue(session, local_file_path, file_name, file_type, company_name, company_id)
 
     def delete_company(self):
         """Delete the company and all related data."""
-        try:
-            if self.is_edit_mode:
-                response = QMessageBox.question(
-                    self, "Confirm Delete", "Are you sure you want to delete this company?",
-                    QMessageBox.Yes | QMessageBox.No, QMessageBox.No
-                )
-                if response == QMessageBox.Yes:
-                    with get_session() as session:
-                        session.delete(self.company)
-                        session.commit()
-                    QMessageBox.information(self, "Deleted", "Company deleted successfully!")
-                    self.close_tab()
-            else:
-                QMessageBox.warning(self, "Error", "No company to delete!")
-        except Exception as e:
-            logging.exception("Failed to delete company data")
-            QMessageBox.critical(self, "Error", f"An error occurred while deleting: {e}")
+        if self.is_edit_mode:
+            response = QMessageBox.question(
+                self, "Confirm Delete", "Are you sure you want to delete this company?",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No
+            )
+            if response == QMessageBox.Yes:
+                company_id = self.company.id
+                with operation('Company delete'):
+                    db_worker().submit_write(
+                        lambda session: self.remove_company(session, company_id),
+                        self.company_deleted,
+                        self.delete_failed,
+                        idempotent=True  # A company already gone is left alone
+                    )
+        else:
+            QMessageBox.warning(self, "Error", "No company to delete!")
+
+    def remove_company(self, session, company_id):
+        """Worker thread: delete a company; the related rows go with it."""
+        company = session.get(Company, company_id)
+        if company is not None:
+            session.delete(company)
+
+    def company_deleted(self, result):
+        QMessageBox.information(self, "Deleted", "Company deleted successfully!")
+        self.close_tab()
+
+    def delete_failed(self, error):
+        logging.error(f"Failed to delete company data: {error}")
+        QMessageBox.critical(self, "Error", f"An error occurred while deleting: {error}")
 
     def close_tab_save(self):
         """Close the form tab."""
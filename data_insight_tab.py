@@ -7,7 +7,10 @@ from datetime import datetime
 
 from sqlalchemy import and_, or_
 from models import DataInsights, Invoice, Task, CIS, VAT, Account, PayRun, ConfirmationStatement
+from deadline_status import status_expression
 from backend import get_session  # Use the context manager for session handling
+from db_worker import db_worker
+from instrumentation import operation
 
 
 class DataInsightsTab(QWidget):
@@ -401,27 +404,33 @@ class DataInsightsTab(QWidget):
         year = int(self.year_dropdown.currentText())
         today = datetime.now()
 
-        try:
-            with get_session() as session:
-                # Fetch or calculate data based on the current month/year or pre-calculated data
-                if month == today.month and year == today.year:
-                    if category == 'Task':
-                        self.fetch_task_data(session)
-                    elif category == 'Invoice':
-                        self.fetch_invoice_data(session)
-                    else:
-                        self.fetch_other_table_data(session, category)
+        def fetch_counts(session):
+            # Fetch or calculate data based on the current month/year or pre-calculated data
+            if month == today.month and year == today.year:
+                if category == 'Task':
+                    return self.fetch_task_data(session)
+                elif category == 'Invoice':
+                    return self.fetch_invoice_data(session)
                 else:
-                    self.fetch_data_insights(session, category, month, year)
-        except Exception as e:
-            print(f"Error: {e}")
+                    return self.fetch_other_table_data(session, category)
+            else:
+                return self.fetch_data_insights(session, category, month, year)
+
+        def show_counts(counts):
+            if counts is None:
+                self.display_no_data_message()  # Display message when no data is found
+            else:
+                self.create_chart(*counts, category)
+
+        # The counts are read on the database worker; a newer selection replaces an older one
+        with operation('Data insights chart'):
+            db_worker().submit((id(self), 'chart'), fetch_counts, show_counts, lambda e: print(f"Error: {e}"))
 
     def fetch_task_data(self, session):
         """Fetch fresh data from Task table."""
         total = session.query(Task).count()
         if total == 0:
-            self.display_no_data_message()  # Display message when no data is found
-            return
+            return None  # Nothing to chart
 
         overdue_count = session.query(Task).filter_by(status='not_started').count()
         urgent_count = session.query(Task).filter_by(status='in_process').count()
@@ -434,14 +443,13 @@ class DataInsightsTab(QWidget):
             early_count, soon_count, urgent_count, overdue_count, paid_count, total
         )
 
-        self.create_chart(early_count, soon_count, urgent_count, overdue_count, paid_count, total, 'Task')
+        return early_count, soon_count, urgent_count, overdue_count, paid_count, total
 
     def fetch_invoice_data(self, session):
         """Fetch fresh data from Task table."""
         total = session.query(Invoice).count()
         if total == 0:
-            self.display_no_data_message()  # Display message when no data is found
-            return
+            return None  # Nothing to chart
 
         overdue_count = session.query(Invoice).filter(and_(Invoice.sent == False, Invoice.paid == False)).count()
         urgent_count = 0
@@ -453,7 +461,7 @@ class DataInsightsTab(QWidget):
             early_count, soon_count, urgent_count, overdue_count, paid_count, total
         )
 
-        self.create_chart(early_count, soon_count, urgent_count, overdue_count, paid_count, total, 'Invoice')
+        return early_count, soon_count, urgent_count, overdue_count, paid_count, total
 
     def fetch_other_table_data(self, session, category):
         """Fetch fresh data from other tables (CIS, VAT, etc.)."""
@@ -467,13 +475,12 @@ class DataInsightsTab(QWidget):
         table = table_mapping[category]
         total = session.query(table).count()
         if total == 0:
-            self.display_no_data_message()  # Display message when no data is found
-            return
+            return None  # Nothing to chart
 
-        overdue_count = session.query(table).filter_by(status='Overdue').count()
-        urgent_count = session.query(table).filter_by(status='Urgent').count()
-        soon_count = session.query(table).filter_by(status='Soon').count()
-        early_count = session.query(table).filter_by(status='Early').count()
+        overdue_count = session.query(table).filter(status_expression(table) == 'Overdue').count()
+        urgent_count = session.query(table).filter(status_expression(table) == 'Urgent').count()
+        soon_count = session.query(table).filter(status_expression(table) == 'Soon').count()
+        early_count = session.query(table).filter(status_expression(table) == 'Early').count()
 
         paid_count = 0  # No 'paid_count' for non-Task tables
 
@@ -482,7 +489,7 @@ class DataInsightsTab(QWidget):
             early_count, soon_count, urgent_count, overdue_count, paid_count, total
         )
 
-        self.create_chart(early_count, soon_count, urgent_count, overdue_count, paid_count, total, category)
+        return early_count, soon_count, urgent_count, overdue_count, paid_count, total
 
     def fetch_data_insights(self, session, category, month, year):
         """Fetch pre-calculated data from DataInsights table."""
@@ -490,12 +497,11 @@ class DataInsightsTab(QWidget):
             category=category, month=month, year=year
         ).first()
         if not insights:
-            self.display_no_data_message()  # Display message when no data is found
-            return
+            return None  # Nothing to chart
 
-        self.create_chart(
+        return (
             insights.early_count, insights.soon_count, insights.urgent_count,
-            insights.overdue_count, insights.paid_count, insights.total_count, category
+            insights.overdue_count, insights.paid_count, insights.total_count
         )
 
     def save_to_data_insights(self, session, category, month, year, early_count, soon_count, urgent_count, overdue_count, paid_count, total):
@@ -537,12 +543,9 @@ class DataInsightsTab(QWidget):
 
 
     def update_insights_table(self):
-        """Refresh data from all relevant tables."""
-        try:
-            with get_session() as session:
-                self.update_data_insights(session)  # Pass session correctly
-        except Exception as e:
-            print(f"Error: {e}")
+        """Refresh data from all relevant tables on the database worker."""
+        with operation('Data insights update'):
+            db_worker().submit((id(self), 'insights'), self.update_data_insights, on_error=lambda e: print(f"Error: {e}"))
 
     def update_data_insights(self, session):
         """Update data insights for all relevant categories."""
@@ -585,10 +588,10 @@ class DataInsightsTab(QWidget):
                 urgent_count = 0
             else:
                 # Other tables (CIS, VAT, etc.)
-                overdue_count = session.query(model).filter_by(status='Overdue').count()
-                urgent_count = session.query(model).filter_by(status='Urgent').count()
-                soon_count = session.query(model).filter_by(status='Soon').count()
-                early_count = session.query(model).filter_by(status='Early').count()
+                overdue_count = session.query(model).filter(status_expression(model) == 'Overdue').count()
+                urgent_count = session.query(model).filter(status_expression(model) == 'Urgent').count()
+                soon_count = session.query(model).filter(status_expression(model) == 'Soon').count()
+                early_count = session.query(model).filter(status_expression(model) == 'Early').count()
                 paid_count = 0  # No 'paid_count' for non-Task tables
 
             # Check if a row already exists in the data_insights table for this category/month/year
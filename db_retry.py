@@ -0,0 +1,98 @@
+import logging
+import os
+import random
+import time
+from PyQt5.QtCore import QCoreApplication, QThread
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from db_session import get_session
+from instrumentation import current_operation
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Attempts after the first one, and the backoff between them in seconds
+RETRIES = int(os.environ.get('DB_RETRIES', '4'))
+BACKOFF_BASE = float(os.environ.get('DB_BACKOFF_BASE', '0.2'))  # Doubled on every retry
+BACKOFF_MAX = float(os.environ.get('DB_BACKOFF_MAX', '5'))
+
+# PostgreSQL SQLSTATEs: serialization failure, deadlock detected, lock not available
+TRANSIENT_SQLSTATES = {'40001', '40P01', '55P03'}
+# MySQL error codes: lock wait timeout, deadlock found
+TRANSIENT_MYSQL_CODES = {1205, 1213}
+# SQLite reports lock conflicts only in the message
+TRANSIENT_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def is_disconnect(error):
+    """Return True when the connection was lost, e.g. the server restarted or a firewall dropped it."""
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+def is_transient(error):
+    """Return True for errors a transaction can succeed after when run again.
+
+    Deadlocks, serialization failures and lock timeouts roll the transaction
+    back; a lost connection or a pool timeout leaves nothing behind either,
+    except during COMMIT (see run_transaction).
+    """
+    if isinstance(error, PoolTimeoutError):
+        return True
+    if not isinstance(error, DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+    original = error.orig
+    sqlstate = getattr(original, 'sqlstate', None) or getattr(original, 'pgcode', None)  # psycopg 3 / psycopg2
+    if sqlstate in TRANSIENT_SQLSTATES:
+        return True
+    arguments = getattr(original, 'args', ())
+    if arguments and arguments[0] in TRANSIENT_MYSQL_CODES:
+        return True
+    message = str(original).lower()
+    return any(text in message for text in TRANSIENT_MESSAGES)
+
+
+def backoff(attempt):
+    """Return the seconds to wait before retry number attempt + 1: exponential, with jitter."""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def on_gui_thread():
+    application = QCoreApplication.instance()
+    return application is not None and QThread.currentThread() == application.thread()
+
+
+def run_transaction(work, idempotent=False, retries=RETRIES):
+    """Run work(session) as one transaction, commit it and return its result.
+
+    On a transient error the whole transaction is run again from the start,
+    with a new session, after a jittered exponential backoff; work must
+    therefore only touch the database, and return plain data. When the
+    connection is lost during COMMIT the transaction may or may not have been
+    committed, so it is only run again when idempotent is True, i.e. running
+    it twice leaves the same rows as running it once.
+
+    Retries are counted in the current instrumentation operation. The backoff
+    sleeps, so on the GUI thread the transaction runs once and is not retried:
+    writes belong on the database worker (see DbWorker.submit_write).
+    """
+    if on_gui_thread():
+        retries = 0
+    for attempt in range(retries + 1):
+        committing = False
+        try:
+            with get_session() as session:
+                result = work(session)
+                committing = True
+                session.commit()
+            return result
+        except Exception as e:
+            if attempt == retries or not is_transient(e) or (committing and is_disconnect(e) and not idempotent):
+                raise
+            operation = current_operation()
+            if operation is not None:
+                operation.add_retry()
+            delay = backoff(attempt)
+            logging.warning(f"Transaction failed ({e.__class__.__name__}: {e}), "
+                            f"retrying in {delay:.2f} seconds ({attempt + 1}/{retries}).")
+            time.sleep(delay)
@@ -0,0 +1,232 @@
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import weakref
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+import backend
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('db_session')
+
+# Connections kept open per running application: the database worker threads
+# (DB_THREADS) and its write thread, the GUI thread and the upload thread
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '7'))
+# Extra connections opened at peaks and closed when returned
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '4'))
+# Seconds to wait for a free connection before failing
+POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '10'))
+# Connections older than this are replaced, before the server or a firewall drops them
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+# Compiled statements kept per engine, so repeated queries skip compiling
+QUERY_CACHE_SIZE = int(os.environ.get('DB_QUERY_CACHE_SIZE', '1000'))
+# Executions after which psycopg 3 prepares a statement on the server
+PREPARE_THRESHOLD = int(os.environ.get('DB_PREPARE_THRESHOLD', '2'))
+
+_stats = weakref.WeakKeyDictionary()  # engine -> PoolStats
+
+
+def engine_options(url):
+    """Return the create_engine() keyword arguments for the application database."""
+    url = make_url(url)
+    options = {'pool_pre_ping': True, 'query_cache_size': QUERY_CACHE_SIZE}
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return options  # One connection per thread, no pool to size
+
+    options.update(
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_use_lifo=True  # Reuse the warm connections and let the idle ones be recycled
+    )
+    if url.get_driver_name() == 'psycopg':
+        options['connect_args'] = {'prepare_threshold': PREPARE_THRESHOLD}
+    return options
+
+
+def create_app_engine(url, **kwargs):
+    """Create the application engine with the tuned pool, and watch its pool.
+
+    Keyword arguments override the options.
+    """
+    engine = create_engine(url, **{**engine_options(url), **kwargs})
+    watch(engine)
+    return engine
+
+
+# Pool statistics
+
+class PoolStats:
+    """Counters of the connection pool of an engine, to size the pool.
+
+    peak_checked_out is the most connections one application had in use at
+    once; the server needs about that many per office user.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidated = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'connect', self.connected)
+        event.listen(engine, 'checkout', self.checked_out_connection)
+        event.listen(engine, 'checkin', self.checked_in_connection)
+        event.listen(engine, 'invalidate', self.invalidated_connection)
+
+    def connected(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def checked_out_connection(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            peak = self.checked_out > self.peak_checked_out
+            if peak:
+                self.peak_checked_out = self.checked_out
+        size = pool_counter(self.engine.pool, 'size')
+        if peak and size is not None and self.checked_out == size + 1:
+            logger.info(f"Connection pool overflowing: {self.checked_out} connections in use, pool size {size}.")
+
+    def checked_in_connection(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def invalidated_connection(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidated += 1
+
+    def snapshot(self):
+        """Return the counters and the current state of the pool as a dict."""
+        pool = self.engine.pool
+        snapshot = {
+            'pool': type(pool).__name__,
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'invalidated': self.invalidated,
+            'checked_out': self.checked_out,
+            'peak_checked_out': self.peak_checked_out,
+        }
+        for name in ('size', 'checkedin', 'overflow', 'timeout'):
+            value = pool_counter(pool, name)
+            if value is not None:
+                snapshot[name] = value
+        return snapshot
+
+
+def pool_counter(pool, name):
+    """Return a counter of a QueuePool, e.g. size(), or None for pools without it.
+
+    SingletonThreadPool, used for in-memory SQLite, has a plain size attribute instead.
+    """
+    method = getattr(pool, name, None)
+    return method() if callable(method) else None
+
+
+def watch(engine):
+    """Return the PoolStats of an engine, counting from the first call."""
+    stats = _stats.get(engine)
+    if stats is None:
+        stats = _stats[engine] = PoolStats(engine)
+        atexit.register(log_used_pool_stats, engine)
+    return stats
+
+
+def pool_stats(engine=None):
+    """Return the pool counters of an engine, the application engine by default."""
+    return watch(engine or backend.engine).snapshot()
+
+
+def log_pool_stats(engine=None):
+    logger.info(f"Connection pool: {json.dumps(pool_stats(engine))}")
+
+
+def log_used_pool_stats(engine):
+    if watch(engine).checkouts:
+        log_pool_stats(engine)
+
+
+def max_connections(users):
+    """Return the most connections the server sees from this many users running the application."""
+    return users * (POOL_SIZE + MAX_OVERFLOW)
+
+
+# Sessions
+
+@contextmanager
+def get_session():
+    """Return a new session from backend, looked up when called so the engine can be replaced."""
+    with backend.get_session() as session:
+        yield session
+
+
+def use_engine(engine):
+    """Point backend, and so every session of the application, at an engine and return its get_session.
+
+    Modules that bound engine or get_session from backend before this ran keep
+    the old ones, which is why the application takes get_session from here.
+    """
+    Session = sessionmaker(bind=engine)
+
+    @contextmanager
+    def engine_session():
+        session = Session()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    watch(engine)
+    backend.engine = engine
+    backend.get_session = engine_session
+    return engine_session
+
+
+def install_app_engine():
+    """Replace the plain engine of backend with one from create_app_engine, on the same database."""
+    url = backend.engine.url
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        watch(backend.engine)  # A second engine would open a second, empty database
+        return backend.engine
+    plain = backend.engine
+    use_engine(create_app_engine(url))
+    plain.dispose()
+    return backend.engine
+
+
+install_app_engine()  # On first import, before the application opens a session
+
+
+def check_in_memory_engine():
+    """Open a session on an in-memory SQLite engine and return its pool statistics.
+
+    That engine has a SingletonThreadPool instead of the QueuePool of a file
+    or a server, and the statistics must work with both.
+    """
+    engine = create_app_engine('sqlite://')
+    with Session(engine) as session:
+        session.execute(text('SELECT 1'))
+    return pool_stats(engine)
+
+
+if __name__ == "__main__":
+    # python db_session.py [office users]: the pool settings and the connections the server must allow
+    # python db_session.py --check: open a session on an in-memory SQLite engine
+    if sys.argv[1:] == ['--check']:
+        print(f"In-memory SQLite: {json.dumps(check_in_memory_engine())}")
+        sys.exit(0)
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    print(f"Pool size {POOL_SIZE}, overflow {MAX_OVERFLOW}, timeout {POOL_TIMEOUT} s, recycle {POOL_RECYCLE} s, "
+          f"query cache {QUERY_CACHE_SIZE}.")
+    print(f"{users} users running the application open at most {max_connections(users)} connections.")
+    log_pool_stats()
@@ -0,0 +1,189 @@
+import itertools
+import logging
+import os
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from db_session import get_session
+from instrumentation import activate, current_operation
+from db_retry import run_transaction
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Database jobs running at the same time. Keep it below the connection pool size.
+DB_THREADS = int(os.environ.get('DB_THREADS', '4'))
+
+
+class DbJob(QRunnable):
+    """Run one database job in its own session on a pool thread.
+
+    A write job runs as a transaction, committed and retried whole on transient errors,
+    unless it runs transactions of its own (transaction=False): then it is called with
+    no session.
+    """
+
+    def __init__(self, worker, request_id, job, operation=None, write=False, idempotent=False,
+                 transaction=True):
+        super().__init__()
+        self.setAutoDelete(False)  # The worker keeps the job until run() has returned (see DbWorker._release)
+        self.worker = worker
+        self.request_id = request_id
+        self.job = job
+        self.operation = operation
+        self.write = write
+        self.idempotent = idempotent
+        self.transaction = transaction
+        self.cancelled = False
+
+    def run(self):
+        try:
+            if not self.cancelled:
+                self.worker.completed.emit(self.request_id, *self.execute())
+        finally:
+            self.worker.released.emit(self.request_id)  # Last: the worker may free the job from now on
+
+    def execute(self):
+        """Run the job and return (result, error)."""
+        try:
+            with activate(self.operation):
+                if self.write and not self.transaction:
+                    return self.job(), None
+                if self.write:
+                    return run_transaction(self.job, self.idempotent), None
+                with get_session() as session:
+                    return self.job(session), None
+        except Exception as e:
+            logging.exception("Database job failed")
+            return None, e
+
+
+class DbWorker(QObject):
+    """Run database work off the GUI thread and hand the results back to it.
+
+    A job is a function taking a session. It runs on a pool thread in a session
+    of its own and must return plain data (tuples, dicts, numbers), never ORM
+    objects: the session is closed before the result reaches the GUI thread.
+    The result is passed to on_done, or the exception to on_error, on the GUI
+    thread.
+
+    A job submitted while an instrumentation operation is active runs and is
+    delivered inside it, and keeps it open until then (see instrumentation).
+
+    Requests are grouped in channels, e.g. (id(tab), 'load'). A new request on a
+    channel supersedes the one before it: a request still waiting is dropped,
+    and the result of one already running is thrown away.
+
+    Writes (submit_write) are never superseded. They run one at a time, in the
+    order they were submitted, so a later save never overtakes an earlier one.
+    A user action saves with one write job: one connection, one transaction
+    and one commit.
+    """
+    completed = pyqtSignal(int, object, object)  # request id, result, error
+    released = pyqtSignal(int)  # request id; emitted by a job as the last thing it does
+
+    def __init__(self, max_threads=DB_THREADS, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.write_pool = QThreadPool(self)
+        self.write_pool.setMaxThreadCount(1)
+        self._ids = itertools.count(1)
+        self._requests = {}  # request id -> (channel, runnable, on_done, on_error, operation)
+        self._latest = {}    # channel -> id of its newest request
+        # request id -> job queued or running. Freeing a QRunnable a pool thread
+        # still holds crashes, so it is only dropped once run() has returned.
+        self._jobs = {}
+        self.completed.connect(self._deliver)  # Queued: emitted on pool threads
+        self.released.connect(self._release)
+
+    def submit(self, channel, job, on_done=None, on_error=None):
+        """Queue a job and return its request id."""
+        self.cancel(channel)
+        return self._queue(channel, job, on_done, on_error, self.pool)
+
+    def submit_write(self, job, on_done=None, on_error=None, idempotent=False, transaction=True):
+        """Queue a job that writes and return its request id.
+
+        The job runs as one transaction and is committed after it returns. On a
+        deadlock, a lock timeout or a dropped connection the whole transaction
+        is run again after a backoff (see db_retry.run_transaction), so the job
+        must only touch the database; the GUI updates belong in on_done. Pass
+        idempotent=True when running it twice leaves the same rows as once.
+
+        Pass transaction=False for a job that commits in steps of its own, e.g. a
+        bulk import (see file_ingest): it is called with no session, and retries
+        its own transactions with db_retry.run_transaction.
+        """
+        request_id = next(self._ids)
+        return self._queue(('write', request_id), job, on_done, on_error, self.write_pool,
+                           request_id, write=True, idempotent=idempotent, transaction=transaction)
+
+    def _queue(self, channel, job, on_done, on_error, pool, request_id=None, **options):
+        request_id = request_id or next(self._ids)
+        operation = current_operation()
+        if operation is not None:
+            operation.hold()  # Until the result is delivered
+        runnable = DbJob(self, request_id, job, operation, **options)
+        self._requests[request_id] = (channel, runnable, on_done, on_error, operation)
+        self._latest[channel] = request_id
+        self._jobs[request_id] = runnable
+        pool.start(runnable)
+        return request_id
+
+    def cancel(self, channel):
+        """Drop the request of a channel; its result is ignored if it is already running."""
+        request_id = self._latest.pop(channel, None)
+        entry = self._requests.pop(request_id, None)
+        if entry is None:
+            return
+        runnable, operation = entry[1], entry[4]
+        runnable.cancelled = True
+        if self.pool.tryTake(runnable) or self.write_pool.tryTake(runnable):
+            self._jobs.pop(request_id, None)  # Taken off the queue, it never runs
+        if operation is not None:
+            operation.release()
+
+    def is_busy(self, channel):
+        """Return True while a request of the channel is waiting or running."""
+        return channel in self._latest
+
+    def has_pending(self):
+        """Return True while any request is waiting, running or not delivered yet."""
+        return bool(self._requests)
+
+    def _deliver(self, request_id, result, error):
+        entry = self._requests.pop(request_id, None)
+        if entry is None:
+            return  # Superseded or cancelled
+        channel, _, on_done, on_error, operation = entry
+        if self._latest.get(channel) == request_id:
+            del self._latest[channel]
+
+        try:
+            with activate(operation):  # Jobs submitted from the callbacks belong to it too
+                if error is not None:
+                    if on_error is not None:
+                        on_error(error)
+                elif on_done is not None:
+                    on_done(result)
+        finally:
+            if operation is not None:
+                operation.release()
+
+    def _release(self, request_id):
+        self._jobs.pop(request_id, None)
+
+    def wait(self, msecs=-1):
+        """Wait for the running jobs. Their results arrive once the event loop runs. Meant for scripts and tests."""
+        self.write_pool.waitForDone(msecs)
+        self.pool.waitForDone(msecs)
+
+
+_worker = None
+
+
+def db_worker():
+    """Return the worker shared by the whole application."""
+    global _worker
+    if _worker is None:
+        _worker = DbWorker()
+    return _worker
@@ -0,0 +1,87 @@
+import os
+from datetime import date, timedelta
+from sqlalchemy import case, func, null
+from sqlalchemy.ext.hybrid import hybrid_property
+
+# Status buckets by days left until the deadline. This is the only place the
+# thresholds are defined:
+#   days left < 0                  -> Overdue
+#   0 <= days left <= URGENT_DAYS  -> Urgent
+#   URGENT_DAYS < days left <= SOON_DAYS -> Soon
+#   days left > SOON_DAYS          -> Early
+URGENT_DAYS = 2
+SOON_DAYS = 7
+
+STATUSES = ('Overdue', 'Urgent', 'Soon', 'Early')
+
+# Order used when a tab lists the most pressing deadlines first
+STATUS_PRIORITY = {status: priority for priority, status in enumerate(STATUSES)}
+
+# Task statuses (Task.status) in the order the task list shows them. Paid tasks are not listed.
+TASK_STATUSES = ('not_started', 'in_process', 'details_missing', 'done')
+TASK_STATUS_PRIORITY = {status: priority for priority, status in enumerate(TASK_STATUSES)}
+
+# Derive the status from the deadline whenever it is read instead of trusting
+# the stored status column. Set LIVE_STATUS=0 to read the stored column.
+LIVE_STATUS = os.environ.get('LIVE_STATUS', '1') != '0'
+
+
+def compute_status(deadline, today=None):
+    """Return the status of a deadline, or None when there is no deadline."""
+    if deadline is None:
+        return None
+    today = today or date.today()
+    days_left = (deadline - today).days
+    if days_left < 0:
+        return 'Overdue'
+    if days_left <= URGENT_DAYS:
+        return 'Urgent'
+    if days_left <= SOON_DAYS:
+        return 'Soon'
+    return 'Early'
+
+
+def status_case(date_column, today=None):
+    """Return a SQL CASE expression computing the status of a date column.
+
+    The bucket boundaries are computed in Python and bound as parameters, so
+    the expression works on every database and can use an index on the column.
+    """
+    today = today or date.today()
+    return case(
+        (date_column.is_(None), null()),
+        (date_column < today, 'Overdue'),
+        (date_column <= today + timedelta(days=URGENT_DAYS), 'Urgent'),
+        (date_column <= today + timedelta(days=SOON_DAYS), 'Soon'),
+        else_='Early'
+    )
+
+
+def deadline_status_property(date_attribute):
+    """Return a hybrid property computing the status from a date attribute.
+
+    On an instance it evaluates compute_status() in Python; in a query it
+    becomes the status_case() SQL expression, so it can be selected, filtered
+    and grouped on without a stored column.
+    """
+    return hybrid_property(
+        lambda self: compute_status(getattr(self, date_attribute)),
+        expr=lambda cls: status_case(getattr(cls, date_attribute))
+    )
+
+
+def row_status(row):
+    """Return the status shown for a model instance.
+
+    Rows without a deadline keep their stored status.
+    """
+    if LIVE_STATUS:
+        return row.live_status or row.status
+    return row.status
+
+
+def status_expression(model):
+    """Return the status column or expression to query for a model."""
+    if LIVE_STATUS:
+        return func.coalesce(model.live_status, model.status)
+    return model.status
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import threading
+from google.auth.credentials import AnonymousCredentials
+from google.oauth2.service_account import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import build_http
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+SCOPES = ['https://www.googleapis.com/auth/drive.file']
+SERVICE_ACCOUNT_FILE_NAME = "adroit-producer-421409-e1fdc9fd2b6f.json"
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/drive/v3/rest'
+
+# Point the client at another server, e.g. 'http://127.0.0.1:8000/' for a local
+# fake Drive used in testing. No credentials are sent to it.
+DRIVE_API_ENDPOINT = os.environ.get('DRIVE_API_ENDPOINT')
+
+# Start without Google Drive. Uploads wait in the queue until the next online start.
+DRIVE_OFFLINE = os.environ.get('DRIVE_OFFLINE') == '1'
+
+# Where the discovery document is kept between runs
+CACHE_DIR = os.environ.get('DRIVE_CACHE_DIR', os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cache'))
+
+
+class DriveUnavailable(Exception):
+    """Raised when Google Drive cannot be used: offline mode or no credentials."""
+
+
+_lock = threading.Lock()
+_credentials = None
+_document = None
+_local = threading.local()  # One client per thread, the clients are not thread safe
+
+
+def service_account_file():
+    """Return the path of the service account key file."""
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), SERVICE_ACCOUNT_FILE_NAME)
+
+
+def is_available():
+    """Return True when Google Drive can be used."""
+    if DRIVE_OFFLINE:
+        return False
+    return bool(DRIVE_API_ENDPOINT) or os.path.exists(service_account_file())
+
+
+def get_credentials():
+    """Load the service account credentials on first use and share them between threads."""
+    global _credentials
+    if DRIVE_OFFLINE:
+        raise DriveUnavailable("Google Drive is disabled (DRIVE_OFFLINE=1).")
+    with _lock:
+        if _credentials is None:
+            if DRIVE_API_ENDPOINT:
+                _credentials = AnonymousCredentials()
+            else:
+                path = service_account_file()
+                if not os.path.exists(path):
+                    raise DriveUnavailable(f"Service account file not found: {path}")
+                _credentials = Credentials.from_service_account_file(path, scopes=SCOPES)
+        return _credentials
+
+
+def discovery_document():
+    """Return the Drive discovery document, read once and kept on disk."""
+    global _document
+    with _lock:
+        if _document is None:
+            path = os.path.join(CACHE_DIR, 'drive.v3.json')
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    content = f.read()
+            else:
+                # Bundled with recent client libraries, fetched once otherwise
+                content = discovery_cache.get_static_doc('drive', 'v3')
+                if content is None:
+                    response, body = build_http().request(DISCOVERY_URL)
+                    if response.status != 200:
+                        raise DriveUnavailable(f"Could not fetch the Drive discovery document: HTTP {response.status}")
+                    content = body.decode('utf-8')
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+            _document = json.loads(content)
+        return _document
+
+
+def new_drive_service():
+    """Build a new Drive client from the cached document and credentials."""
+    document = discovery_document()
+    if DRIVE_API_ENDPOINT:
+        # Only the host of the upload URL follows client_options, so rewrite the
+        # root URL of the document instead
+        document = dict(document, rootUrl=DRIVE_API_ENDPOINT, mtlsRootUrl=DRIVE_API_ENDPOINT)
+    # The authorized Http object keeps its connections open between requests.
+    # build_http() leaves the 308 answers of resumable uploads to the client library.
+    http = AuthorizedHttp(get_credentials(), http=build_http())
+    return build_from_document(document, http=http)
+
+
+def drive_service():
+    """Return the Drive client of the calling thread, building it on first use."""
+    service = getattr(_local, 'service', None)
+    if service is None:
+        service = _local.service = new_drive_service()
+    return service
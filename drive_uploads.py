@@ -0,0 +1,392 @@
+import json
+import logging
+import os
+import queue
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from PyQt5.QtCore import QCoreApplication, QObject, pyqtSignal
+from PyQt5.QtWidgets import QLabel
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaUploadProgress
+from sqlalchemy import BigInteger, event
+from sqlalchemy.ext.compiler import compiles
+from models import Base, Files, UploadJob
+from db_session import create_app_engine, get_session, use_engine
+from db_worker import db_worker
+from drive_client import DriveUnavailable, drive_service, is_available
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+DRIVE_FOLDER_ID = '15OclGTq9SFDYl9pBA69Gs5-jy2dUwxrZ'  # Shared folder the files go to
+
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', '3'))  # Uploads running at the same time
+CHUNK_SIZE = 5 * 1024 * 1024  # Must be a multiple of 256 KB
+MAX_RETRIES = 5               # Attempts per chunk before the job fails
+BACKOFF_BASE = 1.0            # Seconds, doubled on every retry
+BACKOFF_MAX = 60.0
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def drive_link(file_id):
+    """Return the link stored in Files.path for a Drive file."""
+    return f"https://drive.google.com/file/d/{file_id}/view"
+
+
+def is_retryable(error):
+    """Return True for errors worth another attempt: throttling, server errors, network problems."""
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    return isinstance(error, (ConnectionError, socket.timeout, TimeoutError))
+
+
+def with_backoff(call, description):
+    """Run call(), retrying retryable errors with exponential backoff and jitter."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random() / 2)
+            logging.warning(f"{description} failed ({e}), retrying in {delay:.1f} seconds.")
+            time.sleep(delay)
+
+
+class UploadService(QObject):
+    """Upload files to Google Drive in the background.
+
+    Jobs are stored in the upload_job table, so uploads that did not finish are
+    picked up again the next time the service starts. A fixed number of worker
+    threads send the files in resumable chunks, retry transient errors with
+    backoff, and create the Files row once the file is on Drive. The signals are
+    delivered on the GUI thread.
+    """
+    progress = pyqtSignal(int, str, float)  # job id, file name, fraction uploaded
+    finished = pyqtSignal(int, str, str)    # job id, file name, link
+    failed = pyqtSignal(int, str, str)      # job id, file name, error
+
+    def __init__(self, workers=UPLOAD_WORKERS, service_factory=drive_service, parent=None):
+        super().__init__(parent)
+        self.service_factory = service_factory
+        self._queue = queue.Queue()
+        self._threads = []
+        for number in range(workers):
+            thread = threading.Thread(target=self._work, name=f"drive-upload-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        # On the database worker: the service starts while a tab is being built
+        db_worker().submit_write(self.reset_interrupted, self.resume, self.resume_failed, idempotent=True)
+
+    def enqueue(self, session, file_path, name, second_id, company_name, company_id=None):
+        """Add an upload job to the session and return its id straight away.
+
+        The job is stored with the rest of the caller's changes and only starts
+        once the session commits, so it never runs for a save that was rolled back.
+        """
+        job = UploadJob(file_path=file_path, name=name, second_id=second_id,
+                        company_id=company_id, company_name=company_name, status='pending')
+        session.add(job)
+        session.flush()
+        job_id = job.id
+        event.listen(session, 'after_commit', lambda committed: self._queue.put(job_id), once=True)
+        logging.info(f"Queued upload of '{name}' as job {job_id}.")
+        return job_id
+
+    def is_queued(self, session, name, second_id, company_id=None):
+        """Return True when the same file is already waiting to be uploaded."""
+        return session.query(UploadJob.id).filter(
+            UploadJob.name == name,
+            UploadJob.second_id == second_id,
+            UploadJob.company_id == company_id,
+            UploadJob.status.in_(['pending', 'uploading'])
+        ).first() is not None
+
+    def reset_interrupted(self, session):
+        """Return the ids of the jobs left over from a previous run, marked as pending again."""
+        # A job still marked as uploading was cut off when the app closed
+        session.query(UploadJob).filter(UploadJob.status == 'uploading').update(
+            {UploadJob.status: 'pending'}, synchronize_session=False)
+        return [job_id for job_id, in session.query(UploadJob.id).filter(UploadJob.status == 'pending').order_by(UploadJob.id)]
+
+    def resume(self, job_ids):
+        """Queue again the jobs left over from a previous run."""
+        for job_id in job_ids:
+            self._queue.put(job_id)
+        if job_ids:
+            logging.info(f"Resuming {len(job_ids)} unfinished uploads.")
+
+    def resume_failed(self, error):
+        logging.error(f"Could not resume the unfinished uploads: {error}")
+
+    def _work(self):
+        """Worker thread: run jobs from the queue one at a time."""
+        while True:
+            job_id = self._queue.get()
+            try:
+                self.run_job(self.service_factory(), job_id)
+            except DriveUnavailable as e:
+                # The job stays pending and is picked up on the next start
+                logging.warning(f"Upload job {job_id} postponed: {e}")
+            except Exception as e:
+                logging.exception(f"Upload job {job_id} crashed")
+                self.mark_failed(job_id, e)
+            finally:
+                self._queue.task_done()
+
+    def run_job(self, service, job_id):
+        """Upload the file of a job and record it in the files table."""
+        with get_session() as session:
+            job = session.get(UploadJob, job_id)
+            if job is None or job.status != 'pending':
+                return
+            job.status = 'uploading'
+            job.attempts += 1
+            session.commit()
+            file_path, name = job.file_path, job.name
+
+        try:
+            file_id = self.upload(service, job_id, name, file_path)
+        except Exception as e:
+            logging.error(f"Failed to upload '{name}': {e}")
+            self.mark_failed(job_id, e)
+            return
+
+        with get_session() as session:
+            job = session.get(UploadJob, job_id)
+            job.status = 'done'
+            job.drive_file_id = file_id
+            job.error = None
+            session.add(Files(
+                name=job.name,
+                second_id=job.second_id,
+                company_id=job.company_id,
+                path=drive_link(file_id),
+                company_name=job.company_name
+            ))
+            session.commit()
+        self.finished.emit(job_id, name, drive_link(file_id))
+
+    def mark_failed(self, job_id, error):
+        """Record the error of a job that could not be uploaded."""
+        with get_session() as session:
+            job = session.get(UploadJob, job_id)
+            if job is None:
+                return
+            job.status = 'failed'
+            job.error = str(error)
+            name = job.name
+            session.commit()
+        self.failed.emit(job_id, name, str(error))
+
+    def upload(self, service, job_id, name, file_path):
+        """Send a file in resumable chunks and make it readable by anyone with the link."""
+        media = MediaFileUpload(file_path, mimetype='application/octet-stream', chunksize=CHUNK_SIZE, resumable=True)
+        request = service.files().create(
+            body={'name': name, 'parents': [DRIVE_FOLDER_ID]}, media_body=media, fields='id'
+        )
+        response = None
+        while response is None:
+            # After a failed chunk the request asks the server how much it has and carries on from there
+            status, response = with_backoff(request.next_chunk, f"Uploading '{name}'")
+            if status:
+                self.progress.emit(job_id, name, status.progress())
+        file_id = response.get('id')
+        self.progress.emit(job_id, name, 1.0)
+
+        with_backoff(
+            service.permissions().create(fileId=file_id, body={'type': 'anyone', 'role': 'reader'}).execute,
+            f"Sharing '{name}'"
+        )
+        logging.info(f"File '{name}' uploaded. File ID: {file_id}")
+        return file_id
+
+    def retry_failed(self):
+        """Queue the failed jobs again."""
+        with get_session() as session:
+            jobs = session.query(UploadJob).filter(UploadJob.status == 'failed').all()
+            for job in jobs:
+                job.status = 'pending'
+            session.commit()
+            job_ids = [job.id for job in jobs]
+        for job_id in job_ids:
+            self._queue.put(job_id)
+        return len(job_ids)
+
+    def wait(self):
+        """Block until the queue is empty. Meant for scripts and tests, not the GUI."""
+        self._queue.join()
+
+
+_service = None
+
+
+def upload_service():
+    """Return the upload service shared by the whole application, starting it on first use."""
+    global _service
+    if _service is None:
+        _service = UploadService()
+    return _service
+
+
+class UploadStatusLabel(QLabel):
+    """Label showing the progress of the background uploads."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        service = upload_service()
+        service.progress.connect(self.show_progress)
+        service.finished.connect(self.show_finished)
+        service.failed.connect(self.show_failed)
+        if not is_available():
+            self.setText("Google Drive is offline, uploads will wait for the next start.")
+
+    def show_progress(self, job_id, name, fraction):
+        self.setText(f"Uploading '{name}': {fraction:.0%}")
+
+    def show_finished(self, job_id, name, link):
+        self.setText(f"Uploaded '{name}'.")
+
+    def show_failed(self, job_id, name, error):
+        self.setText(f"Upload of '{name}' failed: {error}")
+
+
+# Self-check
+
+class Closed(BaseException):
+    """The application closing in the middle of an upload: not handled like an upload error."""
+
+
+class FakeDrive:
+    """Drive service for the self-check, keeping the files it receives in memory.
+
+    An upload is cut off by the application closing after close_after chunks;
+    the one after it loses the connection once, after its first chunk.
+    """
+
+    def __init__(self, close_after=1, drops=1):
+        self.close_after = close_after
+        self.drops = drops
+        self.chunks_sent = 0
+        self.stored = {}  # file id -> content
+        self.shared = set()
+
+    def files(self):
+        return self
+
+    def permissions(self):
+        return self
+
+    def create(self, body=None, media_body=None, fields=None, fileId=None):
+        if media_body is None:
+            return FakeSharing(self, fileId)
+        return FakeUpload(self, media_body)
+
+
+class FakeSharing:
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.file_id = file_id
+
+    def execute(self):
+        self.drive.shared.add(self.file_id)
+        return {}
+
+
+class FakeUpload:
+    """Resumable upload to FakeDrive: what the server received survives a dropped connection."""
+
+    def __init__(self, drive, media):
+        self.drive = drive
+        self.media = media
+        self.received = b''
+        self.chunks = 0
+
+    def next_chunk(self):
+        drive = self.drive
+        if self.chunks == drive.close_after:
+            drive.close_after = None
+            raise Closed()
+        if self.chunks == 1 and drive.drops:
+            drive.drops -= 1
+            raise ConnectionError('Connection reset by peer')
+        self.received += self.media.getbytes(len(self.received), self.media.chunksize())
+        self.chunks += 1
+        drive.chunks_sent += 1
+        if len(self.received) < self.media.size():
+            return MediaUploadProgress(len(self.received), self.media.size()), None
+        file_id = f"file-{len(drive.stored) + 1}"
+        drive.stored[file_id] = self.received
+        return None, {'id': file_id}
+
+
+def wait_for_database(application):
+    """Run the event loop until the database worker has delivered all its results."""
+    while db_worker().has_pending():
+        db_worker().wait()
+        application.processEvents()
+
+
+def check_resume():
+    """Upload a file to FakeDrive, cut off part way, and return the state of the upload.
+
+    The application closes after the first chunk and leaves the job marked as
+    uploading. A new service picks the job up, loses the connection once and
+    carries on from what the server has.
+    """
+    application = QCoreApplication.instance() or QCoreApplication(sys.argv)
+    compiles(BigInteger, 'sqlite')(lambda type_, compiler, **kw: 'INTEGER')  # SQLite numbers INTEGER keys only
+    directory = tempfile.mkdtemp()
+    engine = create_app_engine(f"sqlite:///{os.path.join(directory, 'uploads.db')}")
+    Base.metadata.create_all(engine, tables=[UploadJob.__table__, Files.__table__])
+    use_engine(engine)
+
+    drive = FakeDrive()
+    service = UploadService(workers=1, service_factory=lambda: drive)
+    wait_for_database(application)
+
+    file_path = os.path.join(directory, 'accounts.pdf')
+    content = os.urandom(2 * CHUNK_SIZE + 1000)
+    with open(file_path, 'wb') as file:
+        file.write(content)
+    with get_session() as session:
+        job = UploadJob(file_path=file_path, name='accounts.pdf', second_id='Company', company_name='Check Ltd')
+        session.add(job)
+        session.commit()
+        job_id = job.id
+    try:
+        service.run_job(drive, job_id)
+    except Closed:
+        pass
+
+    restarted = UploadService(workers=1, service_factory=lambda: drive)
+    wait_for_database(application)
+    restarted.wait()
+    application.processEvents()
+
+    with get_session() as session:
+        job = session.get(UploadJob, job_id)
+        result = {
+            'status': job.status,
+            'attempts': job.attempts,
+            'chunks_sent': drive.chunks_sent,
+            'uploaded_whole': drive.stored.get(job.drive_file_id) == content,
+            'shared': job.drive_file_id in drive.shared,
+            'files_rows': session.query(Files.id).filter(Files.name == job.name).count(),
+        }
+    engine.dispose()
+    return result
+
+
+if __name__ == "__main__":
+    # python drive_uploads.py --check: cut an upload to a fake Drive off part way and resume it
+    if sys.argv[1:] == ['--check']:
+        result = check_resume()
+        print(f"Resumed upload: {json.dumps(result)}")
+        ok = result['status'] == 'done' and result['uploaded_whole'] and result['shared'] and result['files_rows'] == 1
+        sys.exit(0 if ok else 1)
@@ -7,7 +7,10 @@ from PyQt5.QtGui import QColor
 import logging
 from sqlalchemy.exc import IntegrityError
 from models import Employer  # Import the Employer model class
-from backend import get_session, get_employers_by_company_id, delete_employer  # Import session management and CRUD functions
+from backend import get_employers_by_company_id, delete_employer
+from db_worker import db_worker
+from instrumentation import operation
+from list_queries import employer_rows
 import sys
 
 class EmployersTab(QWidget):
@@ -57,51 +60,57 @@ class EmployersTab(QWidget):
         self.setLayout(main_layout)
 
     def load_data(self):
-        """Load employer data from the database and populate the table."""
+        """Load employer data on the database worker and populate the table when it arrives."""
+        with operation('Employers load'):
+            db_worker().submit((id(self), 'rows'), self.fetch_employers, self.populate_table, self.load_failed)
+
+    def fetch_employers(self, session):
+        """Worker thread: return (id, name, email, utr, nino, start date) of the company's employers."""
+        return [tuple(row) for row in session.execute(employer_rows(self.company_id))]
+
+    def populate_table(self, employers):
+        """Fill the table with employer rows."""
         self.table.blockSignals(True)  # Prevent signals while loading data
         self.table.setRowCount(0)  # Clear table
 
         try:
-            with get_session() as session:
-                employers = session.query(Employer).filter_by(company_id=self.company_id).all()  # Ensure correct session context
-                self.table.setRowCount(len(employers))
-
-                for row, employer in enumerate(employers):
-                    # Populate table with employer data
-                    name_item = QTableWidgetItem(employer.name)
-                    email_item = QTableWidgetItem(employer.email)
-                    utr_item = QTableWidgetItem(employer.utr or "")
-                    nino_item = QTableWidgetItem(employer.nino)
-
-                    # Set table items
-                    self.table.setItem(row, 0, name_item)
-                    self.table.setItem(row, 1, email_item)
-                    self.table.setItem(row, 2, utr_item)
-                    self.table.setItem(row, 3, nino_item)
-
-                    # Add QDateEdit widget for date input
-                    date_edit = QDateEdit(calendarPopup=True)
-                    date_edit.setDisplayFormat('yyyy-MM-dd')
-                    if employer.start_date:
-                        date_edit.setDate(QDate(employer.start_date.year, employer.start_date.month, employer.start_date.day))
-                    else:
-                        date_edit.setDate(QDate.currentDate())  # Set default to current date if start_date is None
-                    self.table.setCellWidget(row, 4, date_edit)
-
-                    # Store the employer ID in the row's Qt.UserRole data for each item
-                    for col in range(self.table.columnCount()):
-                        item = self.table.item(row, col)
-                        if item:
-                            item.setData(Qt.UserRole, employer.id)
+            self.table.setRowCount(len(employers))
+
+            for row, (employer_id, name, email, utr, nino, start_date) in enumerate(employers):
+                # Populate table with employer data
+                name_item = QTableWidgetItem(name)
+                email_item = QTableWidgetItem(email)
+                utr_item = QTableWidgetItem(utr or "")
+                nino_item = QTableWidgetItem(nino)
+
+                # Set table items
+                self.table.setItem(row, 0, name_item)
+                self.table.setItem(row, 1, email_item)
+                self.table.setItem(row, 2, utr_item)
+                self.table.setItem(row, 3, nino_item)
+
+                # Add QDateEdit widget for date input
+                date_edit = QDateEdit(calendarPopup=True)
+                date_edit.setDisplayFormat('yyyy-MM-dd')
+                if start_date:
+                    date_edit.setDate(QDate(start_date.year, start_date.month, start_date.day))
+                else:
+                    date_edit.setDate(QDate.currentDate())  # Set default to current date if start_date is None
+                self.table.setCellWidget(row, 4, date_edit)
+
+                # Store the employer ID in the row's Qt.UserRole data for each item
+                for col in range(self.table.columnCount()):
+                    item = self.table.item(row, col)
+                    if item:
+                        item.setData(Qt.UserRole, employer_id)
 
             self.apply_row_colors()  # Apply row colors after loading data
-
-        except Exception as e:
-            logging.exception(f"Error loading data: {e}")
-            QMessageBox.critical(self, "Error", f"Error loading data: {e}")
         finally:
             self.table.blockSignals(False)
 
+    def load_failed(self, error):
+        QMessageBox.critical(self, "Error", f"Error loading data: {error}")
+
     def add_row(self):
         """Add a new row to the table for entering new employer data."""
         row_position = self.table.rowCount()
@@ -119,43 +128,51 @@ class EmployersTab(QWidget):
         self.apply_row_colors()  # Apply row colors after adding a new row
 
     def save_data(self):
-        """Save or update employer data."""
-        try:
-            with get_session() as session:
-                for row in range(self.table.rowCount()):
-                    name_item = self.table.item(row, 0)
-                    if name_item is None:
-                        continue  # Skip empty rows
-
-                    employer_id = name_item.data(Qt.UserRole)
-                    employer = session.query(Employer).get(employer_id) if employer_id else None
-                    if employer:  # Update existing employer
-                        employer.name = name_item.text()
-                        employer.email = self.table.item(row, 1).text()
-                        employer.utr = self.table.item(row, 2).text()
-                        employer.nino = self.table.item(row, 3).text()
-                        date_widget = self.table.cellWidget(row, 4)
-                        if isinstance(date_widget, QDateEdit):
-                            employer.start_date = date_widget.date().toPyDate()
-                    else:  # Add new employer
-                        new_employer = Employer(
-                            name=name_item.text(),
-                            email=self.table.item(row, 1).text(),
-                            utr=self.table.item(row, 2).text(),
-                            nino=self.table.item(row, 3).text(),
-                            start_date=self.table.cellWidget(row, 4).date().toPyDate(),
-                            company_id=self.company_id
-                        )
-                        session.add(new_employer)
-                session.commit()
-                QMessageBox.information(self, "Success", "Employers saved successfully.")
-                self.load_data()
-        except IntegrityError as e:
-            logging.exception("Integrity error during save")
+        """Save or update employer data on the database worker."""
+        rows = self.employer_values()
+        with operation('Employers save'):
+            db_worker().submit_write(lambda session: self.store_employers(session, rows), self.employers_saved, self.save_failed)
+
+    def employer_values(self):
+        """Return the (employer id or None, column values) of the table rows."""
+        rows = []
+        for row in range(self.table.rowCount()):
+            name_item = self.table.item(row, 0)
+            if name_item is None:
+                continue  # Skip empty rows
+            values = {
+                'name': name_item.text(),
+                'email': self.table.item(row, 1).text(),
+                'utr': self.table.item(row, 2).text(),
+                'nino': self.table.item(row, 3).text()
+            }
+            date_widget = self.table.cellWidget(row, 4)
+            if isinstance(date_widget, QDateEdit):
+                values['start_date'] = date_widget.date().toPyDate()
+            rows.append((name_item.data(Qt.UserRole), values))
+        return rows
+
+    def store_employers(self, session, rows):
+        """Worker thread: update the existing employers and add the new ones."""
+        for employer_id, values in rows:
+            employer = session.get(Employer, employer_id) if employer_id else None
+            if employer:  # Update existing employer
+                for key, value in values.items():
+                    setattr(employer, key, value)
+            else:  # Add new employer
+                session.add(Employer(company_id=self.company_id, **values))
+
+    def employers_saved(self, result):
+        QMessageBox.information(self, "Success", "Employers saved successfully.")
+        self.load_data()
+
+    def save_failed(self, error):
+        if isinstance(error, IntegrityError):
+            logging.error(f"Integrity error during save: {error}")
             QMessageBox.critical(self, "Error", "Integrity error, please check your data.")
-        except Exception as e:
-            logging.exception("Failed to save employer data")
-            QMessageBox.critical(self, "Error", f"An error occurred while saving: {e}")
+        else:
+            logging.error(f"Failed to save employer data: {error}")
+            QMessageBox.critical(self, "Error", f"An error occurred while saving: {error}")
 
     def delete_row(self):
         """Delete selected row from the table and database."""
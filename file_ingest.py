@@ -0,0 +1,167 @@
+import csv
+import logging
+import os
+import re
+import sys
+from collections import namedtuple
+from sqlalchemy import insert, select
+from models import Company, Files
+from files_count import recount_files
+from db_retry import run_transaction
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Directory scanned for files already on disk
+FILES_DIR = os.environ.get('FILES_DIR', 'files')
+# Directory entries checked and inserted per transaction
+INGEST_BATCH = int(os.environ.get('FILE_INGEST_BATCH', '500'))
+# Optional CSV in the directory with the owner of files that do not follow the naming rule
+MANIFEST_NAME = 'manifest.csv'
+
+# Files.second_id by its lower case spelling
+CATEGORIES = {category.lower(): category for category in Files.second_id.type.enums}
+# Naming rule: <owner>_<category>_<anything>, e.g. 1234567890_Vat_Q1.pdf or Payroll review_Task_notes.pdf.
+# The owner is the company id (UTR), or the task name for task files.
+NAME_RULE = re.compile(r'^(?P<owner>.+?)_(?P<category>' + '|'.join(CATEGORIES) + r')_', re.IGNORECASE)
+
+IngestSummary = namedtuple('IngestSummary', ['scanned', 'added', 'existing', 'unmatched'])
+
+
+def scan_batches(directory, batch_size=INGEST_BATCH):
+    """Yield the names of the regular files of a directory in lists of batch_size.
+
+    os.scandir reads the directory as it goes, so a folder of 100,000 files is
+    never listed in memory at once. Hidden files and the manifest are skipped.
+    """
+    batch = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or entry.name == MANIFEST_NAME or not entry.is_file():
+                continue
+            batch.append(entry.name)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def read_manifest(directory):
+    """Return {file name: (category, owner)} from the manifest of a directory, empty when there is none.
+
+    The manifest is a CSV with the columns name, category and owner; owner is
+    the company id, or the task name for task files.
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    owners = {}
+    with open(path, newline='', encoding='utf-8') as manifest:
+        for line, row in enumerate(csv.DictReader(manifest), start=2):
+            category = CATEGORIES.get((row.get('category') or '').strip().lower())
+            if not row.get('name') or category is None or not row.get('owner'):
+                logging.warning(f"{MANIFEST_NAME} line {line}: expected a name, a known category and an owner.")
+                continue
+            owners[row['name']] = (category, row['owner'].strip())
+    return owners
+
+
+def file_owner(name, manifest):
+    """Return the (category, owner) of a file from the manifest or the naming rule, or None."""
+    if name in manifest:
+        return manifest[name]
+    match = NAME_RULE.match(name)
+    if match is None:
+        return None
+    return CATEGORIES[match.group('category').lower()], match.group('owner')
+
+
+def ingest_batch(session, directory, names, manifest):
+    """Insert the Files rows of a batch of names not in the database yet.
+
+    One IN query finds the names already stored and one the companies the
+    batch belongs to; the new rows go in with a single executemany INSERT.
+    Returns (added, existing, unmatched, categories added to).
+    """
+    existing = set(session.scalars(select(Files.name).where(Files.name.in_(names))))
+    owners = {}
+    for name in names:
+        if name not in existing:
+            owners[name] = file_owner(name, manifest)
+
+    company_ids = {int(owner) for category, owner in filter(None, owners.values())
+                   if category != 'Task' and owner.isdigit()}
+    company_names = dict(session.execute(
+        select(Company.id, Company.name).where(Company.id.in_(company_ids))
+    ).all()) if company_ids else {}
+
+    rows, unmatched = [], 0
+    for name, owner in owners.items():
+        if owner is None:
+            unmatched += 1
+            continue
+        category, key = owner
+        if category == 'Task':
+            company_id, company_name = None, key  # Task files have no company; the task name is kept in company_name
+        else:
+            company_id = int(key) if key.isdigit() else None
+            company_name = company_names.get(company_id)
+            if company_name is None:
+                logging.warning(f"File '{name}': no company with ID {key}.")
+                unmatched += 1
+                continue
+        rows.append({
+            'name': name,
+            'second_id': category,
+            'company_id': company_id,
+            'company_name': company_name,
+            'path': os.path.join(directory, name),
+        })
+    if rows:
+        session.execute(insert(Files.__table__), rows)  # One executemany, without the ORM per-row bookkeeping
+    return len(rows), len(existing), unmatched, {row['second_id'] for row in rows}
+
+
+def ingest_directory(directory=FILES_DIR, batch_size=INGEST_BATCH):
+    """Add the files of a directory that are not in the database yet and return an IngestSummary.
+
+    Each batch is its own transaction, retried on transient errors, so a run
+    holds no lock for long and one cut off part way resumes where it stopped:
+    the names already stored are skipped. The file counts are recounted once
+    at the end, for the categories that got files. Touches no widgets.
+    """
+    if not os.path.isdir(directory):
+        logging.info("No files directory found to upload.")
+        return IngestSummary(0, 0, 0, 0)
+
+    manifest = read_manifest(directory)
+    scanned = added = existing = unmatched = 0
+    categories = set()
+    for names in scan_batches(directory, batch_size):
+        batch_added, batch_existing, batch_unmatched, batch_categories = run_transaction(
+            lambda session: ingest_batch(session, directory, names, manifest),
+            idempotent=True  # Names stored by a commit that was cut off are skipped when it runs again
+        )
+        scanned += len(names)
+        added += batch_added
+        existing += batch_existing
+        unmatched += batch_unmatched
+        categories |= batch_categories
+        logging.info(f"Scanned {scanned} files, {added} added.")
+
+    if categories:
+        run_transaction(lambda session: [recount_files(session, category) for category in sorted(categories)],
+                        idempotent=True)
+    if unmatched:
+        logging.warning(f"{unmatched} files were skipped: they match neither {MANIFEST_NAME} nor the naming rule, "
+                        f"or name a company that does not exist.")
+    logging.info(f"{added} new files uploaded to the database.")
+    return IngestSummary(scanned, added, existing, unmatched)
+
+
+if __name__ == "__main__":
+    # python file_ingest.py [directory]: add the files of the directory that are not in the database yet
+    summary = ingest_directory(sys.argv[1] if len(sys.argv) > 1 else FILES_DIR)
+    print(f"Scanned {summary.scanned} files: {summary.added} added, {summary.existing} already stored, "
+          f"{summary.unmatched} without an owner.")
@@ -0,0 +1,114 @@
+import logging
+import os
+from sqlalchemy import event, func, inspect, update
+from models import Company, Account, VAT, PayRun, Task, Files
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# File category (Files.second_id) -> (model holding the count, its key column, matching Files column)
+FILE_COUNT_TARGETS = {
+    'Company': (Company, Company.id, Files.company_id),
+    'Account': (Account, Account.company_id, Files.company_id),
+    'Vat': (VAT, VAT.company_id, Files.company_id),
+    'Payrun': (PayRun, PayRun.company_id, Files.company_id),
+    'Task': (Task, Task.task_name, Files.company_name),
+}
+
+
+def recount_files(session, category):
+    """Recompute files_count for every row of a category with one GROUP BY query.
+
+    Only the rows whose count changed are written, in a single bulk UPDATE.
+    The caller commits the session.
+    """
+    model, key_column, files_column = FILE_COUNT_TARGETS[category]
+
+    counts = dict(
+        session.query(files_column, func.count(Files.id))
+        .filter(Files.second_id == category)
+        .group_by(files_column)
+        .all()
+    )
+
+    changes = []
+    for row_id, key, files_count in session.query(model.id, key_column, model.files_count):
+        new_count = counts.get(key, 0)
+        if files_count != new_count:
+            changes.append({'id': row_id, 'files_count': new_count})
+
+    if changes:
+        session.bulk_update_mappings(model, changes)
+    logging.info(f"Recounted {category} files, {len(changes)} rows changed.")
+    return len(changes)
+
+
+def recount_all_files(session):
+    """Recompute the file counts of every category."""
+    return sum(recount_files(session, category) for category in FILE_COUNT_TARGETS)
+
+
+def adjust_files_count(connection, category, key, delta):
+    """Add delta to the files_count of the rows a file belongs to."""
+    target = FILE_COUNT_TARGETS.get(category)
+    if target is None or key is None:
+        return
+    model, key_column, _ = target
+    connection.execute(
+        update(model.__table__)
+        .where(key_column == key)
+        .values(files_count=func.coalesce(model.__table__.c.files_count, 0) + delta)
+    )
+
+
+def file_key(category, company_id, company_name):
+    """Return the key a file is counted under for its category."""
+    return company_name if category == 'Task' else company_id
+
+
+def after_file_insert(mapper, connection, target):
+    adjust_files_count(connection, target.second_id,
+                       file_key(target.second_id, target.company_id, target.company_name), 1)
+
+
+def after_file_delete(mapper, connection, target):
+    adjust_files_count(connection, target.second_id,
+                       file_key(target.second_id, target.company_id, target.company_name), -1)
+
+
+def after_file_update(mapper, connection, target):
+    """Move the count when a file changes category or owner."""
+    state = inspect(target)
+    old_values = {}
+    changed = False
+    for name in ('second_id', 'company_id', 'company_name'):
+        history = state.attrs[name].history
+        if history.has_changes():
+            changed = True
+            old_values[name] = history.deleted[0] if history.deleted else None
+        else:
+            old_values[name] = getattr(target, name)
+    if not changed:
+        return
+    adjust_files_count(connection, old_values['second_id'],
+                       file_key(old_values['second_id'], old_values['company_id'], old_values['company_name']), -1)
+    adjust_files_count(connection, target.second_id,
+                       file_key(target.second_id, target.company_id, target.company_name), 1)
+
+
+def enable_incremental_counts():
+    """Keep the file counts up to date as Files rows are inserted, updated or deleted.
+
+    This only covers changes made through the ORM; a full recount is still
+    available with recount_all_files().
+    """
+    if event.contains(Files, 'after_insert', after_file_insert):
+        return
+    event.listen(Files, 'after_insert', after_file_insert)
+    event.listen(Files, 'after_delete', after_file_delete)
+    event.listen(Files, 'after_update', after_file_update)
+
+
+# Set INCREMENTAL_FILE_COUNTS=1 to maintain the counts on every file change
+if os.environ.get('INCREMENTAL_FILE_COUNTS') == '1':
+    enable_incremental_counts()
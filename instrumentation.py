@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from PyQt5.QtCore import QObject, Qt, pyqtSignal
+from PyQt5.QtWidgets import QLabel
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('instrumentation')
+
+# Append one JSON line per finished operation to this file when set
+INSTRUMENTATION_LOG = os.environ.get('INSTRUMENTATION_LOG')
+
+# A statement run this many times in one operation is reported as a likely N+1 loop
+REPEAT_THRESHOLD = int(os.environ.get('INSTRUMENTATION_REPEAT_THRESHOLD', '10'))
+
+# Finished operations kept for the overlay
+HISTORY_SIZE = 50
+
+_local = threading.local()
+_listeners = []
+history = deque(maxlen=HISTORY_SIZE)
+
+
+class Operation:
+    """One logical operation, e.g. a tab load, a save or a refresh.
+
+    It counts and times the SQL statements run while it is active, and
+    counts the transactions retried and the time spent filling table models.
+    An operation is active on a thread inside its with block. Jobs submitted to the database worker from there
+    carry it along: they run, and their results are delivered, inside it
+    (see db_worker). It is finished when the with block has been left and the
+    last of its jobs has been delivered, and its record is then logged.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_time = 0.0
+        self.populate_time = 0.0
+        self.repeated = Counter()  # statement text -> times run
+        self.retries = 0  # Transactions run again after a transient error (see db_retry)
+        self.elapsed = None
+        self._holds = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.hold()
+        _stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _stack().pop()
+        self.release()
+        return False
+
+    def hold(self):
+        """Keep the operation open, e.g. for a job still running."""
+        with self._lock:
+            self._holds += 1
+
+    def release(self):
+        with self._lock:
+            self._holds -= 1
+            done = self._holds == 0 and self.elapsed is None
+            if done:
+                self.elapsed = time.perf_counter() - self.started
+        if done:
+            finish(self)
+
+    def add_statement(self, statement, duration):
+        with self._lock:
+            self.statements += 1
+            self.sql_time += duration
+            self.repeated[statement] += 1
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def add_populate(self, duration):
+        with self._lock:
+            self.populate_time += duration
+
+    def record(self):
+        """Return the operation as a dict of plain values."""
+        return {
+            'operation': self.name,
+            'finished_at': datetime.now().isoformat(timespec='milliseconds'),
+            'elapsed_ms': round((self.elapsed or 0) * 1000, 1),
+            'statements': self.statements,
+            'sql_ms': round(self.sql_time * 1000, 1),
+            'populate_ms': round(self.populate_time * 1000, 1),
+            'retries': self.retries,
+            'repeated': [
+                {'statement': statement[:200], 'count': count}
+                for statement, count in self.repeated.most_common()
+                if count >= REPEAT_THRESHOLD
+            ],
+        }
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def operation(name):
+    """Return a new operation; use it as a with block around the work it covers."""
+    return Operation(name)
+
+
+def current_operation():
+    """Return the innermost operation active on this thread, or None."""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def activate(operation):
+    """Make an operation active on this thread without holding it open (see db_worker)."""
+    if operation is None:
+        yield
+        return
+    stack = _stack()
+    stack.append(operation)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+@contextmanager
+def populating():
+    """Time the filling of a table model as part of the current operation."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current = current_operation()
+        if current is not None:
+            current.add_populate(time.perf_counter() - started)
+
+
+def add_listener(listener):
+    """Call listener(record) with the record of every finished operation."""
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def finish(operation):
+    record = operation.record()
+    history.append(record)
+    logger.info(json.dumps(record))
+    for repeated in record['repeated']:
+        logger.warning(f"{operation.name}: statement run {repeated['count']} times, "
+                       f"possible N+1 query: {repeated['statement']}")
+    if INSTRUMENTATION_LOG:
+        with open(INSTRUMENTATION_LOG, 'a') as log_file:
+            log_file.write(json.dumps(record) + '\n')
+    for listener in _listeners:
+        listener(record)
+
+
+# Statement hooks, on every engine
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()  # A connection runs one statement at a time
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    current = current_operation()
+    if current is not None and started is not None:
+        current.add_statement(statement, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None:
+        context.connection.info.pop('query_started', None)
+
+
+class OverlayBridge(QObject):
+    """Hands finished operations to the GUI thread."""
+    finished = pyqtSignal(object)
+
+
+class ProfilingOverlay(QLabel):
+    """Small translucent panel listing the latest operations over a widget.
+
+    Show it with ProfilingOverlay(main_window); set PROFILE_OVERLAY=1 for
+    tabs to install it on their window (see install_overlay).
+    """
+    LINES = 8
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet(
+            'background-color: rgba(0, 0, 0, 170); color: white; font-family: monospace; padding: 6px;'
+        )
+        self.bridge = OverlayBridge(self)
+        self.bridge.finished.connect(self.show_record)
+        listener = self.bridge.finished.emit  # Queued when emitted on a pool thread
+        add_listener(listener)
+        self.destroyed.connect(lambda: remove_listener(listener))
+        self.lines = deque(maxlen=self.LINES)
+        for record in list(history)[-self.LINES:]:
+            self.show_record(record)
+        self.show()
+
+    def show_record(self, record):
+        flag = '  N+1?' if record['repeated'] else ''
+        if record.get('retries'):
+            flag += f"  {record['retries']} retries"
+        self.lines.append(
+            f"{record['operation'][:28]:<28} {record['elapsed_ms']:>8.1f} ms  "
+            f"{record['statements']:>4} sql {record['sql_ms']:>8.1f} ms  "
+            f"fill {record['populate_ms']:>7.1f} ms{flag}"
+        )
+        self.setText('\n'.join(self.lines))
+        self.adjustSize()
+        self.move(self.parentWidget().width() - self.width() - 10, 10)
+        self.raise_()
+
+
+def install_overlay(widget):
+    """Show the overlay on the window of a widget once, when PROFILE_OVERLAY=1."""
+    if os.environ.get('PROFILE_OVERLAY') != '1':
+        return None
+    window = widget.window()
+    overlay = window.findChild(ProfilingOverlay)
+    return overlay or ProfilingOverlay(window)
+
+
+def report(records):
+    """Return a text summary of operation records, one line per operation name."""
+    by_name = defaultdict(list)
+    for record in records:
+        by_name[record['operation']].append(record)
+
+    lines = [f"{'operation':<32} {'runs':>5} {'avg ms':>9} {'max ms':>9} {'avg sql':>8} {'max sql':>8} {'fill ms':>8} {'retries':>7}  N+1"]
+    for name, runs in sorted(by_name.items()):
+        elapsed = [run['elapsed_ms'] for run in runs]
+        statements = [run['statements'] for run in runs]
+        lines.append(
+            f"{name[:32]:<32} {len(runs):>5} {sum(elapsed) / len(runs):>9.1f} {max(elapsed):>9.1f} "
+            f"{sum(statements) / len(runs):>8.1f} {max(statements):>8} "
+            f"{sum(run['populate_ms'] for run in runs) / len(runs):>8.1f} "
+            f"{sum(run.get('retries', 0) for run in runs):>7}  "
+            f"{'yes' if any(run['repeated'] for run in runs) else ''}"
+        )
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    # python instrumentation.py operations.jsonl  (a file written with INSTRUMENTATION_LOG)
+    if len(sys.argv) != 2:
+        print("Usage: python instrumentation.py <operations.jsonl>")
+        sys.exit(2)
+    with open(sys.argv[1]) as log_file:
+        print(report(json.loads(line) for line in log_file if line.strip()))
@@ -1,24 +1,37 @@
-from datetime import datetime
 import logging
 import sys
-import time
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
+    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QTableView,
     QLineEdit, QLabel, QComboBox, QDateEdit, QCheckBox, QPushButton, QMessageBox, QInputDialog, QHeaderView
 )
-from PyQt5.QtGui import QColor, QBrush
-from PyQt5.QtCore import Qt, QDate
-from backend import get_session  # Import get_session for session management
-from models import Invoice  # Import your SQLAlchemy Invoice model
+from PyQt5.QtCore import Qt, QDate, QTimer
+from models import Invoice, INVOICE_ORDER  # Import your SQLAlchemy Invoice model
+from sqlalchemy import and_
+from table_model import INVOICE_COLORS
+from windowed_model import WindowedTableModel, KeysetSource, SEARCH_DELAY
+from db_worker import db_worker
+from instrumentation import operation
+from lazy_loading import LazyLoader
+from list_queries import invoice_rows
 
 # Set up logging to display on the console
 logging.basicConfig(level=logging.DEBUG, format='%(name)s - %(levelname)s - %(message)s')
 
+CHECK_FIELDS = {5: 'sent', 6: 'paid'}
+
+
+def invoice_status(sent, paid):
+    """Return the status used to color an invoice row."""
+    if sent and paid:
+        return 'paid'
+    if sent or paid:
+        return 'partial'
+    return 'open'
+
 
 class InvoiceTab(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.invoices = []  # Initialize as empty; will be filled on data load
         self.current_sort_option = 'Default'
         self.initUI()
 
@@ -32,7 +45,12 @@ class InvoiceTab(QWidget):
         self.search_label = QLabel('Search:')
         self.search_bar = QLineEdit(self)
         self.search_bar.setPlaceholderText('Search...')
-        self.search_bar.textChanged.connect(self.search_data)
+        # Searched in the database, so only once the typing stops
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search_data)
+        self.search_bar.textChanged.connect(lambda text: self.search_timer.start())
         search_sort_layout.addWidget(self.search_label)
         search_sort_layout.addWidget(self.search_bar)
 
@@ -46,10 +64,19 @@ class InvoiceTab(QWidget):
 
         layout.addLayout(search_sort_layout)
 
-        self.table = QTableWidget(self)
-        self.table.setColumnCount(8)
-        self.table.setHorizontalHeaderLabels(['Name', 'Type', 'Service Description', 'Invoice Date', 'Service Amount', 'Invoice Sent', 'Invoice Paid', 'Company ID'])
-        self.table.cellDoubleClicked.connect(self.edit_cell)
+        self.model = WindowedTableModel(
+            ['Name', 'Type', 'Service Description', 'Invoice Date', 'Service Amount', 'Invoice Sent', 'Invoice Paid', 'Company ID'],
+            self.row_source(),
+            parent=self,
+            status_colors=INVOICE_COLORS,
+            checkable_columns=CHECK_FIELDS
+        )
+        self.model.check_changed.connect(self.checkbox_state_changed)
+        self.model.window_loaded.connect(self.show_invoices)
+        self.model.load_failed.connect(self.load_failed)
+        self.table = QTableView(self)
+        self.table.setModel(self.model)
+        self.table.doubleClicked.connect(self.edit_cell)
         layout.addWidget(self.table)
 
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
@@ -99,54 +126,37 @@ class InvoiceTab(QWidget):
 
         self.setLayout(layout)
 
-        self.load_existing_invoices()
+        self.lazy_loader = LazyLoader(self, self.load_existing_invoices, layout)  # Loads when first shown
 
     def load_existing_invoices(self):
-        """Load existing invoices into the table within session context."""
-        start_time = time.time()  # Record the start time
-        print("Invoice 1:", datetime.now().strftime("%H:%M:%S"))
-        
-        with get_session() as session:
-            self.invoices = session.query(Invoice).all()
-            self.table.setRowCount(0)
-            for row, invoice in enumerate(self.invoices):
-                self.add_invoice_to_table(invoice, row, session)
-
-        print("Invoice 2:", datetime.now().strftime("%H:%M:%S"))
-        end_time = time.time()  # Record the end time
-        print("Total Invoice: {:.2f} seconds".format(end_time - start_time))
-
-    def add_invoice_to_table(self, invoice, row, session):
-        """Add an invoice to the table at the specified row."""
-        invoice = session.merge(invoice)  # Ensure the invoice is attached to the session
-        self.table.insertRow(row)
-        self.table.setItem(row, 0, self.create_highlighted_item(invoice.name, None))
-        self.table.setItem(row, 1, self.create_highlighted_item(invoice.type, None))
-        self.table.setItem(row, 2, self.create_highlighted_item(invoice.service_description, None))
-        self.table.setItem(row, 3, self.create_highlighted_item(invoice.date.strftime('%Y-%m-%d'), None))
-        self.table.setItem(row, 4, self.create_highlighted_item(str(invoice.amount), None))
-
-        checkbox_sent = QCheckBox()
-        checkbox_sent.setChecked(invoice.sent)
-        checkbox_sent.stateChanged.connect(lambda state, r=row: self.checkbox_state_changed(state, r, 'sent'))
-        checkbox_sent.setStyleSheet("background-color: white;")  # Set white background explicitly
-        self.table.setCellWidget(row, 5, checkbox_sent)
-
-        checkbox_paid = QCheckBox()
-        checkbox_paid.setChecked(invoice.paid)
-        checkbox_paid.stateChanged.connect(lambda state, r=row: self.checkbox_state_changed(state, r, 'paid'))
-        checkbox_paid.setStyleSheet("background-color: white;")  # Set white background explicitly
-        self.table.setCellWidget(row, 6, checkbox_paid)
-
-        self.table.setItem(row, 7, self.create_highlighted_item(str(invoice.company_id), None))
-
-        self.update_row_color(row)
-
-    def create_highlighted_item(self, text, search_text):
-        """Create a QTableWidgetItem with optional highlighted text."""
-        item = QTableWidgetItem(text)
-        item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
-        return item
+        """Load the invoices a page at a time; only the count and the first page are read up front."""
+        with operation('Invoices load'):
+            self.model.reload()
+
+    def row_source(self):
+        """Return the pages of the table, by status, date and id (read from its index)."""
+        return KeysetSource(
+            invoice_rows(),
+            INVOICE_ORDER,
+            self.invoice_row,
+            make_status=lambda invoice: invoice_status(invoice.sent, invoice.paid),
+            columns=list(invoice_rows().selected_columns)[1:],
+            search_columns=[Invoice.name, Invoice.type, Invoice.service_description, Invoice.company_id]
+        )
+
+    def show_invoices(self, total):
+        self.lazy_loader.finish()
+
+    def load_failed(self, error):
+        self.lazy_loader.finish()
+        QMessageBox.critical(self, 'Error', f'Failed to load invoices: {str(error)}')
+
+    def invoice_row(self, invoice):
+        """Return the table values of a projected invoice row (see list_queries.invoice_rows)."""
+        return (
+            invoice.name, invoice.type, invoice.service_description, invoice.date, invoice.amount,
+            invoice.sent, invoice.paid, invoice.company_id
+        )
 
     def save_invoice(self):
         """Save a new invoice to the database."""
@@ -183,20 +193,17 @@ class InvoiceTab(QWidget):
             'company_id': int(self.company_id_input.text()) if type_ == 'company' else None
         }
 
-        try:
-            with get_session() as session:
-                new_invoice = Invoice(**data)
-                session.add(new_invoice)
-                session.commit()
-                session.refresh(new_invoice)
-
-                self.invoices.append(new_invoice)
-                self.load_existing_invoices()
-                QMessageBox.information(self, 'Invoice Saved', 'Invoice successfully saved.')
-                self.clear_inputs()
-        except Exception as e:
-            logging.error(f"Error saving invoice: {e}")
-            QMessageBox.critical(self, 'Error', f'An error occurred while saving the invoice: {str(e)}')
+        with operation('Invoice save'):
+            db_worker().submit_write(lambda session: session.add(Invoice(**data)), self.invoice_saved, self.save_failed)
+
+    def invoice_saved(self, result):
+        self.load_existing_invoices()
+        QMessageBox.information(self, 'Invoice Saved', 'Invoice successfully saved.')
+        self.clear_inputs()
+
+    def save_failed(self, error):
+        logging.error(f"Error saving invoice: {error}")
+        QMessageBox.critical(self, 'Error', f'An error occurred while saving the invoice: {str(error)}')
 
     def clear_inputs(self):
         """Clear the input fields."""
@@ -209,77 +216,82 @@ class InvoiceTab(QWidget):
         self.company_id_input.clear()
 
     def search_data(self):
-        """Search and highlight invoices based on user input."""
+        """Search the invoices in the database and highlight the matches."""
         search_text = self.search_bar.text().lower()
-        for row in range(self.table.rowCount()):
-            match = False
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    item_text = item.text().lower()
-                    if search_text and search_text in item_text:
-                        match = True
-                        item.setBackground(QColor('yellow'))
-                    else:
-                        item.setBackground(QColor('white') if not search_text else item.background())
-            self.table.setRowHidden(row, not match if search_text else False)
-            if not search_text:
-                self.update_row_color(row)
-
-    def edit_cell(self, row, column):
+        self.model.set_highlight(search_text)
+        self.model.set_search(search_text)
+
+    def edit_cell(self, index):
         """Edit a cell's value in the table and update the database."""
-        item = self.table.item(row, column)
-        if item is not None:
-            current_value = item.text()
-            new_value, ok = QInputDialog.getText(self, 'Edit Cell', f'Edit value:', QLineEdit.Normal, current_value)
-            if ok and new_value:
-                confirmation = QMessageBox.question(
-                    self,
-                    'Confirm Edit',
-                    f"Do you want to change '{current_value}' to '{new_value}'?",
-                    QMessageBox.Yes | QMessageBox.No
-                )
-                if confirmation == QMessageBox.Yes:
-                    self.update_database(row, column, new_value)
-                    item.setText(new_value)
+        row, column = index.row(), index.column()
+        if column in CHECK_FIELDS:
+            return  # Checkboxes are toggled in place
+        current_value = self.model.display_text(row, column)
+        new_value, ok = QInputDialog.getText(self, 'Edit Cell', f'Edit value:', QLineEdit.Normal, current_value)
+        if ok and new_value:
+            confirmation = QMessageBox.question(
+                self,
+                'Confirm Edit',
+                f"Do you want to change '{current_value}' to '{new_value}'?",
+                QMessageBox.Yes | QMessageBox.No
+            )
+            if confirmation == QMessageBox.Yes and self.update_database(row, column, new_value):
+                self.model.set_value(row, column, new_value)
 
     def update_database(self, row, column, new_value):
-        """Update the database with new values for a specific invoice."""
-        try:
-            with get_session() as session:
-                invoice = session.merge(self.invoices[row])
-                column_map = {0: 'name', 1: 'type', 2: 'service_description', 3: 'date', 4: 'amount', 5: 'sent', 6: 'paid', 7: 'company_id'}
-                column_key = column_map.get(column)
-
-                if column_key:
-                    if column_key == 'date':
-                        try:
-                            invoice.date = QDate.fromString(new_value, Qt.ISODate).toPyDate()
-                        except ValueError:
-                            QMessageBox.critical(self, 'Invalid Input', 'Please enter a valid date in ISO format (YYYY-MM-DD).')
-                            return
-                    elif column_key == 'amount':
-                        try:
-                            invoice.amount = float(new_value)
-                            if invoice.amount <= 0:
-                                raise ValueError("Service amount must be greater than zero")
-                        except ValueError:
-                            QMessageBox.critical(self, 'Invalid Input', 'Please enter a valid service amount (a positive number).')
-                            return
-                    elif column_key in ['sent', 'paid']:
-                        setattr(invoice, column_key, new_value.lower() == 'yes')
-                    else:
-                        setattr(invoice, column_key, new_value)
-
-                session.commit()
-                self.invoices[row] = invoice  # Update local cache after commit
-        except Exception as e:
-            logging.error(f"Error updating invoice in the database: {e}")
-            QMessageBox.critical(self, 'Error', f'An error occurred while updating the invoice: {str(e)}')
-
-    def checkbox_state_changed(self, state, row, column_key):
+        """Update the database with new values for a specific invoice.
+
+        The value is checked here and stored on the database worker. Returns
+        False when it is not valid for its column.
+        """
+        column_map = {0: 'name', 1: 'type', 2: 'service_description', 3: 'date', 4: 'amount', 5: 'sent', 6: 'paid', 7: 'company_id'}
+        column_key = column_map.get(column)
+        if column_key is None:
+            return True
+
+        if column_key == 'date':
+            try:
+                value = QDate.fromString(new_value, Qt.ISODate).toPyDate()
+            except ValueError:
+                QMessageBox.critical(self, 'Invalid Input', 'Please enter a valid date in ISO format (YYYY-MM-DD).')
+                return False
+        elif column_key == 'amount':
+            try:
+                value = float(new_value)
+                if value <= 0:
+                    raise ValueError("Service amount must be greater than zero")
+            except ValueError:
+                QMessageBox.critical(self, 'Invalid Input', 'Please enter a valid service amount (a positive number).')
+                return False
+        elif column_key in ['sent', 'paid']:
+            value = new_value.lower() == 'yes'
+        else:
+            value = new_value
+
+        invoice_id = self.model.row_id(row)
+        with operation('Invoice save'):
+            db_worker().submit_write(
+                lambda session: self.store_value(session, invoice_id, column_key, value),
+                on_error=self.update_failed,
+                idempotent=True  # Storing the same value twice leaves it the same
+            )
+        return True
+
+    def store_value(self, session, invoice_id, column_key, value):
+        """Worker thread: store one value of an invoice."""
+        invoice = session.get(Invoice, invoice_id)
+        if invoice is None:
+            logging.error(f"Invoice {invoice_id} not found.")
+            return
+        setattr(invoice, column_key, value)
+
+    def update_failed(self, error):
+        logging.error(f"Error updating invoice in the database: {error}")
+        QMessageBox.critical(self, 'Error', f'An error occurred while updating the invoice: {str(error)}')
+
+    def checkbox_state_changed(self, row, column, checked):
         """Handle checkbox state change for 'Invoice Sent' or 'Invoice Paid'."""
-        new_value = 'yes' if state == Qt.Checked else 'no'
+        new_value = 'yes' if checked else 'no'
         confirmation = QMessageBox.question(
             self,
             'Confirm Change',
@@ -288,48 +300,14 @@ class InvoiceTab(QWidget):
         )
 
         if confirmation == QMessageBox.Yes:
-            column = 5 if column_key == 'sent' else 6
             self.update_database(row, column, new_value)
             self.update_row_color(row)
+        else:
+            self.model.set_value(row, column, not checked)  # Revert the checkbox
 
     def update_row_color(self, row):
         """Update the color of a row based on the checkbox states."""
-        checkbox_sent = self.table.cellWidget(row, 5)
-        checkbox_paid = self.table.cellWidget(row, 6)
-
-        if checkbox_sent and checkbox_paid:
-            if checkbox_sent.isChecked() and checkbox_paid.isChecked():
-                color = QColor(87, 242, 141, 127)  # Light green
-            elif checkbox_sent.isChecked() or checkbox_paid.isChecked():
-                color = QColor(241, 240, 133, 127)  # Light yellow
-            else:
-                color = QColor(251, 55, 107, 127)  # Light red
-            
-            # Update the row background color
-            self.set_row_background_color(row, color)
-            
-            # Update the checkbox backgrounds to match the row background color
-            self.update_checkbox_backgrounds(row, color)
-
-    def update_checkbox_backgrounds(self, row, color):
-        """Update the background color of all checkboxes in the specified row."""
-        # Get the checkbox widgets for 'Invoice Sent' and 'Invoice Paid'
-        checkbox_sent = self.table.cellWidget(row, 5)
-        checkbox_paid = self.table.cellWidget(row, 6)
-
-        # Update the stylesheet of each checkbox to match the new background color
-        if checkbox_sent:
-            checkbox_sent.setStyleSheet(f"background-color: rgba({color.red()}, {color.green()}, {color.blue()}, {color.alpha()});")
-        if checkbox_paid:
-            checkbox_paid.setStyleSheet(f"background-color: rgba({color.red()}, {color.green()}, {color.blue()}, {color.alpha()});")
-
-
-    def set_row_background_color(self, row, color):
-        """Set the background color of a row."""
-        for column in range(self.table.columnCount()):
-            item = self.table.item(row, column)
-            if item is not None:
-                item.setBackground(color)
+        self.model.set_status(row, invoice_status(self.model.value(row, 5), self.model.value(row, 6)))
 
     def update_company_id_editable(self):
         """Enable or disable the Company ID field based on the selected type."""
@@ -343,8 +321,7 @@ class InvoiceTab(QWidget):
     def apply_current_sorting(self):
         """Apply the current sorting option to the table."""
         if self.current_sort_option == 'Default':
-            self.sort_invoices()
-            self.load_existing_invoices()
+            self.model.sort(-1)  # Back to the default order
         else:
             column_index, ascending = 0, True
             if self.current_sort_option == 'Sort Name Asc':
@@ -360,34 +337,13 @@ class InvoiceTab(QWidget):
             elif self.current_sort_option == 'Sort Amount Desc':
                 column_index, ascending = 4, False
 
-            self.table.sortItems(column_index, order=Qt.AscendingOrder if ascending else Qt.DescendingOrder)
-        self.update_all_row_colors()
-
-    def update_all_row_colors(self):
-        """Update the colors of all rows."""
-        for row in range(self.table.rowCount()):
-            self.update_row_color(row)
-
-    def sort_invoices(self):
-        """Sort invoices based on their status and other criteria."""
-        def sort_key(invoice):
-            return (
-                (invoice.sent, invoice.paid),
-                invoice.date,
-                invoice.name.lower(),
-                invoice.amount
-            )
-
-        with get_session() as session:
-            self.invoices = [session.merge(inv) for inv in self.invoices]  # Reattach all invoices to session
-            self.invoices.sort(key=sort_key)  # Sort invoices while they are attached to a session
+            self.model.sort(column_index, Qt.AscendingOrder if ascending else Qt.DescendingOrder)
 
     def reset_default_sorting(self):
         """Reset the sorting option to default."""
         self.sort_dropdown.setCurrentIndex(0)
         self.current_sort_option = 'Default'
-        self.sort_invoices()
-        self.load_existing_invoices()
+        self.model.sort(-1)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
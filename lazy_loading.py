@@ -0,0 +1,50 @@
+from PyQt5.QtCore import QObject, QEvent, QTimer, Qt
+from PyQt5.QtWidgets import QLabel
+from instrumentation import install_overlay
+
+
+class LazyLoader(QObject):
+    """Load the data of a tab the first time it becomes visible.
+
+    The tab builds its widgets without touching the database. A placeholder is
+    shown at the top of its layout until the data is in, and the load itself
+    runs from the event loop right after the tab is painted, so opening the
+    window does not wait for any table to load. Loads running on the database
+    worker call finish() once their rows are shown.
+    """
+
+    def __init__(self, widget, load, layout=None, text='Loading...', background=True):
+        super().__init__(widget)
+        self.load = load
+        self.background = background  # The load finishes later, on the database worker
+        self.loaded = False
+        self.placeholder = None
+        if layout is not None:
+            self.placeholder = QLabel(text)
+            self.placeholder.setAlignment(Qt.AlignCenter)
+            layout.insertWidget(0, self.placeholder)
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Show and not self.loaded:
+            self.loaded = True
+            QTimer.singleShot(0, self.run)
+        return False
+
+    def run(self):
+        """Load the data now."""
+        self.loaded = True
+        install_overlay(self.parent())  # Only with PROFILE_OVERLAY=1
+        self.load()
+        if not self.background:
+            self.finish()
+
+    def ensure_loaded(self):
+        """Load the data now unless it has been loaded already."""
+        if not self.loaded:
+            self.run()
+
+    def finish(self):
+        """Remove the placeholder once the data is shown."""
+        if self.placeholder is not None:
+            self.placeholder.hide()
@@ -0,0 +1,94 @@
+from sqlalchemy import select
+from models import Company, Account, CIS, VAT, PayRun, ConfirmationStatement, Address, Task, Invoice, Files, Employer
+from deadline_status import status_expression
+
+# Column projections the list views are loaded with.
+#
+# Each statement selects only the columns its table shows, so rows come back as
+# plain Row tuples: no identity map, no attribute instrumentation and nothing
+# tied to the session. Every statement starts with the id of the row, and the
+# deadline status is computed by the database (see status_expression).
+# The functions build a new statement on every call because the status buckets
+# depend on today's date.
+
+
+def company_rows():
+    """Columns of the all companies list."""
+    return select(
+        Company.id, Company.house_number, Company.name, Company.nature, Company.pay_reference_number,
+        Company.account_office_number, Company.cis, Company.vat, Company.email, Company.contact_number,
+        Company.government_gateway_id, Company.files_count, Company.address_id, Company.date_added
+    )
+
+
+def account_rows():
+    """Columns of the accounts list, with the account office number of the company."""
+    return select(
+        Account.id, Account.name, Company.account_office_number, Account.date,
+        status_expression(Account).label('status'), Account.email_check, Account.invoice_check,
+        Account.done_check, Account.files_count, Account.company_id
+    ).join(Account.company)
+
+
+def cis_rows():
+    """Columns of the CIS list."""
+    return select(
+        CIS.id, CIS.company_id, CIS.name, CIS.employees_reference, CIS.last_month, CIS.next_month,
+        CIS.email_check, CIS.month_check, status_expression(CIS).label('status')
+    )
+
+
+def payrun_rows():
+    """Columns of the pay run list."""
+    return select(
+        PayRun.id, PayRun.company_name, PayRun.date, status_expression(PayRun).label('status'),
+        PayRun.month_check, PayRun.pay_run, PayRun.p60, PayRun.files_count, PayRun.company_id
+    )
+
+
+def confirmation_rows():
+    """Columns of the confirmation statement list."""
+    return select(
+        ConfirmationStatement.id, ConfirmationStatement.company_id, ConfirmationStatement.name,
+        ConfirmationStatement.date, status_expression(ConfirmationStatement).label('status'),
+        ConfirmationStatement.invoice_check, ConfirmationStatement.done_check
+    )
+
+
+def vat_rows():
+    """Columns of the VAT list, with the address of the VAT registration."""
+    return select(
+        VAT.id, VAT.number, VAT.registration_date, VAT.company_number, VAT.company_name, VAT.company_id,
+        VAT.start_date, VAT.end_date, VAT.due_date, status_expression(VAT).label('status'),
+        VAT.calculations, VAT.done,
+        Address.number.label('address_number'), Address.street, Address.city, Address.postcode, Address.country,
+        VAT.files_count
+    ).outerjoin(VAT.address).where(VAT.company_id != None)
+
+
+def task_rows():
+    """Columns of the task lists."""
+    return select(
+        Task.id, Task.task_name, Task.task_type, Task.date_added, Task.date_finished, Task.price,
+        Task.done_by, Task.status, Task.invoice_sent, Task.invoice_paid, Task.office, Task.files_count
+    )
+
+
+def invoice_rows():
+    """Columns of the invoice list."""
+    return select(
+        Invoice.id, Invoice.name, Invoice.type, Invoice.service_description, Invoice.date, Invoice.amount,
+        Invoice.sent, Invoice.paid, Invoice.company_id
+    )
+
+
+def file_rows():
+    """Columns of the files list."""
+    return select(Files.id, Files.company_id, Files.company_name, Files.second_id, Files.name, Files.path)
+
+
+def employer_rows(company_id):
+    """Columns of the employers of a company."""
+    return select(
+        Employer.id, Employer.name, Employer.email, Employer.utr, Employer.nino, Employer.start_date
+    ).where(Employer.company_id == company_id)
@@ -0,0 +1,220 @@
+import logging
+import sys
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from models import Base, ChangeTracked, DeletedRow, UploadJob
+from company_search import install_search_indexes
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# One row per applied migration
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False, server_default=func.now())
+)
+
+
+def add_column(connection, table_name, column_name, definition):
+    """Add a column to a table unless it is already there."""
+    existing = {column['name'] for column in inspect(connection).get_columns(table_name)}
+    if column_name in existing:
+        return False
+    quote = connection.dialect.identifier_preparer.quote
+    connection.execute(text(f'ALTER TABLE {quote(table_name)} ADD COLUMN {quote(column_name)} {definition}'))
+    logging.info(f"Added {table_name}.{column_name}.")
+    return True
+
+
+def create_indexes(connection, names):
+    """Create the model indexes with the given names unless they are already there."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(connection, checkfirst=True)
+                logging.info(f"Index {index.name} on {table.name} is in place.")
+
+
+def drop_indexes(connection, table_name, names):
+    """Drop the indexes of a table with the given names that are there."""
+    quote = connection.dialect.identifier_preparer.quote
+    for index in inspect(connection).get_indexes(table_name):
+        if index['name'] not in names:
+            continue
+        if connection.dialect.name == 'mysql':
+            connection.execute(text(f'DROP INDEX {quote(index["name"])} ON {quote(table_name)}'))
+        else:
+            connection.execute(text(f'DROP INDEX {quote(index["name"])}'))
+        logging.info(f"Dropped index {index['name']} on {table_name}.")
+
+
+def drop_unique_constraint(connection, table_name, column_names):
+    """Drop the unique constraint or index over exactly the given columns, if there is one."""
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    for constraint in inspector.get_unique_constraints(table_name):
+        if constraint['column_names'] != list(column_names):
+            continue
+        if not constraint.get('name'):
+            # SQLite keeps unnamed constraints in the table definition; only a rebuild removes them
+            logging.warning(f"Unnamed unique constraint on {table_name}{tuple(column_names)} left in place.")
+            continue
+        if connection.dialect.name == 'mysql':
+            connection.execute(text(f'ALTER TABLE {quote(table_name)} DROP INDEX {quote(constraint["name"])}'))
+        else:
+            connection.execute(text(f'ALTER TABLE {quote(table_name)} DROP CONSTRAINT {quote(constraint["name"])}'))
+        logging.info(f"Dropped unique constraint {constraint.get('name')} on {table_name}.")
+
+
+def cascade_foreign_key_updates(connection, referred_table):
+    """Recreate the foreign keys to a table with ON UPDATE CASCADE where they lack it.
+
+    Other options of the keys, like ON DELETE, are kept.
+    """
+    if connection.dialect.name == 'sqlite':
+        # SQLite keeps foreign keys in the table definition; only a rebuild changes them
+        logging.warning(f"Foreign keys to {referred_table} left as they are on SQLite.")
+        return
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    drop = 'DROP FOREIGN KEY' if connection.dialect.name == 'mysql' else 'DROP CONSTRAINT'
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        for foreign_key in inspector.get_foreign_keys(table.name):
+            options = foreign_key.get('options') or {}
+            if foreign_key['referred_table'] != referred_table or (options.get('onupdate') or '').upper() == 'CASCADE':
+                continue
+            name = quote(foreign_key['name'])
+            columns = ', '.join(quote(column) for column in foreign_key['constrained_columns'])
+            referred_columns = ', '.join(quote(column) for column in foreign_key['referred_columns'])
+            on_delete = f" ON DELETE {options['ondelete']}" if options.get('ondelete') else ''
+            connection.execute(text(f'ALTER TABLE {quote(table.name)} {drop} {name}'))
+            connection.execute(text(
+                f'ALTER TABLE {quote(table.name)} ADD CONSTRAINT {name} FOREIGN KEY ({columns}) '
+                f'REFERENCES {quote(referred_table)} ({referred_columns}) ON UPDATE CASCADE{on_delete}'
+            ))
+            logging.info(f"Foreign key {foreign_key['name']} on {table.name} now follows {referred_table} updates.")
+
+
+def migration_001_company_search_indexes(connection):
+    """Indexes behind the company search."""
+    install_search_indexes(connection)
+
+
+def migration_002_change_tracking(connection):
+    """updated_at and row_version on the tracked tables, plus the deleted_row tombstones."""
+    for model in ChangeTracked.__subclasses__():
+        table = model.__table__
+        # First: the UPDATE filling updated_at below also bumps row_version
+        add_column(connection, table.name, 'row_version', 'INTEGER NOT NULL DEFAULT 1')
+        if connection.dialect.name == 'sqlite':
+            # SQLite cannot add a column with a non-constant default, so fill it afterwards;
+            # new rows get theirs from the application (ChangeTracked.updated_at)
+            if add_column(connection, table.name, 'updated_at', 'TIMESTAMP'):
+                connection.execute(table.update().values(updated_at=func.current_timestamp()))
+        else:
+            add_column(connection, table.name, 'updated_at', 'TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP')
+
+        for index in table.indexes:
+            if 'updated_at' in index.columns:
+                index.create(connection, checkfirst=True)
+
+    DeletedRow.__table__.create(connection, checkfirst=True)
+
+
+def migration_003_upload_jobs(connection):
+    """upload_job table holding the Google Drive upload queue."""
+    UploadJob.__table__.create(connection, checkfirst=True)
+
+
+def migration_004_filter_indexes(connection):
+    """Indexes for the filter and sort columns of the tabs, file counts and data insights."""
+    # vat.status was declared unique, which allowed one VAT row per status
+    drop_unique_constraint(connection, 'vat', ['status'])
+    create_indexes(connection, {
+        'idx_task_status_date_added', 'idx_task_task_name',
+        'idx_files_second_id_company_id', 'idx_files_second_id_company_name',
+        'idx_files_company_id', 'idx_files_name',
+        'idx_invoice_sent_paid_date',
+        'idx_vat_company_id', 'idx_vat_status_end_date', 'idx_vat_end_date',
+        'idx_account_status_date', 'idx_account_date',
+        'idx_cis_status_next_month', 'idx_cis_next_month',
+        'idx_payrun_status_date', 'idx_payrun_date',
+        'idx_confirmation_statement_status_date', 'idx_confirmation_statement_date',
+        'idx_data_insights_category_month_year',
+    })
+
+
+def migration_005_company_key_cascade(connection):
+    """ON UPDATE CASCADE on the foreign keys to company.id, so a changed UTR is one UPDATE."""
+    cascade_foreign_key_updates(connection, 'company')
+
+
+def migration_006_fill_missing_updated_at(connection):
+    """updated_at of the SQLite rows inserted without one since migration 2, so refreshes see them."""
+    if connection.dialect.name != 'sqlite':
+        return
+    for model in ChangeTracked.__subclasses__():
+        table = model.__table__
+        connection.execute(table.update().where(table.c.updated_at.is_(None)).values(updated_at=func.current_timestamp()))
+
+
+def migration_007_company_reference_trigram_indexes(connection):
+    """Trigram indexes on the company reference numbers, so no arm of the search OR scans the table."""
+    drop_indexes(connection, 'company', {
+        'idx_company_pay_reference', 'idx_company_account_office', 'idx_company_contact_number'
+    })
+    install_search_indexes(connection)
+
+
+def migration_008_list_order_indexes(connection):
+    """Expression indexes on the default order of the task and invoice lists, read a page at a time."""
+    create_indexes(connection, {'idx_task_default_order', 'idx_invoice_default_order'})
+
+
+# Applied in order, each one in its own transaction. Every migration checks what
+# is already there, so a database created with create_all() can be migrated too.
+MIGRATIONS = [
+    (1, migration_001_company_search_indexes),
+    (2, migration_002_change_tracking),
+    (3, migration_003_upload_jobs),
+    (4, migration_004_filter_indexes),
+    (5, migration_005_company_key_cascade),
+    (6, migration_006_fill_missing_updated_at),
+    (7, migration_007_company_reference_trigram_indexes),
+    (8, migration_008_list_order_indexes),
+]
+
+
+def current_version(connection):
+    """Return the version of the last applied migration, 0 for a new database."""
+    schema_version.create(connection, checkfirst=True)
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def migrate(engine):
+    """Apply the migrations the database has not seen yet."""
+    with engine.begin() as connection:
+        version = current_version(connection)
+
+    for number, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(schema_version.insert().values(version=number, name=migration.__name__))
+        logging.info(f"Applied migration {number}: {migration.__doc__}")
+        version = number
+    return version
+
+
+if __name__ == "__main__":
+    from backend import engine
+    try:
+        logging.info(f"Database is at version {migrate(engine)}.")
+    except Exception:
+        logging.exception("Failed to migrate the database")
+        sys.exit(1)
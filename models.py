@@ -1,13 +1,22 @@
 from sqlalchemy import (
-    Float, create_engine, Column, Integer, String, Boolean, Date, ForeignKey, Text, DECIMAL, CheckConstraint, Index, BigInteger, Enum
+    Float, create_engine, Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Text, DECIMAL, CheckConstraint, Index, BigInteger, Enum,
+    DDL, event, func, literal_column, case, false
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker, scoped_session
+from deadline_status import deadline_status_property, TASK_STATUS_PRIORITY
 
 # Base class for all models
 Base = declarative_base()
 
-class Address(Base):
+class ChangeTracked:
+    """Columns recording when a row last changed, used for incremental refreshes."""
+    # Also set by the application: SQLite tables migrated by migration_002 have no server default
+    updated_at = Column(DateTime, nullable=False, default=func.now(), server_default=func.now(),
+                        onupdate=func.now(), index=True)
+    row_version = Column(Integer, nullable=False, server_default='1', onupdate=literal_column('row_version') + 1)
+
+class Address(ChangeTracked, Base):
     __tablename__ = 'address'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
@@ -21,10 +30,10 @@ class Address(Base):
     directors = relationship("Director", back_populates="address", cascade="all, delete-orphan")
     vats = relationship("VAT", back_populates="address", cascade="all, delete-orphan")
 
-class Company(Base):
+class Company(ChangeTracked, Base):
     __tablename__ = 'company'
     
-    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=True)  # The UTR; rows pointing here follow a change (ON UPDATE CASCADE)
     house_number = Column(String(10), nullable=False)  # Updated length
     name = Column(String(255), nullable=False)
     nature = Column(String(255), nullable=False)
@@ -50,11 +59,35 @@ class Company(Base):
     payrun = relationship("PayRun", back_populates="company", uselist=False, cascade="all, delete-orphan")
     directors = relationship("Director", back_populates="company", cascade="all, delete-orphan")
 
-class Director(Base):
+    __table_args__ = (
+        # Trigram indexes for substring search (plain btree indexes on other databases)
+        Index('idx_company_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('idx_company_email_trgm', 'email', postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'}),
+        Index('idx_company_nature_trgm', 'nature', postgresql_using='gin', postgresql_ops={'nature': 'gin_trgm_ops'}),
+        Index('idx_company_gateway_trgm', 'government_gateway_id', postgresql_using='gin',
+              postgresql_ops={'government_gateway_id': 'gin_trgm_ops'}),
+        Index('idx_company_pay_reference_trgm', 'pay_reference_number', postgresql_using='gin',
+              postgresql_ops={'pay_reference_number': 'gin_trgm_ops'}),
+        Index('idx_company_account_office_trgm', 'account_office_number', postgresql_using='gin',
+              postgresql_ops={'account_office_number': 'gin_trgm_ops'}),
+        Index('idx_company_contact_number_trgm', 'contact_number', postgresql_using='gin',
+              postgresql_ops={'contact_number': 'gin_trgm_ops'}),
+        # Exact match indexes for the numeric fields
+        Index('idx_company_house_number', 'house_number'),
+        Index('idx_company_address_id', 'address_id'),
+    )
+
+# The trigram operator classes need the pg_trgm extension
+event.listen(
+    Company.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+class Director(ChangeTracked, Base):
     __tablename__ = 'director'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    company_id = Column(BigInteger, ForeignKey('company.id'), nullable=False, unique=True)
+    company_id = Column(BigInteger, ForeignKey('company.id', onupdate='CASCADE'), nullable=False, unique=True)
     name = Column(String(255), nullable=False)
     insurance_number = Column(String(30), nullable=False)  # Updated length
     address_id = Column(BigInteger, ForeignKey('address.id'), nullable=False)
@@ -69,13 +102,13 @@ class Director(Base):
         Index('idx_director_address_id', 'address_id'),  # Updated index name for clarity
     )
 
-class Employer(Base):
+class Employer(ChangeTracked, Base):
     __tablename__ = 'employer'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     name = Column(String(255), nullable=False)
     email = Column(String(255))
-    company_id = Column(BigInteger, ForeignKey('company.id'), nullable=False, unique=True)
+    company_id = Column(BigInteger, ForeignKey('company.id', onupdate='CASCADE'), nullable=False, unique=True)
     utr = Column(String(15))  # Changed to String to match UTR format
     nino = Column(String(15))
     start_date = Column(Date, nullable=False)
@@ -86,14 +119,15 @@ class Employer(Base):
         Index('idx_employer_company_id', 'company_id'),  # Updated index name for clarity
     )
 
-class PayRun(Base):
+class PayRun(ChangeTracked, Base):
     __tablename__ = 'payrun'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     company_name = Column(String(255), nullable=False)
-    company_id = Column(BigInteger, ForeignKey('company.id'), nullable=False, unique=True)
+    company_id = Column(BigInteger, ForeignKey('company.id', onupdate='CASCADE'), nullable=False, unique=True)
     date = Column(Date, nullable=False)
     status = Column(Enum('Early', 'Soon', 'Urgent', 'Overdue'), nullable=False)  # Changed to Enum
+    live_status = deadline_status_property('date')  # Status derived from the deadline
     month_check = Column(Boolean, nullable=False)
     pay_run = Column(Boolean, nullable=False)
     p60 = Column(Boolean, nullable=False)
@@ -101,14 +135,20 @@ class PayRun(Base):
 
     company = relationship("Company", back_populates="payrun")
 
-class Account(Base):
+    __table_args__ = (
+        Index('idx_payrun_status_date', 'status', 'date'),
+        Index('idx_payrun_date', 'date'),  # Deadline status buckets
+    )
+
+class Account(ChangeTracked, Base):
     __tablename__ = 'account'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    company_id = Column(BigInteger, ForeignKey('company.id'), nullable=False, unique=True)
+    company_id = Column(BigInteger, ForeignKey('company.id', onupdate='CASCADE'), nullable=False, unique=True)
     name = Column(String(255), nullable=False)
     date = Column(Date, nullable=False)
     status = Column(Enum('Early', 'Soon', 'Urgent', 'Overdue'), nullable=False)  # Changed to Enum
+    live_status = deadline_status_property('date')  # Status derived from the deadline
     email_check = Column(Boolean, nullable=False, default=False)
     invoice_check = Column(Boolean, nullable=False, default=False)
     done_check = Column(Boolean, nullable=False, default=False)
@@ -116,35 +156,52 @@ class Account(Base):
 
     company = relationship("Company", back_populates="accounts")
 
-class ConfirmationStatement(Base):
+    __table_args__ = (
+        Index('idx_account_status_date', 'status', 'date'),
+        Index('idx_account_date', 'date'),  # Deadline status buckets
+    )
+
+class ConfirmationStatement(ChangeTracked, Base):
     __tablename__ = 'confirmation_statement'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    company_id = Column(BigInteger, ForeignKey('company.id'), nullable=False, unique=True)
+    company_id = Column(BigInteger, ForeignKey('company.id', onupdate='CASCADE'), nullable=False, unique=True)
     name = Column(String(255), nullable=False)
     date = Column(Date, nullable=False)
     status = Column(Enum('Early', 'Soon', 'Urgent', 'Overdue'), nullable=False)  # Changed to Enum
+    live_status = deadline_status_property('date')  # Status derived from the deadline
     invoice_check = Column(Boolean, nullable=False)
     done_check = Column(Boolean, nullable=False)
 
     company = relationship("Company", back_populates="confirmation_statements")
 
-class CIS(Base):
+    __table_args__ = (
+        Index('idx_confirmation_statement_status_date', 'status', 'date'),
+        Index('idx_confirmation_statement_date', 'date'),  # Deadline status buckets
+    )
+
+class CIS(ChangeTracked, Base):
     __tablename__ = 'cis'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    company_id = Column(BigInteger, ForeignKey('company.id'), nullable=False, unique=True)
+    company_id = Column(BigInteger, ForeignKey('company.id', onupdate='CASCADE'), nullable=False, unique=True)
     name = Column(String(255), nullable=False)
     employees_reference = Column(String(255), nullable=False)
     last_month = Column(Date, nullable=False)
     next_month = Column(Date, nullable=False)
     status = Column(Enum('Early', 'Soon', 'Urgent', 'Overdue'), nullable=False)  # Changed to Enum
+    live_status = deadline_status_property('next_month')  # Status derived from the deadline
     email_check = Column(Boolean, nullable=False, default=False)
     month_check = Column(Boolean, nullable=False, default=False)
 
     company = relationship("Company", back_populates="cis_details")
 
-class VAT(Base):
+    __table_args__ = (
+        Index('idx_cis_status_next_month', 'status', 'next_month'),
+        Index('idx_cis_next_month', 'next_month'),  # Deadline status buckets
+    )
+
+class VAT(ChangeTracked, Base):
     __tablename__ = 'vat'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
@@ -159,17 +216,21 @@ class VAT(Base):
     calculations = Column(Text)
     files_count = Column(Integer, default=0)
     done = Column(Boolean, default=False)
-    company_id = Column(BigInteger, ForeignKey('company.id'))
-    status = Column(Enum('Early', 'Soon', 'Urgent', 'Overdue'), nullable=False, unique=True)  # Changed to Enum
+    company_id = Column(BigInteger, ForeignKey('company.id', onupdate='CASCADE'))
+    status = Column(Enum('Early', 'Soon', 'Urgent', 'Overdue'), nullable=False)  # Changed to Enum
+    live_status = deadline_status_property('end_date')  # Status derived from the deadline
 
     address = relationship("Address", back_populates="vats")
     company = relationship("Company", back_populates="vats")
 
     __table_args__ = (
         Index('idx_vat_address_id', 'address_id'),  # Updated index name for clarity
+        Index('idx_vat_company_id', 'company_id'),
+        Index('idx_vat_status_end_date', 'status', 'end_date'),
+        Index('idx_vat_end_date', 'end_date'),  # Deadline status buckets
     )
 
-class Invoice(Base):
+class Invoice(ChangeTracked, Base):
     __tablename__ = 'invoice'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
@@ -180,11 +241,25 @@ class Invoice(Base):
     amount = Column(DECIMAL(10, 2))
     sent = Column(Boolean, default=False)
     paid = Column(Boolean, default=False)
-    company_id = Column(BigInteger, ForeignKey('company.id'))
+    company_id = Column(BigInteger, ForeignKey('company.id', onupdate='CASCADE'))
 
     company = relationship("Company", back_populates="invoices")
 
-class Task(Base):
+    __table_args__ = (
+        Index('idx_invoice_sent_paid_date', 'sent', 'paid', 'date'),
+    )
+
+# Default order of the invoice list: open, paid, sent, then sent and paid; then date and id.
+# Indexed as it is written, so the pages are read from the index instead of sorting the table.
+INVOICE_ORDER = (
+    func.coalesce(Invoice.sent, false()),
+    func.coalesce(Invoice.paid, false()),
+    func.coalesce(Invoice.date, literal_column("'0001-01-01'")),
+    Invoice.id,
+)
+Index('idx_invoice_default_order', *INVOICE_ORDER)
+
+class Task(ChangeTracked, Base):
     __tablename__ = 'task'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
@@ -200,11 +275,28 @@ class Task(Base):
     office = Column(Enum('london', 'leeds', name="task_office_enum"), nullable=False)
     files_count = Column(Integer, default=0)
 
-class Files(Base):
+    __table_args__ = (
+        Index('idx_task_status_date_added', 'status', 'date_added'),
+        Index('idx_task_task_name', 'task_name'),  # Task files are counted by task name
+    )
+
+# Default order of the task list: status priority, date added and id. Indexed as it is
+# written; the constants are inline because a database only matches an expression index
+# to the same expression, not to one with bound parameters.
+TASK_ORDER = (
+    case(*[(Task.status == literal_column(f"'{status}'"), literal_column(str(rank)))
+           for status, rank in TASK_STATUS_PRIORITY.items()],
+         else_=literal_column(str(len(TASK_STATUS_PRIORITY)))),
+    func.coalesce(Task.date_added, literal_column("'0001-01-01'")),
+    Task.id,
+)
+Index('idx_task_default_order', *TASK_ORDER)
+
+class Files(ChangeTracked, Base):
     __tablename__ = 'files'
     
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    company_id = Column(BigInteger, ForeignKey('company.id'), nullable=True)
+    company_id = Column(BigInteger, ForeignKey('company.id', onupdate='CASCADE'), nullable=True)
     second_id = Column(Enum('Vat', 'Account', 'Company', 'Payrun','Task'), nullable=False)  # Changed to Enum
     path = Column(String(255), nullable=False)
     name = Column(String(255), nullable=False)
@@ -212,6 +304,13 @@ class Files(Base):
 
     company = relationship("Company", back_populates="files")
 
+    __table_args__ = (
+        # File counts and the files of a company or task, by category
+        Index('idx_files_second_id_company_id', 'second_id', 'company_id'),
+        Index('idx_files_second_id_company_name', 'second_id', 'company_name'),
+        Index('idx_files_company_id', 'company_id'),
+        Index('idx_files_name', 'name'),  # Duplicate checks before an upload
+    )
 
 
 class DataInsights(Base):
@@ -230,3 +329,47 @@ class DataInsights(Base):
     paid_count = Column(Integer, nullable=True)  # If applicable
 
     total_count = Column(Integer, nullable=False)  # Total tasks considered for this category, month, year
+
+    __table_args__ = (
+        Index('idx_data_insights_category_month_year', 'category', 'month', 'year'),
+    )
+
+class UploadJob(Base):
+    """File waiting to be uploaded to Google Drive, kept until the upload is done."""
+    __tablename__ = 'upload_job'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    file_path = Column(String(500), nullable=False)  # Local file to upload
+    name = Column(String(255), nullable=False)
+    second_id = Column(Enum('Vat', 'Account', 'Company', 'Payrun', 'Task', name="upload_category_enum"), nullable=False)
+    company_id = Column(BigInteger, ForeignKey('company.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=True)
+    company_name = Column(String(255), nullable=False)
+    status = Column(Enum('pending', 'uploading', 'done', 'failed', name="upload_status_enum"), nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    drive_file_id = Column(String(100), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_upload_job_status', 'status'),
+    )
+
+class DeletedRow(Base):
+    """Tombstone left behind when a change tracked row is deleted."""
+    __tablename__ = 'deleted_row'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    table_name = Column(String(50), nullable=False)
+    row_id = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_deleted_row_table_deleted_at', 'table_name', 'deleted_at'),
+    )
+
+@event.listens_for(ChangeTracked, 'after_delete', propagate=True)
+def record_deleted_row(mapper, connection, target):
+    """Write a tombstone so open tabs can drop the row on their next refresh."""
+    connection.execute(
+        DeletedRow.__table__.insert().values(table_name=mapper.local_table.name, row_id=target.id)
+    )
@@ -1,31 +1,39 @@
 import logging
 import sys
-import time
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
-    QLineEdit, QLabel, QComboBox, QPushButton, QMessageBox, QScrollArea, QApplication, QTabWidget, QCheckBox, QHeaderView
+    QWidget, QVBoxLayout, QHBoxLayout, QTableView,
+    QLineEdit, QLabel, QComboBox, QPushButton, QMessageBox, QScrollArea, QApplication, QTabWidget, QHeaderView
 )
 from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtGui import QColor
-from sqlalchemy import and_
 from employer_tab import EmployersTab  # Ensure this import matches the correct file name
 from models import Company, Files, PayRun  # Import the necessary models
-from backend import get_session  # Corrected to use context manager from backend
-from datetime import datetime
+from deadline_status import compute_status, STATUS_PRIORITY
+from status_engine import refresh_statuses
+from files_count import recount_files
 from dateutil.relativedelta import relativedelta
+from sqlalchemy import update
 from sqlalchemy.orm import joinedload
+from table_model import ColumnTableModel, RowFilterProxy, DEADLINE_COLORS
+from change_tracking import ChangeTracker
+from lazy_loading import LazyLoader
+from list_queries import payrun_rows
+from db_worker import db_worker
+from instrumentation import operation
+from refresh_coordinator import RefreshCoordinator
 
 logging.basicConfig(level=logging.INFO)
 
-COMPANY_PAYRUN_ROLE = Qt.UserRole + 1
+CHECK_FIELDS = {4: 'month_check', 5: 'pay_run', 6: 'p60'}
 
 class PayRunTab(QWidget):
+    refresh_category = 'PayRun'  # Slice of the dashboard refresh shown in this tab
     status_changed = pyqtSignal()  # Signal to emit when status changes
 
     def __init__(self, tab_widget, parent=None):
         super().__init__(parent)
         self.tab_widget = tab_widget
         self.updating_item = False  # Flag to prevent recursion
+        self.tracker = ChangeTracker(PayRun)  # Remembers what the last load has seen
         self.initUI()
 
     def initUI(self):
@@ -57,12 +65,21 @@ class PayRunTab(QWidget):
         main_layout.addLayout(search_sort_layout)
 
         # Table for Pay Runs
-        self.table = QTableWidget()
-        self.table.setColumnCount(9)
-        self.table.setHorizontalHeaderLabels([
-            'Id', 'Company Name', 'Date', 'Status',
-            'Month Check', 'Pay Run', 'P60', 'Files Count','UTR'
-        ])
+        self.model = ColumnTableModel(
+            [
+                'Id', 'Company Name', 'Date', 'Status',
+                'Month Check', 'Pay Run', 'P60', 'Files Count','UTR'
+            ],
+            status_column=3,
+            status_colors=DEADLINE_COLORS,
+            checkable_columns=CHECK_FIELDS,
+            default_order=lambda values: STATUS_PRIORITY.get(values[3], len(STATUS_PRIORITY))  # As build_rows sorts
+        )
+        self.model.check_changed.connect(self.check_item_changed)
+        self.table = QTableView()
+        self.proxy = RowFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self.table.setModel(self.proxy)
 
         # Button Layout
         button_layout = QHBoxLayout()
@@ -87,7 +104,7 @@ class PayRunTab(QWidget):
         main_layout.addLayout(button_layout)
         self.setLayout(main_layout)
 
-        self.load_data()
+        self.lazy_loader = LazyLoader(self, self.load_data, main_layout)  # Loads when first shown
 
     def sort_data(self):
         """Sort data in the table based on user selection."""
@@ -107,253 +124,190 @@ class PayRunTab(QWidget):
             column_index, ascending = 2, False
 
         if sort_option != 'Default':
-            self.table.sortItems(column_index, order=Qt.AscendingOrder if ascending else Qt.DescendingOrder)
+            self.model.sort(column_index, Qt.AscendingOrder if ascending else Qt.DescendingOrder)
         else:
             # If "Default" is selected, load data with status-based sorting
             self.load_data()
 
     def refresh(self):
-        """Refresh the table data."""
-        self.load_data()
-
-    def refresh_tabs(self):
-        """Refresh all tabs and update file counts."""
-        self.update_files_count()
-        self.refresh()
-        if hasattr(self, 'tab_widget'):
-            for i in range(self.tab_widget.count()):
-                tab = self.tab_widget.widget(i)
-                if hasattr(tab, 'refresh') and tab != self:
-                    tab.refresh()
+        """Fetch only the pay runs changed since the last load."""
+        with operation('Pay runs refresh'):
+            db_worker().submit((id(self), 'rows'), self.fetch_changes, self.show_changes, self.load_failed)
 
-    def load_data(self):
-        """Load data from the database and populate the table, sorted by status by default."""
-        start_time = time.time()  # Record the start time
-        print("Payrun time 1:", datetime.now().strftime("%H:%M:%S"))
-        
+    def select_rows(self):
+        """Return the select() the table rows are loaded with, only the columns shown."""
+        return payrun_rows()
 
-        self.table.setRowCount(0)  # Clear the table before loading new data
+    def refresh_tabs(self):
+        """Refresh all tabs with one pass of set-based queries."""
         try:
-            with get_session() as session:
-                payruns = (
-                    session.query(PayRun)
-                    .options(joinedload(PayRun.company))  # Eagerly load the company relationship
-                    .all()
-                )
-
-                self.table.setRowCount(len(payruns))
-
-                # Sort the confirmations based on the status priority
-                status_priority = {
-                    'Overdue': 0,
-                    'Urgent': 1,
-                    'Soon': 2,
-                    'Early': 3
-                }
-                payruns.sort(key=lambda x: status_priority.get(x.status, 5))
-
-                # Block signals while populating the table to avoid unnecessary updates
-                self.table.blockSignals(True)
-                for row, payrun in enumerate(payruns):
-                    self.add_payrun_to_table(row, payrun)
-                self.table.blockSignals(False)
-
+            RefreshCoordinator.of(self).refresh()
         except Exception as e:
-            logging.exception("Failed to load data")
-            QMessageBox.critical(self, 'Error', f'Failed to load data: {str(e)}')
-
-        print("Payrun time 2:", datetime.now().strftime("%H:%M:%S"))
-        end_time = time.time()  # Record the end time
-        print("PAYRUN Total : {:.2f} seconds".format(end_time - start_time))
-
-    def add_payrun_to_table(self, row, payrun):
-        """Add an payrun entry to the table."""
-
-        id_item = QTableWidgetItem(str(payrun.id))
-        id_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 0, id_item)
-
-        name_item = QTableWidgetItem(payrun.company_name)
-        name_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 1, name_item)
+            QMessageBox.critical(self, 'Error', f'An error occurred while refreshing the tabs: {str(e)}')
 
-        date_item = QTableWidgetItem(payrun.date.strftime('%Y-%m-%d'))
-        date_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 2, date_item)
-
-        status_item = QTableWidgetItem(payrun.status)
-        status_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 3, status_item)
-
-        month_check_item = self.create_checkbox_item(payrun.month_check, payrun.id)
-        self.table.setItem(row, 4, month_check_item)
-
-        payrun_check_item = self.create_checkbox_item(payrun.pay_run, payrun.id)
-        self.table.setItem(row, 5, payrun_check_item)
-
-        p60_check_item = self.create_checkbox_item(payrun.p60, payrun.id)
-        self.table.setItem(row, 6, p60_check_item)
-
-        files_item = QTableWidgetItem(payrun.files_count)
-        files_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 7, files_item)
-
-        utr_item = QTableWidgetItem(str(payrun.company_id))
-        utr_item.setFlags(Qt.ItemIsEnabled)
-        self.table.setItem(row, 8, utr_item)
+    def load_data(self):
+        """Load the pay runs on the database worker; the table fills in when they arrive."""
+        with operation('Pay runs load'):
+            db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.load_failed)
+
+    def fetch_rows(self, session):
+        """Worker thread: return the change tracking mark and the table rows."""
+        mark = self.tracker.current_mark(session)
+        return mark, self.build_rows(session.execute(self.select_rows()).all())
+
+    def fetch_changes(self, session):
+        """Worker thread: return the changes since the last load, or all rows when a reload is needed."""
+        changes = self.tracker.fetch_changes(session, self.select_rows(), self.payrun_row)
+        return changes if changes is not None else self.fetch_rows(session)
+
+    def build_rows(self, payruns):
+        """Sort pay runs by status and return their (rows, ids) for the table."""
+        # Sort the confirmations based on the status priority
+        payruns.sort(key=lambda x: STATUS_PRIORITY.get(x.status, len(STATUS_PRIORITY)))
+        return [self.payrun_row(row) for row in payruns], [row.id for row in payruns]
+
+    def show_rows(self, result):
+        """Show the rows of a full load, sorted by status by default."""
+        mark, (rows, ids) = result
+        self.tracker.set_mark(mark)
+        self.model.set_rows(rows, ids=ids)
+        self.lazy_loader.finish()
+        if self.search_bar.text():
+            self.search_data()
+
+    def show_changes(self, result):
+        """Patch the changed rows into the table, or show a full load."""
+        if not self.tracker.apply_changes(result, self.model):
+            self.show_rows(result)
+        elif self.search_bar.text():
+            self.search_data()
+
+    def load_failed(self, error):
+        logging.error(f"Failed to load data: {error}")
+        self.lazy_loader.finish()
+        QMessageBox.critical(self, 'Error', f'Failed to load data: {str(error)}')
+
+    def payrun_row(self, payrun):
+        """Return the table values of a projected payrun row (see list_queries.payrun_rows)."""
+        return (
+            payrun.id, payrun.company_name, payrun.date, payrun.status,
+            payrun.month_check, payrun.pay_run, payrun.p60, payrun.files_count, payrun.company_id
+        )
 
-        self.set_row_color(row, payrun.status)
-       
-    def check_item_changed(self, item):
+    def check_item_changed(self, row, column, checked):
         """Handle checkbox item changes."""
         if self.updating_item:
             return
-        if item.column() in [4,5,6]:  # Invoice Check or Done Check columns
-            try:
-                payrun_id = item.data(COMPANY_PAYRUN_ROLE)
-                with get_session() as session:
-                    payrun = session.query(PayRun).filter_by(id=payrun_id).first()
-                    if payrun:
-                        self.updating_item = True  # Prevent recursion
-                        if item.column() == 4:
-                            payrun.month_check = item.checkState() == Qt.Checked
-                        elif item.column() == 5:
-                            payrun.pay_run = item.checkState() == Qt.Checked
-                        elif item.column() == 6:
-                            payrun.p60 = item.checkState() == Qt.Checked
-                        session.commit()
-                        self.updating_item = False  # Re-enable updates
-
-                        if payrun.month_check and payrun.pay_run:
-                            response = QMessageBox.question(
-                                self, 'Confirm',
-                                'Both checks are marked. Do you want to update the Payrun date and reset the checks?',
-                                QMessageBox.Yes | QMessageBox.No
-                            )
-                            if response == QMessageBox.Yes:
-                                try:
-                                    self.table.blockSignals(True)  # Temporarily disconnect the signal to prevent recursion
-
-                                    # Update the date by adding one month
-                                    payrun.date += relativedelta(months=1)
-                                    # Reset the checkboxes
-                                    payrun.month_check = False
-                                    payrun.pay_run = False
-
-                                    session.commit()
-
-                                    self.load_data()
-                                    self.check_status()
-                                except Exception as e:
-                                    logging.exception("Error updating payrun date")
-                                    QMessageBox.critical(self, "Error", f"Error updating payrun date: {str(e)}")
-                                finally:
-                                    self.table.blockSignals(False)  # Reconnect the signal
-            except Exception as e:
-                logging.exception("Error handling item change")
-                QMessageBox.critical(self, "Error", f"Error handling item change: {str(e)}")
-
-    def create_checkbox_item(self, checked, payrun_id):
-        """Create a checkbox item."""
-        item = QTableWidgetItem()
-        item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
-        item.setCheckState(Qt.Checked if checked else Qt.Unchecked)
-        item.setData(COMPANY_PAYRUN_ROLE, payrun_id)
-        return item
-    
-    def set_row_color(self, row, status):
-        """Set the background color of a row based on its status."""
-        try:
-            color_map = {
-                'Overdue': QColor(251, 55, 107, 127),  # light red with transparency
-                'Urgent': QColor(247, 131, 34, 127),   # light orange with transparency
-                'Soon': QColor(241, 240, 133, 127),    # light yellow with transparency
-                'Early': QColor(87, 242, 141, 127)     # light green with transparency
-            }
-            color = color_map.get(status, QColor(255, 255, 255, 127))  # default to white with transparency
-
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    item.setBackground(color)
-                    item.setData(Qt.UserRole, color)  # Store the color
-        except Exception as e:
-            logging.exception("Error occurred while setting row color")
-            QMessageBox.critical(self, "Error", f"Error occurred while setting row color: {str(e)}")
+        if column in CHECK_FIELDS:  # Month Check, Pay Run or P60 columns
+            payrun_id = self.model.row_id(row)
+            field = CHECK_FIELDS[column]
+            with operation('Pay run save'):
+                db_worker().submit_write(
+                    lambda session: self.store_check(session, payrun_id, field, checked),
+                    lambda checks: self.check_saved(payrun_id, checks),
+                    lambda error: self.check_failed(payrun_id, column, not checked, error),
+                    idempotent=True  # Setting a flag twice leaves it the same
+                )
+
+    def store_check(self, session, payrun_id, field, checked):
+        """Worker thread: store one check and return the month and pay run checks, or None when the pay run is gone."""
+        payrun = session.get(PayRun, payrun_id)
+        if payrun is None:
+            return None
+        setattr(payrun, field, checked)
+        return payrun.month_check, payrun.pay_run
+
+    def check_saved(self, payrun_id, checks):
+        """Offer to move the pay run on by a month once both its checks are marked."""
+        if checks is None or not all(checks):
+            return
+        response = QMessageBox.question(
+            self, 'Confirm',
+            'Both checks are marked. Do you want to update the Payrun date and reset the checks?',
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if response == QMessageBox.Yes:
+            db_worker().submit_write(
+                lambda session: self.roll_payrun_forward(session, payrun_id),
+                lambda record: self.update_row_in_table(payrun_id, record),  # Only this row changed
+                self.roll_forward_failed
+            )
+
+    def roll_payrun_forward(self, session, payrun_id):
+        """Worker thread: move a pay run on by one month, reset its checks and return its reloaded row."""
+        payrun = session.get(PayRun, payrun_id)
+        if payrun is None:
+            return None
+        # Update the date by adding one month
+        payrun.date += relativedelta(months=1)
+        # Reset the checkboxes
+        payrun.month_check = False
+        payrun.pay_run = False
+        self.update_status(payrun)
+        return session.execute(self.select_rows().where(PayRun.id == payrun_id)).one()
+
+    def check_failed(self, payrun_id, column, previous, error):
+        """Put the checkbox back when the check could not be stored."""
+        logging.error(f"Error handling item change: {error}")
+        row = self.model.find_row(payrun_id)
+        if row is not None:
+            self.model.set_value(row, column, previous)
+        QMessageBox.critical(self, "Error", f"Error handling item change: {str(error)}")
+
+    def roll_forward_failed(self, error):
+        logging.error(f"Error updating payrun date: {error}")
+        QMessageBox.critical(self, "Error", f"Error updating payrun date: {str(error)}")
 
     def update_status(self, payrun):
         """Update the status of a payrun based on the date."""
-        today = datetime.now().date()
-        days_diff = (payrun.date - today).days
-        if days_diff > 7:
-            payrun.status = 'Early'
-        elif 3 <= days_diff <= 7:
-            payrun.status = 'Soon'
-        elif 3 <= days_diff <= 0:
-            payrun.status = 'Urgent'
-        else:
-            payrun.status = 'Overdue'
+        payrun.status = compute_status(payrun.date)
 
     def search_data(self):
         """Search data in the table based on user input."""
         search_text = self.search_bar.text().lower()
-        for row in range(self.table.rowCount()):
-            match = False
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    original_color = item.data(Qt.UserRole)
-                    if not original_color:
-                        original_color = item.background()
-                        item.setData(Qt.UserRole, original_color)
-
-                    if search_text and search_text in item.text().lower():
-                        item.setBackground(QColor(255, 255, 0, 127))
-                        match = True
-                    else:
-                        item.setBackground(original_color)
-            self.table.setRowHidden(row, not match if search_text else False)
-
-    def update_files_count(self):
-        """Update the files count for each pay run."""
-        try:
-            with get_session() as session:  # Use context manager for session
-                payruns = session.query(PayRun).all()
-                for payrun in payruns:
-                    file_count = session.query(Files).filter(
-                        and_(Files.company_id == payrun.company_id, Files.second_id == 'Payrun')
-                    ).count()
-                    payrun.files_count = file_count
-                session.commit()  # Commit all changes
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(e)}')
+        self.model.set_highlight(search_text)
+        self.proxy.set_visible_ids(self.model.matching_ids(search_text) if search_text else None)
+
+    def update_files_count(self, on_done=None):
+        """Update the files count for each pay run on the database worker."""
+        with operation('Pay runs files count'):
+            db_worker().submit_write(self.recount, on_done, self.recount_failed,
+                                     idempotent=True)  # Counting twice stores the same counts
+
+    def recount(self, session):
+        recount_files(session, 'Payrun')  # One GROUP BY query for all rows
+
+    def recount_failed(self, error):
+        QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(error)}')
 
     def check_status(self):
-        """Check and update the status of payruns."""
-        try:
-            with get_session() as session:
-                payruns = session.query(PayRun).all()
-                for payrun in payruns:
-                    self.update_status(payrun)
-                session.commit()
-            self.load_data()  # Refresh the table after status updates
-        except Exception as e:
-            logging.exception("Error occurred while checking status")
-            QMessageBox.critical(self, "Error", f"Error occurred while checking status: {str(e)}")
+        """Check and update the status of payruns, then reload the table."""
+        with operation('Pay runs status check'):
+            db_worker().submit_write(self.update_statuses, self.statuses_updated, self.status_failed,
+                                     idempotent=True)  # Setting the statuses twice stores the same ones
+
+    def update_statuses(self, session):
+        """Worker thread: store the statuses; submit_write commits them."""
+        refresh_statuses(session, ['PayRun'])  # One UPDATE ... CASE for the whole table
+
+    def statuses_updated(self, result):
+        """Reload the table once the statuses are stored."""
+        db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.status_failed)
+
+    def status_failed(self, error):
+        QMessageBox.critical(self, "Error", f"Error occurred while checking status: {str(error)}")
 
     def view_employers(self):
         """Open the EmployersTab for the selected company based on payrun.company_id."""
-        selected_row = self.table.currentRow()
+        selected_row = self.proxy.source_row(self.table.currentIndex())
         if selected_row >= 0:
             try:
-                # Get the company_id from the selected row
-                company_id_item = self.table.item(selected_row, 0)  # Assuming column 0 has the company ID
-                if company_id_item is None:
+                # Get the company_id from the UTR column of the selected row
+                company_id = self.model.value(selected_row, 8)
+                if company_id is None:
                     QMessageBox.warning(self, "Invalid Selection", "Please select a valid company.")
                     return
 
-                company_id = int(company_id_item.text())
-
                 # Open the EmployersTab regardless of whether employers are found
                 employer_tab = EmployersTab(company_id, self.tab_widget)
                 self.tab_widget.addTab(employer_tab, f"Employers of Company {company_id}")
@@ -387,108 +341,46 @@ class PayRunTab(QWidget):
 
         if second_confirmation == QMessageBox.Yes:
             # Proceed with clearing p60 if user confirms
-            try:
-                with get_session() as session:
-                    # Fetch all PayRun records from the database
-                    payruns = session.query(PayRun).all()
-
-                    # Set p60 to False for each PayRun
-                    for payrun in payruns:
-                        payrun.p60 = False
-
-                    # Commit the changes to the database
-                    session.commit()
-
-                    # Now update the table in the app to reflect this change
-                    self.update_all_p60_in_table()
-
-            except Exception as e:
-                QMessageBox.critical(self, 'Error', f'Failed to clear p60: {str(e)}')
+            with operation('Pay runs clear P60'):
+                db_worker().submit_write(
+                    self.clear_all_p60,
+                    lambda result: self.update_all_p60_in_table(),  # Now update the table in the app to reflect this change
+                    self.clear_p60_failed,
+                    idempotent=True
+                )
         else:
             return  # User canceled the operation after the second confirmation
+
+    def clear_all_p60(self, session):
+        """Worker thread: set p60 to False for every pay run with one UPDATE."""
+        session.execute(update(PayRun).values(p60=False))
+
+    def clear_p60_failed(self, error):
+        QMessageBox.critical(self, 'Error', f'Failed to clear p60: {str(error)}')
     
     def update_all_p60_in_table(self):
         """Update all p60 values in the table to reflect the changes."""
-        for row in range(self.table.rowCount()):
+        for row in range(self.model.rowCount()):
             # Set the p60 checkbox to unchecked (False)
-            p60_check_item = self.table.cellWidget(row, 6)
-            if p60_check_item:
-                p60_check_item.setChecked(False)
-
-
-
-#old
+            self.model.set_value(row, 6, False)
 
     def get_row_by_payrun_id(self, payrun_id):
         """Find the table row corresponding to the given payrun ID."""
-        for row in range(self.table.rowCount()):
-            if self.table.item(row, 0) and int(self.table.item(row, 0).text()) == payrun_id:  # Now uses payrun.id
-                return row
-        logging.warning(f"Payrun with ID {payrun_id} not found in the table.")
-        return None
-
-    def create_noneditable_item(self, text):
-        """Create a non-editable QTableWidgetItem."""
-        item = QTableWidgetItem(text)
-        item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-        return item
-    
-    def update_status_and_color_by_payrun(self, payrun_id):
-        """Update status and color for a specific payrun entry."""
-        with get_session() as session:
-            payrun = session.query(PayRun).get(payrun_id)  # Always fetch the object within the session
-            if not payrun:
-                logging.error(f"Payrun with ID {payrun_id} not found.")
-                return
-
-            status = payrun.status
-            row = self.get_row_by_payrun_id(payrun_id)
-            if row is not None:  # Ensure row exists before trying to update UI
-                self.set_row_color(row, status)
-                self.update_checkbox_background(row, status)
-
-    def update_checkbox_background(self, row, status):
-        """Update checkbox background color based on status."""
-        if row is None:  # Handle invalid row
-            logging.warning(f"Row not found for the given payrun. Cannot update checkbox background.")
-            return
-
-        color_map = {
-            'Overdue': QColor(251, 55, 107, 127),
-            'Urgent': QColor(247, 131, 34, 127),
-            'Soon': QColor(241, 240, 133, 127),
-            'Early': QColor(87, 242, 141, 127)
-        }
-        color = color_map.get(status, QColor(255, 255, 255, 127))
-
-        for col in [4, 5, 6]:  # Columns for checkboxes
-            item = self.table.cellWidget(row, col)
-            if item:
-                item.setStyleSheet(f"background-color: rgba({color.red()}, {color.green()}, {color.blue()}, {color.alpha() / 255.0});")
-
-    def update_row_in_table(self, payrun):
-        """Update the specific row in the table with the updated payrun data."""
-        row = self.get_row_by_payrun_id(payrun.id)
+        row = self.model.find_row(payrun_id)
         if row is None:
-            logging.error(f"Payrun with ID {payrun.id} not found in the table.")
+            logging.warning(f"Payrun with ID {payrun_id} not found in the table.")
+        return row
+
+    def update_row_in_table(self, payrun_id, payrun):
+        """Show a reloaded payrun in its row and move the row to its sorted place."""
+        row = self.get_row_by_payrun_id(payrun_id)
+        if row is None or payrun is None:
+            logging.error(f"Payrun with ID {payrun_id} not found in the table.")
             return
 
-        # Update the date and status in the table
-        self.table.setItem(row, 2, self.create_noneditable_item(payrun.date.strftime('%Y-%m-%d')))
-        self.table.setItem(row, 3, self.create_noneditable_item(payrun.status))
-
-        # Update the checkboxes in the table (uncheck both after the update)
-        month_check_item = self.table.cellWidget(row, 4)
-        if isinstance(month_check_item, QCheckBox):
-            month_check_item.setChecked(payrun.month_check)
-
-        payrun_check_item = self.table.cellWidget(row, 5)
-        if isinstance(payrun_check_item, QCheckBox):
-            payrun_check_item.setChecked(payrun.pay_run)
-
-        # Update the row color based on the status
-        self.set_row_color(row, payrun.status)
-        self.update_checkbox_background(row, payrun.status)
+        # Update the date, status and checkboxes in the table; the row color follows the status
+        self.model.update_row(row, self.payrun_row(payrun))
+        self.model.reposition_row(row)
 
 
 if __name__ == "__main__":
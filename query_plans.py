@@ -0,0 +1,111 @@
+import logging
+import sys
+from datetime import date
+from sqlalchemy import literal, select, text, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from models import (Company, Account, CIS, VAT, PayRun, ConfirmationStatement, Task, Invoice, Files, DataInsights,
+                    Employer, DeletedRow, TASK_ORDER, INVOICE_ORDER)
+from list_queries import task_rows, invoice_rows, employer_rows
+from deadline_status import status_case
+from company_search import search_predicate
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN of a statement, in the flavour of the database it runs on."""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def compile_explain(element, compiler, **kw):
+    prefix = 'EXPLAIN QUERY PLAN ' if compiler.dialect.name == 'sqlite' else 'EXPLAIN '
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def list_page(statement, keys, after, page_size=200):
+    """Return the query of a page of a list read with keyset pagination (see windowed_model.KeysetSource)."""
+    after = [literal(value, type_=key.type) for key, value in zip(keys, after)]
+    return statement.where(keys[0] >= after[0], tuple_(*keys) > tuple_(*after)).order_by(*keys).limit(page_size)
+
+
+def indexed_queries(today=None, dialect=None):
+    """Return (name, statement) of the filters the application runs that must use an index.
+
+    The company search is only checked on PostgreSQL: its substring matches
+    need the trigram indexes, and scan the table on other databases.
+    """
+    today = today or date.today()
+    queries = [
+        ('paid tasks', task_rows().where(Task.status == 'paid')),
+        ('task list page', list_page(task_rows(), TASK_ORDER, (1, date.min, 1))),
+        ('invoice list page', list_page(invoice_rows(), INVOICE_ORDER, (False, True, date.min, 1))),
+        ('task files count', select(Task.id).where(Task.task_name == 'Task')),
+        ('company files by category', select(Files.id).where(Files.second_id == 'Company', Files.company_id == 1)),
+        ('task files by category', select(Files.id).where(Files.second_id == 'Task', Files.company_name == 'Task')),
+        ('files of a company', select(Files.id).where(Files.company_id == 1)),
+        ('file by name', select(Files.id).where(Files.name == 'file.pdf')),
+        ('invoices by state', select(Invoice.id).where(Invoice.sent == True, Invoice.paid == False)),
+        ('VAT of a company', select(VAT.id).where(VAT.company_id == 1)),
+        ('employers of a company', employer_rows(1)),
+        ('data insights', select(DataInsights.id).where(
+            DataInsights.category == 'Task', DataInsights.month == today.month, DataInsights.year == today.year)),
+        ('deleted rows', select(DeletedRow.row_id).where(
+            DeletedRow.table_name == 'task', DeletedRow.deleted_at >= today)),
+    ]
+    for model, date_column in ((Account, Account.date), (CIS, CIS.next_month), (VAT, VAT.end_date),
+                               (PayRun, PayRun.date), (ConfirmationStatement, ConfirmationStatement.date)):
+        table_name = model.__table__.name
+        queries.append((f'{table_name} by status', select(model.id).where(model.status == 'Overdue')))
+        queries.append((f'{table_name} overdue', select(model.id).where(date_column < today)))
+        queries.append((f'{table_name} changed since', select(model.id).where(model.updated_at >= today)))
+    if dialect == 'postgresql':
+        queries.append(('company search', select(Company.id).where(search_predicate('acme'))))
+        queries.append(('company search by number', select(Company.id).where(search_predicate('12345'))))
+    return queries
+
+
+def uses_index(connection, statement):
+    """Return (True if the plan of the statement reads an index, plan text)."""
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        # On small tables a sequential scan is cheaper, so ask whether an index can be used at all
+        connection.execute(text('SET LOCAL enable_seqscan = off'))
+    rows = connection.execute(Explain(statement)).all()
+
+    if dialect == 'sqlite':
+        plan = '\n'.join(row[-1] for row in rows)
+        return any(marker in plan for marker in ('USING INDEX', 'USING COVERING INDEX', 'PRIMARY KEY')), plan
+    if dialect == 'mysql':
+        plan = '\n'.join(str(dict(row._mapping)) for row in rows)
+        return all(row._mapping['key'] for row in rows), plan
+    plan = '\n'.join(row[0] for row in rows)
+    return 'Index' in plan, plan
+
+
+def check_indexes(engine, today=None):
+    """EXPLAIN every indexed query and return the names of those that scan a whole table."""
+    missing = []
+    for name, statement in indexed_queries(today, engine.dialect.name):
+        with engine.begin() as connection:
+            used, plan = uses_index(connection, statement)
+        if used:
+            logging.info(f"{name}: index used.")
+        else:
+            logging.error(f"{name}: no index used.\n{plan}")
+            missing.append(name)
+    return missing
+
+
+if __name__ == "__main__":
+    from backend import engine
+    missing = check_indexes(engine)
+    if missing:
+        logging.error(f"{len(missing)} queries do not use an index: {', '.join(missing)}")
+        sys.exit(1)
+    logging.info("Every checked query uses an index.")
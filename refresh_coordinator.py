@@ -0,0 +1,116 @@
+import logging
+from PyQt5.QtWidgets import QTabWidget
+from list_queries import company_rows, account_rows, cis_rows, vat_rows, payrun_rows, confirmation_rows
+from deadline_status import LIVE_STATUS
+from status_engine import refresh_statuses
+from files_count import recount_all_files
+from db_worker import db_worker
+from instrumentation import operation
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Dashboard category -> select() of the columns its tab shows (see list_queries)
+DASHBOARD_QUERIES = {
+    'Company': company_rows,
+    'Account': account_rows,
+    'CIS': cis_rows,
+    'VAT': vat_rows,
+    'PayRun': payrun_rows,
+    'ConfirmationStatement': confirmation_rows,
+}
+
+
+def fetch_dashboard(session, categories=None):
+    """Fetch the rows of the dashboard categories with one query per category.
+
+    Returns a dict mapping each category to its list of Row tuples.
+    """
+    categories = DASHBOARD_QUERIES if categories is None else categories
+    return {category: session.execute(DASHBOARD_QUERIES[category]()).all() for category in categories}
+
+
+class RefreshCoordinator:
+    """Refresh every open dashboard tab from one pass over the database.
+
+    Tabs taking part declare a refresh_category, turn their slice into table
+    rows with build_rows(rows) and show them with show_rows((mark, rows)). A
+    global refresh recounts the files, fetches each category once and hands the
+    rows out, so it costs the same number of queries however many tabs are
+    open. The recount is a write job (serialized with the saves and retried on
+    transient errors); the rows are read once it is committed. Other tabs with
+    a refresh() method are refreshed on their own once it is done.
+    """
+
+    def __init__(self, tab_widget):
+        self.tab_widget = tab_widget  # Or a tab shown on its own, refreshed alone
+
+    @classmethod
+    def of(cls, tab):
+        """Return the coordinator of the tab widget showing tab, or of tab alone outside one."""
+        parent = tab.parentWidget()
+        while parent is not None and not isinstance(parent, QTabWidget):
+            parent = parent.parentWidget()
+        return cls(parent if parent is not None else tab)
+
+    def open_tabs(self):
+        """Return the widgets of the open tabs."""
+        if not isinstance(self.tab_widget, QTabWidget):
+            return [self.tab_widget]
+        return [self.tab_widget.widget(i) for i in range(self.tab_widget.count())]
+
+    def refresh(self):
+        """Refresh all open tabs."""
+        # Tabs never shown yet load their data when they are first opened
+        tabs = [tab for tab in self.open_tabs()
+                if getattr(tab, 'lazy_loader', None) is None or tab.lazy_loader.loaded]
+        dashboard_tabs = [tab for tab in tabs if getattr(tab, 'refresh_category', None)]
+
+        with operation('Dashboard refresh'):
+            db_worker().submit_write(
+                self.update_counts,
+                lambda result: self.read(tabs, dashboard_tabs),
+                self.failed,
+                idempotent=True  # Counting twice stores the same counts
+            )
+
+    def update_counts(self, session):
+        """Worker thread: store the file counts, and the statuses unless they are live."""
+        recount_all_files(session)
+        if not LIVE_STATUS:
+            refresh_statuses(session)
+
+    def read(self, tabs, dashboard_tabs):
+        """Read the rows of the dashboard tabs on the database worker."""
+        worker = db_worker()
+        for tab in dashboard_tabs:
+            worker.cancel((id(tab), 'rows'))  # Superseded by this pass
+        worker.submit(
+            ('dashboard', id(self.tab_widget)),
+            lambda session: self.fetch(session, dashboard_tabs),
+            lambda results: self.show(tabs, dashboard_tabs, results),
+            self.failed
+        )
+
+    def failed(self, error):
+        logging.error(f"Dashboard refresh failed: {error}")
+
+    def fetch(self, session, dashboard_tabs):
+        """Worker thread: return (mark, rows) per tab."""
+        # Take the change tracking marks before reading, as a full load does
+        marks = [tab.tracker.current_mark(session) for tab in dashboard_tabs]
+        slices = fetch_dashboard(session, {tab.refresh_category for tab in dashboard_tabs})
+
+        # The rows are read while the session is still open
+        return [(mark, tab.build_rows(list(slices[tab.refresh_category])))
+                for tab, mark in zip(dashboard_tabs, marks)]
+
+    def show(self, tabs, dashboard_tabs, results):
+        """GUI thread: show the fetched rows and refresh the other tabs."""
+        for tab, result in zip(dashboard_tabs, results):
+            tab.show_rows(result)  # Applies the current search as well
+        logging.info(f"Refreshed {len(dashboard_tabs)} dashboard tabs.")
+
+        for tab in tabs:
+            if tab not in dashboard_tabs and hasattr(tab, 'refresh'):
+                tab.refresh()
@@ -0,0 +1,101 @@
+import logging
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import case, select, update
+from models import Account, CIS, ConfirmationStatement, VAT
+from deadline_status import compute_status
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+
+class Rule:
+    """How the deadline of a category moves on once its work is done.
+
+    steps maps each date column that moves to the step it moves by; copies are
+    (column, source column) pairs where the column takes the old value of the
+    source, e.g. the new start of a VAT quarter is the old end. checks are the
+    flags reset to False, and deadline is the column the status follows.
+    """
+
+    def __init__(self, model, steps, deadline, checks, copies=()):
+        self.model = model
+        self.steps = steps
+        self.deadline = deadline
+        self.checks = checks
+        self.copies = copies
+
+
+# The same moves the checkbox confirmations of the tabs make one row at a time
+RULES = {
+    'Account': Rule(
+        Account, {'date': relativedelta(years=1)}, 'date',
+        ('email_check', 'invoice_check', 'done_check')
+    ),
+    'ConfirmationStatement': Rule(
+        ConfirmationStatement, {'date': relativedelta(years=1)}, 'date',
+        ('invoice_check', 'done_check')
+    ),
+    'CIS': Rule(
+        CIS, {'next_month': relativedelta(months=1)}, 'next_month',
+        ('email_check', 'month_check'),
+        copies=(('last_month', 'next_month'),)
+    ),
+    'VAT': Rule(
+        VAT, {'end_date': relativedelta(months=3), 'due_date': relativedelta(months=3)}, 'end_date',
+        ('done',),
+        copies=(('start_date', 'end_date'),)
+    ),
+}
+
+
+def date_map(column, mapping):
+    """Return a CASE giving the new value of a date column from its old one, or the column when nothing maps."""
+    return case(mapping, value=column, else_=column) if mapping else column
+
+
+def roll_forward(session, category, ids, today=None):
+    """Roll the deadlines of the given rows forward with one UPDATE for the table.
+
+    The distinct old dates of the rows are read first and their new dates and
+    statuses computed in Python, with the month-end handling of relativedelta
+    that SQL date arithmetic does not share across databases. The UPDATE then
+    maps old dates to new ones with CASE. Rows without a deadline are left
+    alone. The caller commits, so several categories can roll in one
+    transaction. Returns the number of rows rolled forward.
+    """
+    rule = RULES[category]
+    model = rule.model
+    ids = list(ids)
+    if not ids:
+        return 0
+    deadline = getattr(model, rule.deadline)
+    step_names = list(rule.steps)
+    old_dates = session.execute(
+        select(*[getattr(model, name) for name in step_names])
+        .where(model.id.in_(ids))
+        .distinct()
+    ).all()
+
+    new_dates = {name: {} for name in step_names}
+    for dates in old_dates:
+        for name, old in zip(step_names, dates):
+            if old is not None:
+                new_dates[name][old] = old + rule.steps[name]
+    statuses = {old: compute_status(new, today) for old, new in new_dates[rule.deadline].items()}
+
+    # MySQL assigns left to right and reads the values already assigned, so the
+    # columns reading old dates come before the dates that move
+    values = [(getattr(model, column), getattr(model, source)) for column, source in rule.copies]
+    values.append((model.status, case(statuses, value=deadline, else_=model.status) if statuses else model.status))
+    values += [(getattr(model, name), date_map(getattr(model, name), new_dates[name])) for name in step_names]
+    values += [(getattr(model, check), False) for check in rule.checks]
+
+    result = session.execute(
+        update(model)
+        .where(model.id.in_(ids))
+        .where(deadline.isnot(None))
+        .ordered_values(*values)
+        .execution_options(synchronize_session=False)
+    )
+    logging.info(f"{category}: {result.rowcount} rows rolled forward.")
+    return result.rowcount
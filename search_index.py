@@ -0,0 +1,94 @@
+import re
+
+NGRAM_SIZE = 3
+SEPARATOR = '\x00'  # Keeps matches from spanning two cells
+
+
+def normalize(text):
+    """Lowercase the text and collapse whitespace."""
+    return re.sub(r'\s+', ' ', str(text).lower()).strip()
+
+
+def ngrams(text, size):
+    """Return the set of n-grams of the given size in the text."""
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class SearchIndex:
+    """Inverted index from n-grams to row ids, used for substring search.
+
+    Every trigram of each normalized cell points to the ids of the rows
+    containing it. A search text of three characters or more intersects the
+    postings of its trigrams and confirms the few candidates against the
+    stored row text, so the result is the same as a substring search over every
+    cell. Shorter texts match too many rows to be worth indexing and are
+    answered with a plain scan of the stored texts.
+    """
+
+    def __init__(self, ngram_size=NGRAM_SIZE):
+        self.ngram_size = ngram_size
+        self._postings = {}  # n-gram -> set of row ids
+        self._texts = {}     # row id -> normalized cell texts joined by SEPARATOR
+
+    def __len__(self):
+        return len(self._texts)
+
+    def build(self, rows):
+        """Index an iterable of (row_id, cell texts) pairs from scratch."""
+        self._postings = {}
+        self._texts = {}
+        for row_id, texts in rows:
+            self.add(row_id, texts)
+
+    def add(self, row_id, texts):
+        """Index a single row."""
+        row_text = SEPARATOR.join(normalize(text) for text in texts)
+        postings = self._postings
+        for gram in self.row_grams(row_text):
+            posting = postings.get(gram)
+            if posting is None:
+                postings[gram] = {row_id}
+            else:
+                posting.add(row_id)
+        self._texts[row_id] = row_text
+
+    def remove(self, row_id):
+        """Drop a row from the index."""
+        row_text = self._texts.pop(row_id, None)
+        if row_text is None:
+            return
+        for gram in self.row_grams(row_text):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(row_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def row_grams(self, row_text):
+        """Return the n-grams of a row text that do not span two cells."""
+        grams = ngrams(row_text, self.ngram_size)
+        return {gram for gram in grams if SEPARATOR not in gram}
+
+    def update(self, row_id, texts):
+        """Re-index a row after its values changed."""
+        self.remove(row_id)
+        self.add(row_id, texts)
+
+    def search(self, text):
+        """Return the ids of the rows where any cell contains the text."""
+        text = normalize(text)
+        if not text:
+            return set(self._texts)
+        if len(text) < self.ngram_size:
+            return {row_id for row_id, row_text in self._texts.items() if text in row_text}
+        if len(text) == self.ngram_size:
+            return set(self._postings.get(text, ()))
+
+        # Intersect the postings of the trigrams, starting with the rarest
+        postings = sorted((self._postings.get(gram, set()) for gram in ngrams(text, self.ngram_size)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                return candidates
+        return {row_id for row_id in candidates if text in self._texts[row_id]}
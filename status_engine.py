@@ -0,0 +1,60 @@
+import logging
+import sys
+from sqlalchemy import or_, update
+from models import Account, CIS, PayRun, ConfirmationStatement, VAT
+from db_session import get_session
+from deadline_status import status_case
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Category -> (model, deadline column the status is computed from)
+STATUS_TARGETS = {
+    'Account': (Account, Account.date),
+    'CIS': (CIS, CIS.next_month),
+    'PayRun': (PayRun, PayRun.date),
+    'ConfirmationStatement': (ConfirmationStatement, ConfirmationStatement.date),
+    'VAT': (VAT, VAT.end_date),
+}
+
+
+def refresh_statuses(session, categories=None, today=None):
+    """Recompute the deadline status of every row with one UPDATE ... CASE per table.
+
+    Only rows whose status actually changes are written. The caller commits the
+    session, so all categories are updated in the same transaction.
+    Returns the number of updated rows per category.
+    """
+    updated = {}
+    for category in categories or STATUS_TARGETS:
+        model, date_column = STATUS_TARGETS[category]
+        new_status = status_case(date_column, today)
+        result = session.execute(
+            update(model)
+            .where(date_column.isnot(None))
+            .where(or_(model.status.is_(None), model.status != new_status))
+            .values(status=new_status)
+            .execution_options(synchronize_session=False)
+        )
+        updated[category] = result.rowcount
+        logging.info(f"{category} statuses refreshed, {result.rowcount} rows changed.")
+    return updated
+
+
+def refresh_all_statuses(today=None):
+    """Refresh the statuses of every category in one transaction.
+
+    Entry point for a scheduler (cron, Task Scheduler or a QTimer).
+    """
+    with get_session() as session:
+        updated = refresh_statuses(session, today=today)
+        session.commit()
+    return updated
+
+
+if __name__ == "__main__":
+    try:
+        refresh_all_statuses()
+    except Exception:
+        logging.exception("Failed to refresh the deadline statuses")
+        sys.exit(1)
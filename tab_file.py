@@ -1,107 +1,53 @@
-from datetime import datetime
 import os
 import logging
 import sys
-import time
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QLineEdit, QTableWidget, QTableWidgetItem, QPushButton, QHeaderView,QMessageBox
+    QApplication, QWidget, QVBoxLayout, QLineEdit, QTableView, QPushButton, QHeaderView,QMessageBox
 )
-from PyQt5.QtCore import QUrl, Qt
-from PyQt5.QtGui import QDesktopServices, QBrush, QColor
-from sqlalchemy.exc import SQLAlchemyError
+from PyQt5.QtCore import QUrl, Qt, QTimer
+from PyQt5.QtGui import QDesktopServices, QColor
 from models import Files, Company
-from backend import get_session
 from sqlalchemy.orm import joinedload
+from windowed_model import WindowedTableModel, KeysetSource, SEARCH_DELAY
+from lazy_loading import LazyLoader
+from db_worker import db_worker
+from instrumentation import operation
+from list_queries import file_rows
+from file_ingest import ingest_directory
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-def fetch_files():
-    """Fetch files from the database with error handling for both company-related and task-related files."""
-    try:
-        with get_session() as session:
-            # Fetch all files, including those related to tasks and companies
-            files = session.query(Files).options(joinedload(Files.company)).all()
-
-            files_data = []
-            for file in files:
-                # If the file is related to a company (second_id is 'Company')
-                if file.second_id == 'Task':
-                    file_data = {
-                        'company_id': file.company_id if file.company_id else 'N/A',  # No company association for tasks
-                        'company_name': file.company_name,  # Use a placeholder name for task files
-                        'second_id': file.second_id,
-                        'name': file.name,
-                        'path': file.path
-                    }
-                
-                # If the file is related to a task (second_id is 'Task')
-                else:
-                    file_data = {
-                        'company_id': file.company_id if file.company_id else 'N/A',
-                        'company_name': file.company_name if file.company_name else 'N/A',
-                        'second_id': file.second_id,
-                        'name': file.name,
-                        'path': file.path
-                    }
-
-                files_data.append(file_data)
-
-        return files_data
-
-    except SQLAlchemyError as e:
-        logging.error(f"An SQLAlchemy error occurred: {e}")
-        return []
-
-
-def upload_existing_files():
-    """Automatically upload existing files from a directory to the database."""
-    
-    target_dir = "files"
-    if not os.path.exists(target_dir):
-        logging.info("No files directory found to upload.")
-        return
-
-    files_uploaded = 0
-    try:
-        with get_session() as session:
-            for file_name in os.listdir(target_dir):
-                target_path = os.path.join(target_dir, file_name)
-
-                # Check if the file already exists in the database
-                existing_file = session.query(Files).filter_by(name=file_name).first()
-
-                if not existing_file:
-                    # Determine if the file is task-related or company-related based on file naming convention or other logic
-                    if "task" in file_name.lower():  # Example: if the file name contains 'task', it's task-related
-                        second_id = 'Task'
-                        company_id = None  # No company ID for task-related files
-                    else:
-                        second_id =second_id
-                        company_id = company_id  # Modify this logic to associate the file with a company (hardcoded as '1' here)
-
-                    # Create and add the new file record
-                    new_file = Files(
-                        name=file_name,
-                        second_id=second_id,
-                        company_id=company_id,
-                        path=target_path
-                    )
-                    session.add(new_file)
-                    files_uploaded += 1
-
-            session.commit()
-            logging.info(f"{files_uploaded} new files uploaded to the database.")
-
-    except Exception as e:
-        logging.exception("Failed to upload existing files")
-        QMessageBox.critical(None, "Error", f"An error occurred while uploading files: {e}")
+def file_row(file):
+    """Return the table values of a projected file row: (company id, company name, category, name, path)."""
+    if file.second_id == 'Task':
+        # Task files have no company; the task name is kept in company_name
+        company_name = file.company_name
+    else:
+        company_name = file.company_name if file.company_name else 'N/A'
+    return (
+        file.company_id if file.company_id else 'N/A',
+        company_name,
+        file.second_id,
+        file.name,
+        file.path
+    )
+
+
+def file_source():
+    """Return the pages of the files of both companies and tasks, in the order they were added."""
+    return KeysetSource(
+        file_rows(),
+        [Files.id],
+        file_row,
+        columns=list(file_rows().selected_columns)[1:],
+        search_columns=[Files.company_id, Files.company_name, Files.second_id, Files.name]
+    )
 
 
 class FilesTab(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.files = fetch_files()  # Store the fully loaded files data
         self.initUI()
 
     def initUI(self):
@@ -111,14 +57,29 @@ class FilesTab(QWidget):
         # Search Bar
         self.search_bar = QLineEdit(self)
         self.search_bar.setPlaceholderText('Search...')
-        self.search_bar.textChanged.connect(self.search_data)
+        # Searched in the database, so only once the typing stops
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search_data)
+        self.search_bar.textChanged.connect(lambda text: self.search_timer.start())
         main_layout.addWidget(self.search_bar)
 
         # Table
-        self.table = QTableWidget(self)
-        self.table.setColumnCount(5)  # UTR, Company Name, Type, File Name, Action
-        self.table.setHorizontalHeaderLabels(['UTR', 'Company Name', 'Type', 'File Name', 'Action'])
+        # UTR, Company Name, Type, File Name, Action (the action column holds the file path)
+        self.model = WindowedTableModel(
+            ['UTR', 'Company Name', 'Type', 'File Name', 'Action'],
+            file_source(),
+            parent=self,
+            alternate_colors=(QColor(230, 230, 250, 127), QColor(245, 245, 255, 127)),
+            formatters={4: lambda path: 'Open'}
+        )
+        self.model.window_loaded.connect(self.show_files)
+        self.model.load_failed.connect(self.load_failed)
+        self.table = QTableView(self)
+        self.table.setModel(self.model)
         self.table.setSortingEnabled(True)
+        self.table.clicked.connect(self.cell_clicked)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
 
         # Set column widths
@@ -135,82 +96,32 @@ class FilesTab(QWidget):
         refresh_button.clicked.connect(self.refresh_data)
         main_layout.addWidget(refresh_button)
 
-        self.load_existing_files()
         self.setLayout(main_layout)
 
-    def load_existing_files(self):
-        start_time = time.time()  # Record the start time
-        print("Files 1:", datetime.now().strftime("%H:%M:%S"))
-    
-        """Load files into the table from the fetched data."""
-        self.table.setRowCount(0)
-        for row, file in enumerate(self.files):
-            self.add_file_to_table(file, row)
-        self.apply_row_colors()
-        
-        print("File 2:", datetime.now().strftime("%H:%M:%S"))
-        end_time = time.time()  # Record the end time
-        print("Total File: {:.2f} seconds".format(end_time - start_time))
-
-    def add_file_to_table(self, file, row, search_text=None):
-        """Add a file entry to the table."""
-        self.table.insertRow(row)
-        # Use dictionary keys to access values in file
-        self.table.setItem(row, 0, self.create_noneditable_item(str(file['company_id']), search_text))
-        self.table.setItem(row, 1, self.create_noneditable_item(file['company_name'], search_text))
-        self.table.setItem(row, 2, self.create_noneditable_item(file['second_id'], search_text))
-        self.table.setItem(row, 3, self.create_noneditable_item(file['name'], search_text))
-
-        open_button = QPushButton('Open', self)
-        open_button.clicked.connect(lambda checked, file_path=file['path']: self.open_local_file(file_path))
-        open_button.setStyleSheet("""
-            QPushButton {
-                background-color: seagreen;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: lightgreen;
-            }
-        """)
+        self.lazy_loader = LazyLoader(self, self.load_files, main_layout)  # Loads when first shown
 
-        self.table.setCellWidget(row, 4, open_button)
+    def load_files(self):
+        """Count the files and read the first page; the others are read as they are scrolled to."""
+        with operation('Files load'):
+            self.model.reload()
 
-    def create_noneditable_item(self, text, search_text):
-        """Create a non-editable table item with optional search highlighting."""
-        item = QTableWidgetItem(text)
-        item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)  # Make item non-editable
-        if search_text and search_text in text.lower():
-            item.setBackground(QBrush(QColor('lightblue')))
-        return item
+    def show_files(self, total):
+        self.lazy_loader.finish()
 
-    def apply_row_colors(self):
-        """Apply alternating row colors for better readability."""
-        for row in range(self.table.rowCount()):
-            color = QColor(230, 230, 250, 127) if row % 2 == 0 else QColor(245, 245, 255, 127)
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    item.setBackground(color)
+    def load_failed(self, error):
+        logging.error(f"Failed to load files: {error}")
+        self.lazy_loader.finish()
 
     def search_data(self):
-        """Search for text in the table and highlight matching rows."""
+        """Search the files in the database and highlight the matches."""
         search_text = self.search_bar.text().lower()
-        for row in range(self.table.rowCount()):
-            match = False
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    original_color = item.data(Qt.UserRole)
-                    if not original_color:
-                        original_color = item.background()
-                        item.setData(Qt.UserRole, original_color)
+        self.model.set_highlight(search_text)
+        self.model.set_search(search_text)
 
-                    if search_text and search_text in item.text().lower():
-                        item.setBackground(QColor(255, 255, 0, 127))  # light yellow with transparency
-                        match = True
-                    else:
-                        item.setBackground(original_color)
-            self.table.setRowHidden(row, not match if search_text else False)
+    def cell_clicked(self, index):
+        """Open the file when its action cell is clicked."""
+        if index.column() == 4 and self.model.value(index.row(), 4):  # Empty until its page is read
+            self.open_local_file(self.model.value(index.row(), 4))
 
     def open_local_file(self, file_path):
         """Open a file stored locally using its path or open a Google Drive link."""
@@ -241,13 +152,18 @@ class FilesTab(QWidget):
 
     def refresh_data(self):
         """Refresh the table data from the database."""
-        try:
-            upload_existing_files()  # Automatically upload existing files
-            self.files = fetch_files()  # Re-fetch files from the database
-            self.load_existing_files()
-            logging.info('The file data has been refreshed successfully.')
-        except Exception as e:
-            logging.exception("Error occurred during refresh")
+        with operation('Files refresh'):
+            # A write: one import at a time, never superseded by a second click. Batches of
+            # the files directory are added in transactions of their own (see file_ingest).
+            db_worker().submit_write(ingest_directory, self.files_refreshed, self.refresh_failed,
+                                     transaction=False)
+
+    def files_refreshed(self, summary):
+        self.load_files()  # Counts the files again, including the ones just added
+        logging.info(f'The file data has been refreshed successfully: {summary.added} files added.')
+
+    def refresh_failed(self, error):
+        QMessageBox.critical(self, "Error", f"An error occurred while uploading files: {error}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,417 @@
+from datetime import date
+from PyQt5.QtCore import Qt, QAbstractTableModel, QSortFilterProxyModel, QModelIndex, QVariant, pyqtSignal
+from PyQt5.QtGui import QColor
+from search_index import SearchIndex
+from instrumentation import populating
+
+STATUS_ROLE = Qt.UserRole + 2  # Status of the row, used for the row color
+ROW_ID_ROLE = Qt.UserRole + 3  # Database id of the row
+
+HIGHLIGHT_COLOR = QColor(255, 255, 0, 127)  # light yellow with transparency
+DEFAULT_COLOR = QColor(255, 255, 255, 127)  # white with transparency
+
+DEADLINE_COLORS = {
+    'Overdue': QColor(251, 55, 107, 127),  # light red with transparency
+    'Urgent': QColor(247, 131, 34, 127),   # light orange with transparency
+    'Soon': QColor(241, 240, 133, 127),    # light yellow with transparency
+    'Early': QColor(87, 242, 141, 127)     # light green with transparency
+}
+
+TASK_COLORS = {
+    'not_started': QColor(251, 55, 107, 127),  # Red
+    'in_process': QColor(247, 131, 34, 127),   # Orange
+    'details_missing': QColor(241, 240, 133, 127),  # Yellow
+    'done': QColor(87, 242, 141, 127),         # Green
+    'paid': QColor(192, 192, 192, 127),        # Gray
+}
+
+INVOICE_COLORS = {
+    'paid': QColor(87, 242, 141, 127),     # Light green, sent and paid
+    'partial': QColor(241, 240, 133, 127), # Light yellow, sent or paid
+    'open': QColor(251, 55, 107, 127)      # Light red, neither
+}
+
+
+def format_value(value):
+    """Convert a raw column value into the text shown in the table."""
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+def sort_key(value):
+    """Sort key that keeps None values at the end and never compares mixed types."""
+    if value is None:
+        return (2, '')
+    if isinstance(value, (int, float, date)) or hasattr(value, 'as_tuple'):
+        return (0, value)
+    return (1, str(value).lower())
+
+
+class ColumnTableModel(QAbstractTableModel):
+    """Read-mostly table model that keeps its data in one Python list per column.
+
+    Nothing is allocated per cell: text, check states and colors are produced
+    in data() when the view paints a cell. Row colors come from the status of
+    the row (see STATUS_ROLE) or from alternating colors.
+
+    default_order is the key of a row tuple that the rows given to set_rows()
+    are sorted by, if any. Together with sort() it tells reposition_row() where
+    a changed row belongs.
+    """
+    check_changed = pyqtSignal(int, int, bool)  # row, column, checked
+    cell_edited = pyqtSignal(int, int, object, object)  # row, column, old value, new value
+
+    def __init__(self, headers, parent=None, status_column=None, status_colors=None,
+                 alternate_colors=None, checkable_columns=(), editable_columns=(), formatters=None,
+                 default_order=None):
+        super().__init__(parent)
+        self._headers = list(headers)
+        self._columns = [[] for _ in self._headers]
+        self._ids = []
+        self._statuses = []
+        self._row_by_id = None
+        self._search_index = None  # Built on the first search
+        self._highlight = ''
+        self.status_column = status_column
+        self.status_colors = status_colors or {}
+        self.alternate_colors = alternate_colors
+        self.checkable_columns = set(checkable_columns)
+        self.editable_columns = set(editable_columns)
+        self.formatters = formatters or {}
+        self.default_order = default_order
+        self._order = None  # (key of a row tuple, descending) of the rows, when they are in order
+
+    # Qt model interface
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal and section < len(self._headers):
+            return self._headers[section]
+        return QVariant()
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        column = index.column()
+        if column in self.checkable_columns:
+            flags |= Qt.ItemIsUserCheckable
+        elif column in self.editable_columns:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return QVariant()
+        row, column = index.row(), index.column()
+
+        if role == Qt.DisplayRole or role == Qt.EditRole:
+            if column in self.checkable_columns:
+                return QVariant()
+            return self.display_text(row, column)
+        if role == Qt.CheckStateRole and column in self.checkable_columns:
+            return Qt.Checked if self.value(row, column) else Qt.Unchecked
+        if role == Qt.BackgroundRole:
+            if self._highlight and column not in self.checkable_columns \
+                    and self._highlight in self.display_text(row, column).lower():
+                return HIGHLIGHT_COLOR
+            return self.row_color(row)
+        if role == STATUS_ROLE:
+            return self.status(row)
+        if role == ROW_ID_ROLE:
+            return self.row_id(row)
+        return QVariant()
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid():
+            return False
+        row, column = index.row(), index.column()
+
+        if role == Qt.CheckStateRole and column in self.checkable_columns:
+            checked = value == Qt.Checked
+            self.store_value(row, column, checked)
+            self.dataChanged.emit(index, index, [role])
+            self.check_changed.emit(row, column, checked)
+            return True
+        if role == Qt.EditRole and column in self.editable_columns:
+            old_value = self.value(row, column)
+            if format_value(old_value) == value:
+                return False
+            self.store_value(row, column, value)
+            self.dataChanged.emit(index, index, [role])
+            self.cell_edited.emit(row, column, old_value, value)
+            return True
+        return False
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sort all column arrays by the raw values of one column."""
+        if column < 0 or column >= len(self._headers):
+            return
+        self.arrange(lambda values: sort_key(values[column]), order == Qt.DescendingOrder)
+
+    def reorder(self):
+        """Put the rows back in the current order, e.g. after patching many of them."""
+        if self._order is not None:
+            self.arrange(*self._order)
+
+    def arrange(self, key, descending=False):
+        """Order all column arrays by the key of each row tuple; equal rows keep their order."""
+        order_index = sorted(range(len(self._ids)), key=lambda r: key(self.row_values(r)), reverse=descending)
+        self.layoutAboutToBeChanged.emit()
+        self._columns = [[col[r] for r in order_index] for col in self._columns]
+        self._ids = [self._ids[r] for r in order_index]
+        self._statuses = [self._statuses[r] for r in order_index]
+        self._row_by_id = None
+        self._order = (key, descending)
+        self.layoutChanged.emit()
+
+    # Data access
+
+    def set_rows(self, rows, ids=None, statuses=None):
+        """Replace the content of the model with a sequence of row tuples."""
+        with populating():
+            self.reset_rows(rows, ids, statuses)
+
+    def reset_rows(self, rows, ids, statuses):
+        self.beginResetModel()
+        rows = list(rows)
+        if rows:
+            self._columns = [list(col) for col in zip(*rows)]
+        else:
+            self._columns = [[] for _ in self._headers]
+        self._ids = list(ids) if ids is not None else list(range(len(rows)))
+        if statuses is not None:
+            self._statuses = list(statuses)
+        elif self.status_column is not None:
+            self._statuses = list(self._columns[self.status_column])
+        else:
+            self._statuses = [None] * len(rows)
+        self._row_by_id = None
+        self._search_index = None
+        self._order = (self.default_order, False) if self.default_order else None
+        self.endResetModel()
+
+    def patch_rows(self, rows, ids, removed_ids=(), statuses=None):
+        """Apply changed, new and removed rows without resetting the model.
+
+        Rows whose id is already shown are updated in place, the others are
+        appended, and the rows of removed_ids are dropped.
+        """
+        with populating():
+            self.apply_patch(rows, ids, removed_ids, statuses)
+
+    def apply_patch(self, rows, ids, removed_ids, statuses):
+        removed_rows = sorted((row for row in map(self.find_row, removed_ids) if row is not None), reverse=True)
+        for row in removed_rows:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            for col in self._columns:
+                del col[row]
+            del self._statuses[row]
+            row_id = self._ids.pop(row)
+            if self._search_index is not None:
+                self._search_index.remove(row_id)
+            self.endRemoveRows()
+        if removed_rows:
+            self._row_by_id = None
+
+        statuses = list(statuses) if statuses is not None else [None] * len(ids)
+        new_rows = []
+        for values, row_id, status in zip(rows, ids, statuses):
+            row = self.find_row(row_id)
+            if row is None:
+                new_rows.append((values, row_id, status))
+            else:
+                self.update_row(row, values, status)
+        if not new_rows:
+            return
+
+        first = len(self._ids)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_rows) - 1)
+        for values, row_id, status in new_rows:
+            for col, value in zip(self._columns, values):
+                col.append(value)
+            if status is None and self.status_column is not None:
+                status = values[self.status_column]
+            self._statuses.append(status)
+            self._ids.append(row_id)
+            row = len(self._ids) - 1
+            self._row_by_id[row_id] = row
+            if self._search_index is not None:
+                self._search_index.add(row_id, self.searchable_texts(row))
+        self.endInsertRows()
+
+    def value(self, row, column):
+        """Return the raw value of a cell."""
+        return self._columns[column][row]
+
+    def row_values(self, row):
+        """Return the raw values of a row as a tuple."""
+        return tuple(col[row] for col in self._columns)
+
+    def display_text(self, row, column):
+        """Return the text shown in a cell."""
+        value = self.value(row, column)
+        formatter = self.formatters.get(column)
+        return formatter(value) if formatter else format_value(value)
+
+    def row_id(self, row):
+        """Return the database id stored for a row."""
+        return self._ids[row]
+
+    def status(self, row):
+        """Return the status of a row."""
+        return self._statuses[row]
+
+    def store_value(self, row, column, value):
+        """Write a cell; a write to the status column changes the status as well."""
+        self._columns[column][row] = value
+        if column == self.status_column:
+            self._statuses[row] = value
+
+    def store_status(self, row, status):
+        """Write the status of a row."""
+        self._statuses[row] = status
+
+    def find_row(self, row_id):
+        """Return the row holding the given database id, or None."""
+        if self._row_by_id is None:
+            self._row_by_id = {row_id: row for row, row_id in enumerate(self._ids)}
+        return self._row_by_id.get(row_id)
+
+    def set_value(self, row, column, value):
+        """Change a single cell without emitting the edit signals."""
+        self.store_value(row, column, value)
+        self.reindex_row(row)
+        self.emit_row_changed(row)
+
+    def update_row(self, row, values, status=None):
+        """Replace all values of a row without emitting the edit signals."""
+        for column, value in enumerate(values):
+            self.store_value(row, column, value)
+        if status is not None:
+            self.store_status(row, status)
+        self.reindex_row(row)
+        self.emit_row_changed(row)
+
+    def reposition_row(self, row):
+        """Move a changed row to where the current order puts it and return its new row.
+
+        The other rows are in order, so the place is found with a binary search:
+        after the rows sorting before it or level with it. Rows stay put when
+        the model has no known order.
+        """
+        if self._order is None:
+            return row
+        key, descending = self._order
+        target = key(self.row_values(row))
+        low, high = 0, self.rowCount() - 1  # Places among the other rows
+        while low < high:
+            middle = (low + high) // 2
+            other = key(self.row_values(middle if middle < row else middle + 1))
+            if (other >= target) if descending else (other <= target):
+                low = middle + 1
+            else:
+                high = middle
+        self.move_row(row, low)
+        return low
+
+    def move_row(self, row, position):
+        """Move a row so that it ends up at the given position."""
+        if position == row:
+            return
+        destination = position + 1 if position > row else position  # Counted before the row is taken out
+        self.beginMoveRows(QModelIndex(), row, row, QModelIndex(), destination)
+        for values in self._columns + [self._ids, self._statuses]:
+            values.insert(position, values.pop(row))
+        self._row_by_id = None
+        self.endMoveRows()
+
+    def set_status(self, row, status):
+        """Change the status (and therefore the color) of a row."""
+        self.store_status(row, status)
+        if self.status_column is not None:
+            self.store_value(row, self.status_column, status)
+            self.reindex_row(row)
+        self.emit_row_changed(row)
+
+    def set_highlight(self, text):
+        """Highlight cells containing the given (lowercase) text."""
+        self._highlight = text
+        if self.rowCount():
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, len(self._headers) - 1),
+                                  [Qt.BackgroundRole])
+
+    def searchable_texts(self, row):
+        """Return the texts of a row that take part in the search."""
+        return [self.display_text(row, column) for column in range(len(self._headers))
+                if column not in self.checkable_columns]
+
+    def search_index(self):
+        """Return the search index of the model, building it when needed."""
+        if self._search_index is None:
+            self._search_index = SearchIndex()
+            self._search_index.build((row_id, self.searchable_texts(row)) for row, row_id in enumerate(self._ids))
+        return self._search_index
+
+    def reindex_row(self, row):
+        """Keep the search index in step with a changed row."""
+        if self._search_index is not None:
+            self._search_index.update(self._ids[row], self.searchable_texts(row))
+
+    def matching_ids(self, text):
+        """Return the ids of the rows where any cell contains the given text."""
+        return self.search_index().search(text)
+
+    def row_color(self, row):
+        """Return the background color of a row."""
+        if self.status_colors:
+            return self.status_colors.get(self.status(row), DEFAULT_COLOR)
+        if self.alternate_colors:
+            return self.alternate_colors[row % 2]
+        return QVariant()
+
+    def emit_row_changed(self, row):
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self._headers) - 1))
+
+
+class RowFilterProxy(QSortFilterProxyModel):
+    """Proxy that only shows the rows whose ids are in a given set.
+
+    Sorting is passed on to the source model, which sorts on the raw values.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._visible_ids = None
+
+    def set_visible_ids(self, row_ids):
+        """Show only the rows with the given ids, or every row when row_ids is None."""
+        self._visible_ids = row_ids
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self._visible_ids is None:
+            return True
+        return self.sourceModel().row_id(source_row) in self._visible_ids
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sourceModel().sort(column, order)
+
+    def selected_ids(self, view):
+        """Return the database ids of the rows selected in a view, in source order."""
+        rows = {self.source_row(index) for index in view.selectionModel().selectedRows()}
+        return [self.sourceModel().row_id(row) for row in sorted(rows) if row >= 0]
+
+    def source_row(self, index):
+        """Return the source model row of a view index, or -1."""
+        if not index.isValid():
+            return -1
+        return self.mapToSource(index).row()
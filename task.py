@@ -1,55 +1,34 @@
-from datetime import datetime
+from datetime import date
 import sys
 import os
 import logging
-import time
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
+    QWidget, QVBoxLayout, QHBoxLayout, QTableView,
     QLineEdit, QLabel, QComboBox, QDateEdit, QCheckBox, QPushButton, QMessageBox,
     QHeaderView, QFileDialog, QGridLayout, QApplication,
 )
-from PyQt5.QtGui import QColor
-from PyQt5.QtCore import Qt, QDate
-from sqlalchemy import and_
-from backend import get_session
+from PyQt5.QtCore import Qt, QDate, QTimer
 from paid_tasks import PaidTasksTab
-from models import Task, Files
-from google.oauth2.service_account import Credentials 
-from googleapiclient.discovery import build 
-from googleapiclient.http import MediaFileUpload
-
-SCOPES = ['https://www.googleapis.com/auth/drive.file']
-
-def get_service_account_file_path():
-    """Dynamically retrieves the path to the service account file."""
-    # Get the current directory where the script is located
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    
-    # The name of the service account file
-    service_account_file = os.path.join(script_dir, "adroit-producer-421409-e1fdc9fd2b6f.json")
-
-    # Check if the file exists
-    if not os.path.exists(service_account_file):
-        raise FileNotFoundError(f"Service account file not found: {service_account_file}")
-    
-    return service_account_file
-
-# Get the service account file path dynamically
-SERVICE_ACCOUNT_FILE = get_service_account_file_path()
-
-def authenticate_google_drive():
-    """Authenticate and return the Google Drive service using a service account."""
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    service = build('drive', 'v3', credentials=creds)
-    return service
+from models import Task, Files, TASK_ORDER
+from files_count import recount_files
+from table_model import TASK_COLORS
+from windowed_model import WindowedTableModel, KeysetSource, SEARCH_DELAY
+from change_tracking import ChangeTracker
+from drive_uploads import upload_service, UploadStatusLabel
+from lazy_loading import LazyLoader
+from list_queries import task_rows
+from db_worker import db_worker
+from instrumentation import operation
+
+CHECK_FIELDS = {8: 'invoice_sent', 9: 'invoice_paid'}
 
 class TaskTab(QWidget):
     def __init__(self, tab_widget, parent=None):
         super().__init__(parent)
-        self.tasks = []  # Holds loaded tasks
         self.tab_widget = tab_widget
         self.updating_item = False
         self.main_window = parent
+        self.tracker = ChangeTracker(Task)  # Remembers what the last load has seen
         self.initUI()
 
     def initUI(self):
@@ -63,7 +42,12 @@ class TaskTab(QWidget):
         self.search_label = QLabel('Search:')
         self.search_bar = QLineEdit(self)
         self.search_bar.setPlaceholderText('Search...')
-        self.search_bar.textChanged.connect(self.search_data)
+        # Searched in the database, so only once the typing stops
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search_data)
+        self.search_bar.textChanged.connect(lambda text: self.search_timer.start())
         search_sort_layout.addWidget(self.search_label)
         search_sort_layout.addWidget(self.search_bar)
 
@@ -84,19 +68,31 @@ class TaskTab(QWidget):
         layout.addLayout(search_sort_layout)
 
         # Table for displaying tasks
-        self.table = QTableWidget(self)
-        self.table.setColumnCount(12)
-        self.table.setHorizontalHeaderLabels([
-            'ID', 'Name', 'Task Type', 'Date Added', 'Date Finished', 'Price', 'Done By', 'Status',
-            'Invoice Sent', 'Invoice Paid', 'Office', 'Files'
-        ])
+        self.model = WindowedTableModel(
+            [
+                'ID', 'Name', 'Task Type', 'Date Added', 'Date Finished', 'Price', 'Done By', 'Status',
+                'Invoice Sent', 'Invoice Paid', 'Office', 'Files'
+            ],
+            self.row_source(),
+            parent=self,
+            status_column=7,
+            status_colors=TASK_COLORS,
+            checkable_columns=CHECK_FIELDS,
+            editable_columns=(1, 2, 5),  # Task Name, Task Type, Price
+            formatters={5: lambda price: f'{float(price):.2f}' if price else ''}
+        )
+        self.model.check_changed.connect(self.handle_check_change)
+        self.model.cell_edited.connect(self.handle_text_field_save)
+        self.model.window_loaded.connect(self.show_window)
+        self.model.load_failed.connect(self.load_failed)
+        self.table = QTableView(self)
+        self.table.setModel(self.model)
+        self.table.setEditTriggers(QTableView.DoubleClicked)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.table.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        self.table.cellDoubleClicked.connect(self.edit_cell)
+        self.table.doubleClicked.connect(self.edit_cell)
         layout.addWidget(self.table)
 
-        self.load_data()  # Load initial data into the table
-
         # Form Layout for entering new data
         form_layout = QGridLayout()
         form_layout.addWidget(QLabel('Task Name:'), 0, 0)
@@ -153,6 +149,10 @@ class TaskTab(QWidget):
         self.upload_button.clicked.connect(self.upload_files)
         button_layout.addWidget(self.upload_button)
 
+        self.upload_status_label = UploadStatusLabel(self)  # Progress of the background uploads
+        button_layout.addWidget(self.upload_status_label)
+        upload_service().finished.connect(self.upload_finished)
+
         # Save Button
         self.save_button = QPushButton('Save', self)
         self.save_button.clicked.connect(self.save_task)
@@ -167,138 +167,86 @@ class TaskTab(QWidget):
         # Set the layout for the widget
         self.setLayout(layout)
 
-    def load_data(self):
-        """Load existing tasks into the table."""
-        start_time = time.time()  # Record the start time
-        print("Task 1:", datetime.now().strftime("%H:%M:%S"))
-        
-        self.table.setRowCount(0)  # Clear table before loading new data
-        self.tasks = []  # Reset tasks list
-
-        with get_session() as session:
-            # Query tasks from the database and sort by status
-            tasks = session.query(Task).filter(Task.status != 'paid').all()
-
-            # Sort tasks by status priority
-            status_priority = {
-                'not_started': 1,
-                'in_process': 2,
-                'details_missing': 3,
-                'done': 4,
-            }
-            tasks_sorted = sorted(tasks, key=lambda t: status_priority.get(t.status, 5))
-
-            self.table.setRowCount(len(tasks_sorted))  # Set the row count
-            for row, task in enumerate(tasks_sorted):
-                self.add_task_to_table(row, task)
-                # After adding the task, set the row color based on task status
-                self.set_row_color(row, task.status)
-        print("Task 2:", datetime.now().strftime("%H:%M:%S"))
-        end_time = time.time()  # Record the end time
-        print("Total Task: {:.2f} seconds".format(end_time - start_time))
-
-    def add_task_to_table(self, row, task):
-        """Helper function to add a task to a specific row in the table."""
-        # ID column (make this column read-only)
-        if task.id:
-            item_id = QTableWidgetItem(str(task.id))
-            item_id.setFlags(item_id.flags() & ~Qt.ItemIsEditable)  # Make ID column uneditable
-            self.table.setItem(row, 0, item_id)
-        else:
-            logging.error(f"Task {row} does not have a valid ID.")
-
-        # Editable columns (Task Name, Task Type)
-        self.table.setItem(row, 1, QTableWidgetItem(task.task_name))
-        self.table.setItem(row, 2, QTableWidgetItem(task.task_type))
-
-        # Date Added and Date Finished columns
-        date_added_str = task.date_added.strftime('%Y-%m-%d') if task.date_added else ''
-        self.table.setItem(row, 3, QTableWidgetItem(date_added_str))
-
-        date_finished_str = task.date_finished.strftime('%Y-%m-%d') if task.date_finished else ''
-        self.table.setItem(row, 4, QTableWidgetItem(date_finished_str))
-
-        # Price column
-        self.table.setItem(row, 5, QTableWidgetItem(f'{task.price:.2f}' if task.price else ''))
-
-        # Done By column (enum dropdown handled in edit_cell)
-        self.table.setItem(row, 6, QTableWidgetItem(task.done_by))
-
-        # Status column (enum dropdown handled in edit_cell)
-        self.table.setItem(row, 7, QTableWidgetItem(task.status))
-
-        # Invoice Sent and Invoice Paid columns
-        invoice_sent_item = QCheckBox()
-        invoice_sent_item.setChecked(task.invoice_sent)
-        invoice_sent_item.stateChanged.connect(lambda state, task_id=task.id: self.handle_check_change(task_id, row, 'invoice_sent', state))
-        self.table.setCellWidget(row, 8, invoice_sent_item)
-
-        invoice_paid_item = QCheckBox()
-        invoice_paid_item.setChecked(task.invoice_paid)
-        invoice_paid_item.stateChanged.connect(lambda state, task_id=task.id: self.handle_check_change(task_id, row, 'invoice_paid', state))
-        self.table.setCellWidget(row, 9, invoice_paid_item)
-        
-        # Office column
-        self.table.setItem(row, 10, QTableWidgetItem(task.office))
-
-        # Files count column (Make read-only)
-        item_count = QTableWidgetItem(str(task.files_count))
-        item_count.setFlags(item_count.flags() & ~Qt.ItemIsEditable)  # Make last column uneditable
-        self.table.setItem(row, 11, item_count)
-
-    def set_row_color(self, row, status):
-        """Set the background color of a row based on task status and update checkbox color accordingly."""
-        # Define color map for statuses
-        color_map = {
-            'not_started': QColor(251, 55, 107, 127),  # Red
-            'in_process': QColor(247, 131, 34, 127),   # Orange
-            'details_missing': QColor(241, 240, 133, 127),  # Yellow
-            'done': QColor(87, 242, 141, 127),         # Green
-            'paid': QColor(192, 192, 192, 127),        # Gray
-        }
+        self.lazy_loader = LazyLoader(self, self.load_data, layout)  # Loads when first shown
 
-        # Get the color for the current status, default to white if not found
-        color = color_map.get(status, QColor(255, 255, 255, 127))
+    def load_data(self):
+        """Load the tasks a page at a time; only the count and the first page are read up front."""
+        with operation('Tasks load'):
+            db_worker().submit((id(self), 'rows'), self.tracker.current_mark, self.reload_window, self.load_failed)
+
+    def reload_window(self, mark):
+        """Remember the change tracking mark and count the tasks again; pages are read as they are scrolled to."""
+        self.tracker.set_mark(mark)
+        self.model.reload()
+
+    def show_window(self, total):
+        """The window of the table is counted and its first page is shown."""
+        # The row color follows the task status (see TASK_COLORS)
+        self.lazy_loader.finish()
+
+    def load_failed(self, error):
+        self.lazy_loader.finish()
+        QMessageBox.critical(self, 'Error', f'Failed to load tasks: {str(error)}')
+
+    def task_row(self, task):
+        """Return the table values of a projected task row (see list_queries.task_rows)."""
+        return (
+            task.id, task.task_name, task.task_type, task.date_added, task.date_finished,
+            task.price, task.done_by, task.status, task.invoice_sent, task.invoice_paid,
+            task.office, task.files_count
+        )
+
+    def select_rows(self):
+        """Return the select() the table rows are loaded with, only the columns shown."""
+        return task_rows().where(Task.status != 'paid')
+
+    def row_source(self):
+        """Return the pages of the table, by status priority, date added and id (read from its index)."""
+        return KeysetSource(
+            self.select_rows(),
+            TASK_ORDER,
+            self.task_row,
+            search_columns=[Task.task_name, Task.task_type, Task.done_by, Task.status, Task.office]
+        )
 
-        # Set background color for the entire row
-        self.set_row_background_color(row, color)
+    def refresh(self):
+        """Update the file counts and reload the table only when tasks changed since the last load.
 
-        # Additionally set the background color for the checkboxes in the row
-        self.set_checkbox_background(row, color)
+        Tasks marked as paid drop out of the query and are removed from the table.
+        """
+        with operation('Tasks refresh'):
+            db_worker().submit_write(self.recount, self.read_mark, self.load_failed, idempotent=True)
 
-    def set_row_background_color(self, row, color):
-        """Set the background color of a specific row."""
-        for column in range(self.table.columnCount()):
-            item = self.table.item(row, column)
-            if item:
-                item.setBackground(color)
+    def read_mark(self, result=None):
+        """Read the change tracking mark once the file counts are stored."""
+        db_worker().submit((id(self), 'rows'), self.tracker.current_mark, self.reload_if_changed, self.load_failed)
 
-    def set_checkbox_background(self, row, color):
-        """Update checkbox background color based on the status color."""
-        for col in [8, 9]:  # Columns for 'Invoice Sent' and 'Invoice Paid' checkboxes
-            checkbox = self.table.cellWidget(row, col)
-            if checkbox and isinstance(checkbox, QCheckBox):
-                checkbox.setStyleSheet(f"background-color: rgba({color.red()}, {color.green()}, {color.blue()}, {color.alpha() / 255.0});")
+    def reload_if_changed(self, mark):
+        if mark != self.tracker.mark or self.tracker.loaded_on != date.today():
+            self.reload_window(mark)
 
-    def refresh(self):
-        """Refresh the table data."""
+    def upload_finished(self, job_id, file_name, link):
+        """Count the file once a background upload has added it."""
         self.update_files_count()
-        self.load_data()
 
-    def update_files_count(self):
-        """Update the files count for each task."""
-        try:
-            with get_session() as session:
-                tasks = session.query(Task).all()
-                for task in tasks:
-                    file_count = session.query(Files).filter(and_(Files.company_name == task.task_name, Files.second_id == 'Task')).count()
-                    task.files_count = file_count
-                session.commit()
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(e)}')
-
-    def edit_cell(self, row, column):
-        """Handle cell editing for specific columns like enums, dates, and text fields."""
+    def update_files_count(self, on_done=None):
+        """Update the files count for each task on the database worker."""
+        with operation('Tasks files count'):
+            db_worker().submit_write(self.recount, on_done, self.recount_failed,
+                                     idempotent=True)  # Counting twice stores the same counts
+
+    def recount(self, session):
+        recount_files(session, 'Task')  # One GROUP BY query for all rows
+
+    def recount_failed(self, error):
+        QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(error)}')
+
+    def edit_cell(self, index):
+        """Handle cell editing for specific columns like enums and dates.
+
+        Text fields (Task Name, Task Type, Price) are edited in place by the view.
+        """
+        row, column = index.row(), index.column()
         logging.info(f"Editing cell at row {row}, column {column}")
         if column == 0 or column == 11:
             logging.info(f"Column {column} is not editable.")
@@ -316,96 +264,66 @@ class TaskTab(QWidget):
             elif column == 10:
                 combo_box.addItems(['london', 'leeds'])
 
-            current_text = self.table.item(row, column).text()
+            current_text = self.model.display_text(row, column)
             combo_box.setCurrentText(current_text)
             logging.info(f"Current value in combo box: {current_text}")
 
-            self.table.setCellWidget(row, column, combo_box)
-            combo_box.activated.connect(lambda: self.save_combo_value(row, column, combo_box))
+            self.table.setIndexWidget(index, combo_box)
+            combo_box.activated.connect(lambda: self.save_combo_value(index, combo_box))
 
         # Date picker for 'Date Added' and 'Date Finished' columns
         elif column in [3, 4]:  # 'Date Added', 'Date Finished'
             logging.info(f"Initiating date picker for column {column}")
             date_edit = QDateEdit(self.table)
             date_edit.setCalendarPopup(True)
-            current_text = self.table.item(row, column).text()
-
-            if current_text:
-                logging.info(f"Setting date from text: {current_text}")
-                current_date = QDate.fromString(current_text, 'yyyy-MM-dd')
-                if current_date.isValid():
-                    date_edit.setDate(current_date)
-                else:
-                    date_edit.setDate(QDate.currentDate())
-            elif column in [1, 2, 5]:
-                logging.info(f"Setting default current date")
-                date_edit.setDate(QDate.currentDate())
+            current_date = self.model.value(row, column)
 
-            self.table.setCellWidget(row, column, date_edit)
-            date_edit.dateChanged.connect(lambda: self.save_date_value(row, column, date_edit))
+            if current_date:
+                logging.info(f"Setting date from value: {current_date}")
+                date_edit.setDate(QDate(current_date.year, current_date.month, current_date.day))
+            else:
+                date_edit.setDate(QDate.currentDate())
 
-        # Text fields for 'Task Name', 'Task Type', etc.
-        else:
-            logging.info(f"Initiating text editing for column {column}")
-            item = self.table.item(row, column)
-            if item is not None:
-                item.setFlags(item.flags() | Qt.ItemIsEditable)
-                self.table.editItem(item)
+            self.table.setIndexWidget(index, date_edit)
+            date_edit.dateChanged.connect(lambda: self.save_date_value(index, date_edit))
 
-                # Temporarily block signals to avoid recursion
-                self.table.blockSignals(True)
+    def handle_text_field_save(self, row, column, old_value, new_value):
+        """Save an edited text field to the database."""
+        logging.info(f"Attempting to save text field at row {row}, column {column}")
+        logging.info(f"New value entered: {new_value}")
 
-                # Connect the signal to handle when editing is finished
-                self.table.itemChanged.connect(lambda changed_item: self.handle_text_field_save(row, column, changed_item))
+        # Confirm the update with the user
+        confirmation = QMessageBox.question(self, "Confirm Update",
+                                            "Do you want to save the text field changes to the database?",
+                                            QMessageBox.Yes | QMessageBox.No)
 
-                # Re-enable signals after connecting
-                self.table.blockSignals(False)
+        if confirmation == QMessageBox.Yes:
+            try:
+                if column == 5:  # Price is stored as a number
+                    self.model.set_value(row, column, float(new_value) if new_value else None)
+                logging.info("Saving changes to the database...")
+                # Validate and save the changes to the database
+                self.validate_before_save(row)
+                self.upload_changes(row)
+                logging.info("Text field changes saved successfully.")
+                self.show_confirmation_message()
 
-    def handle_text_field_save(self, row, column, item):
-        """Save the text field value back to the table and update the database."""
-        logging.info(f"Attempting to save text field at row {row}, column {column}")
+            except Exception as e:
+                logging.error(f"Error saving text value: {str(e)}")
+                QMessageBox.critical(self, 'Error', f"Failed to save changes: {str(e)}")
+                self.model.set_value(row, column, old_value)
+        else:
+            logging.info("User canceled the text field changes.")
+            # Reset the text field if not confirmed
+            self.model.set_value(row, column, old_value)
 
-        if item is None:
-            logging.error(f"Item at row {row}, column {column} is None. Aborting save.")
-            return  # Prevent further execution if item is None
-
-        if item.row() == row and item.column() == column:
-            new_value = item.text()
-            logging.info(f"New value entered: {new_value}")
-
-            # Confirm the update with the user
-            confirmation = QMessageBox.question(self, "Confirm Update",
-                                                "Do you want to save the text field changes to the database?",
-                                                QMessageBox.Yes | QMessageBox.No)
-
-            if confirmation == QMessageBox.Yes:
-                try:
-                    logging.info("Saving changes to the database...")
-                    # Validate and save the changes to the database
-                    self.validate_before_save(row)
-                    self.upload_changes(row)
-                    logging.info("Text field changes saved successfully.")
-                    self.show_confirmation_message()
-
-                    # Temporarily disconnect signal to prevent multiple triggers
-                    self.table.blockSignals(True)
-                    self.table.itemChanged.disconnect()  # Disconnect to avoid duplicate signals
-                    self.table.blockSignals(False)
-
-                except Exception as e:
-                    logging.error(f"Error saving text value: {str(e)}")
-                    QMessageBox.critical(self, 'Error', f"Failed to save changes: {str(e)}")
-            else:
-                logging.info("User canceled the text field changes.")
-                # Reset the text field if not confirmed
-                self.load_data()  # Reload the data to reset changes
-    
     def show_confirmation_message(self):
         """Display a confirmation message after text editing is completed."""
         QMessageBox.information(self, 'Success', 'Changes saved successfully.')
 
-    def save_combo_value(self, row, column, combo_box):
+    def save_combo_value(self, index, combo_box):
         """Save the selected combo box value back to the table and update the database."""
+        row, column = index.row(), index.column()
         selected_value = combo_box.currentText()
         logging.info(f"Combo box selected value for row {row}, column {column}: {selected_value}")
 
@@ -416,15 +334,12 @@ class TaskTab(QWidget):
         if confirmation == QMessageBox.Yes:
             try:
                 logging.info(f"Saving combo box value {selected_value} to the database")
-                self.table.setItem(row, column, QTableWidgetItem(selected_value))
-                self.table.setCellWidget(row, column, None)  # Remove the combo box after saving
+                # Setting the status column also updates the row color
+                self.model.set_value(row, column, selected_value)
+                self.table.setIndexWidget(index, None)  # Remove the combo box after saving
                 self.validate_before_save(row)
                 self.upload_changes(row)
 
-                # After saving, update the row color based on the status
-                task_status = self.table.item(row, 7).text()  # Column 7 is the status
-                self.set_row_color(row, task_status)
-            
                 logging.info(f"Combo box value saved and row color updated.")
             except Exception as e:
                 logging.error(f"Error saving combo box value: {str(e)}")
@@ -432,9 +347,10 @@ class TaskTab(QWidget):
         else:
             logging.info("User canceled combo box changes.")
 
-    def save_date_value(self, row, column, date_edit):
+    def save_date_value(self, index, date_edit):
         """Save the selected date value back to the table and update the database."""
-        selected_date = date_edit.date().toString('yyyy-MM-dd')
+        row, column = index.row(), index.column()
+        selected_date = date_edit.date().toPyDate()
         logging.info(f"Date selected for row {row}, column {column}: {selected_date}")
 
         confirmation = QMessageBox.question(self, "Confirm Update",
@@ -445,17 +361,13 @@ class TaskTab(QWidget):
             try:
                 # Update the date in the table
                 logging.info(f"Saving date value {selected_date} for task in row {row} to the database")
-                self.table.setItem(row, column, QTableWidgetItem(selected_date))
-                self.table.setCellWidget(row, column, None)  # Remove the date edit after saving
+                self.model.set_value(row, column, selected_date)
+                self.table.setIndexWidget(index, None)  # Remove the date edit after saving
 
                 # Validate and commit the changes
                 self.validate_before_save(row)
                 self.upload_changes(row)
-
-                # After saving, update the row color based on the status
-                task_status = self.table.item(row, 7).text()  # Column 7 is the status
-                self.set_row_color(row, task_status)
-                logging.info(f"Date value saved and row color updated based on status '{task_status}'.")
+                logging.info(f"Date value saved for row {row}.")
             
             except Exception as e:
                 logging.error(f"Error saving date value for row {row}: {str(e)}")
@@ -469,16 +381,15 @@ class TaskTab(QWidget):
         date_finished_column = 4
 
         # Get the current status and date finished values
-        status = self.table.item(row, status_column).text()
-        date_finished = self.table.item(row, date_finished_column).text()
+        status = self.model.value(row, status_column)
+        date_finished = self.model.value(row, date_finished_column)
 
         logging.info(f"Validating row {row}: status={status}, date_finished={date_finished}")
 
         # Check if the task is 'done' or 'paid' and date_finished is not set
         if (status == 'done' or status == 'paid') and not date_finished:
             # Set today's date if the date finished is empty
-            today_date = QDate.currentDate().toString('yyyy-MM-dd')
-            self.table.setItem(row, date_finished_column, QTableWidgetItem(today_date))
+            self.model.set_value(row, date_finished_column, date.today())
             
             logging.info(f"Date Finished set to today's date for row {row} as status changed to {status}")
 
@@ -487,135 +398,131 @@ class TaskTab(QWidget):
 
     def upload_changes(self, row):
         """Upload the changes from the given row into the database for the corresponding task."""
-        try:
-            task_id_item = self.table.item(row, 0)
-            if task_id_item is None or not task_id_item.text().isdigit():
-                raise ValueError(f"Invalid task ID in row {row}. Task ID is either missing or non-numeric.")
-            
-            task_id = int(task_id_item.text())
-            logging.info(f"Task ID for row {row}: {task_id}")
-
-            # Retrieve the updated values from the table
-            task_name = self.table.item(row, 1).text()
-            task_type = self.table.item(row, 2).text()
-            logging.info(f"Task details for row {row}: name={task_name}, type={task_type}")
-
-            # Ensure valid dates are handled before saving
-            date_added_text = self.table.item(row, 3).text()
-            date_added = QDate.fromString(date_added_text, 'yyyy-MM-dd').toPyDate() if date_added_text else None
-
-            date_finished_text = self.table.item(row, 4).text()
-            date_finished = QDate.fromString(date_finished_text, 'yyyy-MM-dd').toPyDate() if date_finished_text else None
-
-            logging.info(f"Dates for row {row}: added={date_added}, finished={date_finished}")
-
-            price_text = self.table.item(row, 5).text()
-            price = float(price_text) if price_text else None
-
-            done_by = self.table.item(row, 6).text()
-            status = self.table.item(row, 7).text()
-
-            invoice_sent = self.table.cellWidget(row, 8).isChecked()
-            invoice_paid = self.table.cellWidget(row, 9).isChecked()
-
-            office = self.table.item(row, 10).text()
-
-            # Update the task within the same session
-            with get_session() as session:
-                task = session.query(Task).get(task_id)
-                if not task:
-                    raise ValueError(f"Task with ID {task_id} not found.")
-
-                logging.info(f"Updating task ID {task_id} in the database")
+        task_id = self.model.row_id(row)
+        if task_id is None:
+            raise ValueError(f"Invalid task ID in row {row}. Task ID is missing.")
+        logging.info(f"Task ID for row {row}: {task_id}")
+
+        # Retrieve the updated values from the table
+        (_, task_name, task_type, date_added, date_finished, price, done_by, status,
+         invoice_sent, invoice_paid, office, _) = self.model.row_values(row)
+        logging.info(f"Task details for row {row}: name={task_name}, type={task_type}")
+        logging.info(f"Dates for row {row}: added={date_added}, finished={date_finished}")
+        values = {
+            'task_name': task_name, 'task_type': task_type, 'date_added': date_added,
+            'date_finished': date_finished, 'price': price, 'done_by': done_by, 'status': status,
+            'invoice_sent': invoice_sent, 'invoice_paid': invoice_paid, 'office': office
+        }
 
-                # Update task fields
-                task.task_name = task_name
-                task.task_type = task_type
-                task.date_added = date_added
-                task.date_finished = date_finished
-                task.price = price
-                task.done_by = done_by
-                task.status = status
-                task.invoice_sent = invoice_sent
-                task.invoice_paid = invoice_paid
-                task.office = office
+        with operation('Task save'):
+            db_worker().submit_write(
+                lambda session: self.store_task(session, task_id, values),
+                lambda result: QMessageBox.information(self, 'Success', 'Task updated successfully.'),
+                self.update_failed,
+                idempotent=True  # Every field is set, so storing them twice leaves the same row
+            )
+
+    def store_task(self, session, task_id, values):
+        """Worker thread: store the fields of a task."""
+        task = session.get(Task, task_id)
+        if not task:
+            raise ValueError(f"Task with ID {task_id} not found.")
+
+        logging.info(f"Updating task ID {task_id} in the database")
+        for key, value in values.items():
+            setattr(task, key, value)
+
+    def update_failed(self, error):
+        logging.error(f"Failed to update task: {str(error)}")
+        QMessageBox.critical(self, 'Error', f"Failed to update task: {str(error)}")
+
+    def handle_check_change(self, row, column, checked):
+        """
+        This method is triggered when a checkbox is changed. It stores the change
+        on the database worker and then performs logic based on the state of the
+        checkbox fields.
 
-                session.commit()  # Commit the changes to the database
+        Args:
+            row (int): The row of the task in the table.
+            column (int): The checkbox column (8 for 'invoice_sent', 9 for 'invoice_paid').
+            checked (bool): The new state of the checkbox.
+        """
+        task_id = self.model.row_id(row)
+        field = CHECK_FIELDS[column]
+        with operation('Task save'):
+            db_worker().submit_write(
+                lambda session: self.store_check(session, task_id, field, checked),
+                lambda checks: self.check_saved(task_id, checks),
+                lambda error: self.check_failed(task_id, column, not checked, error),
+                idempotent=True  # Setting a flag twice leaves it the same
+            )
+
+    def store_check(self, session, task_id, field, checked):
+        """Worker thread: store one check and return (invoice_sent, invoice_paid), or None when the task is gone."""
+        task = session.get(Task, task_id)
+        if not task:
+            logging.error(f"Task with ID {task_id} not found.")
+            return None
 
-                logging.info(f"Task ID {task_id} successfully updated in the database")
+        # Update the task's field based on the checkbox state
+        setattr(task, field, checked)
+        return task.invoice_sent, task.invoice_paid
 
-            # Removed `session.refresh(task)` since it's no longer bound after committing.
+    def check_saved(self, task_id, checks):
+        """Offer to mark the task as paid once both invoice checks are marked."""
+        # Check if both invoice_sent and invoice_paid are True
+        if checks is None or not all(checks):
+            return
+        # Prompt the user for confirmation to set status as "paid"
+        confirmation = QMessageBox.question(self, "Confirm Payment",
+                                            "Both 'Invoice Sent' and 'Invoice Paid' are checked. "
+                                            "Do you want to mark this task as 'Paid'?",
+                                            QMessageBox.Yes | QMessageBox.No)
 
-            QMessageBox.information(self, 'Success', 'Task updated successfully.')
+        if confirmation == QMessageBox.Yes:
+            db_worker().submit_write(
+                lambda session: self.mark_paid(session, task_id, QDate.currentDate().toPyDate()),
+                lambda date_finished: self.show_paid(task_id, date_finished),
+                self.update_failed,
+                idempotent=True
+            )
+        else:
+            # If the user selects "No", revert the 'invoice_paid' checkbox to unchecked
+            db_worker().submit_write(
+                lambda session: self.store_check(session, task_id, 'invoice_paid', False),
+                lambda result: self.show_value(task_id, 9, False),  # 9 is the column for 'Invoice Paid'
+                self.update_failed,
+                idempotent=True
+            )
+
+    def mark_paid(self, session, task_id, today):
+        """Worker thread: mark a task as 'Paid' and return its finished date, set to today if it was not set."""
+        task = session.get(Task, task_id)
+        if not task:
+            return None
+        task.status = 'paid'
+        if not task.date_finished:
+            task.date_finished = today
+        logging.info(f"Task {task_id} has been marked as paid and updated in the database.")
+        return task.date_finished
+
+    def show_paid(self, task_id, date_finished):
+        """Update the status and finished date of a task marked as paid in the table."""
+        if date_finished is None:
+            return
+        self.show_value(task_id, 4, date_finished)  # Date Finished column
+        self.show_value(task_id, 7, 'paid')  # Status column, also updates the row color
 
-        except Exception as e:
-            logging.error(f"Failed to update task: {str(e)}")
-            QMessageBox.critical(self, 'Error', f"Failed to update task: {str(e)}")
+    def show_value(self, task_id, column, value):
+        row = self.model.find_row(task_id)
+        if row is not None:
+            self.model.set_value(row, column, value)
 
-    def handle_check_change(self, task_id, row, field, state):
-        """
-        This method is triggered when a checkbox is changed. It handles updating the database
-        and performing logic based on state changes in the checkbox fields.
-        
-        Args:
-            task_id (int): The ID of the task being updated.
-            row (int): The row of the task in the table.
-            field (str): The field being updated (either 'invoice_sent' or 'invoice_paid').
-            state (int): The new state of the checkbox (Qt.Checked or Qt.Unchecked).
-        """
-        try:
-            # Update the task within the same session
-            with get_session() as session:
-                task = session.query(Task).get(task_id)
-
-                if not task:
-                    logging.error(f"Task with ID {task_id} not found.")
-                    return
-
-                # Update the task's field based on the checkbox state
-                if field == 'invoice_sent':
-                    task.invoice_sent = (state == Qt.Checked)
-                elif field == 'invoice_paid':
-                    task.invoice_paid = (state == Qt.Checked)
-
-                # Update the task in the database
-                session.commit()
-
-                # Check if both invoice_sent and invoice_paid are True
-                if task.invoice_sent and task.invoice_paid:
-                    # Prompt the user for confirmation to set status as "paid"
-                    confirmation = QMessageBox.question(self, "Confirm Payment",
-                                                        "Both 'Invoice Sent' and 'Invoice Paid' are checked. "
-                                                        "Do you want to mark this task as 'Paid'?",
-                                                        QMessageBox.Yes | QMessageBox.No)
-
-                    if confirmation == QMessageBox.Yes:
-                        # Mark the task as 'Paid'
-                        task.status = 'paid'
-
-                        # Set the finished date to today if it's not already set
-                        if not task.date_finished:
-                            task.date_finished = QDate.currentDate().toPyDate()
-
-                        # Update the status and finished date in the table
-                        self.table.setItem(row, 7, QTableWidgetItem(task.status))  # Status column
-                        self.table.setItem(row, 4, QTableWidgetItem(task.date_finished.strftime('%Y-%m-%d')))  # Date Finished column
-
-                        # Commit the updated task
-                        session.commit()
-
-                        # Update row color after the task is paid
-                        self.set_row_color(row, task.status)
-
-                        logging.info(f"Task {task_id} has been marked as paid and updated in the database.")
-                    else:
-                        # If the user selects "No", revert the 'invoice_paid' checkbox to unchecked
-                        invoice_paid_item = self.table.cellWidget(row, 9)  # 9 is the column for 'Invoice Paid'
-                        invoice_paid_item.setChecked(False)
-
-        except Exception as e:
-            logging.error(f"Error updating task {task_id}: {str(e)}")
-            QMessageBox.critical(self, 'Error', f"Failed to update task: {str(e)}")
+    def check_failed(self, task_id, column, previous, error):
+        """Put the checkbox back when the check could not be stored."""
+        logging.error(f"Error updating task {task_id}: {str(error)}")
+        self.show_value(task_id, column, previous)
+        QMessageBox.critical(self, 'Error', f"Failed to update task: {str(error)}")
 
     def save_task(self):
         """Save a new task to the database."""
@@ -651,20 +558,17 @@ class TaskTab(QWidget):
             'files_count': 0
         }
 
-        try:
-            with get_session() as session:
-                new_task = Task(**data)
-                session.add(new_task)
-                session.commit()
-                session.refresh(new_task)
-
-                self.tasks.append(new_task)
-                self.load_data()  # Reload data to reflect the new task
-                QMessageBox.information(self, 'Task Saved', 'Task successfully saved.')
-                self.clear_inputs()
-        except Exception as e:
-            logging.error(f"Error saving task: {e}")
-            QMessageBox.critical(self, 'Error', f'An error occurred while saving the task: {str(e)}')
+        with operation('Task save'):
+            db_worker().submit_write(lambda session: session.add(Task(**data)), self.task_saved, self.save_failed)
+
+    def task_saved(self, result):
+        self.load_data()  # Reload data to reflect the new task
+        QMessageBox.information(self, 'Task Saved', 'Task successfully saved.')
+        self.clear_inputs()
+
+    def save_failed(self, error):
+        logging.error(f"Error saving task: {error}")
+        QMessageBox.critical(self, 'Error', f'An error occurred while saving the task: {str(error)}')
 
     def clear_inputs(self):
         """Clear the input fields after saving a task."""
@@ -698,30 +602,16 @@ class TaskTab(QWidget):
             column_index, ascending = 5, False
 
         if sort_option != 'Default':
-            self.table.sortItems(column_index, order=Qt.AscendingOrder if ascending else Qt.DescendingOrder)
+            self.model.sort(column_index, Qt.AscendingOrder if ascending else Qt.DescendingOrder)
         else:
-            # If "Default" is selected, load data with status-based sorting
-            self.load_data()
+            # If "Default" is selected, go back to the status-based order
+            self.model.sort(-1)
             
     def search_data(self):
-        """Search data in the table based on user input."""
+        """Search the tasks in the database and highlight the matches."""
         search_text = self.search_bar.text().lower()
-        for row in range(self.table.rowCount()):
-            match = False
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    original_color = item.data(Qt.UserRole)
-                    if not original_color:
-                        original_color = item.background()
-                        item.setData(Qt.UserRole, original_color)
-
-                    if search_text and search_text in item.text().lower():
-                        item.setBackground(QColor(255, 255, 0, 127))
-                        match = True
-                    else:
-                        item.setBackground(original_color)
-            self.table.setRowHidden(row, not match if search_text else False)
+        self.model.set_highlight(search_text)
+        self.model.set_search(search_text)
 
     def view_paid(self):
         """Open the PaidTasksTab as a new tab in the main tab widget."""
@@ -740,25 +630,20 @@ class TaskTab(QWidget):
 
     def get_task_id_from_row(self, row):
         """Retrieve the task ID from the selected row."""
-        # Assuming the task ID is in the first column (column 0)
-        task_id_item = self.table.item(row, 0)
-        
-        if task_id_item and task_id_item.text().isdigit():
-            return int(task_id_item.text())  # Convert task ID to integer and return it
-        else:
-            return None  # Return None if the ID is invalid or not found
+        if row < 0 or row >= self.model.rowCount():
+            return None  # Return None if the row is invalid
+        return self.model.row_id(row)
 
     def upload_files(self):
-        """Upload a file for the selected task and save the file details to Google Drive."""
-        selected_row = self.table.currentRow()
+        """Queue a file of the selected task for upload to Google Drive."""
+        selected_row = self.table.currentIndex().row()
 
         if selected_row == -1:
             QMessageBox.warning(self, "No Task Selected", "Please select a task to upload a file.")
             return
 
         task_id = self.get_task_id_from_row(selected_row)
-        task_name_item = self.table.item(selected_row, 1)  # Task name is in column 1
-        task_name = task_name_item.text() if task_name_item else None
+        task_name = self.model.value(selected_row, 1)  # Task name is in column 1
 
         if not task_id or not task_name:
             QMessageBox.warning(self, "Invalid Task", "Selected task is invalid.")
@@ -776,66 +661,19 @@ class TaskTab(QWidget):
 
             file_name = os.path.basename(file_path)
 
-            try:
-                service = self.authenticate_google_drive()
-                google_drive_file_id = self.upload_file_to_google_drive(service, file_name, file_path)
-
-                if google_drive_file_id:
-                    google_drive_link = f"https://drive.google.com/file/d/{google_drive_file_id}/view"
-                    
-                    # Create a new Files object without a company_id
-                    with get_session() as session:
-                        new_file = Files(
-                            second_id='Task',
-                            path=google_drive_link,
-                            name=file_name,
-                            company_name=task_name,
-                            company_id=None  # Set to None for task-related files
-                        )
-                        session.add(new_file)
-                        session.commit()
-                        self.update_files_count()
-                    QMessageBox.information(self, "File Uploaded", f"File '{file_name}' uploaded successfully for task '{task_name}'.")
-
-            except Exception as e:
-                logging.error(f"Failed to upload file to Google Drive for task {task_id}: {str(e)}")
-                QMessageBox.critical(self, "Error", f"An error occurred while uploading the file: {str(e)}")
-
-    @staticmethod
-    def authenticate_google_drive():
-        """Authenticate and return the Google Drive service using a service account."""
-        creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-        service = build('drive', 'v3', credentials=creds)
-        return service
-
-    def upload_file_to_google_drive(self, service, file_name, file_path):
-        """Upload a file to Google Drive and return the file ID."""
-        try:
-            folder_id = '15OclGTq9SFDYl9pBA69Gs5-jy2dUwxrZ'
-
-            file_metadata = {
-                'name': file_name,
-                'parents': [folder_id]
-            }
+            # The upload runs in the background; the file is listed once it is on Drive
+            with operation('Task file upload'):
+                db_worker().submit_write(
+                    lambda session: upload_service().enqueue(session, file_path, file_name, 'Task', task_name),
+                    lambda job_id: QMessageBox.information(
+                        self, "File Queued", f"File '{file_name}' is being uploaded for task '{task_name}'."),
+                    lambda error: self.upload_failed(task_id, error)
+                )
 
-            media = MediaFileUpload(file_path, mimetype='application/octet-stream')
-            file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    def upload_failed(self, task_id, error):
+        logging.error(f"Failed to queue the upload for task {task_id}: {str(error)}")
+        QMessageBox.critical(self, "Error", f"An error occurred while uploading the file: {str(error)}")
 
-            file_id = file.get('id')
-            logging.info(f"File '{file_name}' uploaded successfully. File ID: {file_id}")
-
-            # Set file permissions to allow anyone with the link to view
-            permission = {
-                'type': 'anyone',
-                'role': 'reader'
-            }
-            service.permissions().create(fileId=file_id, body=permission).execute()
-
-            return file_id
-
-        except Exception as e:
-            logging.error(f"An error occurred while uploading the file to Google Drive: {e}")
-            return None
 
 if __name__ == '__main__':
     logging.info("Starting Task Management Application")
@@ -1,22 +1,31 @@
+import logging
 import sys
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
-    QLabel, QLineEdit, QComboBox, QCheckBox, QMessageBox, QPushButton, QApplication, QHeaderView
+    QWidget, QVBoxLayout, QHBoxLayout, QTableView,
+    QLabel, QLineEdit, QComboBox, QMessageBox, QPushButton, QApplication, QHeaderView
 )
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QColor
-from sqlalchemy import and_
 from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
-from backend import get_session  # Use context manager for session handling
 from models import VAT, Address, Files  # Import the necessary models
-from dateutil.relativedelta import relativedelta
+from deadline_status import LIVE_STATUS, compute_status, row_status
+from status_engine import refresh_statuses
+from roll_forward import roll_forward
+from files_count import recount_files
+from table_model import ColumnTableModel, RowFilterProxy, DEADLINE_COLORS
+from change_tracking import ChangeTracker
+from lazy_loading import LazyLoader
+from list_queries import vat_rows
+from db_worker import db_worker
+from instrumentation import operation
+from refresh_coordinator import RefreshCoordinator
 
 class VatTab(QWidget):
+    refresh_category = 'VAT'  # Slice of the dashboard refresh shown in this tab
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.user_edit_flag = False
-        self.original_text = ''
+        self.tracker = ChangeTracker(VAT)  # Remembers what the last load has seen
         self.initUI()
 
     def initUI(self):
@@ -48,21 +57,34 @@ class VatTab(QWidget):
         self.refresh_button.clicked.connect(self.refresh_tabs)
         search_sort_layout.addWidget(self.refresh_button)
 
+        self.roll_forward_button = QPushButton("Roll Forward Selected")
+        self.roll_forward_button.setMinimumHeight(40)
+        self.roll_forward_button.clicked.connect(self.roll_forward_selected)
+        search_sort_layout.addWidget(self.roll_forward_button)
+
         main_layout.addLayout(search_sort_layout)
 
         # Table setup
-        self.table = QTableWidget()
-        self.table.setColumnCount(17)
-        self.table.setHorizontalHeaderLabels([
-            'VAT Number', 'Reg. Date', 'C. Number', 'C. Name', 'C. UTR',
-            'Start Date', 'End Date', 'Due Date', 'VAT Status', 'Calculations',
-            'VAT Done', 'Number', 'Street',
-            'City', 'PostCode', 'Country', 'VAT Files'
-        ])
-        self.table.itemChanged.connect(self.handle_item_changed)
-        self.table.itemDoubleClicked.connect(self.store_original_text)
-        self.update_files_count()
-        self.load_data()
+        self.model = ColumnTableModel(
+            [
+                'VAT Number', 'Reg. Date', 'C. Number', 'C. Name', 'C. UTR',
+                'Start Date', 'End Date', 'Due Date', 'VAT Status', 'Calculations',
+                'VAT Done', 'Number', 'Street',
+                'City', 'PostCode', 'Country', 'VAT Files'
+            ],
+            status_column=8,
+            status_colors=DEADLINE_COLORS,
+            checkable_columns=(10,),
+            editable_columns=(9,)
+        )
+        self.model.cell_edited.connect(self.handle_item_changed)
+        self.model.check_changed.connect(self.handle_vat_done_change)
+        self.table = QTableView()
+        self.proxy = RowFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self.table.setModel(self.proxy)
+        self.table.setSelectionBehavior(QTableView.SelectRows)  # Several rows for the bulk roll forward
+        self.table.setEditTriggers(QTableView.DoubleClicked)
 
         header = self.table.horizontalHeader()
         header.setSectionResizeMode(QHeaderView.Stretch)
@@ -71,6 +93,22 @@ class VatTab(QWidget):
         main_layout.addWidget(self.table)
         self.setLayout(main_layout)
 
+        self.lazy_loader = LazyLoader(self, self.load_first, main_layout)  # Loads when first shown
+
+    def load_first(self):
+        """Recount the files and load the VAT records the first time the tab is shown."""
+        with operation('VAT load'):
+            db_worker().submit_write(lambda session: self.store_derived(session, recount=True),
+                                     self.read_rows, self.load_failed, idempotent=True)
+
+    def store_derived(self, session, recount=False):
+        """Worker thread: recount the files if asked, and store the statuses unless they are live."""
+        if recount:
+            self.recount(session)
+        if not LIVE_STATUS:
+            # Update all stored statuses with one UPDATE ... CASE
+            refresh_statuses(session, ['VAT'])
+
     def sort_data(self):
         """Sort data in the table based on user selection."""
         sort_option = self.sort_dropdown.currentText()
@@ -91,228 +129,220 @@ class VatTab(QWidget):
 
         if sort_option in column_map:
             column, order = column_map[sort_option]
-            with get_session() as session:
-                records = session.query(VAT).options(joinedload(VAT.address)).filter(VAT.company_id != None).order_by(column.asc() if order == 'asc' else column.desc()).all()
-                self.populate_table(records)  # Populate table within the session context
+
+            def fetch_sorted(session):
+                records = session.execute(self.select_rows().order_by(column.asc() if order == 'asc' else column.desc())).all()
+                return self.build_rows(records)
+
+            with operation('VAT sort'):
+                db_worker().submit((id(self), 'rows'), fetch_sorted, self.populate_table, self.load_failed)
         else:
             self.load_data()
 
     def load_data(self):
-        """Load VAT data from the database."""
-        with get_session() as session:
-            vat_records = session.query(VAT).options(joinedload(VAT.address)).filter(VAT.company_id != None).all()
-            # Update statuses within the session context
-            for vat in vat_records:
-                self.update_vat_status(session, vat)
-            session.commit()  # Commit all status updates in a single transaction
-            self.populate_table(vat_records)  # Populate table within the session context
-
-    def populate_table(self, records):
-        """Populate the table with VAT records."""
-        self.table.itemChanged.disconnect(self.handle_item_changed)
-
-        self.table.setRowCount(0)
-        row_count = len(records)
-        self.table.setRowCount(row_count)
-
-        for row, vat in enumerate(records):
-            self.table.setItem(row, 0, QTableWidgetItem(vat.number))
-            self.table.setItem(row, 1, QTableWidgetItem(vat.registration_date.strftime('%Y-%m-%d') if vat.registration_date else ''))
-            self.table.setItem(row, 2, QTableWidgetItem(vat.company_number))
-            self.table.setItem(row, 3, QTableWidgetItem(vat.company_name))
-            self.table.setItem(row, 4, QTableWidgetItem(str(vat.company_id)))
-            self.table.setItem(row, 5, QTableWidgetItem(vat.start_date.strftime('%Y-%m-%d') if vat.start_date else ''))
-            self.table.setItem(row, 6, QTableWidgetItem(vat.end_date.strftime('%Y-%m-%d') if vat.end_date else ''))
-            self.table.setItem(row, 7, QTableWidgetItem(vat.due_date.strftime('%Y-%m-%d') if vat.due_date else ''))
-
-            status_item = QTableWidgetItem(vat.status)
-            status_item.setFlags(Qt.ItemIsEnabled)
-            self.table.setItem(row, 8, status_item)
-
-            vat_calc_item = QTableWidgetItem(vat.calculations)
-            self.table.setItem(row, 9, vat_calc_item)
-
-            vat_done_checkbox = QCheckBox()
-            vat_done_checkbox.setChecked(vat.done)
-            vat_done_checkbox.stateChanged.connect(lambda state, vat=vat: self.handle_vat_done_change(state, vat))
-            self.table.setCellWidget(row, 10, vat_done_checkbox)
-
-            if vat.address:
-                self.table.setItem(row, 11, QTableWidgetItem(str(vat.address.number)))
-                self.table.setItem(row, 12, QTableWidgetItem(vat.address.street))
-                self.table.setItem(row, 13, QTableWidgetItem(vat.address.city))
-                self.table.setItem(row, 14, QTableWidgetItem(vat.address.postcode))
-                self.table.setItem(row, 15, QTableWidgetItem(vat.address.country))
-            self.table.setItem(row, 16, QTableWidgetItem(str(vat.files_count)))
-
-            self.set_row_color(row, vat.status)
-            self.update_checkbox_background(row, vat.status)
-
-        self.table.itemChanged.connect(self.handle_item_changed)
-
-    def handle_vat_done_change(self, state, vat):
-        """Handle VAT done checkbox state change."""
-        if state == Qt.Checked:
-            reply = QMessageBox.question(
-                self, 
-                'Confirmation', 
-                'Are you sure you want to mark this VAT as done? This will update the dates accordingly.',
-                QMessageBox.Yes | QMessageBox.No, 
-                QMessageBox.No
-            )
-            if reply == QMessageBox.Yes:
-                with get_session() as session:
-                    vat = session.merge(vat)  # Ensure the VAT instance is attached to the session
-                    vat.done = True
-                    self.update_vat_dates(session, vat)  # Update dates in a session context
-                    vat.done = False  # Reset the 'done' status after updating the dates
-                    session.add(vat)  # Ensure changes are tracked by the session
-                    session.commit()  # Commit changes to the database
-                self.load_data()  # Refresh the table to show the updated data
+        """Load VAT data on the database worker; the table fills in when it arrives."""
+        with operation('VAT load'):
+            if LIVE_STATUS:
+                self.read_rows()
             else:
-                # If the user cancels, reset the checkbox to unchecked
-                checkbox = self.sender()
-                if isinstance(checkbox, QCheckBox):
-                    checkbox.setChecked(False)
-                vat.done = False
-                self.load_data()
+                db_worker().submit_write(self.store_derived, self.read_rows, self.load_failed, idempotent=True)
+
+    def read_rows(self, result=None):
+        """Load the rows on the database worker, after the writes submitted before."""
+        db_worker().submit((id(self), 'rows'), self.fetch_rows, self.show_rows, self.load_failed)
+
+    def fetch_rows(self, session):
+        """Worker thread: return the change tracking mark and the table rows."""
+        mark = self.tracker.current_mark(session)
+        return mark, self.build_rows(session.execute(self.select_rows()).all())
+
+    def fetch_changes(self, session):
+        """Worker thread: return the changes since the last load, or all rows when a reload is needed."""
+        changes = self.tracker.fetch_changes(session, self.select_rows(), self.vat_row)
+        return changes if changes is not None else self.fetch_rows(session)
+
+    def select_rows(self):
+        """Return the select() the table rows are loaded with, only the columns shown."""
+        return vat_rows()
+
+    def build_rows(self, records):
+        """Return the (rows, ids) of VAT records for the table."""
+        return [self.vat_row(vat) for vat in records], [vat.id for vat in records]
+
+    def show_rows(self, result):
+        """Show the rows of a full load."""
+        mark, rows = result
+        self.tracker.set_mark(mark)
+        self.populate_table(rows)
+        self.lazy_loader.finish()
+
+    def show_changes(self, result):
+        """Patch the changed rows into the table, or show a full load."""
+        if not self.tracker.apply_changes(result, self.model):
+            self.show_rows(result)
+        elif self.search_bar.text():
+            self.search_data()
+
+    def load_failed(self, error):
+        self.lazy_loader.finish()
+        QMessageBox.critical(self, 'Error', f'Failed to load data: {str(error)}')
+
+    def populate_table(self, rows):
+        """Populate the table with the (rows, ids) of VAT records."""
+        rows, ids = rows
+        self.model.set_rows(rows, ids=ids)
+        if self.search_bar.text():
+            self.search_data()
+
+    def vat_row(self, vat):
+        """Return the table values of a projected VAT row (see list_queries.vat_rows)."""
+        return (
+            vat.number, vat.registration_date, vat.company_number, vat.company_name, vat.company_id,
+            vat.start_date, vat.end_date, vat.due_date, vat.status, vat.calculations, vat.done,
+            vat.address_number, vat.street, vat.city, vat.postcode, vat.country,
+            vat.files_count
+        )
+
+    def handle_vat_done_change(self, row, column, checked):
+        """Handle VAT done checkbox state change."""
+        if not checked:
+            return
+        reply = QMessageBox.question(
+            self,
+            'Confirmation',
+            'Are you sure you want to mark this VAT as done? This will update the dates accordingly.',
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        if reply == QMessageBox.Yes:
+            vat_id = self.model.row_id(row)
+            with operation('VAT save'):
+                # The dates move on a quarter and 'done' is reset, ready for the next return
+                db_worker().submit_write(
+                    lambda session: self.roll_rows_forward(session, [vat_id]),  # Only this row changed
+                    self.show_rolled_rows,
+                    lambda error: self.vat_done_failed(vat_id, column, error)
+                )
+        else:
+            # If the user cancels, reset the checkbox to unchecked
+            self.model.set_value(row, column, False)
 
+    def vat_done_failed(self, vat_id, column, error):
+        """Reset the checkbox when the VAT record could not be moved on."""
+        logging.error(f"Error updating VAT dates: {error}")
+        row = self.model.find_row(vat_id)
+        if row is not None:
+            self.model.set_value(row, column, False)
+        QMessageBox.critical(self, "Error", f"Error updating VAT dates: {str(error)}")
 
     def refresh(self):
-        """Refresh the table data."""
-        self.load_data()
+        """Fetch only the VAT records changed since the last load."""
+        with operation('VAT refresh'):
+            db_worker().submit((id(self), 'rows'), self.fetch_changes, self.show_changes, self.load_failed)
 
     def refresh_tabs(self):
-        """Refresh all tabs and update file counts."""
-        self.update_files_count()
-        self.refresh()
-        if hasattr(self, 'tab_widget'):
-            for i in range(self.tab_widget.count()):
-                tab = self.tab_widget.widget(i)
-                if hasattr(tab, 'refresh') and tab != self:
-                    tab.refresh()
-
-    def update_files_count(self):
-        """Update the file count for each VAT entry."""
+        """Refresh all tabs with one pass of set-based queries."""
         try:
-            with get_session() as session:
-                vats = session.query(VAT).all()
-                for vat in vats:
-                    file_count = session.query(Files).filter(
-                        and_(Files.company_id == vat.company_id, Files.second_id == 'Vat')
-                    ).count()
-                    vat.files_count = file_count
-                    session.add(vat)  # Mark the VAT object as modified
-                session.commit()  # Commit all changes
+            RefreshCoordinator.of(self).refresh()
         except Exception as e:
-            QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(e)}')
+            QMessageBox.critical(self, 'Error', f'An error occurred while refreshing the tabs: {str(e)}')
+
+    def update_files_count(self, on_done=None):
+        """Update the file count for each VAT entry on the database worker."""
+        with operation('VAT files count'):
+            db_worker().submit_write(self.recount, on_done, self.recount_failed,
+                                     idempotent=True)  # Counting twice stores the same counts
 
-    def handle_item_changed(self, item):
+    def recount(self, session):
+        recount_files(session, 'Vat')  # One GROUP BY query for all rows
+
+    def recount_failed(self, error):
+        QMessageBox.critical(self, 'Error', f'An error occurred while updating file counts: {str(error)}')
+
+    def handle_item_changed(self, row, column, old_value, new_value):
         """Handle changes to VAT calculations."""
-        if self.user_edit_flag and item.column() == 9:  # VAT Calculations column
-            try:
-                row = item.row()
-                vat_number = self.table.item(row, 0).text()
-                with get_session() as session:
-                    vat = session.query(VAT).filter_by(number=vat_number).first()
-                    if vat:
-                        new_value = item.text()
-                        confirmation = QMessageBox.question(
-                            self, 'Confirm Update', f'Do you want to update VAT Calculations to "{new_value}"?',
-                            QMessageBox.Yes | QMessageBox.No
-                        )
-                        if confirmation == QMessageBox.Yes:
-                            vat.calculations = new_value
-                            session.commit()
-                        else:
-                            self.table.itemChanged.disconnect(self.handle_item_changed)
-                            item.setText(self.original_text)
-                            self.table.itemChanged.connect(self.handle_item_changed)
-            except Exception as e:
-                print(f"Error: {e}")
-        self.user_edit_flag = False  # Reset the flag after handling the change
-
-    def store_original_text(self, item):
-        """Store original text for a table item when double-clicked."""
-        if item.column() == 9:
-            self.user_edit_flag = True
-            self.original_text = item.text()
+        if column != 9:  # VAT Calculations column
+            return
+        confirmation = QMessageBox.question(
+            self, 'Confirm Update', f'Do you want to update VAT Calculations to "{new_value}"?',
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if confirmation != QMessageBox.Yes:
+            self.model.set_value(row, column, old_value)
+            return
+        vat_id = self.model.row_id(row)
+        with operation('VAT save'):
+            db_worker().submit_write(
+                lambda session: self.store_calculations(session, vat_id, new_value),
+                on_error=lambda error: self.calculations_failed(vat_id, column, old_value, error),
+                idempotent=True
+            )
+
+    def store_calculations(self, session, vat_id, calculations):
+        """Worker thread: store the VAT calculations of one record."""
+        vat = session.get(VAT, vat_id)
+        if vat:
+            vat.calculations = calculations
+
+    def calculations_failed(self, vat_id, column, old_value, error):
+        """Put the old calculations back when the new ones could not be stored."""
+        logging.error(f"Error updating VAT calculations: {error}")
+        row = self.model.find_row(vat_id)
+        if row is not None:
+            self.model.set_value(row, column, old_value)
+        QMessageBox.critical(self, "Error", f"Error updating VAT calculations: {str(error)}")
 
     def search_data(self):
         """Search VAT data in the table based on user input."""
         search_text = self.search_bar.text().lower()
-        self.user_edit_flag = False  # Disable user edit flag during search
-        for row in range(self.table.rowCount()):
-            match = False
-            for col in range(self.table.columnCount()):
-                item = self.table.item(row, col)
-                if item:
-                    original_color = item.data(Qt.UserRole)
-                    if not original_color:
-                        original_color = item.background()
-                        item.setData(Qt.UserRole, original_color)
-
-                    if search_text and search_text in item.text().lower():
-                        item.setBackground(QColor(255, 255, 0, 127))  # light yellow with transparency
-                        match = True
-                    else:
-                        item.setBackground(original_color)
-            self.table.setRowHidden(row, not match if search_text else False)
-
-    def set_row_color(self, row, status):
-        """Set the background color of a row based on its status."""
-        color_map = {
-            'Overdue': QColor(251, 55, 107, 127),  # light red with transparency
-            'Urgent': QColor(247, 131, 34, 127),   # light orange with transparency
-            'Soon': QColor(241, 240, 133, 127),    # light yellow with transparency
-            'Early': QColor(87, 242, 141, 127)     # light green with transparency
-        }
-        color = color_map.get(status, QColor(255, 255, 255, 127))  # default to white with transparency
-
-        for col in range(self.table.columnCount()):
-            item = self.table.item(row, col)
-            if item:
-                item.setBackground(color)
-                item.setData(Qt.UserRole, color)  # Store the original color
-
-    def update_checkbox_background(self, row, status):
-        """Update checkbox background color based on status."""
-        color_map = {
-            'Overdue': QColor(251, 55, 107, 127),
-            'Urgent': QColor(247, 131, 34, 127),
-            'Soon': QColor(241, 240, 133, 127),
-            'Early': QColor(87, 242, 141, 127)
-        }
-        color = color_map.get(status, QColor(255, 255, 255, 127))
-
-        checkbox = self.table.cellWidget(row, 10)
-        if checkbox:
-            checkbox.setStyleSheet(f"background-color: rgba({color.red()}, {color.green()}, {color.blue()}, {color.alpha() / 255.0});")
+        self.model.set_highlight(search_text)
+        self.proxy.set_visible_ids(self.model.matching_ids(search_text) if search_text else None)
 
     def update_vat_status(self, session, vat):
         """Update the status of a VAT entry based on the date."""
-        today = datetime.now().date()
         if vat.end_date:
-            days_to_end = (vat.end_date - today).days
-            if days_to_end < 0:
-                vat.status = "Overdue"
-            elif days_to_end <= 2:
-                vat.status = "Urgent"
-            elif days_to_end <= 7:
-                vat.status = "Soon"
-            else:
-                vat.status = "Early"
+            vat.status = compute_status(vat.end_date)
         session.add(vat)  # Mark the VAT object as modified
 
 
-    def update_vat_dates(self, session, vat):
-        """Update the start, end, and due dates for VAT after marking as done."""
-        if vat.done:
-            vat.start_date = vat.end_date
-            vat.end_date = vat.end_date + relativedelta(months=3)
-            vat.due_date = vat.due_date + relativedelta(months=3)
-        session.add(vat)  # Mark the VAT object as modified
-        session.commit()  # Commit changes to the database
+    def roll_forward_selected(self):
+        """Roll all selected VAT records forward at once, with one confirmation and one commit."""
+        vat_ids = self.proxy.selected_ids(self.table)
+        if not vat_ids:
+            QMessageBox.information(self, 'Roll Forward', 'Select the VAT records to roll forward first.')
+            return
+        response = QMessageBox.question(
+            self, 'Confirm',
+            f'Roll {len(vat_ids)} selected VAT records forward? This will move them on to the next quarter.',
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if response != QMessageBox.Yes:
+            return
+        with operation('VAT roll forward'):
+            db_worker().submit_write(
+                lambda session: self.roll_rows_forward(session, vat_ids),
+                self.show_rolled_rows,
+                self.roll_forward_failed
+            )
+
+    def roll_rows_forward(self, session, vat_ids):
+        """Worker thread: roll VAT records forward with one UPDATE and return their reloaded rows."""
+        roll_forward(session, 'VAT', vat_ids)
+        return session.execute(self.select_rows().where(VAT.id.in_(vat_ids))).all()
+
+    def show_rolled_rows(self, records):
+        """Show rolled forward VAT records in their rows and move each row to its sorted place."""
+        for vat in records:
+            row = self.model.find_row(vat.id)
+            if row is not None:
+                self.model.update_row(row, self.vat_row(vat))
+                self.model.reposition_row(row)
+        if self.search_bar.text():
+            self.search_data()
+
+    def roll_forward_failed(self, error):
+        logging.error(f"Error rolling VAT records forward: {error}")
+        QMessageBox.critical(self, "Error", f"Error rolling VAT records forward: {str(error)}")
 
 
 if __name__ == "__main__":
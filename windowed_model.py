@@ -0,0 +1,336 @@
+import copy
+import logging
+from collections import OrderedDict
+from datetime import date, datetime
+from PyQt5.QtCore import Qt, QModelIndex, pyqtSignal
+from sqlalchemy import Enum, String, cast, func, literal, or_, tuple_
+from sqlalchemy.sql.elements import Label
+from table_model import ColumnTableModel
+from instrumentation import populating
+from db_worker import db_worker
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+
+# Rows fetched per query, and pages kept in memory. A windowed table never
+# holds more than PAGE_SIZE * MAX_PAGES rows, however long the table grows.
+PAGE_SIZE = 200
+MAX_PAGES = 20
+
+# Milliseconds of no typing before a search box reloads the window from the database
+SEARCH_DELAY = 300
+
+# Stands in for NULL in the sort keys of number columns (see sortable)
+LOWEST_NUMBER = -10 ** 15
+
+
+def sortable(column):
+    """Return a column as a sort key that is never NULL.
+
+    Row-value comparisons like (a, b) >= (x, y) are never true when a value is
+    NULL, so NULLs are replaced with the lowest value of the column type and
+    sort first. Enums are compared as their text.
+    """
+    if isinstance(column, Label):
+        column = column.element
+    if isinstance(column.type, Enum):
+        return func.coalesce(cast(column, String), '')
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = str
+
+    if issubclass(python_type, bool):
+        lowest = False
+    elif issubclass(python_type, datetime):
+        lowest = datetime.min
+    elif issubclass(python_type, date):
+        lowest = date.min
+    elif issubclass(python_type, str):
+        lowest = ''
+    else:
+        lowest = python_type(LOWEST_NUMBER)
+    return func.coalesce(column, literal(lowest, type_=column.type))
+
+
+class KeysetSource:
+    """Rows of a select() read a page at a time with keyset pagination.
+
+    statement is the projection the table shows (see list_queries). keys are
+    the expressions the rows are ordered by, all of them never NULL (see
+    sortable) and ending with the unique id of the row. A page is read after
+    the key of the last row of the page before it, with WHERE (keys) > after
+    ORDER BY keys LIMIT n: nothing is counted or numbered up front, and with
+    an index on the keys (e.g. models.TASK_ORDER) reading page 1000 costs as
+    much as reading page 1.
+
+    make_row turns a result row into table values and make_status returns the
+    status of a result row. columns are the expressions behind the table
+    columns, for sorting by a column; search_columns are matched by search.
+
+    Sources are not changed in place: ordered() and searching() return a copy,
+    so a job still running on the worker keeps reading the query it started with.
+    """
+
+    def __init__(self, statement, keys, make_row, make_status=None, columns=None, search_columns=()):
+        self.statement = statement
+        self.default_keys = list(keys)
+        self.keys = self.default_keys
+        self.descending = False
+        self.make_row = make_row
+        self.make_status = make_status
+        self.columns = list(columns) if columns is not None else list(statement.selected_columns)
+        self.search_columns = list(search_columns)
+        self.search = ''
+
+    def ordered(self, column=None, descending=False):
+        """Return a copy ordered by a table column and the id, or in the default order when column is None."""
+        source = copy.copy(self)
+        if column is None:
+            source.keys, source.descending = self.default_keys, False
+        else:
+            source.keys, source.descending = [sortable(self.columns[column]), self.default_keys[-1]], descending
+        return source
+
+    def searching(self, text):
+        """Return a copy showing only the rows where a search column contains text."""
+        source = copy.copy(self)
+        source.search = text.strip().lower()
+        return source
+
+    def filtered(self):
+        """Return the statement with the search applied."""
+        if not self.search or not self.search_columns:
+            return self.statement
+        return self.statement.where(or_(*[
+            func.lower(cast(column, String)).contains(self.search, autoescape=True)
+            for column in self.search_columns
+        ]))
+
+    def order_by(self):
+        return [key.desc() for key in self.keys] if self.descending else list(self.keys)
+
+    def page(self, session, after, page_size):
+        """Return (rows, ids, statuses, key of the last row) of the page after the key after.
+
+        after is None for the first page. The key of the last row is where the
+        next page starts, or None when the page is empty.
+        """
+        statement = self.filtered().add_columns(*[key.label(f'key_{i}') for i, key in enumerate(self.keys)])
+        if after is not None:
+            keys, leading = tuple_(*self.keys), self.keys[0]
+            after = [literal(value, type_=key.type) for key, value in zip(self.keys, after)]  # Booleans too
+            # The bound on the leading key alone lets SQLite seek in an expression index as well
+            if self.descending:
+                statement = statement.where(leading <= after[0], keys < tuple_(*after))
+            else:
+                statement = statement.where(leading >= after[0], keys > tuple_(*after))
+        rows = session.execute(statement.order_by(*self.order_by()).limit(page_size)).all()
+        last = tuple(getattr(rows[-1], f'key_{i}') for i in range(len(self.keys))) if rows else None
+        return (
+            [self.make_row(row) for row in rows],
+            [row.id for row in rows],
+            [self.make_status(row) for row in rows] if self.make_status else None,
+            last
+        )
+
+
+class WindowedTableModel(ColumnTableModel):
+    """Table model showing a KeysetSource one page at a time.
+
+    The rows are not counted: rowCount() is the rows of the pages read so far,
+    and the view asks for the next page (canFetchMore, fetchMore) once it is
+    scrolled to the end. Only the max_pages most recently painted pages are
+    kept. The key each page starts after is remembered, so a page dropped from
+    memory is read again with one seek when it is painted; its rows show
+    empty until it arrives.
+
+    Search and sort run in the database: set_search() and sort() reload the
+    window instead of filtering or sorting rows in memory.
+    """
+    window_loaded = pyqtSignal(int)  # rows of the first page
+    load_failed = pyqtSignal(object)  # error
+
+    def __init__(self, headers, source, page_size=PAGE_SIZE, max_pages=MAX_PAGES, **kwargs):
+        super().__init__(headers, **kwargs)
+        self.source = source
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._total = 0  # Rows of the pages read so far
+        self._starts = []  # page number -> key of the last row before the page, None for the first page
+        self._at_end = True  # The last page read was not full, so there are no rows after it
+        self._pages = OrderedDict()  # page number -> (rows as lists, ids, statuses), least recently used first
+        self._pending = set()  # page numbers being read
+        self._loaded = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._total
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded and not self._at_end
+
+    def fetchMore(self, parent=QModelIndex()):
+        """Read the page after the last one read; called by the view when it is scrolled to the end."""
+        if self.canFetchMore(parent):
+            self.fetch_page(len(self._starts) - 1)
+
+    # Window
+
+    def reload(self):
+        """Read the first page again and drop the others; they are read again when scrolled to."""
+        self._loaded = True
+        source, page_size = self.source, self.page_size
+        db_worker().submit(
+            (id(self), 'window'),
+            lambda session: source.page(session, None, page_size),
+            self.show_window,
+            self.load_failed.emit
+        )
+
+    def show_window(self, first_page):
+        with populating():
+            self.reset_window(first_page)
+        self.window_loaded.emit(self.rowCount())
+
+    def reset_window(self, first_page):
+        self.beginResetModel()
+        for number in self._pending:
+            db_worker().cancel(self.page_channel(number))  # Read against the old window
+        self._pending.clear()
+        self._pages.clear()
+        self._total, self._starts = 0, [None]
+        self.store_page(0, first_page)
+        self.count_page(first_page)
+        self.endResetModel()
+
+    def count_page(self, page):
+        """Add the rows of the page read at the end of the table, and note where the next one starts."""
+        ids, last = page[1], page[3]
+        self._total += len(ids)
+        self._at_end = len(ids) < self.page_size
+        if not self._at_end:
+            self._starts.append(last)
+
+    def page_channel(self, number):
+        return (id(self), 'page', number)
+
+    def fetch_page(self, number):
+        """Read a page on the database worker, once."""
+        if number in self._pending or number >= len(self._starts):
+            return
+        self._pending.add(number)
+        source, after, page_size = self.source, self._starts[number], self.page_size
+        db_worker().submit(
+            self.page_channel(number),
+            lambda session: source.page(session, after, page_size),
+            lambda page: self.show_page(number, page),
+            lambda error: self.page_failed(number, error)
+        )
+
+    def show_page(self, number, page):
+        self._pending.discard(number)
+        if number == len(self._starts) - 1 and number * self.page_size == self._total:
+            # The page after the last one read: its rows are added to the table
+            ids = page[1]
+            if ids:
+                self.beginInsertRows(QModelIndex(), self._total, self._total + len(ids) - 1)
+                self.store_page(number, page)
+                self.count_page(page)
+                self.endInsertRows()
+            else:
+                self._at_end = True
+            return
+
+        self.store_page(number, page)
+        first = number * self.page_size
+        last = min(first + self.page_size, self._total) - 1
+        if last >= first:
+            self.dataChanged.emit(self.index(first, 0), self.index(last, self.columnCount() - 1))
+
+    def page_failed(self, number, error):
+        # The page stays pending, so a failing query is not retried on every paint
+        logging.error(f"Failed to read page {number}: {error}")
+        self.load_failed.emit(error)
+
+    def store_page(self, number, page):
+        """Keep a page, dropping the least recently used ones beyond max_pages."""
+        rows, ids, statuses = page[:3]
+        rows = [list(values) for values in rows]
+        if statuses is None:
+            statuses = [values[self.status_column] if self.status_column is not None else None for values in rows]
+        self._pages[number] = (rows, ids, list(statuses))
+        self._pages.move_to_end(number)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def cached_row(self, row, fetch=True):
+        """Return (page, offset in the page) of a row, or (None, 0) while the page is not read."""
+        number = row // self.page_size
+        page = self._pages.get(number)
+        if page is None:
+            if fetch:
+                self.fetch_page(number)
+            return None, 0
+        offset = row - number * self.page_size
+        if offset >= len(page[1]):
+            return None, 0  # Rows removed since the window was counted
+        self._pages.move_to_end(number)
+        return page, offset
+
+    # Data access
+
+    def value(self, row, column):
+        page, offset = self.cached_row(row)
+        return page[0][offset][column] if page else None
+
+    def row_values(self, row):
+        page, offset = self.cached_row(row)
+        return tuple(page[0][offset]) if page else (None,) * self.columnCount()
+
+    def display_text(self, row, column):
+        page, _ = self.cached_row(row)
+        return super().display_text(row, column) if page else ''
+
+    def row_id(self, row):
+        page, offset = self.cached_row(row)
+        return page[1][offset] if page else None
+
+    def status(self, row):
+        page, offset = self.cached_row(row)
+        return page[2][offset] if page else None
+
+    def store_value(self, row, column, value):
+        page, offset = self.cached_row(row, fetch=False)
+        if page:
+            page[0][offset][column] = value
+            if column == self.status_column:
+                page[2][offset] = value
+
+    def store_status(self, row, status):
+        page, offset = self.cached_row(row, fetch=False)
+        if page:
+            page[2][offset] = status
+
+    def find_row(self, row_id):
+        """Return the row holding the given database id among the cached pages, or None."""
+        for number, (_, ids, _) in self._pages.items():
+            if row_id in ids:
+                return number * self.page_size + ids.index(row_id)
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Order the rows by a column in the database, or in the default order when column is negative.
+
+        Ignored until the first load, like sorting an empty table: the view
+        sorts by its sort indicator as soon as sorting is enabled.
+        """
+        if not self._loaded or column >= self.columnCount():
+            return
+        self.source = self.source.ordered(column if column >= 0 else None, order == Qt.DescendingOrder)
+        self.reload()
+
+    def set_search(self, text):
+        """Show only the rows matching text, searched in the database."""
+        self.source = self.source.searching(text)
+        if self._loaded:
+            self.reload()